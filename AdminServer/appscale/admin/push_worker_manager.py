@@ -184,17 +184,19 @@ class ProjectPushWorkerManager(object):
       queue_config: A JSON string specifying queue configuration.
     """
     if queue_config is None:
-      rates = {'default': '5/s'}
+      push_queues = {'default': {'rate': '5/s'}}
     else:
       queues = json.loads(queue_config)['queue']
-      rates = {
-        queue_name: queue['rate'] for queue_name, queue in queues.items()
+      push_queues = {
+        queue_name: {key: queue[key] for key in ('rate', 'bucket_size')
+                     if key in queue}
+        for queue_name, queue in queues.items()
         if 'mode' not in queue or queue['mode'] == 'push'}
 
     config_location = os.path.join(CELERY_CONFIG_DIR,
                                    '{}.json'.format(self.project_id))
     with open(config_location, 'w') as config_file:
-      json.dump(rates, config_file)
+      json.dump(push_queues, config_file)
 
   def _update_worker(self, queue_config, _):
     """ Handles updates to a queue configuration node.
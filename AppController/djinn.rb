@@ -3250,11 +3250,13 @@ class Djinn
           start_groomer_service
           verbose = @options['verbose'].downcase == 'true'
           GroomerService.start_transaction_groomer(verbose)
+          GroomerService.start_index_backfill(verbose)
         end
       }
     else
       stop_groomer_service
       GroomerService.stop_transaction_groomer
+      GroomerService.stop_index_backfill
     end
 
     start_admin_server
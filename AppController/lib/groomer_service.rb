@@ -38,4 +38,14 @@ module GroomerService
   def self.stop_transaction_groomer
     MonitInterface.stop(:transaction_groomer)
   end
+
+  def self.start_index_backfill(verbose)
+    start_cmd = `which appscale-index-backfill`.chomp
+    start_cmd << ' --verbose' if verbose
+    MonitInterface.start(:index_backfill, start_cmd, nil, nil, MAX_MEM)
+  end
+
+  def self.stop_index_backfill
+    MonitInterface.stop(:index_backfill)
+  end
 end
@@ -8,13 +8,13 @@ import time
 from appscale.datastore import appscale_datastore_batch
 from appscale.datastore.backup.datastore_backup import DatastoreBackup
 from appscale.datastore.datastore_distributed import DatastoreDistributed
-from appscale.datastore.dbconstants import InternalError
+from appscale.datastore.dbconstants import (
+  AppScaleDBConnectionError, BadRequest, InternalError)
 from appscale.datastore.utils import tornado_synchronous
 from appscale.datastore.zkappscale import zktransaction as zk
 from appscale.datastore.zkappscale.transaction_manager import (
   TransactionManager)
 
-from google.appengine.datastore import datastore_pb
 from google.appengine.datastore import entity_pb
 
 
@@ -30,6 +30,9 @@ class DatastoreRestore(multiprocessing.Process):
   # Retry sleep on datastore error in seconds.
   DB_ERROR_PERIOD = 30
 
+  # The number of times to try storing a batch of entities.
+  BATCH_ATTEMPTS = 3
+
   # The amount of seconds between polling to get the restore lock.
   LOCK_POLL_PERIOD = 60
 
@@ -52,7 +55,7 @@ class DatastoreRestore(multiprocessing.Process):
     self.entities_restored = 0
     self.indexes = []
     self.ds_distributed = None
-    self.dynamic_put_sync = None
+    self.bulk_put_sync = None
 
   def stop(self):
     """ Stops the restore process. """
@@ -65,8 +68,7 @@ class DatastoreRestore(multiprocessing.Process):
     transaction_manager = TransactionManager(self.zoo_keeper.handle)
     self.ds_distributed = DatastoreDistributed(
       datastore_batch, transaction_manager, zookeeper=self.zoo_keeper)
-    self.dynamic_put_sync = tornado_synchronous(
-      self.ds_distributed.dynamic_put)
+    self.bulk_put_sync = tornado_synchronous(self.ds_distributed.bulk_put)
 
     while True:
       logging.debug("Trying to get restore lock.")
@@ -84,6 +86,14 @@ class DatastoreRestore(multiprocessing.Process):
           "running.")
         time.sleep(random.randint(1, self.LOCK_POLL_PERIOD))
 
+  def load_indexes(self):
+    """ Fetches the application's composite index definitions so that
+    restored entities get composite index entries. """
+    get_indices_sync = tornado_synchronous(
+      self.ds_distributed.datastore_batch.get_indices)
+    self.indexes = [entity_pb.CompositeIndex(index)
+                    for index in get_indices_sync(self.app_id)]
+
   def get_restore_lock(self):
     """ Tries to acquire the lock for a datastore restore.
 
@@ -102,43 +112,31 @@ class DatastoreRestore(multiprocessing.Process):
     """
     logging.debug("Entity batch to process: {0}".format(entity_batch))
 
-    # Convert encoded entities to EntityProto objects, change the app ID if
-    # it's different than the original and encode again.
-    new_entities_encoded = []
+    # Convert encoded entities to EntityProto objects and change the app ID if
+    # it's different than the original.
     ent_protos = []
     for entity in entity_batch:
       ent_proto = entity_pb.EntityProto()
       ent_proto.ParseFromString(entity)
       ent_proto.key().set_app(self.app_id)
-
       ent_protos.append(ent_proto)
-      new_entities_encoded.append(ent_proto.Encode())
-    logging.debug("Entities encoded: {0}".format(new_entities_encoded))
-
-    # Create a PutRequest with the entities to be stored.
-    put_request = datastore_pb.PutRequest()
-    put_response = datastore_pb.PutResponse()
-    for entity in new_entities_encoded:
-      new_entity = put_request.add_entity()
-      new_entity.MergeFromString(entity)
-    logging.debug("Put request: {0}".format(put_request))
-
-    try:
-      self.dynamic_put_sync(self.app_id, put_request, put_response)
-      self.entities_restored += len(ent_protos)
-    except zk.ZKInternalException, zkie:
-      logging.error("ZK internal exception for app id {0}, " \
-        "info {1}".format(self.app_id, str(zkie)))
-      return False
-    except zk.ZKTransactionException, zkte:
-      logging.error("Concurrent transaction exception for app id {0}, " \
-        "info {1}".format(self.app_id, str(zkte)))
-      return False
-    except InternalError:
-      logging.exception('Unable to write entity')
-      return False
-
-    return True
+
+    # Bulk puts are idempotent, so failed batches can be retried.
+    for attempt in range(1, self.BATCH_ATTEMPTS + 1):
+      try:
+        self.bulk_put_sync(self.app_id, ent_protos, self.indexes)
+        self.entities_restored += len(ent_protos)
+        return True
+      except AppScaleDBConnectionError:
+        logging.exception('Unable to write entity batch (attempt {})'.
+                          format(attempt))
+        if attempt < self.BATCH_ATTEMPTS:
+          time.sleep(self.DB_ERROR_PERIOD)
+      except (BadRequest, InternalError):
+        logging.exception('Unable to write entity batch')
+        return False
+
+    return False
 
   def read_from_file_and_restore(self, backup_file):
     """ Reads entities from backup file and stores them in the datastore.
@@ -172,6 +170,7 @@ class DatastoreRestore(multiprocessing.Process):
     """
     logging.info("Restore started")
     start = time.time()
+    self.load_indexes()
 
     for backup_file in glob.glob('{0}/*{1}'.
         format(self.backup_dir, DatastoreBackup.BACKUP_FILE_SUFFIX)):
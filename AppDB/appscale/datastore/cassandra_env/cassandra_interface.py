@@ -17,10 +17,11 @@ from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
 import cassandra
 from cassandra.cluster import Cluster
 from cassandra.query import BatchStatement
+from cassandra.query import BatchType
 from cassandra.query import ConsistencyLevel
 from cassandra.query import SimpleStatement
-from cassandra.query import ValueSequence
 from tornado import gen
+from tornado import locks
 
 from appscale.datastore import dbconstants
 from appscale.datastore.cassandra_env.constants import (
@@ -32,6 +33,7 @@ from appscale.datastore.cassandra_env.large_batch import (
 from appscale.datastore.cassandra_env.retry_policies import (
   BASIC_RETRIES, NO_RETRIES
 )
+from appscale.datastore.cassandra_env.statement_cache import StatementCache
 from appscale.datastore.cassandra_env.tornado_cassandra import TornadoCassandra
 from appscale.datastore.dbconstants import (
   AppScaleDBConnectionError, Operations, TxnActions
@@ -76,6 +78,12 @@ PRIMED_KEY = 'primed'
 # The size in bytes that a batch must be to use the batches table.
 LARGE_BATCH_THRESHOLD = 5 << 10
 
+# The number of table rows to fetch per page when scanning a range.
+SCAN_PAGE_SIZE = 100
+
+# The maximum number of bulk write statements to have in flight at once.
+MAX_BULK_WRITES = 64
+
 
 def batch_size(batch):
   """ Calculates the size of a batch.
@@ -114,6 +122,181 @@ class ScatterPropStates(object):
   POPULATION_IN_PROGRESS = 'population_in_progress'
 
 
+def range_statement(statement_cache, table_name, start_inclusive,
+                    end_inclusive, limited):
+  """ Retrieves a prepared statement for fetching a range of rows.
+
+  The statement's parameters are the start key, end key, list of columns, and
+  the limit (if the statement is limited).
+
+  Args:
+    statement_cache: A StatementCache object.
+    table_name: A string specifying the table to query.
+    start_inclusive: A boolean indicating that the start key is included.
+    end_inclusive: A boolean indicating that the end key is included.
+    limited: A boolean indicating that the statement has a limit.
+  Returns:
+    A PreparedStatement object.
+  """
+  gt_compare = '>=' if start_inclusive else '>'
+  lt_compare = '<=' if end_inclusive else '<'
+
+  statement = (
+    'SELECT * FROM "{table}" WHERE '
+    'token({key}) {gt_compare} ? AND '
+    'token({key}) {lt_compare} ? AND '
+    '{column} IN ? '
+    '{limit}'
+    'ALLOW FILTERING'
+  ).format(table=table_name,
+           key=ThriftColumn.KEY,
+           gt_compare=gt_compare,
+           lt_compare=lt_compare,
+           column=ThriftColumn.COLUMN_NAME,
+           limit='LIMIT ? ' if limited else '')
+
+  key = ('range_query', table_name, gt_compare, lt_compare, limited)
+  return statement_cache.get(key, statement, retry_policy=BASIC_RETRIES)
+
+
+class RangeScan(object):
+  """ Streams a range of rows from a table one page at a time.
+
+  Rows are fetched using the driver's paging, so only a single page of results
+  is held in memory at once. Each row is returned as a (key, columns) tuple,
+  where columns is a dictionary mapping column names to values.
+  """
+  def __init__(self, tornado_cassandra, statement_cache, table_name,
+               column_names, start_key, end_key, limit=None, offset=0,
+               start_inclusive=True, end_inclusive=True,
+               page_size=SCAN_PAGE_SIZE):
+    """ Creates a new RangeScan.
+
+    Args:
+      tornado_cassandra: A TornadoCassandra object.
+      statement_cache: A StatementCache object.
+      table_name: A string specifying the table to scan.
+      column_names: A list of columns to fetch for each row.
+      start_key: A string specifying where the scan starts.
+      end_key: A string specifying where the scan ends.
+      limit: An integer specifying the maximum number of rows to return or
+        None to scan the whole range.
+      offset: An integer specifying the number of rows to skip.
+      start_inclusive: A boolean indicating that the start_key is included.
+      end_inclusive: A boolean indicating that the end_key is included.
+      page_size: An integer specifying the number of rows to fetch at once.
+    """
+    self._tornado_cassandra = tornado_cassandra
+    self._limit = limit
+    self._remaining_offset = offset
+    self._returned = 0
+
+    # The rows for the last key in a page might continue on the next page.
+    self._pending_key = None
+    self._pending_columns = None
+
+    self._paging_state = None
+    self._done = limit is not None and limit <= 0
+
+    # Each table row is stored as one Cassandra row per column.
+    query_limit = None
+    if limit is not None:
+      query_limit = len(column_names) * (limit + offset)
+      page_size = min(page_size, limit + offset)
+
+    prepared = range_statement(statement_cache, table_name, start_inclusive,
+                               end_inclusive, query_limit is not None)
+    parameters = [bytearray(start_key), bytearray(end_key), column_names]
+    if query_limit is not None:
+      parameters.append(query_limit)
+
+    self._query = prepared.bind(parameters)
+    self._query.fetch_size = max(len(column_names) * page_size, 1)
+
+  @property
+  def done(self):
+    """ Indicates whether or not the scan has returned all of its rows. """
+    return self._done
+
+  @gen.coroutine
+  def next_page(self):
+    """ Fetches the next group of rows.
+
+    If a fetch fails, calling this method again resumes from the same page.
+
+    Returns:
+      A list of (key, columns) tuples. An empty list indicates that there are
+      no more rows in the range.
+    Raises:
+      AppScaleDBConnectionError: If the page could not be fetched.
+    """
+    rows = []
+    while not rows and not self._done:
+      rows = yield self._fetch_page()
+
+    raise gen.Return(rows)
+
+  def _add_row(self, rows, key, columns):
+    """ Adds a complete row to a page if it is within the offset and limit.
+
+    Args:
+      rows: A list of (key, columns) tuples.
+      key: A string specifying the row key.
+      columns: A dictionary mapping column names to values.
+    """
+    if self._remaining_offset > 0:
+      self._remaining_offset -= 1
+      return
+
+    rows.append((key, columns))
+    self._returned += 1
+    if self._limit is not None and self._returned >= self._limit:
+      self._done = True
+
+  @gen.coroutine
+  def _fetch_page(self):
+    """ Fetches a single page of results from Cassandra.
+
+    Returns:
+      A list of (key, columns) tuples, which may be empty even if there are
+      more rows in the range.
+    """
+    try:
+      results, paging_state = yield self._tornado_cassandra.execute_page(
+        self._query, paging_state=self._paging_state)
+    except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      message = 'Exception during range scan'
+      logging.exception(message)
+      raise AppScaleDBConnectionError(message)
+
+    rows = []
+    pending_key = self._pending_key
+    pending_columns = self._pending_columns
+    for key, column, value in results:
+      if key != pending_key:
+        if pending_columns:
+          self._add_row(rows, pending_key, pending_columns)
+          if self._done:
+            raise gen.Return(rows)
+
+        pending_key = key
+        pending_columns = {}
+
+      pending_columns[column] = value
+
+    if paging_state is None:
+      if pending_columns:
+        self._add_row(rows, pending_key, pending_columns)
+
+      self._done = True
+    else:
+      self._pending_key = pending_key
+      self._pending_columns = pending_columns
+      self._paging_state = paging_state
+
+    raise gen.Return(rows)
+
+
 class DatastoreProxy(AppDBInterface):
   """
     Cassandra implementation of the AppDBInterface
@@ -147,7 +330,7 @@ class DatastoreProxy(AppDBInterface):
         time.sleep(3)
 
     self.session.default_consistency_level = ConsistencyLevel.QUORUM
-    self.prepared_statements = {}
+    self.statement_cache = StatementCache(self.session)
 
     # Provide synchronous version of some async methods
     self.batch_get_entity_sync = tornado_synchronous(self.batch_get_entity)
@@ -188,13 +371,14 @@ class DatastoreProxy(AppDBInterface):
     row_keys_bytes = [bytearray(row_key) for row_key in row_keys]
 
     statement = 'SELECT * FROM "{table}" '\
-                'WHERE {key} IN %s and {column} IN %s'.format(
+                'WHERE {key} IN ? and {column} IN ?'.format(
                   table=table_name,
                   key=ThriftColumn.KEY,
                   column=ThriftColumn.COLUMN_NAME,
                 )
-    query = SimpleStatement(statement, retry_policy=BASIC_RETRIES)
-    parameters = (ValueSequence(row_keys_bytes), ValueSequence(column_names))
+    query = self.statement_cache.get(('batch_get_entity', table_name),
+                                     statement, retry_policy=BASIC_RETRIES)
+    parameters = (row_keys_bytes, column_names)
 
     try:
       results = yield self.tornado_cassandra.execute(
@@ -249,15 +433,19 @@ class DatastoreProxy(AppDBInterface):
                value=ThriftColumn.VALUE)
 
     if ttl is not None:
-      insert_str += 'USING TTL {}'.format(ttl)
+      insert_str += ' USING TTL ?'
 
-    statement = self.session.prepare(insert_str)
+    statement = self.statement_cache.get(
+      ('batch_put_entity', table_name, ttl is not None), insert_str)
 
     statements_and_params = []
     for row_key in row_keys:
       for column in column_names:
         params = (bytearray(row_key), column,
                   bytearray(cell_values[row_key][column]))
+        if ttl is not None:
+          params += (ttl,)
+
         statements_and_params.append((statement, params))
 
     try:
@@ -287,10 +475,7 @@ class DatastoreProxy(AppDBInterface):
                column=ThriftColumn.COLUMN_NAME,
                value=ThriftColumn.VALUE)
 
-    if statement not in self.prepared_statements:
-      self.prepared_statements[statement] = self.session.prepare(statement)
-
-    return self.prepared_statements[statement]
+    return self.statement_cache.get(('insert', table), statement)
 
   def prepare_delete(self, table):
     """ Prepare a delete statement.
@@ -306,10 +491,20 @@ class DatastoreProxy(AppDBInterface):
       'WHERE {key} = ?'
     ).format(table=table, key=ThriftColumn.KEY)
 
-    if statement not in self.prepared_statements:
-      self.prepared_statements[statement] = self.session.prepare(statement)
+    return self.statement_cache.get(('delete', table), statement)
 
-    return self.prepared_statements[statement]
+  def prepare_group_update(self):
+    """ Prepare a statement that records the last update to an entity group.
+
+    Returns:
+      A PreparedStatement object.
+    """
+    statement = (
+      'INSERT INTO group_updates (group, last_update) '
+      'VALUES (?, ?) '
+      'USING TIMESTAMP ?'
+    )
+    return self.statement_cache.get(('group_update',), statement)
 
   @gen.coroutine
   def normal_batch(self, mutations, txid):
@@ -328,14 +523,8 @@ class DatastoreProxy(AppDBInterface):
 
       if table == 'group_updates':
         key = mutation['key']
-        insert = (
-          'INSERT INTO group_updates (group, last_update) '
-          'VALUES (%(group)s, %(last_update)s) '
-          'USING TIMESTAMP %(timestamp)s'
-        )
-        parameters = {'group': key, 'last_update': mutation['last_update'],
-                      'timestamp': get_write_time(txid)}
-        batch.add(insert, parameters)
+        parameters = (key, mutation['last_update'], get_write_time(txid))
+        batch.add(self.prepare_group_update(), parameters)
         continue
 
       if mutation['operation'] == Operations.PUT:
@@ -379,14 +568,8 @@ class DatastoreProxy(AppDBInterface):
 
       if table == 'group_updates':
         key = mutation['key']
-        insert = (
-          'INSERT INTO group_updates (group, last_update) '
-          'VALUES (%(group)s, %(last_update)s) '
-          'USING TIMESTAMP %(timestamp)s'
-        )
-        parameters = {'group': key, 'last_update': mutation['last_update'],
-                      'timestamp': get_write_time(txid)}
-        statements_and_params.append((SimpleStatement(insert), parameters))
+        parameters = (key, mutation['last_update'], get_write_time(txid))
+        statements_and_params.append((self.prepare_group_update(), parameters))
         continue
 
       if mutation['operation'] == Operations.PUT:
@@ -421,6 +604,57 @@ class DatastoreProxy(AppDBInterface):
       for statement, params in statements_and_params
     ]
 
+  @gen.coroutine
+  def bulk_write(self, mutations, txid, max_in_flight=MAX_BULK_WRITES):
+    """ Applies mutations without atomicity guarantees.
+
+    Mutations for the same row are sent together in an unlogged batch, which
+    Cassandra applies as a single partition update. This avoids the batch log
+    that normal_batch uses, so it should only be used when the mutations can
+    be safely retried.
+
+    Args:
+      mutations: A list of dictionaries representing mutations.
+      txid: An integer specifying a transaction ID.
+      max_in_flight: An integer specifying the maximum number of statements
+        to wait on at once.
+    Raises:
+      AppScaleDBConnectionError if a database connection error was encountered.
+    """
+    self.logger.debug('Bulk write: {} mutations'.format(len(mutations)))
+    by_partition = {}
+    for mutation in mutations:
+      partition = (mutation['table'], str(mutation['key']))
+      by_partition.setdefault(partition, []).append(mutation)
+
+    in_flight = locks.Semaphore(max_in_flight)
+    futures = []
+    for partition_mutations in by_partition.itervalues():
+      statements_and_params = self.statements_for_mutations(
+        partition_mutations, txid)
+      if len(statements_and_params) == 1:
+        statement, parameters = statements_and_params[0]
+      else:
+        statement = BatchStatement(batch_type=BatchType.UNLOGGED,
+                                   consistency_level=ConsistencyLevel.QUORUM,
+                                   retry_policy=BASIC_RETRIES)
+        for batch_statement, batch_params in statements_and_params:
+          statement.add(batch_statement, batch_params)
+
+        parameters = None
+
+      yield in_flight.acquire()
+      future = self.tornado_cassandra.execute(statement, parameters=parameters)
+      future.add_done_callback(lambda _: in_flight.release())
+      futures.append(future)
+
+    try:
+      yield futures
+    except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      message = 'Unable to apply bulk write'
+      logging.exception(message)
+      raise AppScaleDBConnectionError(message)
+
   @gen.coroutine
   def large_batch(self, app, mutations, entity_changes, txn):
     """ Insert or delete multiple rows across tables in an atomic statement.
@@ -447,7 +681,8 @@ class DatastoreProxy(AppDBInterface):
       '                     path, old_value, new_value) '
       'VALUES (?, ?, ?, ?, ?, ?)'
     )
-    insert_statement = self.session.prepare(insert_item)
+    insert_statement = self.statement_cache.get(('insert_batch_log',),
+                                                insert_item)
 
     statements_and_params = []
     for entity_change in entity_changes:
@@ -501,11 +736,11 @@ class DatastoreProxy(AppDBInterface):
 
     clear_batch = (
       'DELETE FROM batches '
-      'WHERE app = %(app)s AND transaction = %(transaction)s'
+      'WHERE app = ? AND transaction = ?'
     )
-    parameters = {'app': app, 'transaction': txn}
+    statement = self.statement_cache.get(('clear_batch_log',), clear_batch)
     try:
-      yield self.tornado_cassandra.execute(clear_batch, parameters)
+      yield self.tornado_cassandra.execute(statement, (app, txn))
     except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
       logging.exception('Unable to clear batch log')
 
@@ -528,13 +763,14 @@ class DatastoreProxy(AppDBInterface):
 
     row_keys_bytes = [bytearray(row_key) for row_key in row_keys]
 
-    statement = 'DELETE FROM "{table}" WHERE {key} IN %s'.\
+    statement = 'DELETE FROM "{table}" WHERE {key} IN ?'.\
       format(
         table=table_name,
         key=ThriftColumn.KEY
       )
-    query = SimpleStatement(statement, retry_policy=BASIC_RETRIES)
-    parameters = (ValueSequence(row_keys_bytes),)
+    query = self.statement_cache.get(('batch_delete', table_name), statement,
+                                     retry_policy=BASIC_RETRIES)
+    parameters = (row_keys_bytes,)
 
     try:
       yield self.tornado_cassandra.execute(query, parameters=parameters)
@@ -658,37 +894,11 @@ class DatastoreProxy(AppDBInterface):
     if not isinstance(offset, (int, long)):
       raise TypeError('offset must be int or long')
 
-    if start_inclusive:
-      gt_compare = '>='
-    else:
-      gt_compare = '>'
-
-    if end_inclusive:
-      lt_compare = '<='
-    else:
-      lt_compare = '<'
-
-    query_limit = ''
+    query = range_statement(self.statement_cache, table_name,
+                            start_inclusive, end_inclusive, limit is not None)
+    parameters = [bytearray(start_key), bytearray(end_key), column_names]
     if limit is not None:
-      query_limit = 'LIMIT {}'.format(len(column_names) * limit)
-
-    statement = (
-      'SELECT * FROM "{table}" WHERE '
-      'token({key}) {gt_compare} %s AND '
-      'token({key}) {lt_compare} %s AND '
-      '{column} IN %s '
-      '{limit} '
-      'ALLOW FILTERING'
-    ).format(table=table_name,
-             key=ThriftColumn.KEY,
-             gt_compare=gt_compare,
-             lt_compare=lt_compare,
-             column=ThriftColumn.COLUMN_NAME,
-             limit=query_limit)
-
-    query = SimpleStatement(statement, retry_policy=BASIC_RETRIES)
-    parameters = (bytearray(start_key), bytearray(end_key),
-                  ValueSequence(column_names))
+      parameters.append(len(column_names) * limit)
 
     try:
       results = yield self.tornado_cassandra.execute(
@@ -717,6 +927,46 @@ class DatastoreProxy(AppDBInterface):
       logging.exception(message)
       raise AppScaleDBConnectionError(message)
 
+  def range_scan(self, table_name, column_names, start_key, end_key,
+                 limit=None, offset=0, start_inclusive=True,
+                 end_inclusive=True, page_size=SCAN_PAGE_SIZE):
+    """ Creates a scan that fetches a range of rows one page at a time.
+
+    Unlike range_query, the offset is applied before the limit, and rows are
+    not kept in memory once they have been returned.
+
+    Args:
+      table_name: Name of table to access
+      column_names: Columns which get returned within the key range
+      start_key: String for which the query starts at
+      end_key: String for which the query ends at
+      limit: Maximum number of results to return or None for no limit
+      offset: The number of rows to skip at the start of the range
+      start_inclusive: Boolean if results should include the start_key
+      end_inclusive: Boolean if results should include the end_key
+      page_size: The number of rows to fetch in each request
+    Raises:
+      TypeError: If an argument passed in was not of the expected type.
+    Returns:
+      A RangeScan object.
+    """
+    if not isinstance(table_name, str):
+      raise TypeError('table_name must be a string')
+    if not isinstance(column_names, list):
+      raise TypeError('column_names must be a list')
+    if not isinstance(start_key, str):
+      raise TypeError('start_key must be a string')
+    if not isinstance(end_key, str):
+      raise TypeError('end_key must be a string')
+    if not isinstance(limit, (int, long)) and limit is not None:
+      raise TypeError('limit must be int, long, or NoneType')
+    if not isinstance(offset, (int, long)):
+      raise TypeError('offset must be int or long')
+
+    return RangeScan(self.tornado_cassandra, self.statement_cache, table_name,
+                     column_names, start_key, end_key, limit, offset,
+                     start_inclusive, end_inclusive, page_size)
+
   @gen.coroutine
   def get_metadata(self, key):
     """ Retrieve a value from the datastore metadata table.
@@ -840,7 +1090,8 @@ class DatastoreProxy(AppDBInterface):
     Returns:
       A set of integers specifying transaction IDs.
     """
-    query = 'SELECT * FROM group_updates WHERE group=%s'
+    query = self.statement_cache.get(
+      ('select_group_update',), 'SELECT * FROM group_updates WHERE group=?')
     results = yield [
       self.tornado_cassandra.execute(query, [bytearray(group)])
       for group in groups
@@ -867,10 +1118,11 @@ class DatastoreProxy(AppDBInterface):
     insert = (
       'INSERT INTO transactions (txid_hash, operation, namespace, path,'
       '                          start_time, is_xg, in_progress)'
-      'VALUES (%(txid_hash)s, %(operation)s, %(namespace)s, %(path)s,'
-      '        %(start_time)s, %(is_xg)s, %(in_progress)s)'
+      'VALUES (:txid_hash, :operation, :namespace, :path,'
+      '        :start_time, :is_xg, :in_progress)'
       'USING TTL {ttl}'
     ).format(ttl=dbconstants.MAX_TX_DURATION * 2)
+    statement = self.statement_cache.get(('start_transaction',), insert)
     parameters = {'txid_hash': tx_partition(app, txid),
                   'operation': TxnActions.START,
                   'namespace': '',
@@ -880,7 +1132,7 @@ class DatastoreProxy(AppDBInterface):
                   'in_progress': in_progress_bin}
 
     try:
-      yield self.tornado_cassandra.execute(insert, parameters)
+      yield self.tornado_cassandra.execute(statement, parameters)
     except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
       message = 'Exception while starting a transaction'
       logging.exception(message)
@@ -897,7 +1149,7 @@ class DatastoreProxy(AppDBInterface):
     """
     batch = BatchStatement(consistency_level=ConsistencyLevel.QUORUM,
                            retry_policy=BASIC_RETRIES)
-    insert = self.session.prepare("""
+    insert = self.statement_cache.get(('insert_transaction_mutation',), """
       INSERT INTO transactions (txid_hash, operation, namespace, path, entity)
       VALUES (?, ?, ?, ?, ?)
       USING TTL {ttl}
@@ -929,7 +1181,7 @@ class DatastoreProxy(AppDBInterface):
     """
     batch = BatchStatement(consistency_level=ConsistencyLevel.QUORUM,
                            retry_policy=BASIC_RETRIES)
-    insert = self.session.prepare("""
+    insert = self.statement_cache.get(('insert_transaction_mutation',), """
       INSERT INTO transactions (txid_hash, operation, namespace, path, entity)
       VALUES (?, ?, ?, ?, ?)
       USING TTL {ttl}
@@ -963,13 +1215,15 @@ class DatastoreProxy(AppDBInterface):
     """
     select = (
       'SELECT count(*) FROM transactions '
-      'WHERE txid_hash = %(txid_hash)s '
-      'AND operation = %(operation)s'
+      'WHERE txid_hash = :txid_hash '
+      'AND operation = :operation'
     )
+    statement = self.statement_cache.get(('count_transactional_tasks',),
+                                         select)
     parameters = {'txid_hash': tx_partition(app, txid),
                   'operation': TxnActions.ENQUEUE_TASK}
     try:
-      result = yield self.tornado_cassandra.execute(select, parameters)
+      result = yield self.tornado_cassandra.execute(statement, parameters)
       raise gen.Return(result[0].count)
     except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
       message = 'Exception while fetching task count'
@@ -994,7 +1248,8 @@ class DatastoreProxy(AppDBInterface):
       'VALUES (?, ?, ?, ?, ?) '
       'USING TTL {ttl}'
     ).format(ttl=dbconstants.MAX_TX_DURATION * 2)
-    insert = self.session.prepare(query_str)
+    insert = self.statement_cache.get(('insert_transactional_task',),
+                                      query_str)
 
     for task in tasks:
       task.clear_transaction()
@@ -1028,7 +1283,7 @@ class DatastoreProxy(AppDBInterface):
     """
     batch = BatchStatement(consistency_level=ConsistencyLevel.QUORUM,
                            retry_policy=BASIC_RETRIES)
-    insert = self.session.prepare("""
+    insert = self.statement_cache.get(('insert_transaction_read',), """
       INSERT INTO transactions (txid_hash, operation, namespace, path)
       VALUES (?, ?, ?, ?)
       USING TTL {ttl}
@@ -1065,11 +1320,12 @@ class DatastoreProxy(AppDBInterface):
       'SELECT namespace, operation, path, start_time, is_xg, in_progress, '
       '       entity, task '
       'FROM transactions '
-      'WHERE txid_hash = %(txid_hash)s '
+      'WHERE txid_hash = :txid_hash '
     )
+    statement = self.statement_cache.get(('select_transaction',), select)
     parameters = {'txid_hash': tx_partition(app, txid)}
     try:
-      results = yield self.tornado_cassandra.execute(select, parameters)
+      results = yield self.tornado_cassandra.execute(statement, parameters)
     except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
       message = 'Exception while inserting entities in a transaction'
       logging.exception(message)
@@ -2,13 +2,11 @@ import sys
 import uuid
 
 from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
-from cassandra.query import (
-  ConsistencyLevel,
-  SimpleStatement
-)
+from cassandra.query import ConsistencyLevel
 from tornado import gen
 
 from appscale.datastore.cassandra_env.retry_policies import NO_RETRIES
+from appscale.datastore.cassandra_env.statement_cache import StatementCache
 from appscale.datastore.cassandra_env.tornado_cassandra import TornadoCassandra
 from appscale.datastore.dbconstants import (
   AppScaleBadArg,
@@ -36,16 +34,23 @@ class ReservationFailed(Exception):
 class EntityIDAllocator(object):
   """ Keeps track of reserved entity IDs for a project. """
 
-  def __init__(self, session, project, scattered=False):
+  def __init__(self, session, project, scattered=False, statement_cache=None):
     """ Creates a new EntityIDAllocator object.
 
     Args:
       session: A cassandra-drivers session object.
       project: A string specifying a project ID.
+      scattered: A boolean indicating that scattered IDs are allocated.
+      statement_cache: A StatementCache object shared with other users of
+        the session.
     """
     self.project = project
     self.session = session
     self.tornado_cassandra = TornadoCassandra(self.session)
+    if statement_cache is None:
+      statement_cache = StatementCache(self.session)
+
+    self.statement_cache = statement_cache
     self.scattered = scattered
     if scattered:
       self.max_allowed = _MAX_SCATTERED_COUNTER
@@ -69,9 +74,9 @@ class EntityIDAllocator(object):
       raise AppScaleDBConnectionError('Unable to create reserved_ids entry')
 
     logger.debug('Creating reserved_ids entry for {}'.format(self.project))
-    insert = SimpleStatement("""
+    insert = self.statement_cache.get(('insert_reserved_ids',), """
       INSERT INTO reserved_ids (project, scattered, last_reserved, op_id)
-      VALUES (%(project)s, %(scattered)s, 0, uuid())
+      VALUES (:project, :scattered, 0, uuid())
       IF NOT EXISTS
     """, retry_policy=NO_RETRIES)
     parameters = {'project': self.project, 'scattered': self.scattered}
@@ -87,11 +92,11 @@ class EntityIDAllocator(object):
     Returns:
       An integer specifying an entity ID.
     """
-    get_reserved = SimpleStatement("""
+    get_reserved = self.statement_cache.get(('select_last_reserved',), """
       SELECT last_reserved
       FROM reserved_ids
-      WHERE project = %(project)s
-      AND scattered = %(scattered)s
+      WHERE project = :project
+      AND scattered = :scattered
     """, consistency_level=ConsistencyLevel.SERIAL)
     parameters = {'project': self.project, 'scattered': self.scattered}
     try:
@@ -112,11 +117,11 @@ class EntityIDAllocator(object):
     Returns:
       A UUID4 containing the latest op_id.
     """
-    get_op_id = SimpleStatement("""
+    get_op_id = self.statement_cache.get(('select_reservation_op_id',), """
       SELECT op_id
       FROM reserved_ids
-      WHERE project = %(project)s
-      AND scattered = %(scattered)s
+      WHERE project = :project
+      AND scattered = :scattered
     """, consistency_level=ConsistencyLevel.SERIAL)
     parameters = {'project': self.project, 'scattered': self.scattered}
     results = yield self.tornado_cassandra.execute(get_op_id, parameters)
@@ -133,13 +138,13 @@ class EntityIDAllocator(object):
       ReservationFailed if the update statement fails.
     """
     op_id = uuid.uuid4()
-    set_reserved = SimpleStatement("""
+    set_reserved = self.statement_cache.get(('update_last_reserved',), """
       UPDATE reserved_ids
-      SET last_reserved = %(new_reserved)s,
-          op_id = %(op_id)s
-      WHERE project = %(project)s
-      AND scattered = %(scattered)s
-      IF last_reserved = %(last_reserved)s
+      SET last_reserved = :new_reserved,
+          op_id = :op_id
+      WHERE project = :project
+      AND scattered = :scattered
+      IF last_reserved = :last_reserved
     """, retry_policy=NO_RETRIES)
     parameters = {
       'last_reserved': last_reserved, 'new_reserved': new_reserved,
@@ -251,15 +256,18 @@ class EntityIDAllocator(object):
 
 class ScatteredAllocator(EntityIDAllocator):
   """ An iterator that generates evenly-distributed entity IDs. """
-  def __init__(self, session, project):
+  def __init__(self, session, project, statement_cache=None):
     """ Creates a new ScatteredAllocator instance. Each project should just
     have one instance since it reserves a large block of IDs at a time.
 
     Args:
       session: A cassandra-driver session.
       project: A string specifying a project ID.
+      statement_cache: A StatementCache object shared with other users of
+        the session.
     """
-    super(ScatteredAllocator, self).__init__(session, project, scattered=True)
+    super(ScatteredAllocator, self).__init__(
+      session, project, scattered=True, statement_cache=statement_cache)
 
     # The range that this datastore has already reserved for scattered IDs.
     self.start_id = None
@@ -8,7 +8,10 @@ import cassandra_interface
 
 from appscale.common import appscale_info
 from appscale.common.constants import SCHEMA_CHANGE_TIMEOUT
-from appscale.taskqueue.distributed_tq import create_pull_queue_tables
+from appscale.taskqueue.distributed_tq import (
+  create_pull_queue_tables,
+  create_push_task_names_table
+)
 from cassandra import ConsistencyLevel
 from cassandra.cluster import Cluster
 from cassandra.cluster import SimpleStatement
@@ -287,6 +290,7 @@ def prime_cassandra(replication):
   create_groups_table(session)
   create_transactions_table(session)
   create_pull_queue_tables(cluster, session)
+  create_push_task_names_table(session)
   create_entity_ids_table(session)
 
   first_entity = session.execute(
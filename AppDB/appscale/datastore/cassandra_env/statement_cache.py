@@ -0,0 +1,68 @@
+""" Keeps track of prepared statements for a Cassandra session. """
+import collections
+import threading
+
+
+class StatementCache(object):
+  """ Prepares each statement shape once per session and reuses it.
+
+  Statements are identified by a key that describes their shape (eg. the
+  table, comparison operators, and whether or not there is a limit). The
+  variable parts of each statement should be passed as bound parameters.
+  """
+  def __init__(self, session):
+    """ Creates a new StatementCache.
+
+    Args:
+      session: A cassandra-driver session.
+    """
+    self._session = session
+    self._statements = {}
+    self._lock = threading.Lock()
+
+    # Tracks how many times each statement shape has been used.
+    self._uses = collections.Counter()
+
+  def get(self, key, statement, retry_policy=None, consistency_level=None):
+    """ Retrieves a prepared statement, preparing it if necessary.
+
+    Args:
+      key: A tuple identifying the shape of the statement.
+      statement: A string containing the CQL for the statement. This is only
+        used if the statement has not been prepared yet.
+      retry_policy: The retry policy to use for the statement.
+      consistency_level: The consistency level to use for the statement.
+    Returns:
+      A PreparedStatement object.
+    """
+    self._uses[key] += 1
+    try:
+      return self._statements[key]
+    except KeyError:
+      pass
+
+    # Preparing a statement blocks, so avoid doing it more than once when
+    # called from multiple threads.
+    with self._lock:
+      if key not in self._statements:
+        prepared = self._session.prepare(statement)
+        if retry_policy is not None:
+          prepared.retry_policy = retry_policy
+        if consistency_level is not None:
+          prepared.consistency_level = consistency_level
+
+        self._statements[key] = prepared
+
+    return self._statements[key]
+
+  def stats(self):
+    """ Reports how many statements have been prepared and used.
+
+    Returns:
+      A dictionary containing statement counts.
+    """
+    return {
+      'prepared': len(self._statements),
+      'uses': {' '.join(str(part) for part in key): count
+               for key, count in self._uses.items()}
+    }
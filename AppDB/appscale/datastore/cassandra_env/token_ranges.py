@@ -0,0 +1,334 @@
+""" Divides tables into key ranges that can be scanned concurrently.
+
+AppScale uses the ByteOrderedPartitioner, so a row's token is its key. Each
+range is represented as a (start, end) tuple of keys. The start key is
+excluded from the range and the end key is included. An empty end key
+indicates the end of the ring.
+"""
+import logging
+import os
+import threading
+import time
+from subprocess import CalledProcessError
+
+from appscale.datastore import dbconstants
+from appscale.datastore.utils import tornado_synchronous
+from . import get_token
+
+# The number of ranges to process at the same time by default.
+DEFAULT_WORKERS = 4
+
+# The number of seconds to wait before retrying a range after an error.
+RETRY_DELAY = 30
+
+# The number of times to try processing a batch before giving up.
+MAX_BATCH_ATTEMPTS = 5
+
+# The number of seconds to wait before processing a batch again. The delay
+# doubles after each failure, up to RETRY_DELAY.
+BATCH_RETRY_DELAY = 1
+
+# The number of bytes to compare when estimating progress through a range.
+PROGRESS_KEY_LENGTH = 8
+
+
+def _key_to_int(key, length):
+  """ Converts a key to an integer that preserves the key's ordering.
+
+  Args:
+    key: A string specifying a key.
+    length: The number of bytes to pad the key to.
+  Returns:
+    An integer.
+  """
+  return int(key.ljust(length, '\x00').encode('hex') or '0', 16)
+
+
+def _int_to_key(value, length):
+  """ Converts an integer back to a key.
+
+  Args:
+    value: An integer created by _key_to_int.
+    length: The number of bytes in the key.
+  Returns:
+    A string specifying a key.
+  """
+  return '{:x}'.format(value).zfill(length * 2).decode('hex')
+
+
+def key_midpoint(start, end):
+  """ Finds a key that lies roughly halfway between two keys.
+
+  Args:
+    start: A string specifying the lower key.
+    end: A string specifying the upper key. An empty string indicates the end
+      of the ring.
+  Returns:
+    A string specifying a key between start and end or None if there are no
+    keys between them.
+  """
+  length = max(len(start), len(end)) + 1
+  low = _key_to_int(start, length)
+  if end:
+    high = _key_to_int(end, length)
+  else:
+    high = 256 ** length
+
+  middle = _int_to_key((low + high) // 2, length).rstrip('\x00')
+  if middle <= start or (end and middle >= end):
+    return None
+
+  return middle
+
+
+def range_fraction(start, end, position):
+  """ Estimates how much of a key range comes before a key.
+
+  Args:
+    start: A string specifying the start of the range.
+    end: A string specifying the end of the range. An empty string indicates
+      the end of the ring.
+    position: A string specifying a key within the range.
+  Returns:
+    A float between 0 and 1.
+  """
+  # Only the bytes after the shared prefix make a difference, and a few of
+  # them are enough for an estimate.
+  shared = os.path.commonprefix([start, end]) if end else ''
+  length = PROGRESS_KEY_LENGTH
+  low = _key_to_int(start[len(shared):][:length], length)
+  point = _key_to_int(position[len(shared):][:length], length)
+  if end:
+    high = _key_to_int(end[len(shared):][:length], length)
+  else:
+    high = 256 ** length
+
+  if high <= low:
+    return 1.0
+
+  return min(max(float(point - low) / (high - low), 0.0), 1.0)
+
+
+def split_range(start, end, boundaries, num_ranges):
+  """ Divides a key range into smaller ranges.
+
+  Known boundaries (eg. ring tokens and key samples) are used first since they
+  reflect how the data is distributed. If there are not enough boundaries, the
+  largest ranges are split at their midpoints.
+
+  Args:
+    start: A string specifying the start of the range (exclusive).
+    end: A string specifying the end of the range (inclusive). An empty string
+      indicates the end of the ring.
+    boundaries: An iterable of keys that make good split points.
+    num_ranges: The desired number of ranges.
+  Returns:
+    A list of (start, end) tuples that cover the given range in order.
+  """
+  points = sorted(set(
+    key for key in boundaries if key > start and (not end or key < end)))
+
+  # Select evenly spaced boundaries so that each range contains roughly the
+  # same number of them.
+  if len(points) >= num_ranges:
+    step = len(points) / float(num_ranges)
+    points = sorted(set(points[int(step * index)]
+                        for index in range(1, num_ranges)))
+
+  keys = [start] + points + [end]
+  while len(keys) - 1 < num_ranges:
+    split = False
+    for index in reversed(range(len(keys) - 1)):
+      if len(keys) - 1 >= num_ranges:
+        break
+
+      middle = key_midpoint(keys[index], keys[index + 1])
+      if middle is not None:
+        keys.insert(index + 1, middle)
+        split = True
+
+    # Stop if none of the ranges can be divided any further.
+    if not split:
+      break
+
+  return zip(keys[:-1], keys[1:])
+
+
+def get_boundaries(cluster):
+  """ Collects keys that divide the data in the cluster.
+
+  Args:
+    cluster: A cassandra-driver Cluster object.
+  Returns:
+    A list of keys.
+  """
+  boundaries = []
+  token_map = cluster.metadata.token_map
+  if token_map is not None:
+    boundaries.extend(token.value for token in token_map.ring)
+
+  # The key samples are only available when running on a database node.
+  try:
+    boundaries.extend(sample['key'] for sample in get_token.get_sample())
+  except (OSError, CalledProcessError) as error:
+    logging.debug('Unable to sample keys: {}'.format(error))
+
+  return boundaries
+
+
+class ParallelScan(object):
+  """ Scans several key ranges of a table concurrently.
+
+  Each range is scanned by a single worker thread, so batches from the same
+  range are processed in order. The process_rows callback is called from
+  multiple threads at once. After each batch, the checkpoint callback is
+  given the ranges that still need to be scanned. Passing those ranges to a
+  new ParallelScan resumes the work.
+  """
+  def __init__(self, db_access, table_name, column_names, ranges,
+               process_rows, checkpoint=None, workers=DEFAULT_WORKERS,
+               batch_size=100):
+    """ Creates a new ParallelScan.
+
+    Args:
+      db_access: A DatastoreProxy object.
+      table_name: A string specifying the table to scan.
+      column_names: A list of columns to fetch for each row.
+      ranges: A list of (start, end) tuples.
+      process_rows: A function that accepts a list of (key, columns) tuples.
+      checkpoint: A function that accepts a list of (start, end) tuples.
+      workers: An integer specifying the maximum number of ranges to scan at
+        the same time.
+      batch_size: An integer specifying the number of rows in each batch.
+    """
+    self._db_access = db_access
+    self._table_name = table_name
+    self._column_names = column_names
+    self._process_rows = process_rows
+    self._checkpoint = checkpoint
+    self._workers = workers
+    self._batch_size = batch_size
+
+    # Maps range indexes to the remaining part of each range.
+    self._remaining = dict(enumerate(ranges))
+    self._pending = list(reversed(range(len(ranges))))
+    self._lock = threading.Lock()
+    self._errors = []
+
+  @property
+  def remaining(self):
+    """ The ranges that have not been fully scanned. """
+    with self._lock:
+      return [self._remaining[index] for index in sorted(self._remaining)]
+
+  def run(self):
+    """ Scans all of the ranges and waits for the workers to finish.
+
+    Raises:
+      The first exception encountered by a worker.
+    """
+    threads = [threading.Thread(target=self._work)
+               for _ in range(min(self._workers, len(self._pending)))]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+
+    for thread in threads:
+      thread.join()
+
+    if self._errors:
+      raise self._errors[0]
+
+  def _work(self):
+    """ Scans ranges until there are none left or an error occurs. """
+    while True:
+      with self._lock:
+        if not self._pending or self._errors:
+          return
+
+        index = self._pending.pop()
+
+      try:
+        self._scan_range(index)
+      except Exception as error:
+        logging.exception('Unable to scan {}'.format(self._remaining[index]))
+        with self._lock:
+          self._errors.append(error)
+
+        return
+
+  def _stopped(self):
+    """ Checks if a worker has failed.
+
+    Returns:
+      A boolean indicating that the other workers should stop.
+    """
+    with self._lock:
+      return bool(self._errors)
+
+  def _scan_range(self, index):
+    """ Processes all of the rows in a range.
+
+    Args:
+      index: An integer identifying the range.
+    """
+    start, end = self._remaining[index]
+    scan = None
+    while True:
+      # Stop between batches if another worker failed. The range keeps its
+      # remaining part so that the scan can be resumed.
+      if self._stopped():
+        return
+
+      try:
+        # After an error, restart the scan after the last processed batch.
+        if scan is None:
+          scan = self._db_access.range_scan(
+            self._table_name, self._column_names, start, end,
+            start_inclusive=False, page_size=self._batch_size)
+
+        rows = tornado_synchronous(scan.next_page)()
+      except dbconstants.AppScaleDBConnectionError as error:
+        logging.error('Error getting a batch: {}'.format(error))
+        scan = None
+        time.sleep(RETRY_DELAY)
+        continue
+
+      if not rows:
+        break
+
+      if self._stopped():
+        return
+
+      self._process_batch(rows)
+      start = rows[-1][0]
+      with self._lock:
+        self._remaining[index] = (start, end)
+        if self._checkpoint is not None:
+          self._checkpoint(
+            [self._remaining[key] for key in sorted(self._remaining)])
+
+    with self._lock:
+      del self._remaining[index]
+
+  def _process_batch(self, rows):
+    """ Processes a batch of rows, retrying with a backoff after errors.
+
+    Args:
+      rows: A list of (key, columns) tuples.
+    Raises:
+      The last exception if the batch fails MAX_BATCH_ATTEMPTS times.
+    """
+    delay = BATCH_RETRY_DELAY
+    for attempt in range(1, MAX_BATCH_ATTEMPTS + 1):
+      try:
+        self._process_rows(rows)
+        return
+      except Exception:
+        if attempt == MAX_BATCH_ATTEMPTS or self._stopped():
+          raise
+
+        logging.exception('Unable to process batch starting with {}. '
+                          'Retrying in {}s'.format(repr(rows[0][0]), delay))
+        time.sleep(delay)
+        delay = min(delay * 2, RETRY_DELAY)
@@ -1,8 +1,32 @@
 """ A wrapper that converts Cassandra futures to Tornado futures. """
 import logging
+from cassandra.query import BatchStatement, BoundStatement
 from tornado.concurrent import Future as TornadoFuture
 from tornado.ioloop import IOLoop
 
+from appscale.datastore.request_trace import Category, current_trace
+
+
+def query_category(query):
+  """ Determines whether a query reads or writes data.
+
+  Args:
+    query: A string or an instance of a Cassandra statement.
+  Returns:
+    Category.READ or Category.WRITE.
+  """
+  if isinstance(query, BatchStatement):
+    return Category.WRITE
+
+  if isinstance(query, BoundStatement):
+    query = query.prepared_statement
+
+  query_string = getattr(query, 'query_string', query)
+  if query_string.lstrip().upper().startswith('SELECT'):
+    return Category.READ
+
+  return Category.WRITE
+
 
 class TornadoCassandra(object):
   """ A wrapper that converts Cassandra futures to Tornado futures. """
@@ -30,8 +54,62 @@ class TornadoCassandra(object):
       callback_args=(io_loop, tornado_future, cassandra_future),
       errback_args=(io_loop, tornado_future, query)
     )
+    self._trace(query, tornado_future)
     return tornado_future
 
+  def execute_page(self, query, parameters=None, paging_state=None, *args,
+                   **kwargs):
+    """ Runs a Cassandra query asynchronously and fetches a single page.
+
+    The number of rows in each page is determined by the query's fetch_size.
+
+    Args:
+      query: An instance of Cassandra query.
+      parameters: A tuple or dictionary of query parameters.
+      paging_state: The paging state returned by the previous page or None to
+        start at the beginning of the results.
+    Returns:
+      A Tornado future that resolves to a tuple containing a list of rows and
+      the paging state for the next page (None if there are no more pages).
+    """
+    tornado_future = TornadoFuture()
+    io_loop = IOLoop.current()
+    cassandra_future = self._session.execute_async(
+      query, parameters, paging_state=paging_state, *args, **kwargs)
+    cassandra_future.add_callbacks(
+      self._handle_single_page, self._handle_failure,
+      callback_args=(io_loop, tornado_future, cassandra_future),
+      errback_args=(io_loop, tornado_future, query)
+    )
+    self._trace(query, tornado_future)
+    return tornado_future
+
+  @staticmethod
+  def _trace(query, tornado_future):
+    """ Records the query in the current request's trace.
+
+    Args:
+      query: An instance of Cassandra query.
+      tornado_future: A Tornado future that resolves with the query result.
+    """
+    trace = current_trace()
+    if trace is not None:
+      trace.track_query(query_category(query), tornado_future)
+
+  @staticmethod
+  def _handle_single_page(results, io_loop, tornado_future, cassandra_future):
+    """ Assigns a single page of the Cassandra result to the Tornado future.
+
+    Args:
+      results: A list of result rows (limited version of ResultSet).
+      io_loop: An instance of tornado IOLoop where execute was initially called.
+      tornado_future: A Tornado future.
+      cassandra_future: A Cassandra future containing ResultSet.
+    """
+    result_set = cassandra_future.result()
+    page = (result_set.current_rows, result_set.paging_state)
+    io_loop.add_callback(tornado_future.set_result, page)
+
   @staticmethod
   def _handle_page(results, io_loop, tornado_future, cassandra_future):
     """ Assigns the Cassandra result to the Tornado future.
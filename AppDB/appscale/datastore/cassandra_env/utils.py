@@ -1,65 +1,53 @@
 """ Helper functions for the Cassandra datastore implementation. """
 from .. import dbconstants
-from .. import helper_functions
 from ..dbconstants import Operations
-from ..utils import (
-  clean_app_id,
-  encode_index_pb,
-  get_composite_index_keys,
-  get_composite_indexes_rows,
-  get_entity_key,
-  get_entity_kind,
-  get_index_kv_from_tuple,
-  get_kind_key
-)
-
-
-def deletions_for_entity(entity, composite_indices=()):
+from ..index_encoder import IndexEncoder, REVERSE_TABLE
+
+
+def deletions_for_entity(entity, composite_indices=(), encoder=None):
   """ Get a list of deletions needed across tables for deleting an entity.
 
   Args:
     entity: An entity object.
     composite_indices: A list or tuple of composite indices.
+    encoder: An IndexEncoder to reuse. It must have been created with the
+      same composite indices.
   Returns:
     A list of dictionaries representing mutation operations.
   """
-  deletions = []
-  app_id = clean_app_id(entity.key().app())
-  namespace = entity.key().name_space()
-  prefix = dbconstants.KEY_DELIMITER.join([app_id, namespace])
+  if encoder is None:
+    encoder = IndexEncoder(composite_indices)
 
-  asc_rows = get_index_kv_from_tuple([(prefix, entity)])
-  for entry in asc_rows:
+  rows = encoder.entity_rows(entity)
+  deletions = []
+  for key in rows.asc_keys:
     deletions.append({'table': dbconstants.ASC_PROPERTY_TABLE,
-                      'key': entry[0],
+                      'key': key,
                       'operation': Operations.DELETE})
 
-  dsc_rows = get_index_kv_from_tuple(
-    [(prefix, entity)], reverse=True)
-  for entry in dsc_rows:
+  for key in rows.dsc_keys:
     deletions.append({'table': dbconstants.DSC_PROPERTY_TABLE,
-                      'key': entry[0],
+                      'key': key,
                       'operation': Operations.DELETE})
 
-  for key in get_composite_indexes_rows([entity], composite_indices):
+  for key in rows.composite_keys:
     deletions.append({'table': dbconstants.COMPOSITE_TABLE,
                       'key': key,
                       'operation': Operations.DELETE})
 
-  entity_key = get_entity_key(prefix, entity.key().path())
   deletions.append({'table': dbconstants.APP_ENTITY_TABLE,
-                    'key': entity_key,
+                    'key': rows.entity_key,
                     'operation': Operations.DELETE})
 
-  kind_key = get_kind_key(prefix, entity.key().path())
   deletions.append({'table': dbconstants.APP_KIND_TABLE,
-                    'key': kind_key,
+                    'key': rows.kind_key,
                     'operation': Operations.DELETE})
 
   return deletions
 
 
-def index_deletions(old_entity, new_entity, composite_indices=()):
+def index_deletions(old_entity, new_entity, composite_indices=(),
+                    encoder=None):
   """ Get a list of index deletions needed for updating an entity. For changing
   an existing entity, this involves examining the property list of both
   entities to see which index entries need to be removed.
@@ -68,14 +56,18 @@ def index_deletions(old_entity, new_entity, composite_indices=()):
     old_entity: An entity object.
     new_entity: An entity object.
     composite_indices: A list or tuple of composite indices.
+    encoder: An IndexEncoder to reuse.
   Returns:
     A list of dictionaries representing mutation operations.
   """
+  if encoder is None:
+    encoder = IndexEncoder(composite_indices)
+
   deletions = []
-  app_id = clean_app_id(old_entity.key().app())
-  namespace = old_entity.key().name_space()
-  kind = get_entity_kind(old_entity.key())
-  entity_key = str(encode_index_pb(old_entity.key().path()))
+  key = old_entity.key()
+  layout = encoder.layout(key)
+  key_suffix = dbconstants.KEY_DELIMITER + encoder.encode_path(
+    key.path().element_list())
 
   new_props = {}
   for prop in new_entity.property_list():
@@ -83,33 +75,26 @@ def index_deletions(old_entity, new_entity, composite_indices=()):
       new_props[prop.name()] = []
     new_props[prop.name()].append(prop)
 
-  changed_props = {}
+  changed_prop_names = set()
   for prop in old_entity.property_list():
     if prop.name() in new_props and prop in new_props[prop.name()]:
       continue
 
-    if prop.name() not in changed_props:
-      changed_props[prop.name()] = []
-    changed_props[prop.name()].append(prop)
-
-    value = str(encode_index_pb(prop.value()))
+    changed_prop_names.add(prop.name())
 
-    key = dbconstants.KEY_DELIMITER.join(
-      [app_id, namespace, kind, prop.name(), value, entity_key])
+    value = encoder.encode_value(prop.value())
+    property_prefix = layout.property_prefix(prop.name())
     deletions.append({'table': dbconstants.ASC_PROPERTY_TABLE,
-                      'key': key,
+                      'key': property_prefix + value + key_suffix,
                       'operation': Operations.DELETE})
 
-    reverse_key = dbconstants.KEY_DELIMITER.join(
-      [app_id, namespace, kind, prop.name(),
-       helper_functions.reverse_lex(value), entity_key])
+    reverse_value = value.translate(REVERSE_TABLE)
     deletions.append({'table': dbconstants.DSC_PROPERTY_TABLE,
-                      'key': reverse_key,
+                      'key': property_prefix + reverse_value + key_suffix,
                       'operation': Operations.DELETE})
 
-  changed_prop_names = set(changed_props.keys())
   for index in composite_indices:
-    if index.definition().entity_type() != kind:
+    if index.definition().entity_type() != layout.kind:
       continue
 
     index_props = set(prop.name() for prop
@@ -117,8 +102,8 @@ def index_deletions(old_entity, new_entity, composite_indices=()):
     if index_props.isdisjoint(changed_prop_names):
       continue
 
-    old_entries = set(get_composite_index_keys(index, old_entity))
-    new_entries = set(get_composite_index_keys(index, new_entity))
+    old_entries = set(encoder.composite_keys(index, old_entity))
+    new_entries = set(encoder.composite_keys(index, new_entity))
     for entry in (old_entries - new_entries):
       deletions.append({'table': dbconstants.COMPOSITE_TABLE,
                         'key': entry,
@@ -128,7 +113,7 @@ def index_deletions(old_entity, new_entity, composite_indices=()):
 
 
 def mutations_for_entity(entity, txn, current_value=None,
-                         composite_indices=()):
+                         composite_indices=(), encoder=None):
   """ Get a list of mutations needed across tables for an entity change.
 
   Args:
@@ -136,52 +121,75 @@ def mutations_for_entity(entity, txn, current_value=None,
     txn: A transaction ID handler.
     current_value: The entity object currently stored.
     composite_indices: A list of composite indices for the entity kind.
+    encoder: An IndexEncoder to reuse. It must have been created with the
+      same composite indices.
   Returns:
     A list of dictionaries representing mutations.
   """
+  if encoder is None:
+    encoder = IndexEncoder(composite_indices)
+
   mutations = []
   if current_value is not None:
     mutations.extend(
-      index_deletions(current_value, entity, composite_indices))
+      index_deletions(current_value, entity, composite_indices, encoder))
 
-  app_id = clean_app_id(entity.key().app())
-  namespace = entity.key().name_space()
-  encoded_path = str(encode_index_pb(entity.key().path()))
-  prefix = dbconstants.KEY_DELIMITER.join([app_id, namespace])
-  entity_key = dbconstants.KEY_DELIMITER.join([prefix, encoded_path])
+  rows = encoder.entity_rows(entity)
   entity_value = {dbconstants.APP_ENTITY_SCHEMA[0]: entity.Encode(),
                   dbconstants.APP_ENTITY_SCHEMA[1]: str(txn)}
   mutations.append({'table': dbconstants.APP_ENTITY_TABLE,
-                    'key': entity_key,
+                    'key': rows.entity_key,
                     'operation': Operations.PUT,
                     'values': entity_value})
 
-  reference_value = {'reference': entity_key}
+  reference_value = {'reference': rows.entity_key}
 
-  kind_key = get_kind_key(prefix, entity.key().path())
   mutations.append({'table': dbconstants.APP_KIND_TABLE,
-                    'key': kind_key,
+                    'key': rows.kind_key,
                     'operation': Operations.PUT,
                     'values': reference_value})
 
-  asc_rows = get_index_kv_from_tuple([(prefix, entity)])
-  for entry in asc_rows:
+  for key in rows.asc_keys:
     mutations.append({'table': dbconstants.ASC_PROPERTY_TABLE,
-                      'key': entry[0],
+                      'key': key,
                       'operation': Operations.PUT,
                       'values': reference_value})
 
-  dsc_rows = get_index_kv_from_tuple([(prefix, entity)], reverse=True)
-  for entry in dsc_rows:
+  for key in rows.dsc_keys:
     mutations.append({'table': dbconstants.DSC_PROPERTY_TABLE,
-                      'key': entry[0],
+                      'key': key,
                       'operation': Operations.PUT,
                       'values': reference_value})
 
-  for key in get_composite_indexes_rows([entity], composite_indices):
+  for key in rows.composite_keys:
     mutations.append({'table': dbconstants.COMPOSITE_TABLE,
                       'key': key,
                       'operation': Operations.PUT,
                       'values': reference_value})
 
   return mutations
+
+
+def mutations_for_entities(entities, txn, current_values,
+                           composite_indices=()):
+  """ Get a list of mutations needed across tables for several entities.
+
+  The index keys for the whole batch are built with one IndexEncoder, so
+  the key prefixes for each kind are only computed once.
+
+  Args:
+    entities: A list of entity objects.
+    txn: A transaction ID handler.
+    current_values: A list containing the entity object currently stored (or
+      None) for each entity.
+    composite_indices: A list of composite indices for the entity kinds.
+  Returns:
+    A list of dictionaries representing mutations.
+  """
+  encoder = IndexEncoder(composite_indices)
+  mutations = []
+  for entity, current_value in zip(entities, current_values):
+    mutations.extend(mutations_for_entity(
+      entity, txn, current_value, composite_indices, encoder))
+
+  return mutations
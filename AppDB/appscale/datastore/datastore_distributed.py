@@ -25,6 +25,7 @@ from appscale.datastore.cassandra_env.entity_id_allocator import ScatteredAlloca
 from appscale.datastore.cassandra_env.large_batch import BatchNotApplied
 from appscale.datastore.cassandra_env.utils import deletions_for_entity
 from appscale.datastore.cassandra_env.utils import mutations_for_entity
+from appscale.datastore.cassandra_env.utils import mutations_for_entities
 from appscale.datastore.taskqueue_client import EnqueueError, TaskQueueClient
 from appscale.datastore.utils import clean_app_id
 from appscale.datastore.utils import decode_path
@@ -40,6 +41,7 @@ from appscale.datastore.utils import group_for_key
 from appscale.datastore.utils import kind_from_encoded_key
 from appscale.datastore.utils import reference_property_to_reference
 from appscale.datastore.utils import UnprocessedQueryCursor
+from appscale.datastore.query_planner import QueryPlanner, Strategy
 from appscale.datastore.range_iterator import RangeExhausted, RangeIterator
 from appscale.datastore.zkappscale import entity_lock
 from appscale.datastore.zkappscale import zktransaction
@@ -114,13 +116,17 @@ class DatastoreDistributed():
   BATCH_SIZE = 100
 
   def __init__(self, datastore_batch, transaction_manager, zookeeper=None,
-               log_level=logging.INFO, taskqueue_locations=()):
+               log_level=logging.INFO, taskqueue_locations=(),
+               entity_cache=None, building_indexes=None):
     """
        Constructor.
 
      Args:
        datastore_batch: A reference to the batch datastore interface.
        zookeeper: A reference to the zookeeper interface.
+       entity_cache: An optional EntityCache for non-transactional reads.
+       building_indexes: An optional BuildingIndexes object. When it is
+         provided, new indexes are built by the backfill worker.
     """
     class_name = self.__class__.__name__
     self.logger = logging.getLogger(class_name)
@@ -144,6 +150,9 @@ class DatastoreDistributed():
 
     self.taskqueue_client = TaskQueueClient(taskqueue_locations)
     self.transaction_manager = transaction_manager
+    self.entity_cache = entity_cache
+    self.query_planner = QueryPlanner(datastore_batch)
+    self.building_indexes = building_indexes
     self.zookeeper.handle.add_listener(self._zk_state_listener)
 
   def get_limit(self, query):
@@ -400,6 +409,9 @@ class DatastoreDistributed():
       dbconstants.METADATA_TABLE, index_keys,
       column_names=dbconstants.METADATA_TABLE)
 
+    if self.building_indexes is not None:
+      yield self.building_indexes.cancel(index.id())
+
   @gen.coroutine
   def create_composite_index(self, app_id, index):
     """ Stores a new index for the given application identifier.
@@ -427,11 +439,23 @@ class DatastoreDistributed():
   def update_composite_index(self, app_id, index):
     """ Updates an index for a given app ID.
 
+    If the backfill worker is in use, the index is marked as building and a
+    backfill job is recorded instead.
+
     Args:
       app_id: A string containing the app ID.
       index: An entity_pb.CompositeIndex object.
     """
     self.logger.info('Updating index: {}'.format(index))
+    if self.building_indexes is not None:
+      index.set_state(entity_pb.CompositeIndex.WRITE_ONLY)
+      row_key = self._SEPARATOR.join([app_id, 'index', str(index.id())])
+      yield self.datastore_batch.batch_put_entity(
+        dbconstants.METADATA_TABLE, [row_key], dbconstants.METADATA_SCHEMA,
+        {row_key: {dbconstants.METADATA_SCHEMA[0]: index.Encode()}})
+      yield self.building_indexes.schedule(app_id, index)
+      return
+
     entries_updated = 0
     entity_type = index.definition().entity_type()
 
@@ -486,7 +510,8 @@ class DatastoreDistributed():
     """
     if project not in self.sequential_allocators:
       self.sequential_allocators[project] = EntityIDAllocator(
-        self.datastore_batch.session, project)
+        self.datastore_batch.session, project,
+        statement_cache=self.datastore_batch.statement_cache)
 
     allocator = self.sequential_allocators[project]
     start_id, end_id = yield allocator.allocate_size(size)
@@ -504,7 +529,8 @@ class DatastoreDistributed():
     """
     if project not in self.sequential_allocators:
       self.sequential_allocators[project] = EntityIDAllocator(
-        self.datastore_batch.session, project)
+        self.datastore_batch.session, project,
+        statement_cache=self.datastore_batch.statement_cache)
 
     allocator = self.sequential_allocators[project]
     start_id, end_id = yield allocator.allocate_max(max_id)
@@ -520,11 +546,13 @@ class DatastoreDistributed():
     """
     if project_id not in self.sequential_allocators:
       self.sequential_allocators[project_id] = EntityIDAllocator(
-        self.datastore_batch.session, project_id)
+        self.datastore_batch.session, project_id,
+        statement_cache=self.datastore_batch.statement_cache)
 
     if project_id not in self.scattered_allocators:
       self.scattered_allocators[project_id] = ScatteredAllocator(
-        self.datastore_batch.session, project_id)
+        self.datastore_batch.session, project_id,
+        statement_cache=self.datastore_batch.statement_cache)
 
     for id_ in ids:
       counter, space = IdToCounter(id_)
@@ -557,8 +585,9 @@ class DatastoreDistributed():
     for encoded_group_key, entity_list in by_group.iteritems():
       group_key = entity_pb.Reference(encoded_group_key)
 
-      txid = self.transaction_manager.create_transaction_id(app, xg=False)
-      self.transaction_manager.set_groups(app, txid, [group_key])
+      txid = yield self.transaction_manager.create_transaction_id(
+        app, xg=False)
+      yield self.transaction_manager.set_groups(app, txid, [group_key])
 
       # Allow the lock to stick around if there is an issue applying the batch.
       lock = entity_lock.EntityLock(self.zookeeper.handle, [group_key], txid)
@@ -567,19 +596,18 @@ class DatastoreDistributed():
       except entity_lock.LockTimeout:
         raise Timeout('Unable to acquire entity group lock')
 
+      entity_keys = [
+        get_entity_key(self.get_table_prefix(entity), entity.key().path())
+        for entity in entity_list]
       try:
-        entity_keys = [
-          get_entity_key(self.get_table_prefix(entity), entity.key().path())
-          for entity in entity_list]
         try:
           current_values = yield self.datastore_batch.batch_get_entity(
             dbconstants.APP_ENTITY_TABLE, entity_keys, APP_ENTITY_SCHEMA)
         except dbconstants.AppScaleDBConnectionError:
-          lock.release()
-          self.transaction_manager.delete_transaction_id(app, txid)
+          yield lock.release_async()
+          yield self.transaction_manager.delete_transaction_id(app, txid)
           raise
 
-        batch = []
         entity_changes = []
         for entity in entity_list:
           prefix = self.get_table_prefix(entity)
@@ -590,16 +618,16 @@ class DatastoreDistributed():
             current_value = entity_pb.EntityProto(
               current_values[entity_key][APP_ENTITY_SCHEMA[0]])
 
-          batch.extend(mutations_for_entity(entity, txid, current_value,
-                                            composite_indexes))
-
-          batch.append({'table': 'group_updates',
-                        'key': bytearray(encoded_group_key),
-                        'last_update': txid})
-
           entity_changes.append(
             {'key': entity.key(), 'old': current_value, 'new': entity})
 
+        batch = mutations_for_entities(
+          entity_list, txid, [change['old'] for change in entity_changes],
+          composite_indexes)
+        batch.append({'table': 'group_updates',
+                      'key': bytearray(encoded_group_key),
+                      'last_update': txid})
+
         if batch_size(batch) > LARGE_BATCH_THRESHOLD:
           try:
             yield self.datastore_batch.large_batch(app, batch, entity_changes,
@@ -608,7 +636,7 @@ class DatastoreDistributed():
             # If the "applied" switch has not been flipped, the lock can be
             # released. The transaction ID is kept so that the groomer can
             # clean up the batch tables.
-            lock.release()
+            yield lock.release_async()
             raise dbconstants.AppScaleDBConnectionError(str(error))
         else:
           try:
@@ -616,19 +644,98 @@ class DatastoreDistributed():
           except dbconstants.AppScaleDBConnectionError:
             # Since normal batches are guaranteed to be atomic, the lock can
             # be released.
-            lock.release()
-            self.transaction_manager.delete_transaction_id(app, txid)
+            yield lock.release_async()
+            yield self.transaction_manager.delete_transaction_id(app, txid)
             raise
 
-        lock.release()
+        yield lock.release_async()
 
       finally:
         # In case of failure entity group lock should stay acquired
         # as transaction groomer will handle it later.
         # But tornado lock must be released.
         lock.ensure_release_tornado_lock()
+        self._invalidate_cached_entities(entity_keys)
+
+      yield self.transaction_manager.delete_transaction_id(app, txid)
+
+  @gen.coroutine
+  def bulk_put(self, app, entities, composite_indexes=()):
+    """ Stores entities without locking their entity groups.
 
-      self.transaction_manager.delete_transaction_id(app, txid)
+    This is meant for imports (such as restoring a backup) where nothing else
+    is modifying the entities. The existing versions are fetched together,
+    and index rows are written in unlogged batches without the batch log.
+    Since the index rows are written before the entities, a failed bulk put
+    can simply be retried.
+
+    Args:
+      app: A string containing the application ID.
+      entities: A list of entity_pb.EntityProto objects with complete keys.
+      composite_indexes: A list or tuple of CompositeIndex objects.
+    Raises:
+      BadRequest if an entity does not have a complete key.
+      AppScaleDBConnectionError if a database connection error was encountered.
+    """
+    self.logger.debug('Bulk inserting {} entities'.format(len(entities)))
+
+    # When an entity appears more than once, the last version is kept.
+    by_key = {}
+    for entity in entities:
+      self.validate_key(entity.key())
+      last_path = entity.key().path().element_list()[-1]
+      if last_path.id() == 0 and not last_path.has_name():
+        raise BadRequest('Bulk puts require complete keys')
+
+      self.__obfuscate_user_values(entity)
+      entity_key = get_entity_key(self.get_table_prefix(entity),
+                                  entity.key().path())
+      by_key[entity_key] = entity
+
+    entity_keys = by_key.keys()
+    current_values = yield self.datastore_batch.batch_get_entity(
+      dbconstants.APP_ENTITY_TABLE, entity_keys, APP_ENTITY_SCHEMA)
+
+    # The transaction ID only provides the write timestamp, so the groups do
+    # not need to be registered or locked.
+    txid = yield self.transaction_manager.create_transaction_id(app, xg=False)
+    try:
+      new_values = []
+      old_values = []
+      groups = set()
+      for entity_key, entity in by_key.iteritems():
+        current_value = None
+        if current_values[entity_key]:
+          current_value = entity_pb.EntityProto(
+            current_values[entity_key][APP_ENTITY_SCHEMA[0]])
+
+        new_values.append(entity)
+        old_values.append(current_value)
+        groups.add(group_for_key(entity.key()).Encode())
+
+      mutations = mutations_for_entities(new_values, txid, old_values,
+                                         composite_indexes)
+
+      # The index rows are written before the entities. If the entity writes
+      # only partly succeed, a retry would read the new versions as the
+      # current values and miss the old index rows that need to be deleted.
+      index_mutations = [mutation for mutation in mutations
+                         if mutation['table'] != dbconstants.APP_ENTITY_TABLE]
+      entity_mutations = [mutation for mutation in mutations
+                          if mutation['table'] == dbconstants.APP_ENTITY_TABLE]
+
+      # Let transactions that read these groups detect the change.
+      entity_mutations.extend(
+        {'table': 'group_updates', 'key': bytearray(group),
+         'last_update': txid} for group in groups)
+
+      try:
+        yield self.datastore_batch.bulk_write(index_mutations, txid)
+        yield self.datastore_batch.bulk_write(entity_mutations, txid)
+      finally:
+        self._invalidate_cached_entities(entity_keys)
+    finally:
+      yield self.transaction_manager.delete_transaction_id(app, txid)
 
   @gen.coroutine
   def delete_entities(self, group, txid, keys, composite_indexes=()):
@@ -649,19 +756,36 @@ class DatastoreDistributed():
     current_values = yield self.datastore_batch.batch_get_entity(
       dbconstants.APP_ENTITY_TABLE, entity_keys, APP_ENTITY_SCHEMA)
 
-    for key in entity_keys:
-      if not current_values[key]:
-        continue
+    try:
+      for key in entity_keys:
+        if not current_values[key]:
+          continue
 
-      current_value = entity_pb.EntityProto(
-        current_values[key][APP_ENTITY_SCHEMA[0]])
-      batch = deletions_for_entity(current_value, composite_indexes)
+        current_value = entity_pb.EntityProto(
+          current_values[key][APP_ENTITY_SCHEMA[0]])
+        batch = deletions_for_entity(current_value, composite_indexes)
 
-      batch.append({'table': 'group_updates',
-                    'key': bytearray(group.Encode()),
-                    'last_update': txid})
+        batch.append({'table': 'group_updates',
+                      'key': bytearray(group.Encode()),
+                      'last_update': txid})
 
-      yield self.datastore_batch.normal_batch(batch, txid)
+        yield self.datastore_batch.normal_batch(batch, txid)
+    finally:
+      self._invalidate_cached_entities(entity_keys)
+
+  @staticmethod
+  def __obfuscate_user_values(entity):
+    """ Fills in the obfuscated user IDs for an entity's user properties.
+
+    Args:
+      entity: An entity_pb.EntityProto object.
+    """
+    for prop in itertools.chain(entity.property_list(),
+                                entity.raw_property_list()):
+      if prop.value().has_uservalue():
+        uid = md5.new(prop.value().uservalue().email().lower()).digest()
+        uid = '1' + ''.join(['%02d' % ord(x) for x in uid])[:20]
+        prop.mutable_value().mutable_uservalue().set_obfuscated_gaiaid(uid)
 
   @gen.coroutine
   def dynamic_put(self, app_id, put_request, put_response):
@@ -676,20 +800,15 @@ class DatastoreDistributed():
     """
     if app_id not in self.scattered_allocators:
       self.scattered_allocators[app_id] = ScatteredAllocator(
-        self.datastore_batch.session, app_id)
+        self.datastore_batch.session, app_id,
+        statement_cache=self.datastore_batch.statement_cache)
     allocator = self.scattered_allocators[app_id]
 
     entities = put_request.entity_list()
 
     for entity in entities:
       self.validate_key(entity.key())
-
-      for prop in itertools.chain(entity.property_list(),
-                                  entity.raw_property_list()):
-        if prop.value().has_uservalue():
-          uid = md5.new(prop.value().uservalue().email().lower()).digest()
-          uid = '1' + ''.join(['%02d' % ord(x) for x in uid])[:20]
-          prop.mutable_value().mutable_uservalue().set_obfuscated_gaiaid(uid)
+      self.__obfuscate_user_values(entity)
 
       last_path = entity.key().path().element_list()[-1]
       if last_path.id() == 0 and not last_path.has_name():
@@ -839,12 +958,22 @@ class DatastoreDistributed():
       txnid = txn_hash[root_key]
       self.zookeeper.release_lock(app_id, txnid)
 
+  def _invalidate_cached_entities(self, entity_keys):
+    """ Removes modified entities from the entity cache.
+
+    Args:
+      entity_keys: A list of entity table keys.
+    """
+    if self.entity_cache is not None:
+      self.entity_cache.invalidate(entity_keys)
+
   @gen.coroutine
-  def fetch_keys(self, key_list):
+  def fetch_keys(self, key_list, use_cache=False):
     """ Given a list of keys fetch the entities.
 
     Args:
       key_list: A list of keys to fetch.
+      use_cache: A boolean specifying that the entity cache can be used.
     Returns:
       A tuple of entities from the datastore and key list.
     """
@@ -854,8 +983,32 @@ class DatastoreDistributed():
       index_key = str(encode_index_pb(key.path()))
       prefix = self.get_table_prefix(key)
       row_keys.append(self._SEPARATOR.join([prefix, index_key]))
-    result = yield self.datastore_batch.batch_get_entity(
-      dbconstants.APP_ENTITY_TABLE, row_keys, APP_ENTITY_SCHEMA)
+
+    if not use_cache or self.entity_cache is None:
+      result = yield self.datastore_batch.batch_get_entity(
+        dbconstants.APP_ENTITY_TABLE, row_keys, APP_ENTITY_SCHEMA)
+      raise gen.Return((result, row_keys))
+
+    result = {}
+    keys_to_fetch = []
+    for row_key in row_keys:
+      row = self.entity_cache.get(row_key)
+      if row is None:
+        keys_to_fetch.append(row_key)
+      else:
+        result[row_key] = row
+
+    if keys_to_fetch:
+      generation = self.entity_cache.start_fetch()
+      fetched = {}
+      try:
+        fetched = yield self.datastore_batch.batch_get_entity(
+          dbconstants.APP_ENTITY_TABLE, keys_to_fetch, APP_ENTITY_SCHEMA)
+      finally:
+        self.entity_cache.finish_fetch(generation, fetched)
+
+      result.update(fetched)
+
     raise gen.Return((result, row_keys))
 
   @gen.coroutine
@@ -881,7 +1034,7 @@ class DatastoreDistributed():
       yield self.datastore_batch.record_reads(
         app_id, get_request.transaction().handle(), fetched_groups)
     else:
-      results, row_keys = yield self.fetch_keys(keys)
+      results, row_keys = yield self.fetch_keys(keys, use_cache=True)
 
     result_count = 0
     for r in row_keys:
@@ -940,8 +1093,9 @@ class DatastoreDistributed():
       for encoded_group_key, key_list in by_group.iteritems():
         group_key = entity_pb.Reference(encoded_group_key)
 
-        txid = self.transaction_manager.create_transaction_id(app_id, xg=False)
-        self.transaction_manager.set_groups(app_id, txid, [group_key])
+        txid = yield self.transaction_manager.create_transaction_id(
+          app_id, xg=False)
+        yield self.transaction_manager.set_groups(app_id, txid, [group_key])
 
         # Allow the lock to stick around if there is an issue applying the batch.
         lock = entity_lock.EntityLock(self.zookeeper.handle, [group_key], txid)
@@ -957,7 +1111,7 @@ class DatastoreDistributed():
             key_list,
             composite_indexes=filtered_indexes
           )
-          lock.release()
+          yield lock.release_async()
         finally:
           # In case of failure entity group lock should stay acquired
           # as transaction groomer will handle it later.
@@ -965,7 +1119,7 @@ class DatastoreDistributed():
           lock.ensure_release_tornado_lock()
 
         self.logger.debug('Removed {} entities'.format(len(key_list)))
-        self.transaction_manager.delete_transaction_id(app_id, txid)
+        yield self.transaction_manager.delete_transaction_id(app_id, txid)
 
   def generate_filter_info(self, filters):
     """Transform a list of filters into a more usable form.
@@ -1240,24 +1394,6 @@ class DatastoreDistributed():
         to_fetch += dbconstants.MAX_GROUPS_FOR_XG
         added_padding = True
 
-  def __extract_entities(self, kv):
-    """ Given a result from a range query on the Entity table return a
-        list of encoded entities.
-
-    Args:
-      kv: Key and values from a range query on the entity table.
-    Returns:
-      The extracted entities.
-    """
-    keys = [item.keys()[0] for item in kv]
-    results = []
-    for index, entity in enumerate(kv):
-      key = keys[index]
-      entity = entity[key][APP_ENTITY_SCHEMA[0]]
-      results.append(entity)
-
-    return results
-
   @gen.coroutine
   def ancestor_query(self, query, filter_info):
     """ Performs ancestor queries which is where you select
@@ -1375,36 +1511,25 @@ class DatastoreDistributed():
     Returns:
        A validated database result.
     """
-    final_result = []
-    while 1:
-      result = yield self.datastore_batch.range_query(
-        dbconstants.APP_ENTITY_TABLE,
-        APP_ENTITY_SCHEMA,
-        startrow,
-        endrow,
-        limit,
-        offset=0,
-        start_inclusive=start_inclusive,
-        end_inclusive=end_inclusive)
+    scan = self.datastore_batch.range_scan(
+      dbconstants.APP_ENTITY_TABLE,
+      APP_ENTITY_SCHEMA,
+      startrow,
+      endrow,
+      limit,
+      offset=offset,
+      start_inclusive=start_inclusive,
+      end_inclusive=end_inclusive)
 
-      prev_len = len(result)
-      last_result = None
-      if result:
-        last_result = result[-1].keys()[0]
-      else:
+    entities = []
+    while True:
+      rows = yield scan.next_page()
+      if not rows:
         break
 
-      final_result += result
+      entities.extend(columns[APP_ENTITY_SCHEMA[0]] for _, columns in rows)
 
-      if len(result) != prev_len:
-        startrow = last_result
-        start_inclusive = self._DISABLE_INCLUSIVITY
-        limit = limit - len(result)
-        continue
-      else:
-        break
-
-    raise gen.Return(self.__extract_entities(final_result))
+    raise gen.Return(entities)
 
   @gen.coroutine
   def kindless_query(self, query, filter_info):
@@ -1697,13 +1822,16 @@ class DatastoreDistributed():
     return filter_ops
 
   @gen.coroutine
-  def __single_property_query(self, query, filter_info, order_info):
+  def __single_property_query(self, query, filter_info, order_info,
+                              extra_filters=None):
     """Performs queries satisfiable by the Single_Property tables.
 
     Args:
       query: The query to run.
       filter_info: tuple with filter operators and values.
       order_info: tuple with property name and the sort order.
+      extra_filters: A dictionary mapping other property names to lists of
+        equality filter properties to apply after fetching the entities.
     Returns:
       List of entities retrieved from the given query.
     """
@@ -1729,6 +1857,8 @@ class DatastoreDistributed():
 
     multiple_equality_filters = self.__get_multiple_equality_filters(
       query.filter_list())
+    if extra_filters:
+      multiple_equality_filters.update(extra_filters)
 
     if len(order_info) > 1 or (order_info and order_info[0][0] == '__key__'):
       return
@@ -1791,8 +1921,9 @@ class DatastoreDistributed():
           new_entities.append(valid_entity)
 
       if len(multiple_equality_filters) > 0:
-        self.logger.debug('Detected multiple equality filters on a repeated'
-          'property. Removing results that do not match query.')
+        self.logger.debug('Detected multiple equality filters on a repeated '
+          'property or other properties. Removing results that do not match '
+          'query.')
         new_entities = self.__apply_multiple_equality_filters(
           new_entities, multiple_equality_filters)
 
@@ -2138,42 +2269,32 @@ class DatastoreDistributed():
       A dictionary mapping entity references to index entries.
     """
     reference_hash = {}
-    min_common_path = ranges[0].get_cursor()
-    entries_exhausted = False
     while True:
-      common_keys = []
-      entry = None
-      for range_ in ranges:
-        try:
-          entry = yield range_.async_next()
-        except RangeExhausted:
-          # If any ranges have been exhausted, there are no more matches.
-          entries_exhausted = True
-          break
-
-        # If this entry's path is ahead of the others, consider it the new
-        # minimum acceptable path and adjust the other ranges.
-        if entry.encoded_path > str(encode_index_pb(min_common_path)):
-          min_common_path = entry.path
-          break
-
-        common_keys.append({'index': entry.key, 'prop_name': range_.prop_name})
-
-      if entries_exhausted:
+      # Advance all of the ranges at the same time.
+      try:
+        entries = yield gen.multi_future(
+          [range_.async_next() for range_ in ranges],
+          quiet_exceptions=RangeExhausted)
+      except RangeExhausted:
+        # If any ranges have been exhausted, there are no more matches.
         break
 
-      # If not all paths are common, adjust earlier ranges.
-      if len(common_keys) < len(ranges):
+      # If an entry's path is ahead of the others, consider it the new
+      # minimum acceptable path and adjust the other ranges.
+      newest = max(entries, key=lambda entry: entry.encoded_path)
+      if any(entry.encoded_path != newest.encoded_path for entry in entries):
         for range_ in ranges:
-          range_.set_cursor(min_common_path, inclusive=True)
+          range_.set_cursor(newest.path, inclusive=True)
 
         continue
 
-      reference_hash[entry.entity_reference] = common_keys
+      reference_hash[newest.entity_reference] = [
+        {'index': entry.key, 'prop_name': range_.prop_name}
+        for entry, range_ in zip(entries, ranges)]
 
       # Ensure the chosen reference is excluded.
       for range_ in ranges:
-        range_.set_cursor(min_common_path, inclusive=False)
+        range_.set_cursor(newest.path, inclusive=False)
 
       # If there are enough references to satisfy the query, stop fetching
       # entries.
@@ -2182,6 +2303,42 @@ class DatastoreDistributed():
 
     raise gen.Return(reference_hash)
 
+  @gen.coroutine
+  def __filtered_single_property_query(self, query, filter_info,
+                                       property_name):
+    """ Performs an equality query by scanning a single property's index and
+    applying the rest of the filters to the fetched entities.
+
+    This is cheaper than a zigzag merge join when one of the filters is much
+    more selective than the others.
+
+    Args:
+      query: A datastore_pb.Query.
+      filter_info: dict of property names mapping to tuples of filter
+        operators and values.
+      property_name: A string specifying the property whose index is scanned.
+    Returns:
+      List of entities retrieved from the given query or None if the other
+      filters cannot be applied to the fetched entities.
+    """
+    extra_filters = {}
+    for query_filter in query.filter_list():
+      for prop in query_filter.property_list():
+        if prop.name() == property_name:
+          continue
+
+        # Only equality filters can be checked against the fetched entities.
+        if query_filter.op() != datastore_pb.Query_Filter.EQUAL:
+          raise gen.Return(None)
+
+        extra_filters.setdefault(prop.name(), []).append(prop)
+
+    # Results are returned in key order like they are for merge joins, so
+    # orders on the equality-filtered properties can be ignored.
+    results = yield self.__single_property_query(
+      query, {property_name: filter_info[property_name]}, [], extra_filters)
+    raise gen.Return(results)
+
   @gen.coroutine
   def zigzag_merge_join(self, query, filter_info, order_info):
     """ Performs a composite query for queries which have multiple
@@ -2622,8 +2779,8 @@ class DatastoreDistributed():
       passes_all_filters = True
       for filter_prop_name in filter_dict:
         if filter_prop_name not in relevant_props_in_entity:
-          raise dbconstants.AppScaleDBError(
-            'Property name not found in entity.')
+          passes_all_filters = False
+          break
 
         filter_props = filter_dict[filter_prop_name]
         entity_props = relevant_props_in_entity[filter_prop_name]
@@ -2879,6 +3036,54 @@ class DatastoreDistributed():
       zigzag_merge_join,
   ]
 
+  # Maps planner strategies to the methods that implement them.
+  _PLAN_STRATEGIES = {
+    Strategy.KIND: __kind_query,
+    Strategy.SINGLE_PROPERTY: __single_property_query,
+    Strategy.ZIGZAG_MERGE_JOIN: zigzag_merge_join,
+  }
+
+  @gen.coroutine
+  def __plan_query(self, query, filter_info, order_info):
+    """ Estimates the cost of the strategies that can run a query.
+
+    Args:
+      query: A datastore_pb.Query.
+      filter_info: dict of property names mapping to tuples of filter
+        operators and values.
+      order_info: tuple with property name and the sort order.
+    Returns:
+      A list of QueryPlan objects, cheapest first.
+    """
+    zigzag = self.is_zigzag_merge_join(query, filter_info, order_info)
+    plans = yield self.query_planner.plan(
+      query, self.remove_exists_filters(filter_info), order_info,
+      self.get_limit(query), zigzag)
+    raise gen.Return(plans)
+
+  @gen.coroutine
+  def explain_query(self, query):
+    """ Describes how a query would be executed.
+
+    Args:
+      query: A datastore_pb.Query.
+    Returns:
+      A dictionary describing the chosen strategy, its estimated cost, and
+      the alternatives that were considered.
+    """
+    filters, orders = datastore_index.Normalize(query.filter_list(),
+                                                query.order_list(), [])
+    filter_info = self.generate_filter_info(filters)
+    order_info = self.generate_order_info(orders)
+
+    if query.composite_index_size() > 0:
+      raise gen.Return({'strategy': Strategy.COMPOSITE,
+                        'index': query.composite_index(0).id(),
+                        'candidates': []})
+
+    plans = yield self.__plan_query(query, filter_info, order_info)
+    raise gen.Return(self.query_planner.explain(plans))
+
   @gen.coroutine
   def __get_query_results(self, query):
     """Applies the strategy for the provided query.
@@ -2918,9 +3123,29 @@ class DatastoreDistributed():
     # We do the composite check first because its easy to determine if a query
     # has a composite index.
     if query.composite_index_size() > 0:
+      index_id = query.composite_index(0).id()
+      if (self.building_indexes is not None and
+          self.building_indexes.is_building(index_id)):
+        raise dbconstants.NeedIndex(
+          'Index {} is still being built'.format(index_id))
+
       result = yield self.__composite_query(query, filter_info, order_info)
       raise gen.Return(result)
 
+    plans = yield self.__plan_query(query, filter_info, order_info)
+    if plans:
+      plan = plans[0]
+      self.logger.debug('Using {} plan'.format(plan))
+      if plan.strategy == Strategy.FILTERED_SINGLE_PROPERTY:
+        results = yield self.__filtered_single_property_query(
+          query, filter_info, plan.property_name)
+      else:
+        strategy = self._PLAN_STRATEGIES[plan.strategy]
+        results = yield strategy(self, query, filter_info, order_info)
+
+      if results or results == []:
+        raise gen.Return(results)
+
     for strategy in DatastoreDistributed._QUERY_STRATEGIES:
       results = yield strategy(self, query, filter_info, order_info)
       if results or results == []:
@@ -3003,8 +3228,9 @@ class DatastoreDistributed():
     Returns:
       A long representing a unique transaction ID.
     """
-    txid = self.transaction_manager.create_transaction_id(app_id, xg=is_xg)
-    in_progress = self.transaction_manager.get_open_transactions(app_id)
+    txid = yield self.transaction_manager.create_transaction_id(
+      app_id, xg=is_xg)
+    in_progress = yield self.transaction_manager.get_open_transactions(app_id)
     yield self.datastore_batch.start_transaction(
       app_id, txid, is_xg, in_progress)
     raise gen.Return(txid)
@@ -3070,7 +3296,13 @@ class DatastoreDistributed():
     composite_indices = [entity_pb.CompositeIndex(index) for index in indices]
 
     decoded_groups = [entity_pb.Reference(group) for group in tx_groups]
-    self.transaction_manager.set_groups(app, txn, decoded_groups)
+    yield self.transaction_manager.set_groups(app, txn, decoded_groups)
+
+    # Fetch current values so we can remove old indices.
+    entity_table_keys = [encode_entity_table_key(key)
+                         for key, _ in metadata['puts'].iteritems()]
+    entity_table_keys.extend([encode_entity_table_key(key)
+                              for key in metadata['deletes']])
 
     # Allow the lock to stick around if there is an issue applying the batch.
     lock = entity_lock.EntityLock(self.zookeeper.handle, decoded_groups, txn)
@@ -3084,29 +3316,24 @@ class DatastoreDistributed():
         group_txids = yield self.datastore_batch.group_updates(
           metadata['reads'])
       except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
-        lock.release()
-        self.transaction_manager.delete_transaction_id(app, txn)
+        yield lock.release_async()
+        yield self.transaction_manager.delete_transaction_id(app, txn)
         raise dbconstants.AppScaleDBConnectionError(
           'Unable to fetch group updates')
 
       for group_txid in group_txids:
         if group_txid in metadata['in_progress'] or group_txid > txn:
-          lock.release()
-          self.transaction_manager.delete_transaction_id(app, txn)
+          yield lock.release_async()
+          yield self.transaction_manager.delete_transaction_id(app, txn)
           raise dbconstants.ConcurrentModificationException(
             'A group was modified after this transaction was started.')
 
-      # Fetch current values so we can remove old indices.
-      entity_table_keys = [encode_entity_table_key(key)
-                           for key, _ in metadata['puts'].iteritems()]
-      entity_table_keys.extend([encode_entity_table_key(key)
-                                for key in metadata['deletes']])
       try:
         current_values = yield self.datastore_batch.batch_get_entity(
           dbconstants.APP_ENTITY_TABLE, entity_table_keys, APP_ENTITY_SCHEMA)
       except dbconstants.AppScaleDBConnectionError:
-        lock.release()
-        self.transaction_manager.delete_transaction_id(app, txn)
+        yield lock.release_async()
+        yield self.transaction_manager.delete_transaction_id(app, txn)
         raise
 
       batch = []
@@ -3153,7 +3380,7 @@ class DatastoreDistributed():
           # If the "applied" switch has not been flipped, the lock can be
           # released. The transaction ID is kept so that the groomer can
           # clean up the batch tables.
-          lock.release()
+          yield lock.release_async()
           raise dbconstants.AppScaleDBConnectionError(str(error))
       else:
         try:
@@ -3161,19 +3388,20 @@ class DatastoreDistributed():
         except dbconstants.AppScaleDBConnectionError:
           # Since normal batches are guaranteed to be atomic, the lock can
           # be released.
-          lock.release()
-          self.transaction_manager.delete_transaction_id(app, txn)
+          yield lock.release_async()
+          yield self.transaction_manager.delete_transaction_id(app, txn)
           raise
 
-      lock.release()
+      yield lock.release_async()
 
     finally:
       # In case of failure entity group lock should stay acquired
       # as transaction groomer will handle it later.
       # But tornado lock must be released.
       lock.ensure_release_tornado_lock()
+      self._invalidate_cached_entities(entity_table_keys)
 
-    self.transaction_manager.delete_transaction_id(app, txn)
+    yield self.transaction_manager.delete_transaction_id(app, txn)
 
     # Process transactional tasks.
     if metadata['tasks']:
@@ -223,3 +223,7 @@ class ExcessiveTasks(Exception):
 class TxTimeoutException(Exception):
   """ Indicates that the transaction started too long ago. """
   pass
+
+class NeedIndex(Exception):
+  """ Indicates that a query requires an index that is not ready. """
+  pass
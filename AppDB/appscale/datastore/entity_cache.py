@@ -0,0 +1,217 @@
+""" An in-process cache of entity table rows for non-transactional reads. """
+
+import collections
+import time
+
+from appscale.datastore.dbconstants import KEY_DELIMITER
+
+
+class ProjectCache(object):
+  """ An LRU cache of entity rows that belong to a single project. """
+  def __init__(self, max_bytes):
+    """ Creates a new ProjectCache.
+
+    Args:
+      max_bytes: An integer specifying the memory limit for the project.
+    """
+    self.max_bytes = max_bytes
+    self.size = 0
+    # Maps entity table keys to (row, size, expiration) tuples.
+    self.rows = collections.OrderedDict()
+
+  def pop(self, key):
+    """ Removes a row from the cache.
+
+    Args:
+      key: A string specifying an entity table key.
+    Returns:
+      A boolean indicating whether or not the key was present.
+    """
+    try:
+      _, size, _ = self.rows.pop(key)
+    except KeyError:
+      return False
+
+    self.size -= size
+    return True
+
+  def evict_oldest(self):
+    """ Removes the least recently used row. """
+    _, (_, size, _) = self.rows.popitem(last=False)
+    self.size -= size
+
+
+class EntityCache(object):
+  """ Caches entity table rows, keyed by entity table key.
+
+  Rows are cached per project and each project's cache is bounded by a memory
+  limit. Since other datastore servers and the groomer can modify entities
+  without invalidating this cache, rows also expire after a fixed amount of
+  time. Transactional reads should not use the cache.
+
+  In order to prevent a slow read from caching a value that was overwritten
+  while the read was in progress, callers wrap reads with start_fetch and
+  finish_fetch. Any key invalidated after a fetch started is not cached.
+  """
+  def __init__(self, project_max_bytes, ttl):
+    """ Creates a new EntityCache.
+
+    Args:
+      project_max_bytes: An integer specifying the memory limit per project.
+      ttl: A number specifying how many seconds a row can stay cached.
+    """
+    self.project_max_bytes = project_max_bytes
+    self.ttl = ttl
+
+    self._projects = {}
+
+    # Incremented every time a set of keys is invalidated.
+    self._generation = 0
+
+    # Maps generations to the number of fetches started during them.
+    self._inflight = collections.Counter()
+
+    # Maps keys to the generation in which they were last invalidated. This
+    # is only needed while fetches are in progress.
+    self._invalidated = {}
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+
+  @staticmethod
+  def _project_for_key(key):
+    """ Extracts the project ID from an entity table key.
+
+    Args:
+      key: A string specifying an entity table key.
+    Returns:
+      A string specifying the project ID.
+    """
+    return key.split(KEY_DELIMITER, 1)[0]
+
+  @staticmethod
+  def _row_size(key, row):
+    """ Estimates the memory used by a cached row.
+
+    Args:
+      key: A string specifying an entity table key.
+      row: A dictionary mapping column names to values.
+    Returns:
+      An integer specifying the approximate size in bytes.
+    """
+    return len(key) + sum(len(column) + len(value)
+                          for column, value in row.iteritems())
+
+  def get(self, key):
+    """ Retrieves a cached row.
+
+    Args:
+      key: A string specifying an entity table key.
+    Returns:
+      A dictionary mapping column names to values or None if the key is not
+      cached. An empty dictionary indicates that the entity does not exist.
+    """
+    project_cache = self._projects.get(self._project_for_key(key))
+    if project_cache is None or key not in project_cache.rows:
+      self.misses += 1
+      return None
+
+    row, size, expiration = project_cache.rows.pop(key)
+    if time.time() > expiration:
+      project_cache.size -= size
+      self.misses += 1
+      return None
+
+    # Re-insert the row to mark it as the most recently used.
+    project_cache.rows[key] = (row, size, expiration)
+    self.hits += 1
+    return row
+
+  def start_fetch(self):
+    """ Records the start of a database read that may populate the cache.
+
+    Returns:
+      An integer that should be passed to finish_fetch.
+    """
+    generation = self._generation
+    self._inflight[generation] += 1
+    return generation
+
+  def finish_fetch(self, generation, rows):
+    """ Caches the results of a database read.
+
+    Args:
+      generation: The value returned by start_fetch.
+      rows: A dictionary mapping entity table keys to rows.
+    """
+    for key, row in rows.iteritems():
+      if self._invalidated.get(key, generation) > generation:
+        continue
+
+      self._put(key, row)
+
+    self._inflight[generation] -= 1
+    if self._inflight[generation] <= 0:
+      del self._inflight[generation]
+
+    if not self._inflight:
+      self._invalidated.clear()
+
+  def _put(self, key, row):
+    """ Adds a row to the cache.
+
+    Args:
+      key: A string specifying an entity table key.
+      row: A dictionary mapping column names to values.
+    """
+    size = self._row_size(key, row)
+    if size > self.project_max_bytes:
+      return
+
+    project_id = self._project_for_key(key)
+    project_cache = self._projects.get(project_id)
+    if project_cache is None:
+      project_cache = ProjectCache(self.project_max_bytes)
+      self._projects[project_id] = project_cache
+
+    project_cache.pop(key)
+    while (project_cache.rows and
+           project_cache.size + size > project_cache.max_bytes):
+      project_cache.evict_oldest()
+      self.evictions += 1
+
+    project_cache.rows[key] = (dict(row), size, time.time() + self.ttl)
+    project_cache.size += size
+
+  def invalidate(self, keys):
+    """ Removes rows that have been modified.
+
+    Args:
+      keys: An iterable containing entity table keys.
+    """
+    self._generation += 1
+    for key in keys:
+      project_cache = self._projects.get(self._project_for_key(key))
+      if project_cache is not None and project_cache.pop(key):
+        self.invalidations += 1
+
+      if self._inflight:
+        self._invalidated[key] = self._generation
+
+  def stats(self):
+    """ Reports cache usage.
+
+    Returns:
+      A dictionary containing cache metrics.
+    """
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'invalidations': self.invalidations,
+      'bytes': {project_id: project_cache.size
+                for project_id, project_cache in self._projects.iteritems()}
+    }
+
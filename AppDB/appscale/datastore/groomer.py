@@ -19,10 +19,13 @@ from appscale.common import appscale_info
 from appscale.common import constants
 from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
 from appscale.common.unpackaged import DASHBOARD_DIR
-from appscale.taskqueue.distributed_tq import TaskName
+from appscale.taskqueue.task_name import TaskName
 from . import helper_functions
 from .cassandra_env import cassandra_interface
+from .cassandra_env import token_ranges
 from .datastore_distributed import DatastoreDistributed
+from .query_planner import PropertyStatsCollector
+from .query_planner import property_stats_key
 from .utils import get_composite_indexes_rows
 from .zkappscale import zktransaction as zk
 from .zkappscale.entity_lock import EntityLock
@@ -106,6 +109,12 @@ class DatastoreGroomer(threading.Thread):
   # Log progress every time this many seconds have passed.
   LOG_PROGRESS_FREQUENCY = 60 * 5
 
+  # The number of key ranges to divide a table into when scanning it.
+  SCAN_RANGES = 64
+
+  # The number of key ranges to scan at the same time.
+  SCAN_WORKERS = 8
+
   def __init__(self, zoo_keeper, table_name, ds_path):
     """ Constructor.
 
@@ -124,6 +133,7 @@ class DatastoreGroomer(threading.Thread):
     self.datastore_path = ds_path
     self.stats = {}
     self.namespace_info = {}
+    self.property_stats = PropertyStatsCollector()
     self.num_deletes = 0
     self.composite_index_cache = {}
     self.entities_checked = 0
@@ -135,6 +145,9 @@ class DatastoreGroomer(threading.Thread):
     self.last_logged = time.time()
     self.groomer_state = []
 
+    # Protects statistics that are updated by concurrent range scans.
+    self.stats_lock = threading.Lock()
+
   def stop(self):
     """ Stops the groomer thread. """
     self.zoo_keeper.close()
@@ -169,22 +182,58 @@ class DatastoreGroomer(threading.Thread):
     """
     return self.zoo_keeper.get_lock_with_path(zk.DS_GROOM_LOCK_PATH)
 
-  def get_entity_batch(self, last_key):
-    """ Gets a batch of entites to operate on.
+  def get_scan_ranges(self, task_id):
+    """ Retrieves the key ranges that a task needs to scan.
 
     Args:
-      last_key: The last key from a previous query.
+      task_id: A string specifying the task ID.
     Returns:
-      A list of entities.
+      A list of (start, end) tuples.
+    """
+    # If we have state information beyond what function to use, resume the
+    # ranges that were not finished.
+    if len(self.groomer_state) > 1 and self.groomer_state[0] == task_id:
+      keys = self.groomer_state[1:]
+
+      # Older versions only stored the last key that was processed.
+      if len(keys) == 1:
+        return [(keys[0], '')]
+
+      return zip(keys[::2], keys[1::2])
+
+    boundaries = token_ranges.get_boundaries(self.db_access.cluster)
+    return token_ranges.split_range('', '', boundaries, self.SCAN_RANGES)
+
+  def scan_table(self, task_id, table_name, column_names, process_rows):
+    """ Processes every row in a table using concurrent range scans.
+
+    The progress of each range is stored in the groomer state so that the task
+    can be resumed.
+
+    Args:
+      task_id: A string specifying the task ID.
+      table_name: A string specifying the table to scan.
+      column_names: A list of columns to fetch for each row.
+      process_rows: A function that accepts a list of (key, columns) tuples.
     """
-    return self.db_access.range_query_sync(
-      dbconstants.APP_ENTITY_TABLE, dbconstants.APP_ENTITY_SCHEMA,
-      last_key, "", self.BATCH_SIZE, start_inclusive=False)
+    def checkpoint(ranges):
+      state = [task_id]
+      for start, end in ranges:
+        state.extend([start, end])
+
+      self.update_groomer_state(state)
+
+    scan = token_ranges.ParallelScan(
+      self.db_access, table_name, column_names,
+      self.get_scan_ranges(task_id), process_rows, checkpoint,
+      workers=self.SCAN_WORKERS, batch_size=self.BATCH_SIZE)
+    scan.run()
 
   def reset_statistics(self):
     """ Reinitializes statistics. """
     self.stats = {}
     self.namespace_info = {}
+    self.property_stats = PropertyStatsCollector()
     self.num_deletes = 0
     self.journal_entries_cleaned = 0
 
@@ -500,63 +549,53 @@ class DatastoreGroomer(threading.Thread):
       table_name = dbconstants.DSC_PROPERTY_TABLE
       task_id = self.CLEAN_DSC_INDICES_TASK
 
-    # If we have state information beyond what function to use,
-    # load the last seen start key.
-    if len(self.groomer_state) > 1 and self.groomer_state[0] == task_id:
-      start_key = self.groomer_state[1]
-    else:
-      start_key = ''
-    end_key = dbconstants.TERMINATING_STRING
-
     # Indicate that an index scrub has started.
-    if direction == datastore_pb.Query_Order.ASCENDING and not start_key:
+    resuming = len(self.groomer_state) > 1 and self.groomer_state[0] == task_id
+    if direction == datastore_pb.Query_Order.ASCENDING and not resuming:
       self.db_access.set_metadata_sync(
         cassandra_interface.INDEX_STATE_KEY,
         cassandra_interface.IndexStates.SCRUB_IN_PROGRESS)
 
-    while True:
-      references = self.db_access.range_query_sync(
-        table_name=table_name,
-        column_names=dbconstants.PROPERTY_SCHEMA,
-        start_key=start_key,
-        end_key=end_key,
-        limit=self.BATCH_SIZE,
-        start_inclusive=False,
-      )
-      if len(references) == 0:
-        break
+    def process_references(rows):
+      references = [{key: columns} for key, columns in rows]
+      self.clean_up_index_batch(references, direction)
+
+    self.scan_table(task_id, table_name, dbconstants.PROPERTY_SCHEMA,
+                    process_references)
 
+  def clean_up_index_batch(self, references, direction):
+    """ Deletes invalid entries from a batch of single property index entries.
+
+    Args:
+      references: A list of dictionaries mapping index keys to columns.
+      direction: The direction of the index.
+    """
+    with self.stats_lock:
       self.index_entries_checked += len(references)
       if time.time() > self.last_logged + self.LOG_PROGRESS_FREQUENCY:
         logging.info('Checked {} index entries'
           .format(self.index_entries_checked))
         self.last_logged = time.time()
-      first_ref = references[0].keys()[0]
-      logging.debug('Fetched {} total refs, starting with {}, direction: {}'
-        .format(self.index_entries_checked, [first_ref], direction))
 
-      last_start_key = start_key
-      start_key = references[-1].keys()[0]
-      if start_key == last_start_key:
-        raise dbconstants.AppScaleDBError(
-          'An infinite loop was detected while fetching references.')
+    first_ref = references[0].keys()[0]
+    logging.debug('Fetched {} refs, starting with {}, direction: {}'
+      .format(len(references), [first_ref], direction))
 
-      entities = self.fetch_entity_dict_for_references(references)
+    entities = self.fetch_entity_dict_for_references(references)
 
-      # Group invalid references by entity key so we can minimize locks.
-      invalid_refs = {}
-      for reference in references:
-        prop_name = reference.keys()[0].split(self.ds_access._SEPARATOR)[3]
-        if not self.ds_access._DatastoreDistributed__valid_index_entry(
-          reference, entities, direction, prop_name):
-          entity_key = reference.values()[0][self.ds_access.INDEX_REFERENCE_COLUMN]
-          if entity_key not in invalid_refs:
-            invalid_refs[entity_key] = []
-          invalid_refs[entity_key].append(reference)
-
-      for entity_key in invalid_refs:
-        self.lock_and_delete_indexes(invalid_refs[entity_key], direction, entity_key)
-      self.update_groomer_state([task_id, start_key])
+    # Group invalid references by entity key so we can minimize locks.
+    invalid_refs = {}
+    for reference in references:
+      prop_name = reference.keys()[0].split(self.ds_access._SEPARATOR)[3]
+      if not self.ds_access._DatastoreDistributed__valid_index_entry(
+        reference, entities, direction, prop_name):
+        entity_key = reference.values()[0][self.ds_access.INDEX_REFERENCE_COLUMN]
+        if entity_key not in invalid_refs:
+          invalid_refs[entity_key] = []
+        invalid_refs[entity_key].append(reference)
+
+    for entity_key in invalid_refs:
+      self.lock_and_delete_indexes(invalid_refs[entity_key], direction, entity_key)
 
   def clean_up_kind_indices(self):
     """ Deletes invalid kind index entries.
@@ -730,12 +769,16 @@ class DatastoreGroomer(threading.Thread):
     if app_id in self.APPSCALE_APPLICATIONS:
       return True
 
-    self.initialize_kind(app_id, kind)
-    self.initialize_namespace(app_id, namespace)
-    self.namespace_info[app_id][namespace]['size'] += size
-    self.namespace_info[app_id][namespace]['number'] += 1
-    self.stats[app_id][kind]['size'] += size
-    self.stats[app_id][kind]['number'] += 1
+    # Entity batches are processed by several threads.
+    with self.stats_lock:
+      self.initialize_kind(app_id, kind)
+      self.initialize_namespace(app_id, namespace)
+      self.namespace_info[app_id][namespace]['size'] += size
+      self.namespace_info[app_id][namespace]['number'] += 1
+      self.stats[app_id][kind]['size'] += size
+      self.stats[app_id][kind]['number'] += 1
+      self.property_stats.add_entity(app_id, namespace, kind, entity)
+
     return True
 
   def txn_blacklist_cleanup(self):
@@ -870,36 +913,25 @@ class DatastoreGroomer(threading.Thread):
     return True
 
   def clean_up_entities(self):
-    # If we have state information beyond what function to use,
-    # load the last seen key.
-    if (len(self.groomer_state) > 1 and
-      self.groomer_state[0] == self.CLEAN_ENTITIES_TASK):
-      last_key = self.groomer_state[1]
-    else:
-      last_key = ""
-    while True:
-      try:
-        logging.debug('Fetching {} entities'.format(self.BATCH_SIZE))
-        entities = self.get_entity_batch(last_key)
-
-        if not entities:
-          break
-
-        for entity in entities:
-          self.process_entity(entity)
-
-        last_key = entities[-1].keys()[0]
-        self.entities_checked += len(entities)
-        if time.time() > self.last_logged + self.LOG_PROGRESS_FREQUENCY:
-          logging.info('Checked {} entities'.format(self.entities_checked))
-          self.last_logged = time.time()
-        self.update_groomer_state([self.CLEAN_ENTITIES_TASK, last_key])
-      except datastore_errors.Error, error:
-        logging.error("Error getting a batch: {0}".format(error))
-        time.sleep(self.DB_ERROR_PERIOD)
-      except dbconstants.AppScaleDBConnectionError, connection_error:
-        logging.error("Error getting a batch: {0}".format(connection_error))
-        time.sleep(self.DB_ERROR_PERIOD)
+    """ Processes every entity in the entity table. """
+    self.scan_table(self.CLEAN_ENTITIES_TASK, dbconstants.APP_ENTITY_TABLE,
+                    dbconstants.APP_ENTITY_SCHEMA, self.process_entity_batch)
+
+  def process_entity_batch(self, entities):
+    """ Processes a batch of entities from the entity table.
+
+    Args:
+      entities: A list of (key, columns) tuples.
+    """
+    logging.debug('Processing {} entities'.format(len(entities)))
+    for key, columns in entities:
+      self.process_entity({key: columns})
+
+    with self.stats_lock:
+      self.entities_checked += len(entities)
+      if time.time() > self.last_logged + self.LOG_PROGRESS_FREQUENCY:
+        logging.info('Checked {} entities'.format(self.entities_checked))
+        self.last_logged = time.time()
 
   def register_db_accessor(self, app_id):
     """ Gets a distributed datastore object to interact with
@@ -1051,6 +1083,14 @@ class DatastoreGroomer(threading.Thread):
       logging.info("Number of hard deletes: {0}".format(self.num_deletes))
       del ds_distributed
 
+    # Store property cardinalities for the query planner.
+    for app_id in self.property_stats.projects:
+      try:
+        self.db_access.set_metadata_sync(
+          property_stats_key(app_id), self.property_stats.serialize(app_id))
+      except dbconstants.AppScaleDBConnectionError as error:
+        logging.error('Unable to store property stats: {}'.format(error))
+
   def update_groomer_state(self, state):
     """ Updates the groomer's internal state and persists the state to
     ZooKeeper.
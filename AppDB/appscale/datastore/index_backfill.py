@@ -0,0 +1,536 @@
+""" Builds composite indexes for entities that already exist.
+
+When a composite index is added, the datastore server stores it in the
+WRITE_ONLY (building) state and records a backfill job in ZooKeeper. New
+writes keep the index up to date, and queries are not allowed to use it. A
+backfill worker scans the kind table rows for the index's kind in each
+namespace, several key ranges at once, and writes the missing index entries.
+The ranges that remain are saved in the job node, so a restarted worker
+continues where the last one stopped. Once every range has been scanned, the
+index is marked as READ_WRITE and the job is removed.
+"""
+import base64
+import json
+import logging
+import sys
+import threading
+import time
+
+from kazoo.exceptions import NoNodeError, NodeExistsError
+from tornado import gen
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from . import dbconstants
+from .cassandra_env import token_ranges
+from .index_encoder import IndexEncoder
+from .utils import clean_app_id, tornado_synchronous
+from .zkappscale.tornado_kazoo import TornadoKazoo
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import entity_pb
+
+# The node that contains a child for each index that is being built.
+BACKFILL_NODE = '/appscale/datastore/index_backfill'
+
+# Workers hold a lock under this node while building an index.
+BACKFILL_LOCK_NODE = '/appscale/datastore/index_backfill_locks'
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+  """ Indicates that a backfill job was removed while it was running. """
+  pass
+
+
+def job_node(index_id):
+  """ Determines the ZooKeeper path for an index's backfill job.
+
+  Args:
+    index_id: An integer specifying the composite index ID.
+  Returns:
+    A string specifying a ZooKeeper path.
+  """
+  return '/'.join([BACKFILL_NODE, str(index_id)])
+
+
+def index_metadata_key(project_id, index_id):
+  """ Determines the metadata table key that stores an index definition.
+
+  Args:
+    project_id: A string specifying a project ID.
+    index_id: An integer specifying the composite index ID.
+  Returns:
+    A string specifying a metadata table key.
+  """
+  return dbconstants.KEY_DELIMITER.join([project_id, 'index', str(index_id)])
+
+
+def encode_job(job):
+  """ Serializes a backfill job so that it can be stored in ZooKeeper.
+
+  Args:
+    job: A dictionary describing the job.
+  Returns:
+    A JSON string.
+  """
+  def encode_ranges(ranges):
+    if ranges is None:
+      return None
+
+    return [[base64.b64encode(start), base64.b64encode(end)]
+            for start, end in ranges]
+
+  return json.dumps({
+    'project': job['project'],
+    'index': base64.b64encode(job['index'].Encode()),
+    'ranges': encode_ranges(job['ranges']),
+    'remaining': encode_ranges(job['remaining']),
+    'processed': job['processed']
+  })
+
+
+def decode_job(data):
+  """ Parses a backfill job that was stored in ZooKeeper.
+
+  Args:
+    data: A JSON string created by encode_job.
+  Returns:
+    A dictionary describing the job.
+  """
+  def decode_ranges(ranges):
+    if ranges is None:
+      return None
+
+    return [(base64.b64decode(start), base64.b64decode(end))
+            for start, end in ranges]
+
+  job = json.loads(data)
+  return {
+    'project': str(job['project']),
+    'index': entity_pb.CompositeIndex(base64.b64decode(job['index'])),
+    'ranges': decode_ranges(job['ranges']),
+    'remaining': decode_ranges(job['remaining']),
+    'processed': job['processed']
+  }
+
+
+def job_progress(job):
+  """ Estimates how much of a backfill job is complete.
+
+  Each range is given the same weight since the ranges are chosen to contain
+  a similar amount of data.
+
+  Args:
+    job: A dictionary describing the job.
+  Returns:
+    A float specifying the percentage of the job that is complete.
+  """
+  if job['ranges'] is None:
+    return 0.0
+
+  if not job['ranges']:
+    return 100.0
+
+  # A range keeps its end key as the start moves forward.
+  remaining = {end: start for start, end in job['remaining']}
+  complete = 0.0
+  for start, end in job['ranges']:
+    if end in remaining:
+      complete += token_ranges.range_fraction(start, end, remaining[end])
+    else:
+      complete += 1
+
+  return 100 * complete / len(job['ranges'])
+
+
+class RateLimiter(object):
+  """ Spaces out work from several threads to stay under a rate. """
+  def __init__(self, rate):
+    """ Creates a new RateLimiter.
+
+    Args:
+      rate: A number specifying the maximum units of work per second.
+    """
+    self._interval = 1.0 / rate
+    self._next_start = time.time()
+    self._lock = threading.Lock()
+
+  def wait(self, units=1):
+    """ Blocks until the given amount of work can be started.
+
+    Args:
+      units: An integer specifying the amount of work.
+    """
+    with self._lock:
+      now = time.time()
+      start = max(now, self._next_start)
+      self._next_start = start + units * self._interval
+
+    if start > now:
+      time.sleep(start - now)
+
+
+class BuildingIndexes(object):
+  """ Keeps track of the composite indexes that are still being built. """
+  def __init__(self, zk_client):
+    """ Creates a new BuildingIndexes object.
+
+    Args:
+      zk_client: A KazooClient.
+    """
+    self._zk_client = zk_client
+    self._tornado_zk = TornadoKazoo(zk_client)
+    self._index_ids = set()
+
+    self._zk_client.ensure_path(BACKFILL_NODE)
+    self._zk_client.ChildrenWatch(BACKFILL_NODE, self._update_index_ids)
+
+  def is_building(self, index_id):
+    """ Checks if an index is still being built.
+
+    Args:
+      index_id: An integer specifying the composite index ID.
+    Returns:
+      A boolean indicating that queries should not use the index yet.
+    """
+    return index_id in self._index_ids
+
+  @gen.coroutine
+  def schedule(self, project_id, index):
+    """ Records a backfill job for an index.
+
+    Args:
+      project_id: A string specifying a project ID.
+      index: An entity_pb.CompositeIndex object.
+    """
+    job = {'project': project_id, 'index': index, 'ranges': None,
+           'remaining': None, 'processed': 0}
+    try:
+      yield self._tornado_zk.create(job_node(index.id()), encode_job(job))
+    except NodeExistsError:
+      logger.info('Index {} is already being built'.format(index.id()))
+
+    # Don't wait for the watch before refusing to use the index.
+    self._index_ids = self._index_ids | {index.id()}
+
+  @gen.coroutine
+  def cancel(self, index_id):
+    """ Removes the backfill job for an index if there is one.
+
+    Args:
+      index_id: An integer specifying the composite index ID.
+    """
+    try:
+      yield self._tornado_zk.delete(job_node(index_id))
+    except NoNodeError:
+      pass
+
+  @gen.coroutine
+  def progress(self):
+    """ Reports how far along each backfill job is.
+
+    Returns:
+      A dictionary mapping index IDs to dictionaries with job details.
+    """
+    children = yield self._tornado_zk.get_children(BACKFILL_NODE)
+    report = {}
+    for index_id in children:
+      try:
+        data, _ = yield self._tornado_zk.get(job_node(index_id))
+      except NoNodeError:
+        continue
+
+      job = decode_job(data)
+      report[index_id] = {
+        'project': job['project'],
+        'kind': job['index'].definition().entity_type(),
+        'percentComplete': round(job_progress(job), 1),
+        'entitiesProcessed': job['processed']
+      }
+
+    raise gen.Return(report)
+
+  def _update_index_ids(self, children):
+    """ Updates the set of indexes that are being built.
+
+    Args:
+      children: A list of strings specifying index IDs.
+    """
+    self._index_ids = set(int(index_id) for index_id in children)
+
+
+class IndexBackfill(object):
+  """ Builds composite indexes for the jobs that are recorded in ZooKeeper. """
+  # The number of key ranges to divide a kind's rows into.
+  SCAN_RANGES = 64
+
+  # The number of kind table rows to process at a time.
+  BATCH_SIZE = 100
+
+  # The minimum number of seconds between saving a job's progress.
+  CHECKPOINT_INTERVAL = 10
+
+  # The number of seconds to wait before checking for jobs again.
+  POLL_INTERVAL = 60
+
+  def __init__(self, zk_client, db_access, workers=token_ranges.DEFAULT_WORKERS,
+               rate_limit=None):
+    """ Creates a new IndexBackfill.
+
+    Args:
+      zk_client: A KazooClient.
+      db_access: A DatastoreProxy.
+      workers: An integer specifying the number of ranges to scan at once.
+      rate_limit: A number specifying the maximum number of kind table rows
+        to process per second or None for no limit.
+    """
+    self._zk_client = zk_client
+    self._db_access = db_access
+    self._workers = workers
+    self._rate_limiter = None
+    if rate_limit:
+      self._rate_limiter = RateLimiter(rate_limit)
+
+    self._jobs_changed = threading.Event()
+    self._lock = threading.Lock()
+
+  def run(self):
+    """ Builds indexes as jobs are added. This does not return. """
+    self._zk_client.ensure_path(BACKFILL_NODE)
+    self._zk_client.ensure_path(BACKFILL_LOCK_NODE)
+    self._zk_client.ChildrenWatch(
+      BACKFILL_NODE, lambda children: self._jobs_changed.set())
+
+    while True:
+      self._jobs_changed.clear()
+      index_ids = self._zk_client.retry(self._zk_client.get_children,
+                                        BACKFILL_NODE)
+      for index_id in index_ids:
+        lock = self._zk_client.Lock('/'.join([BACKFILL_LOCK_NODE, index_id]))
+        # Another worker is already building this index.
+        if not lock.acquire(blocking=False):
+          continue
+
+        try:
+          self.build(index_id)
+        except Exception:
+          logger.exception('Unable to build index {}'.format(index_id))
+        finally:
+          lock.release()
+
+      self._jobs_changed.wait(self.POLL_INTERVAL)
+
+  def build(self, index_id):
+    """ Writes the missing entries for an index and marks it as ready.
+
+    Args:
+      index_id: A string specifying the composite index ID.
+    """
+    path = job_node(index_id)
+    try:
+      data, _ = self._zk_client.get(path)
+    except NoNodeError:
+      return
+
+    job = decode_job(data)
+    project_id = job['project']
+    index = job['index']
+    if self._get_index(project_id, index.id()) is None:
+      logger.info('Index {} was deleted before it was built'.format(index_id))
+      self._delete_job(path)
+      return
+
+    if job['ranges'] is None:
+      job['ranges'] = self._kind_ranges(project_id,
+                                        index.definition().entity_type())
+      job['remaining'] = list(job['ranges'])
+      self._save_job(path, job)
+
+    logger.info('Building index {} for {}: {:.1f}% complete'.format(
+      index_id, project_id, job_progress(job)))
+
+    last_saved = [time.time()]
+
+    def process_rows(rows):
+      if self._rate_limiter is not None:
+        self._rate_limiter.wait(len(rows))
+
+      references = [columns['reference'] for key, columns in rows]
+      self._index_entities(index, references)
+      with self._lock:
+        job['processed'] += len(references)
+
+    def checkpoint(remaining):
+      job['remaining'] = remaining
+      if time.time() - last_saved[0] < self.CHECKPOINT_INTERVAL:
+        return
+
+      if not self._save_job(path, job):
+        raise JobCancelled('Job {} was removed'.format(path))
+
+      last_saved[0] = time.time()
+      logger.info('Building index {}: {:.1f}% complete'.format(
+        index_id, job_progress(job)))
+
+    scan = token_ranges.ParallelScan(
+      self._db_access, dbconstants.APP_KIND_TABLE,
+      dbconstants.APP_KIND_SCHEMA, job['remaining'], process_rows,
+      checkpoint, workers=self._workers, batch_size=self.BATCH_SIZE)
+    try:
+      scan.run()
+    except JobCancelled:
+      logger.info('Index {} was deleted before it was built'.format(index_id))
+      return
+    finally:
+      job['remaining'] = scan.remaining
+      self._save_job(path, job)
+
+    stored_index = self._get_index(project_id, index.id())
+    if stored_index is None:
+      logger.info('Index {} was deleted before it was built'.format(index_id))
+      self._delete_job(path)
+      return
+
+    stored_index.set_state(entity_pb.CompositeIndex.READ_WRITE)
+    metadata_key = index_metadata_key(project_id, index.id())
+    self._db_access.batch_put_entity_sync(
+      dbconstants.METADATA_TABLE, [metadata_key], dbconstants.METADATA_SCHEMA,
+      {metadata_key: {dbconstants.METADATA_SCHEMA[0]: stored_index.Encode()}})
+    self._delete_job(path)
+    logger.info('Finished building index {} ({} entities)'.format(
+      index_id, job['processed']))
+
+  def _namespaces(self, project_id):
+    """ Finds the namespaces that contain a project's entities.
+
+    Each namespace is found by fetching a single kind table row that comes
+    after the keys of the previous namespace.
+
+    Args:
+      project_id: A string specifying a project ID.
+    Returns:
+      A list of strings specifying namespaces.
+    """
+    prefix = clean_app_id(project_id) + dbconstants.KEY_DELIMITER
+    end = prefix + dbconstants.TERMINATING_STRING
+    start = prefix
+    namespaces = []
+    while True:
+      scan = self._db_access.range_scan(
+        dbconstants.APP_KIND_TABLE, dbconstants.APP_KIND_SCHEMA, start, end,
+        limit=1, start_inclusive=False, page_size=1)
+      rows = tornado_synchronous(scan.next_page)()
+      if not rows:
+        return namespaces
+
+      key = rows[0][0]
+      namespace = key[len(prefix):].split(dbconstants.KEY_DELIMITER, 1)[0]
+      namespaces.append(namespace)
+      start = (prefix + namespace + dbconstants.KEY_DELIMITER +
+               dbconstants.TERMINATING_STRING)
+
+  def _kind_ranges(self, project_id, kind):
+    """ Divides the kind table rows for a kind into ranges to scan.
+
+    Args:
+      project_id: A string specifying a project ID.
+      kind: A string specifying the entity kind.
+    Returns:
+      A list of (start, end) tuples.
+    """
+    namespaces = self._namespaces(project_id)
+    if not namespaces:
+      return []
+
+    boundaries = token_ranges.get_boundaries(self._db_access.cluster)
+    ranges_per_namespace = max(self.SCAN_RANGES // len(namespaces), 1)
+    app_id = clean_app_id(project_id)
+    ranges = []
+    for namespace in namespaces:
+      start = dbconstants.KEY_DELIMITER.join(
+        [app_id, namespace, kind + dbconstants.KIND_SEPARATOR])
+      end = start + dbconstants.TERMINATING_STRING
+      ranges.extend(token_ranges.split_range(start, end, boundaries,
+                                             ranges_per_namespace))
+
+    return ranges
+
+  def _index_entities(self, index, references):
+    """ Writes the composite index entries for a list of entities.
+
+    Args:
+      index: An entity_pb.CompositeIndex.
+      references: A list of entity table keys.
+    """
+    if not references:
+      return
+
+    results = self._db_access.batch_get_entity_sync(
+      dbconstants.APP_ENTITY_TABLE, references,
+      dbconstants.APP_ENTITY_SCHEMA)
+
+    # The encoder is not thread-safe, so each batch gets its own.
+    encoder = IndexEncoder([index])
+    row_keys = []
+    row_values = {}
+    for reference in references:
+      encoded = results.get(reference, {}).get(
+        dbconstants.APP_ENTITY_SCHEMA[0])
+      if encoded is None or encoded == dbconstants.TOMBSTONE:
+        continue
+
+      entity = entity_pb.EntityProto(encoded)
+      for key in encoder.composite_keys(index, entity):
+        row_keys.append(key)
+        row_values[key] = {'reference': reference}
+
+    if row_keys:
+      self._db_access.batch_put_entity_sync(
+        dbconstants.COMPOSITE_TABLE, row_keys, dbconstants.COMPOSITE_SCHEMA,
+        row_values)
+
+  def _get_index(self, project_id, index_id):
+    """ Fetches the stored definition of an index.
+
+    Args:
+      project_id: A string specifying a project ID.
+      index_id: An integer specifying the composite index ID.
+    Returns:
+      An entity_pb.CompositeIndex or None if the index was deleted.
+    """
+    metadata_key = index_metadata_key(project_id, index_id)
+    results = self._db_access.batch_get_entity_sync(
+      dbconstants.METADATA_TABLE, [metadata_key], dbconstants.METADATA_SCHEMA)
+    encoded = results.get(metadata_key, {}).get(dbconstants.METADATA_SCHEMA[0])
+    if encoded is None:
+      return None
+
+    return entity_pb.CompositeIndex(encoded)
+
+  def _save_job(self, path, job):
+    """ Stores a job's progress.
+
+    Args:
+      path: A string specifying the job's ZooKeeper path.
+      job: A dictionary describing the job.
+    Returns:
+      A boolean indicating that the job still exists.
+    """
+    try:
+      self._zk_client.retry(self._zk_client.set, path, encode_job(job))
+    except NoNodeError:
+      return False
+
+    return True
+
+  def _delete_job(self, path):
+    """ Removes a job.
+
+    Args:
+      path: A string specifying the job's ZooKeeper path.
+    """
+    try:
+      self._zk_client.retry(self._zk_client.delete, path)
+    except NoNodeError:
+      pass
@@ -0,0 +1,359 @@
+""" Encodes the index rows for batches of entities.
+
+The functions in utils build each index key on its own, so a value is encoded
+again for the ascending table, the descending table and every composite index
+that uses it. IndexEncoder encodes each property value once per entity,
+reuses a single protocol buffer encoder, and caches the parts of the keys that
+only depend on the project, namespace and kind.
+"""
+import itertools
+import string
+import sys
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+
+from .dbconstants import (
+  BadRequest, ID_KEY_LENGTH, ID_SEPARATOR, KEY_DELIMITER, KIND_SEPARATOR
+)
+from .utils import clean_app_id, get_scatter_prop
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import entity_pb
+from google.appengine.datastore import sortable_pb_encoder
+
+# Maps each byte to the byte that sorts in the opposite order.
+REVERSE_TABLE = string.maketrans(
+  ''.join(chr(byte) for byte in range(256)),
+  ''.join(chr(255 - byte) for byte in range(256)))
+
+
+class CompositeLayout(object):
+  """ The parts of a composite index that are the same for every entity. """
+  __slots__ = ['index', 'key_prefix', 'ancestor', 'properties', 'required']
+
+  def __init__(self, index, key_prefix):
+    """ Creates a new CompositeLayout.
+
+    Args:
+      index: A datastore_pb.CompositeIndex.
+      key_prefix: A string that every key for this index starts with.
+    """
+    definition = index.definition()
+    self.index = index
+    self.key_prefix = key_prefix
+    self.ancestor = definition.ancestor() == 1
+    self.properties = [
+      (prop.name(), prop.direction() == entity_pb.Index_Property.DESCENDING)
+      for prop in definition.property_list()]
+    self.required = set(name for name, _ in self.properties
+                        if name != '__key__')
+
+
+class KindLayout(object):
+  """ Key prefixes and composite indexes for a kind in a namespace. """
+  __slots__ = ['prefix', 'kind', 'property_prefixes', 'composites']
+
+  def __init__(self, prefix, kind, composites):
+    """ Creates a new KindLayout.
+
+    Args:
+      prefix: A string containing the project ID and namespace.
+      kind: A string specifying the kind.
+      composites: A list of CompositeLayout objects.
+    """
+    self.prefix = prefix
+    self.kind = kind
+    self.composites = composites
+
+    # Maps property names to the start of their single-property index keys.
+    self.property_prefixes = {}
+
+  def property_prefix(self, name):
+    """ Fetches the start of the single-property index keys for a property.
+
+    Args:
+      name: A string specifying the property name.
+    Returns:
+      A string.
+    """
+    try:
+      return self.property_prefixes[name]
+    except KeyError:
+      property_prefix = KEY_DELIMITER.join([self.prefix, self.kind, name, ''])
+      self.property_prefixes[name] = property_prefix
+      return property_prefix
+
+
+class EntityIndexRows(object):
+  """ The row keys that an entity needs across the index tables. """
+  __slots__ = ['entity', 'entity_key', 'kind_key', 'asc_keys', 'dsc_keys',
+               'composite_keys']
+
+  def __init__(self, entity, entity_key, kind_key, asc_keys, dsc_keys,
+               composite_keys):
+    self.entity = entity
+    self.entity_key = entity_key
+    self.kind_key = kind_key
+    self.asc_keys = asc_keys
+    self.dsc_keys = dsc_keys
+    self.composite_keys = composite_keys
+
+
+class IndexEncoder(object):
+  """ Builds index rows for many entities at a time. """
+  def __init__(self, composite_indexes=()):
+    """ Creates a new IndexEncoder.
+
+    Args:
+      composite_indexes: A list of datastore_pb.CompositeIndex objects.
+    """
+    self._composite_indexes = composite_indexes
+    self._layouts = {}
+    self._encoder = sortable_pb_encoder.Encoder()
+
+  def encode(self, entities):
+    """ Builds the index rows for a list of entities.
+
+    Args:
+      entities: A list of entity_pb.EntityProto objects.
+    Returns:
+      A list of EntityIndexRows objects in the same order.
+    """
+    return [self.entity_rows(entity) for entity in entities]
+
+  def entity_rows(self, entity):
+    """ Builds the index rows for an entity.
+
+    Args:
+      entity: An entity_pb.EntityProto.
+    Returns:
+      An EntityIndexRows object.
+    """
+    key = entity.key()
+    elements = key.path().element_list()
+    layout = self.layout(key)
+    encoded_path = self.encode_path(elements)
+    entity_key = KEY_DELIMITER.join([layout.prefix, encoded_path])
+    kind_key = self._kind_key(layout, elements)
+
+    values = self.encode_properties(entity.property_list())
+
+    composite_keys = []
+    for composite in layout.composites:
+      composite_keys.extend(
+        self._composite_keys(composite, values, encoded_path))
+
+    # Give some entities a property that makes it easy to sample keys.
+    scatter_prop = get_scatter_prop(elements)
+    if scatter_prop is not None:
+      values.append((scatter_prop.name(),
+                     self.encode_value(scatter_prop.value())))
+
+    key_suffix = KEY_DELIMITER + encoded_path
+    asc_keys = []
+    dsc_keys = []
+    for name, value in values:
+      property_prefix = layout.property_prefix(name)
+      asc_keys.append(property_prefix + value + key_suffix)
+      dsc_keys.append(
+        property_prefix + value.translate(REVERSE_TABLE) + key_suffix)
+
+    return EntityIndexRows(entity, entity_key, kind_key, asc_keys, dsc_keys,
+                           composite_keys)
+
+  def composite_keys(self, index, entity):
+    """ Builds the keys for an entity in a composite index.
+
+    Args:
+      index: A datastore_pb.CompositeIndex.
+      entity: An entity_pb.EntityProto.
+    Returns:
+      A list of strings.
+    """
+    layout = self.layout(entity.key())
+    composite = None
+    for candidate in layout.composites:
+      if candidate.index is index:
+        composite = candidate
+
+    if composite is None:
+      composite = self._composite_layout(index, entity.key())
+
+    values = self.encode_properties(entity.property_list())
+    encoded_path = self.encode_path(entity.key().path().element_list())
+    return self._composite_keys(composite, values, encoded_path)
+
+  def encode_properties(self, properties):
+    """ Encodes property values so that they sort correctly.
+
+    Args:
+      properties: A list of entity_pb.Property objects.
+    Returns:
+      A list of (property name, encoded value) tuples.
+    """
+    return [(prop.name(), self.encode_value(prop.value()))
+            for prop in properties]
+
+  def encode_value(self, value):
+    """ Encodes a property value the same way as encode_index_pb.
+
+    Args:
+      value: An entity_pb.PropertyValue.
+    Returns:
+      A string.
+    """
+    if value.has_uservalue():
+      user_value = entity_pb.PropertyValue()
+      user_value.mutable_uservalue().set_email(value.uservalue().email())
+      user_value.mutable_uservalue().set_auth_domain('')
+      user_value.mutable_uservalue().set_gaiaid(0)
+      value = user_value
+
+    encoder = self._encoder
+    del encoder.buf[:]
+    value.Output(encoder)
+    encoded = encoder.buf.tostring()
+
+    # Null bytes are used as delimiters, so they are escaped.
+    if '\x01' in encoded:
+      encoded = encoded.replace('\x01', '\x01\x02')
+
+    if '\x00' in encoded:
+      encoded = encoded.replace('\x00', '\x01\x01')
+
+    return encoded
+
+  @staticmethod
+  def encode_path(elements):
+    """ Encodes a key path the same way as encode_index_pb.
+
+    Args:
+      elements: A list of entity_pb.Path_Element objects.
+    Returns:
+      A string.
+    Raises:
+      BadRequest if the path is invalid.
+    """
+    parts = []
+    for element in elements:
+      if element.has_name():
+        key_id = element.name()
+      elif element.has_id():
+        key_id = str(element.id()).zfill(ID_KEY_LENGTH)
+      else:
+        raise BadRequest('Entity path must contain name or ID')
+
+      kind = element.type()
+      if ID_SEPARATOR in kind:
+        raise BadRequest('Kind names must not include ":"')
+
+      parts.append(kind + ID_SEPARATOR + key_id + KIND_SEPARATOR)
+
+    return ''.join(parts)
+
+  def layout(self, key):
+    """ Fetches the cached layout for a key's project, namespace and kind.
+
+    Args:
+      key: An entity_pb.Reference.
+    Returns:
+      A KindLayout.
+    """
+    kind = key.path().element_list()[-1].type()
+    cache_key = (key.app(), key.name_space(), kind)
+    try:
+      return self._layouts[cache_key]
+    except KeyError:
+      pass
+
+    prefix = KEY_DELIMITER.join([clean_app_id(key.app()), key.name_space()])
+    composites = [self._composite_layout(index, key)
+                  for index in self._composite_indexes
+                  if index.definition().entity_type() == kind]
+    layout = KindLayout(prefix, kind, composites)
+    self._layouts[cache_key] = layout
+    return layout
+
+  @staticmethod
+  def _composite_layout(index, key):
+    """ Creates a CompositeLayout for an index in a key's namespace.
+
+    Args:
+      index: A datastore_pb.CompositeIndex.
+      key: An entity_pb.Reference.
+    Returns:
+      A CompositeLayout.
+    """
+    key_prefix = KEY_DELIMITER.join(
+      [clean_app_id(key.app()), key.name_space(), str(index.id()), ''])
+    return CompositeLayout(index, key_prefix)
+
+  @staticmethod
+  def _kind_key(layout, elements):
+    """ Builds the kind table key for an entity.
+
+    Args:
+      layout: A KindLayout.
+      elements: A list of entity_pb.Path_Element objects.
+    Returns:
+      A string.
+    """
+    parts = [layout.kind + KIND_SEPARATOR]
+    for element in elements:
+      if element.has_name():
+        key_id = element.name()
+      else:
+        key_id = str(element.id()).zfill(ID_KEY_LENGTH)
+
+      parts.append(element.type() + ID_SEPARATOR + key_id + KIND_SEPARATOR)
+
+    return layout.prefix + KEY_DELIMITER + ''.join(parts)
+
+  @staticmethod
+  def _composite_keys(composite, values, encoded_path):
+    """ Builds the keys for an entity in a composite index.
+
+    Args:
+      composite: A CompositeLayout.
+      values: A list of (property name, encoded value) tuples.
+      encoded_path: A string containing the encoded entity path.
+    Returns:
+      A list of strings.
+    """
+    by_name = {}
+    for name, value in values:
+      if name in composite.required:
+        by_name.setdefault(name, []).append(value)
+
+    if not composite.properties or len(by_name) < len(composite.required):
+      return []
+
+    value_lists = []
+    for name, descending in composite.properties:
+      if name == '__key__':
+        options = [encoded_path]
+      else:
+        options = by_name[name]
+
+      if descending:
+        options = [option.translate(REVERSE_TABLE) for option in options]
+
+      value_lists.append(options)
+
+    if composite.ancestor:
+      # Every ancestor path, not including the entity itself.
+      separator_positions = [
+        position for position, char in enumerate(encoded_path)
+        if char == KIND_SEPARATOR][:-1]
+      prefixes = [composite.key_prefix + encoded_path[:position + 1] +
+                  KEY_DELIMITER for position in separator_positions]
+    else:
+      prefixes = [composite.key_prefix]
+
+    keys = []
+    for combination in itertools.product(*value_lists):
+      index_value = KEY_DELIMITER.join(combination) + KEY_DELIMITER
+      for prefix in prefixes:
+        keys.append(prefix + index_value + encoded_path)
+
+    return keys
@@ -0,0 +1,92 @@
+""" Helpers for running several datastore server processes on one port.
+
+Each worker binds its own listening socket with SO_REUSEPORT, which lets the
+kernel spread new connections across the workers. Workers also listen on a
+private loopback socket so that they can relay requests that affect every
+process (like clearing statistics) to each other.
+"""
+import socket
+
+import tornado.netutil
+import tornado.process
+
+# The number of pending connections each listening socket can have.
+BACKLOG = 128
+
+# The address that workers use to reach each other.
+LOOPBACK = '127.0.0.1'
+
+
+def bind_shared_socket(port, address=''):
+  """ Binds a listening socket that other processes can bind to as well.
+
+  Args:
+    port: An integer specifying the port to listen on.
+    address: A string specifying the address to listen on.
+  Returns:
+    A non-blocking socket object.
+  """
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  try:
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setblocking(0)
+    sock.bind((address, port))
+    sock.listen(BACKLOG)
+  except socket.error:
+    sock.close()
+    raise
+
+  return sock
+
+
+def fork_workers(num_workers):
+  """ Starts worker processes. This only returns in the worker processes.
+
+  The parent process restarts workers that exit abnormally.
+
+  Args:
+    num_workers: An integer specifying the number of processes to start.
+  Returns:
+    A tuple containing the worker's ID, a socket that only this worker
+    listens on, and a list of ports that the other workers listen on.
+  """
+  private_sockets = [
+    tornado.netutil.bind_sockets(0, address=LOOPBACK, backlog=BACKLOG)[0]
+    for _ in range(num_workers)]
+  ports = [sock.getsockname()[1] for sock in private_sockets]
+
+  worker_id = tornado.process.fork_processes(num_workers)
+
+  for index, sock in enumerate(private_sockets):
+    if index != worker_id:
+      sock.close()
+
+  sibling_ports = [port for index, port in enumerate(ports)
+                   if index != worker_id]
+  return worker_id, private_sockets[worker_id], sibling_ports
+
+
+def merge_stats(total, stats):
+  """ Combines the statistics that two workers report.
+
+  Numbers are added together, dictionaries are merged, and lists (such as
+  [request count, total time] pairs) are added element by element.
+
+  Args:
+    total: A dictionary containing statistics. It is modified in place.
+    stats: A dictionary containing statistics to add.
+  Returns:
+    The total dictionary.
+  """
+  for key, value in stats.iteritems():
+    if key not in total:
+      total[key] = value
+    elif isinstance(value, dict):
+      merge_stats(total[key], value)
+    elif isinstance(value, list):
+      total[key] = [current + new for current, new in zip(total[key], value)]
+    else:
+      total[key] += value
+
+  return total
@@ -0,0 +1,301 @@
+""" Estimates the cost of different ways to execute a query. """
+
+import json
+import logging
+import sys
+import time
+from collections import namedtuple
+
+from tornado import gen
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore.dbconstants import (
+  AppScaleDBConnectionError, KEY_DELIMITER)
+from appscale.datastore.utils import clean_app_id
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import datastore_pb
+
+# The prefix for datastore metadata keys that store property statistics.
+PROPERTY_STATS_KEY = 'property_stats'
+
+QueryPlan = namedtuple('QueryPlan',
+                       ['strategy', 'property_name', 'rows', 'cost'])
+
+
+class Strategy(object):
+  """ Ways of executing a query. """
+  KIND = 'kind'
+  SINGLE_PROPERTY = 'single-property'
+  ZIGZAG_MERGE_JOIN = 'zigzag-merge-join'
+  FILTERED_SINGLE_PROPERTY = 'filtered-single-property'
+  COMPOSITE = 'composite'
+
+
+def property_stats_key(project_id):
+  """ Determines the metadata key used to store a project's statistics.
+
+  Args:
+    project_id: A string specifying a project ID.
+  Returns:
+    A string specifying a datastore metadata key.
+  """
+  return KEY_DELIMITER.join([PROPERTY_STATS_KEY, project_id])
+
+
+class PropertyStatsCollector(object):
+  """ Gathers per-property cardinality statistics while scanning entities.
+
+  The number of distinct values is tracked exactly until a property has
+  MAX_TRACKED_VALUES of them. After that, it is extrapolated from the rate at
+  which new values were found.
+  """
+  MAX_TRACKED_VALUES = 1000
+
+  def __init__(self):
+    """ Creates a new PropertyStatsCollector. """
+    # Maps projects to namespaces to kinds to kind statistics.
+    self._projects = {}
+
+  def add_entity(self, project_id, namespace, kind, entity):
+    """ Adds an entity's properties to the statistics.
+
+    Args:
+      project_id: A string specifying the entity's project ID.
+      namespace: A string specifying the entity's namespace.
+      kind: A string specifying the entity's kind.
+      entity: An entity_pb.EntityProto object.
+    """
+    namespaces = self._projects.setdefault(project_id, {})
+    kinds = namespaces.setdefault(namespace, {})
+    if kind not in kinds:
+      kinds[kind] = {'entities': 0, 'properties': {}}
+
+    kind_stats = kinds[kind]
+    kind_stats['entities'] += 1
+    for prop in entity.property_list():
+      prop_stats = kind_stats['properties'].get(prop.name())
+      if prop_stats is None:
+        prop_stats = {'entries': 0, 'values': set(), 'full_at': None}
+        kind_stats['properties'][prop.name()] = prop_stats
+
+      prop_stats['entries'] += 1
+      if prop_stats['full_at'] is not None:
+        continue
+
+      prop_stats['values'].add(hash(prop.value().Encode()))
+      if len(prop_stats['values']) >= self.MAX_TRACKED_VALUES:
+        prop_stats['full_at'] = prop_stats['entries']
+
+  @property
+  def projects(self):
+    """ The projects that have statistics. """
+    return self._projects.keys()
+
+  def _distinct_values(self, prop_stats):
+    """ Estimates the number of distinct values for a property.
+
+    Args:
+      prop_stats: A dictionary containing collected property statistics.
+    Returns:
+      An integer.
+    """
+    if prop_stats['full_at'] is None:
+      return len(prop_stats['values'])
+
+    estimate = (self.MAX_TRACKED_VALUES * prop_stats['entries'] //
+                prop_stats['full_at'])
+    return min(estimate, prop_stats['entries'])
+
+  def serialize(self, project_id):
+    """ Encodes a project's statistics.
+
+    Args:
+      project_id: A string specifying a project ID.
+    Returns:
+      A JSON string that maps namespaces to kinds to kind statistics. Each
+      property is stored as an [index entries, distinct values] pair.
+    """
+    encoded = {}
+    for namespace, kinds in self._projects.get(project_id, {}).iteritems():
+      encoded[namespace] = {}
+      for kind, kind_stats in kinds.iteritems():
+        encoded[namespace][kind] = {
+          'entities': kind_stats['entities'],
+          'properties': {
+            name: [prop_stats['entries'], self._distinct_values(prop_stats)]
+            for name, prop_stats in kind_stats['properties'].iteritems()}
+        }
+
+    return json.dumps(encoded)
+
+
+class QueryPlanner(object):
+  """ Chooses the cheapest strategy for queries that can use more than one.
+
+  Costs are expressed in terms of the number of rows read from the database.
+  Without statistics for a kind, the planner keeps the default strategy.
+  """
+  # The number of seconds to keep a project's statistics before refreshing.
+  STATS_TTL = 300
+
+  # The relative cost of reading an index entry.
+  INDEX_ROW_COST = 1
+
+  # The relative cost of fetching an entity.
+  ENTITY_ROW_COST = 4
+
+  def __init__(self, datastore_batch):
+    """ Creates a new QueryPlanner.
+
+    Args:
+      datastore_batch: A DatastoreProxy object.
+    """
+    self._db = datastore_batch
+
+    # Maps projects to (statistics, expiration) tuples.
+    self._stats = {}
+
+  @gen.coroutine
+  def get_kind_stats(self, project_id, namespace, kind):
+    """ Retrieves the statistics that the groomer collected for a kind.
+
+    Args:
+      project_id: A string specifying a project ID.
+      namespace: A string specifying a namespace.
+      kind: A string specifying an entity kind.
+    Returns:
+      A dictionary containing kind statistics or None if they are not
+      available.
+    """
+    stats, expiration = self._stats.get(project_id, (None, 0))
+    if time.time() > expiration:
+      try:
+        encoded = yield self._db.get_metadata(property_stats_key(project_id))
+        stats = json.loads(encoded) if encoded else {}
+      except (AppScaleDBConnectionError, ValueError) as error:
+        logging.warning('Unable to fetch property stats for {}: {}'.format(
+          project_id, error))
+        stats = {}
+
+      self._stats[project_id] = (stats, time.time() + self.STATS_TTL)
+
+    raise gen.Return(stats.get(namespace, {}).get(kind))
+
+  def _property_rows(self, kind_stats, property_name, filter_ops):
+    """ Estimates the number of index entries that match a property's filters.
+
+    Args:
+      kind_stats: A dictionary containing kind statistics.
+      property_name: A string specifying a property name.
+      filter_ops: A list of (operator, value) tuples.
+    Returns:
+      A number.
+    """
+    entries, distinct = kind_stats['properties'].get(property_name, (0, 0))
+    if any(op == datastore_pb.Query_Filter.EQUAL for op, _ in filter_ops):
+      return entries / float(max(distinct, 1))
+
+    return entries
+
+  @gen.coroutine
+  def plan(self, query, filter_info, order_info, limit, zigzag):
+    """ Lists the strategies that can be used for a query.
+
+    Args:
+      query: A datastore_pb.Query object.
+      filter_info: A dictionary mapping property names to lists of
+        (operator, value) tuples. EXISTS filters should already be removed.
+      order_info: A list of (property name, direction) tuples.
+      limit: An integer specifying the number of results requested.
+      zigzag: A boolean indicating that a zigzag merge join can be used.
+    Returns:
+      A list of QueryPlan objects, cheapest first. When there are no
+      statistics, the costs are None and the default strategy is first. An
+      empty list indicates that the default strategy order should be used.
+    """
+    property_names = set(filter_info.keys())
+    property_names.update(prop_name for prop_name, _ in order_info)
+    property_names.discard('__key__')
+
+    kind_stats = None
+    if query.has_kind():
+      kind_stats = yield self.get_kind_stats(
+        clean_app_id(query.app()), query.name_space(), query.kind())
+
+    if not property_names:
+      plans = [(Strategy.KIND, None)]
+    elif len(property_names) == 1:
+      plans = [(Strategy.SINGLE_PROPERTY, list(property_names)[0])]
+    elif zigzag:
+      plans = [(Strategy.ZIGZAG_MERGE_JOIN, None)]
+
+      # Key filters cannot be applied to fetched entities.
+      if '__key__' not in filter_info:
+        plans.extend((Strategy.FILTERED_SINGLE_PROPERTY, prop_name)
+                     for prop_name in sorted(filter_info))
+    else:
+      raise gen.Return([])
+
+    if kind_stats is None:
+      raise gen.Return([QueryPlan(strategy, prop_name, None, None)
+                        for strategy, prop_name in plans])
+
+    entities = kind_stats['entities']
+    property_rows = {
+      prop_name: self._property_rows(kind_stats, prop_name,
+                                     filter_info.get(prop_name, []))
+      for prop_name in property_names}
+
+    # Assume that filters on different properties are independent.
+    matches = float(entities)
+    for rows in property_rows.itervalues():
+      matches *= rows / entities if entities else 0
+
+    # Most strategies can stop once enough results have been found.
+    fraction = min(1, limit / matches) if matches else 1
+    fetch_cost = self.INDEX_ROW_COST + self.ENTITY_ROW_COST
+
+    results = []
+    for strategy, prop_name in plans:
+      if strategy == Strategy.KIND:
+        rows = entities
+        cost = min(rows, limit) * fetch_cost
+      elif strategy == Strategy.SINGLE_PROPERTY:
+        rows = property_rows[prop_name]
+        cost = min(rows, limit) * fetch_cost
+      elif strategy == Strategy.ZIGZAG_MERGE_JOIN:
+        # Every range in the join is read up to the last match.
+        rows = sum(property_rows.itervalues()) * fraction
+        cost = (rows * self.INDEX_ROW_COST +
+                min(matches, limit) * self.ENTITY_ROW_COST)
+      else:
+        # Each index entry requires an entity fetch before filtering.
+        rows = property_rows[prop_name] * fraction
+        cost = rows * fetch_cost
+
+      results.append(QueryPlan(strategy, prop_name, int(rows), int(cost)))
+
+    # The sort is stable, so the default strategy wins ties.
+    raise gen.Return(sorted(results, key=lambda plan: plan.cost))
+
+  @staticmethod
+  def explain(plans):
+    """ Describes the plans that were considered for a query.
+
+    Args:
+      plans: A list of QueryPlan objects from the plan method.
+    Returns:
+      A dictionary describing the chosen plan and the alternatives.
+    """
+    if not plans:
+      return {'strategy': None, 'candidates': []}
+
+    chosen = plans[0]
+    return {
+      'strategy': chosen.strategy,
+      'property': chosen.property_name,
+      'estimatedRows': chosen.rows,
+      'estimatedCost': chosen.cost,
+      'candidates': [plan._asdict() for plan in plans]
+    }
@@ -43,9 +43,22 @@ class RangeIterator(object):
   """ Iterates through a range of index entries.
 
   This was designed for merge join queries. The range can only be narrowed.
+
+  Entries are fetched in pages. The first page is small so that queries with
+  a small limit do not read more than they need, and the page size doubles
+  each time the iterator moves past a page. Seeking within a page does not
+  require a database request. When the cursor nears the end of a page, the
+  next page is fetched in the background.
   """
+  # The largest number of entries to fetch at once.
   CHUNK_SIZE = 1000
 
+  # The number of entries to fetch in the first request.
+  INITIAL_CHUNK_SIZE = 100
+
+  # Start fetching the next page when this fraction of the page is left.
+  PREFETCH_THRESHOLD = 0.25
+
   def __init__(self, db, project_id, namespace, kind, prop_name, value):
     """ Creates a new RangeIterator.
 
@@ -71,6 +84,14 @@ class RangeIterator(object):
     self._cache = []
     self._index_exhausted = False
 
+    self._chunk_size = self.INITIAL_CHUNK_SIZE
+
+    # A pending request for the entries that follow the cache.
+    self._prefetch = None
+
+    # The number of database requests that have been made.
+    self.fetches = 0
+
   @property
   def prefix(self):
     """ The encoded reference without the path element. """
@@ -87,29 +108,68 @@ class RangeIterator(object):
     Raises:
       RangeExhausted when there are no more entries in the range.
     """
-    try:
+    while True:
       # First check if the request can be fulfilled with the cache.
-      entry = self._next_from_cache()
-      self._cursor = Cursor(entry.key, inclusive=False)
-      raise gen.Return(entry)
-    except ValueError:
-      # If the cache and index have been exhausted, there are no more entries.
-      if self._index_exhausted:
-        raise RangeExhausted()
-
-    self._cache = yield self._db.range_query(
-      ASC_PROPERTY_TABLE, PROPERTY_SCHEMA, self._cursor.key, self._range[-1],
-      self.CHUNK_SIZE, start_inclusive=self._cursor.inclusive)
-
-    if len(self._cache) < self.CHUNK_SIZE:
-      self._index_exhausted = True
+      try:
+        entry = self._next_from_cache()
+      except ValueError:
+        # If the cache and index have been exhausted, there are no more
+        # entries.
+        if self._index_exhausted:
+          raise RangeExhausted()
+      else:
+        self._cursor = Cursor(entry.key, inclusive=False)
+        self._start_prefetch()
+        raise gen.Return(entry)
+
+      yield self._fetch_chunk()
 
-    if not self._cache:
-      raise RangeExhausted()
+  def _query_chunk(self, start_key, start_inclusive):
+    """ Requests a chunk of entries from the database.
 
-    entry = self.entry_from_result(self._cache[0])
-    self._cursor = Cursor(entry.key, inclusive=False)
-    raise gen.Return(entry)
+    Args:
+      start_key: A string specifying where the chunk starts.
+      start_inclusive: A boolean indicating that the start key is included.
+    Returns:
+      A tuple containing the requested size and a Future that resolves to a
+      list of index entries.
+    """
+    self.fetches += 1
+    chunk_size = self._chunk_size
+    future = self._db.range_query(
+      ASC_PROPERTY_TABLE, PROPERTY_SCHEMA, start_key, self._range[-1],
+      chunk_size, start_inclusive=start_inclusive)
+    return chunk_size, future
+
+  def _start_prefetch(self):
+    """ Fetches the page after the cache if the cursor is close to its end. """
+    if self._prefetch is not None or self._index_exhausted or not self._cache:
+      return
+
+    remaining = len(self._cache) - self._cache_index()
+    if remaining > len(self._cache) * self.PREFETCH_THRESHOLD:
+      return
+
+    self._prefetch = self._query_chunk(self._cache[-1].keys()[0], False)
+
+  @gen.coroutine
+  def _fetch_chunk(self):
+    """ Replaces the cache with the entries that follow the cursor. """
+    if self._cache:
+      self._chunk_size = min(self._chunk_size * 2, self.CHUNK_SIZE)
+
+    # The prefetched page starts after the cache. Since the cursor has moved
+    # past the cache, the page is still useful.
+    if self._prefetch is not None:
+      chunk_size, future = self._prefetch
+      self._prefetch = None
+    else:
+      chunk_size, future = self._query_chunk(self._cursor.key,
+                                             self._cursor.inclusive)
+
+    self._cache = yield future
+    if len(self._cache) < chunk_size:
+      self._index_exhausted = True
 
   @classmethod
   def from_filter(cls, db, project_id, namespace, kind, pb_filter):
@@ -209,13 +269,15 @@ class RangeIterator(object):
     self._range = (start_key, end_key)
     self._cursor.key = max(start_key, self._cursor.key)
 
-  def _next_from_cache(self):
-    """ Retrieves the next index entry from the cache.
+    # Any pending request used the previous range.
+    self._prefetch = None
+
+  def _cache_index(self):
+    """ Finds the position of the cursor within the cache.
 
     Returns:
-      An IndexEntry.
-    Raises:
-      ValueError if the cache does not contain a suitable entry.
+      An integer specifying the index of the smallest cached key that is >=
+      the cursor.
     """
     lo = 0
     hi = len(self._cache)
@@ -227,6 +289,17 @@ class RangeIterator(object):
       else:
         hi = mid
 
+    return lo
+
+  def _next_from_cache(self):
+    """ Retrieves the next index entry from the cache.
+
+    Returns:
+      An IndexEntry.
+    Raises:
+      ValueError if the cache does not contain a suitable entry.
+    """
+    lo = self._cache_index()
     try:
       entry = self.entry_from_result(self._cache[lo])
     except IndexError:
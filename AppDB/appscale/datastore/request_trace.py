@@ -0,0 +1,141 @@
+""" Records where the datastore server spends time while handling a request.
+
+A RequestTrace is activated with a Tornado StackContext, so it follows the
+request through coroutines and callbacks without being passed to every
+function. Code that talks to ZooKeeper or Cassandra looks up the active trace
+with current_trace and does nothing when there isn't one (e.g. in the groomer).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+from tornado import stack_context
+
+# Keeps track of the trace for the callback that is currently running.
+_local = threading.local()
+
+
+class Category(object):
+  """ The kinds of work that are timed for each request. """
+  LOCK = 'lock'
+  READ = 'read'
+  WRITE = 'write'
+  DECODE = 'decode'
+  ENCODE = 'encode'
+
+  ALL = (LOCK, READ, WRITE, DECODE, ENCODE)
+
+
+class _ActiveTrace(object):
+  """ Makes a trace the current one while a callback is running. """
+  def __init__(self, trace):
+    """ Creates a new _ActiveTrace.
+
+    Args:
+      trace: A RequestTrace object.
+    """
+    self._trace = trace
+    self._previous = None
+
+  def __enter__(self):
+    self._previous = getattr(_local, 'trace', None)
+    _local.trace = self._trace
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    _local.trace = self._previous
+
+
+class RequestTrace(object):
+  """ Accumulates time spent on different kinds of work during a request. """
+  def __init__(self):
+    """ Creates a new RequestTrace. """
+    # Maps categories to the number of milliseconds spent on them.
+    self.timings = {category: 0.0 for category in Category.ALL}
+
+    # The number of requests made to the database.
+    self.round_trips = 0
+
+  def add(self, category, elapsed):
+    """ Records time spent on a kind of work.
+
+    Args:
+      category: A string specifying a Category.
+      elapsed: The number of seconds spent.
+    """
+    self.timings[category] += elapsed * 1000
+
+  @contextmanager
+  def timer(self, category):
+    """ Records the time spent in a block.
+
+    Args:
+      category: A string specifying a Category.
+    """
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.add(category, time.time() - start)
+
+  def track_query(self, category, future):
+    """ Records a database request and the time it takes to complete.
+
+    Args:
+      category: A string specifying Category.READ or Category.WRITE.
+      future: A Tornado future that resolves when the request finishes.
+    """
+    start = time.time()
+    self.round_trips += 1
+    future.add_done_callback(
+      lambda _: self.add(category, time.time() - start))
+
+  def activate(self):
+    """ Makes this the current trace for callbacks started in a block.
+
+    Returns:
+      A StackContext that should be used in a with statement. Coroutines
+      should be started inside the block and yielded outside of it.
+    """
+    return stack_context.StackContext(partial(_ActiveTrace, self))
+
+  def fields(self):
+    """ Lists the trace values in the form used by the service stats.
+
+    Returns:
+      A dictionary mapping request field names to integers.
+    """
+    fields = {'{}_time'.format(category): int(round(elapsed))
+              for category, elapsed in self.timings.iteritems()}
+    fields['round_trips'] = self.round_trips
+    return fields
+
+  def __repr__(self):
+    timings = ', '.join('{}={:.1f}ms'.format(category, self.timings[category])
+                        for category in Category.ALL)
+    return 'RequestTrace({}, round_trips={})'.format(timings, self.round_trips)
+
+
+def current_trace():
+  """ Retrieves the trace for the request that is currently being handled.
+
+  Returns:
+    A RequestTrace object or None.
+  """
+  return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def timed(category):
+  """ Records the time spent in a block for the current request.
+
+  Args:
+    category: A string specifying a Category.
+  """
+  trace = current_trace()
+  if trace is None:
+    yield
+    return
+
+  with trace.timer(category):
+    yield
@@ -2,25 +2,21 @@
 Blobstore server for uploading blobs.
 See LICENSE file.
 
-Some code was taken from 
-http://blog.doughellmann.com/2009/07/pymotw-urllib2-library-for-opening-urls.html
-
+Uploads are streamed: each file in the form is written to blob storage as its
+data arrives, so the memory used by an upload does not depend on its size.
 """
 import argparse
 import base64
 import cgi
-import cStringIO
 import datetime
 import gzip
 import hashlib
-import itertools
 import logging
-import math
-import mimetools
 import os 
 import os.path
 import requests
 import sys
+import threading
 import tornado.httpserver
 import tornado.ioloop
 import tornado.web
@@ -33,8 +29,12 @@ from appscale.common.constants import LOG_FORMAT
 from appscale.common.deployment_config import DeploymentConfig
 from appscale.common.deployment_config import ConfigInaccessible
 from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from kazoo.client import KazooClient
 from StringIO import StringIO
+from tornado import gen
+from tornado.httputil import HTTPHeaders
 
 sys.path.append(APPSCALE_PYTHON_APPSERVER)
 from google.appengine.api import apiproxy_stub_map
@@ -66,6 +66,12 @@ UPLOAD_ERROR = 'There was an error with your upload. Redirect path not '\
 # The maximum size of an incoming request.
 MAX_REQUEST_BUFF_SIZE = 2 * 1024 * 1024 * 1024  # 2GBs
 
+# The number of threads used for storing uploads and forwarding callbacks.
+UPLOAD_THREADS = 8
+
+# The content type that is assumed for files that do not specify one.
+DEFAULT_FILE_CONTENT_TYPE = 'application/unknown'
+
 # The header used by GCS to provide a resumable upload ID.
 GCS_UPLOAD_ID_HEADER = 'X-GUploader-UploadID'
 
@@ -79,91 +85,444 @@ datastore_path = ""
 deployment_config = None
 
 
-class MultiPartForm(object):
-  """Accumulate the data to be used when posting a form."""
+class MalformedUpload(Exception):
+  """ Indicates that the body of an upload could not be parsed. """
+  pass
+
+
+class UploadFailed(Exception):
+  """ Indicates that an uploaded file could not be stored. """
+  pass
+
+
+class ProjectDatastoreRouter(object):
+  """ Sends each thread's datastore calls to the stub for its project.
+
+  The API proxy is shared by every thread, so this is registered as the
+  datastore stub. The project's stub is chosen when an RPC is created, which
+  happens in the thread that makes the call.
+  """
+  def __init__(self):
+    """ Creates a new ProjectDatastoreRouter. """
+    self._stubs = {}
+    self._stubs_lock = threading.Lock()
+    self._local = threading.local()
+
+  @contextmanager
+  def project(self, app_id):
+    """ Directs the calling thread's datastore calls to a project.
+
+    Args:
+      app_id: A string specifying the project ID.
+    """
+    previous = getattr(self._local, 'app_id', None)
+    self._local.app_id = app_id
+    try:
+      yield
+    finally:
+      self._local.app_id = previous
+
+  def CreateRPC(self):
+    """ Creates an RPC for the calling thread's project. """
+    return self._stub().CreateRPC()
+
+  def MakeSyncCall(self, service, call, request, response, request_id=None):
+    """ Makes a datastore call for the calling thread's project. """
+    self._stub().MakeSyncCall(service, call, request, response, request_id)
+
+  def _stub(self):
+    """ Fetches the stub for the calling thread's project.
+
+    Returns:
+      A DatastoreDistributed stub.
+    Raises:
+      BadRequestError if the thread has not selected a project.
+    """
+    app_id = getattr(self._local, 'app_id', None)
+    if app_id is None:
+      raise datastore_errors.BadRequestError(
+        'Datastore calls must be made for a project')
+
+    with self._stubs_lock:
+      stub = self._stubs.get(app_id)
+      if stub is None:
+        stub = datastore_distributed.DatastoreDistributed(
+          app_id, datastore_path, require_indexes=False)
+        self._stubs[app_id] = stub
+
+      return stub
+
+
+# Directs datastore calls to the stub for each thread's project.
+datastore_router = ProjectDatastoreRouter()
+
+
+class MultipartParser(object):
+  """ Splits a multipart/form-data body into parts as the body arrives. """
+
+  # The events that the parser produces.
+  PART_START = 'part_start'
+  PART_DATA = 'part_data'
+  PART_END = 'part_end'
+
+  # The maximum size of the headers for each part.
+  MAX_HEADERS_SIZE = 64 * 1024
+
+  # The states of the parser.
+  _PREAMBLE, _DELIMITER, _HEADERS, _BODY, _DONE = range(5)
 
   def __init__(self, boundary):
-    """ Constructor. """
-    self.form_fields = []
-    self.files = []
-    if not boundary:
-      self.boundary = mimetools.choose_boundary()
+    """ Creates a new MultipartParser.
+
+    Args:
+      boundary: A string specifying the boundary between parts.
+    """
+    self._delimiter = '\r\n--' + boundary
+    # The first delimiter is not required to follow a line break.
+    self._buffer = '\r\n'
+    self._state = self._PREAMBLE
+
+  @property
+  def complete(self):
+    """ Checks if the closing delimiter has been received.
+
+    Returns:
+      A boolean indicating whether or not the body is complete.
+    """
+    return self._state == self._DONE
+
+  def feed(self, data):
+    """ Parses the next part of the body.
+
+    Only a few bytes that might belong to a delimiter are kept between calls.
+    All other part data is returned right away.
+
+    Args:
+      data: A string containing the next part of the body.
+    Returns:
+      A list of tuples containing an event and its value. PART_START events
+      include the part's HTTPHeaders, PART_DATA events include a string of
+      part data, and PART_END events include None.
+    Raises:
+      MalformedUpload if the body is not valid.
+    """
+    self._buffer += data
+    events = []
+    while True:
+      if self._state in (self._PREAMBLE, self._BODY):
+        index = self._buffer.find(self._delimiter)
+        if index == -1:
+          # Keep enough data to find a delimiter that spans two calls.
+          data_end = max(len(self._buffer) - len(self._delimiter) + 1, 0)
+          if self._state == self._BODY and data_end:
+            events.append((self.PART_DATA, self._buffer[:data_end]))
+
+          self._buffer = self._buffer[data_end:]
+          break
+
+        if self._state == self._BODY:
+          if index:
+            events.append((self.PART_DATA, self._buffer[:index]))
+
+          events.append((self.PART_END, None))
+
+        self._buffer = self._buffer[index + len(self._delimiter):]
+        self._state = self._DELIMITER
+      elif self._state == self._DELIMITER:
+        if self._buffer.startswith('--'):
+          self._state = self._DONE
+          continue
+
+        line_end = self._buffer.find('\r\n')
+        if line_end == -1:
+          if len(self._buffer) > self.MAX_HEADERS_SIZE:
+            raise MalformedUpload('Invalid boundary line')
+          break
+
+        self._buffer = self._buffer[line_end + 2:]
+        self._state = self._HEADERS
+      elif self._state == self._HEADERS:
+        if self._buffer.startswith('\r\n'):
+          headers = HTTPHeaders()
+          self._buffer = self._buffer[2:]
+        else:
+          headers_end = self._buffer.find('\r\n\r\n')
+          if headers_end == -1:
+            if len(self._buffer) > self.MAX_HEADERS_SIZE:
+              raise MalformedUpload('Part headers are too large')
+            break
+
+          headers = HTTPHeaders.parse(self._buffer[:headers_end])
+          self._buffer = self._buffer[headers_end + 4:]
+
+        events.append((self.PART_START, headers))
+        self._state = self._BODY
+      else:
+        # Ignore anything after the closing delimiter.
+        self._buffer = ''
+        break
+
+    return events
+
+
+class FileUpload(object):
+  """ Stores an uploaded file as its data arrives. """
+  def __init__(self, filename, content_type, creation):
+    """ Creates a new FileUpload.
+
+    Args:
+      filename: A string specifying the name of the uploaded file.
+      content_type: A string specifying the content type of the file.
+      creation: A datetime specifying when the upload started.
+    """
+    self.filename = filename
+    self.content_type = content_type
+    self.creation = creation
+    self.size = 0
+    self._md5 = hashlib.md5()
+
+  def write(self, data):
+    """ Stores the next part of the file.
+
+    Args:
+      data: A string containing the next part of the file.
+    """
+    self.size += len(data)
+    self._md5.update(data)
+    self._write(data)
+
+  def finish(self):
+    """ Stores the rest of the file.
+
+    Returns:
+      A dictionary containing the blob info metadata for the file.
+    """
+    blob_key = self._finish()
+    return {"filename": self.filename,
+            "creation-date": blobstore._format_creation(self.creation),
+            "key": blob_key,
+            "size": str(self.size),
+            "content-type": self.content_type,
+            "md5-hash": self._md5.hexdigest()}
+
+  def _write(self, data):
+    """ Stores the next part of the file.
+
+    Args:
+      data: A string containing the next part of the file.
+    """
+    raise NotImplementedError()
+
+  def _finish(self):
+    """ Stores the rest of the file.
+
+    Returns:
+      A string specifying the blob key.
+    """
+    raise NotImplementedError()
+
+
+class DatastoreUpload(FileUpload):
+  """ Stores an uploaded file in the datastore. """
+  def __init__(self, app_id, filename, content_type, creation):
+    """ Creates a new DatastoreUpload.
+
+    Args:
+      app_id: A string specifying the project that the file belongs to.
+      filename: A string specifying the name of the uploaded file.
+      content_type: A string specifying the content type of the file.
+      creation: A datetime specifying when the upload started.
+    Raises:
+      UploadFailed if unable to create a blob key.
+    """
+    super(DatastoreUpload, self).__init__(filename, content_type, creation)
+    self._app_id = app_id
+    with project_datastore(app_id):
+      self._blob_key = dev_appserver_upload.GenerateBlobKey(app_id=app_id)
+      if not self._blob_key:
+        raise UploadFailed('Unable to generate a blob key.')
+
+      blob_storage = datastore_blob_storage.DatastoreBlobStorage(app_id)
+      self._writer = blob_storage.CreateBlobWriter(self._blob_key)
+
+  def _write(self, data):
+    """ Stores the next part of the file.
+
+    Args:
+      data: A string containing the next part of the file.
+    """
+    with project_datastore(self._app_id):
+      self._writer.write(data)
+
+  def _finish(self):
+    """ Stores the rest of the file and its BlobInfo entity.
+
+    Returns:
+      A string specifying the blob key.
+    Raises:
+      UploadFailed if the file's metadata is not valid.
+    """
+    try:
+      content_type = self.content_type.decode('utf-8')
+      filename = self.filename.decode('utf-8')
+    except UnicodeDecodeError:
+      raise UploadFailed('The uploaded file contained invalid UTF-8 metadata.')
+
+    with project_datastore(self._app_id):
+      self._writer.close()
+
+      blob_entity = datastore.Entity(blobstore.BLOB_INFO_KIND,
+                                     name=str(self._blob_key), namespace='',
+                                     _app=self._app_id)
+      blob_entity['content_type'] = content_type
+      blob_entity['filename'] = filename
+      blob_entity['creation'] = self.creation
+      blob_entity['md5_hash'] = self._md5.hexdigest()
+      blob_entity['size'] = self.size
+      datastore.Put(blob_entity)
+
+    return str(self._blob_key)
+
+
+class GCSUpload(FileUpload):
+  """ Stores an uploaded file in GCS with a resumable upload. """
+  def __init__(self, bucket_name, filename, content_type, creation):
+    """ Creates a new GCSUpload.
+
+    Args:
+      bucket_name: A string specifying the GCS bucket to store the file in.
+      filename: A string specifying the name of the uploaded file.
+      content_type: A string specifying the content type of the file.
+      creation: A datetime specifying when the upload started.
+    Raises:
+      UploadFailed if unable to start the resumable upload.
+    """
+    super(GCSUpload, self).__init__(filename, content_type, creation)
+    gcs_config = {'scheme': 'https', 'port': 443}
+    try:
+      gcs_config.update(deployment_config.get_config('gcs'))
+    except ConfigInaccessible:
+      raise UploadFailed('Unable to fetch GCS configuration.')
+
+    if 'host' not in gcs_config:
+      raise UploadFailed('GCS host is not defined.')
+
+    gcs_path = '{scheme}://{host}:{port}'.format(**gcs_config)
+    self.gs_path = '/gs/{}/{}'.format(bucket_name, filename)
+    self._url = '/'.join([gcs_path, bucket_name, filename])
+    response = requests.post(self._url, headers={'x-goog-resumable': 'start'})
+    if (response.status_code != 201 or
+        GCS_UPLOAD_ID_HEADER not in response.headers):
+      raise UploadFailed('Unable to start resumable GCS upload.')
+
+    self._upload_id = response.headers[GCS_UPLOAD_ID_HEADER]
+    self._pieces = []
+    self._buffered = 0
+    self._offset = 0
+
+  def _write(self, data):
+    """ Sends each complete chunk of the file to GCS.
+
+    Args:
+      data: A string containing the next part of the file.
+    Raises:
+      UploadFailed if GCS does not accept a chunk.
+    """
+    self._pieces.append(data)
+    self._buffered += len(data)
+    if self._buffered < GCS_CHUNK_SIZE:
+      return
+
+    buffered_data = ''.join(self._pieces)
+    chunk_start = 0
+    while len(buffered_data) - chunk_start >= GCS_CHUNK_SIZE:
+      chunk = buffered_data[chunk_start:chunk_start + GCS_CHUNK_SIZE]
+      if self._send_chunk(chunk, total='*') != 308:
+        raise UploadFailed('Unable to continue GCS upload.')
+      chunk_start += GCS_CHUNK_SIZE
+
+    remaining = buffered_data[chunk_start:]
+    self._pieces = [remaining] if remaining else []
+    self._buffered = len(remaining)
+
+  def _finish(self):
+    """ Sends the last chunk of the file to GCS.
+
+    Returns:
+      A string specifying the blob key.
+    Raises:
+      UploadFailed if GCS does not complete the upload.
+    """
+    if self._send_chunk(''.join(self._pieces), total=self.size) != 200:
+      raise UploadFailed('Unable to complete GCS upload.')
+
+    return 'encoded_gs_key:' + base64.b64encode(self.gs_path)
+
+  def _send_chunk(self, chunk, total):
+    """ Sends a chunk of the file to GCS.
+
+    Args:
+      chunk: A string containing the chunk data.
+      total: The total size of the file or '*' if it is not known yet.
+    Returns:
+      An integer specifying the response status code.
+    """
+    if chunk:
+      current_range = '{}-{}'.format(self._offset,
+                                     self._offset + len(chunk) - 1)
     else:
-      self.boundary = boundary
-    return
-  
-  def get_content_type(self):
-    """ Get the content type to use. """
-    return 'multipart/form-data; boundary=%s' % self.boundary
-
-  def add_field(self, name, value):
-    """Add a simple field to the form data."""
-    self.form_fields.append((name, value))
-    return
-
-  def add_file(self, 
-               fieldname, 
-               filename,  
-               fileHandle, 
-               blob_key, 
-               access_type,
-               size,
-               creation):
-    """Add a file to be uploaded."""
-    body = fileHandle.read()
-    mimetype = 'message/external-body; blob-key="%s"; access-type="%s"' % \
-       (blob_key, access_type)
-    self.files.append((fieldname, filename, mimetype, body, size, creation))
-    return
-  
-  def __str__(self):
-    """Return a string representing the form data, including attached files."""
-    # Build a list of lists, each containing "lines" of the
-    # request.  Each part is separated by a boundary string.
-    # Once the list is built, return a string where each
-    # line is separated by '\r\n'.  
-    parts = []
-    part_boundary = '--' + self.boundary
-     
-    # Add the form fields
-    parts.extend(
-        [ part_boundary,
-          'Content-Disposition: form-data; name="%s"' % name,
-          '',
-          value,
-        ]
-        for name, value in self.form_fields
-        )
-     
-    # Add the files to upload
-    parts.extend(
-        [ part_boundary,
-          'Content-Type: %s' % content_type,
-          'MIME-Version: 1.0',
-          'Content-Disposition: form-data; name="%s"; filename="%s"' % \
-             (field_name, filename),
-          '',
-          'Content-Type: application/octet-stream',
-          'MIME-Version: 1.0',
-          'Content-Length: %d'%size,
-          'content-type: application/octet-stream',
-          'content-disposition: form-data; name="%s"; filename="%s"' % \
-             (field_name, filename),
-          blobstore.UPLOAD_INFO_CREATION_HEADER + ": %s" % creation,
-          '',
-          ''
-        ]
-        for field_name, filename, content_type, body, size, \
-            creation in self.files
-        )
-     
-    # Flatten the list and add closing boundary marker,
-    # then return CR+LF separated data
-    flattened = list(itertools.chain(*parts))
-    flattened.append('--' + self.boundary + '--')
-    flattened.append('')
-    return '\r\n'.join(flattened)
- 
+      current_range = '*'
+
+    content_range = 'bytes {}/{}'.format(current_range, total)
+    response = requests.put(self._url, data=chunk,
+                            headers={'Content-Range': content_range},
+                            params={'upload_id': self._upload_id})
+    self._offset += len(chunk)
+    return response.status_code
+
+
+def forward_callback(urlrequest):
+  """ Sends the blob metadata to the application's upload handler.
+
+  Args:
+    urlrequest: A urllib2.Request for the application's success path.
+  Returns:
+    A string containing the response body.
+  Raises:
+    urllib2.HTTPError if the application does not return a 200 status.
+  """
+  response = urllib2.urlopen(urlrequest)
+  output = response.read()
+  if response.info().get('Content-Encoding') == 'gzip':
+    buf = StringIO(output)
+    f = gzip.GzipFile(fileobj=buf)
+    output = f.read()
+
+  return output
+
+def project_datastore(app_id):
+  """ Directs the calling thread's datastore calls to a project.
+
+  Args:
+    app_id: A string specifying the project ID.
+  Returns:
+    A context manager.
+  """
+  return datastore_router.project(app_id)
+
+def run_in_project(app_id, func, *args):
+  """ Runs a function that makes datastore calls for a project.
+
+  Args:
+    app_id: A string specifying the project ID.
+    func: The function to run.
+    args: The arguments to pass to the function.
+  Returns:
+    The function's return value.
+  """
+  with project_datastore(app_id):
+    return func(*args)
+
 def get_blobinfo(blob_key):
   """ Get BlobInfo from the datastore given its key. 
    
@@ -202,29 +561,18 @@ def setup_env():
 
 class Application(tornado.web.Application):
   """ The tornado web application handling uploads and healthchecks. """
-  def __init__(self):
-    """ Constructor. """
+  def __init__(self, thread_pool):
+    """ Constructor.
+
+    Args:
+      thread_pool: A ThreadPoolExecutor used for blocking upload operations.
+    """
     handlers = [
-      (r"/_ah/upload/(.*)/(.*)", UploadHandler),
+      (r"/_ah/upload/(.*)/(.*)", UploadHandler, {'thread_pool': thread_pool}),
       (r"/", HealthCheck)
     ]   
     tornado.web.Application.__init__(self, handlers)
 
-def split_content_type(c_type):
-  """ Parses the content type. 
-  
-  Args: 
-    c_type: the content type.
-  Returns:
-    A tuple the first portion of the content type and a key/value dictionary
-    of the content-type.
-  """
-  delim = ';'
-  ps = c_type.split(delim)
-  tup = dict([(k.lower().strip(), v) for k, v in [p.split('=', 1) \
-                                     for p in ps[1:]]])
-  return tup
-
 class SmartRedirectHandler(urllib2.HTTPRedirectHandler):     
   """ An overridden class for custom actions on redirects. """
   def http_error_301(self, req, fp, code, msg, headers):  
@@ -241,30 +589,98 @@ class HealthCheck(tornado.web.RequestHandler):
     """ This path is called to make sure the server is up and running. """
     self.finish("Hello") 
  
+@tornado.web.stream_request_body
 class UploadHandler(tornado.web.RequestHandler):
-  """ Tornado handler for uploads. """
-  def post(self, app_id="blob", session_id = "session"):
-    """ Handler a post request from a user uploading a blob. 
-    
+  """ Tornado handler for uploads.
+
+  The body is parsed as it arrives, and each file is stored as its data is
+  received. Tornado waits for each chunk to be stored before reading more of
+  the body, which limits the amount of the upload that is held in memory.
+  Blocking operations run in a thread pool so that the IOLoop can continue
+  to serve other requests.
+  """
+  def initialize(self, thread_pool):
+    """ Defines required resources to handle requests.
+
     Args:
-      app_id: The application triggering the upload.
-      session_id: Authentication token to validate the upload.
+      thread_pool: A ThreadPoolExecutor used for blocking upload operations.
     """
-    global datastore_path
-    db = datastore_distributed.DatastoreDistributed(
-      app_id, datastore_path, require_indexes=False)
-    apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', db)
-    os.environ['APPLICATION_ID'] = app_id
+    self._thread_pool = thread_pool
+    self._app_id = None
+    self._session = None
+    self._parser = None
+    self._creation = None
+    self._part_name = None
+    self._upload = None
+    self._field_pieces = []
+    self._blob_infos = {}
+    self._fields = {}
+
+  @gen.coroutine
+  def prepare(self):
+    """ Validates the upload session before the body arrives. """
+    app_id, session_id = self.path_args
 
-    # Setup the app id in the datastore.
     # Get session info and upload success path.
-    blob_session = get_session(session_id)
+    blob_session = yield self._thread_pool.submit(
+      run_in_project, app_id, get_session, session_id)
     if not blob_session:
       self.finish('Session has expired. Contact the owner of the ' + \
                   'app for support.\n\n')
       return
 
-    success_path = blob_session["success_path"]
+    _, content_type_params = cgi.parse_header(
+      self.request.headers.get('Content-Type', ''))
+    if 'boundary' not in content_type_params:
+      self.send_error(400, reason='Upload is not a multipart form.')
+      return
+
+    yield self._thread_pool.submit(
+      run_in_project, app_id, datastore.Delete, blob_session)
+    self._app_id = app_id
+    self._session = blob_session
+    self._parser = MultipartParser(content_type_params['boundary'])
+    self._creation = datetime.datetime.now()
+
+  @gen.coroutine
+  def data_received(self, chunk):
+    """ Stores the next chunk of the body.
+
+    Args:
+      chunk: A string containing the next part of the body.
+    """
+    if self._finished:
+      return
+
+    try:
+      for event, value in self._parser.feed(chunk):
+        if event == MultipartParser.PART_START:
+          yield self._start_part(value)
+        elif event == MultipartParser.PART_DATA:
+          yield self._write_part(value)
+        else:
+          yield self._finish_part()
+    except MalformedUpload as error:
+      self.send_error(400, reason=str(error))
+    except UploadFailed as error:
+      self.send_error(reason=str(error))
+
+  @gen.coroutine
+  def post(self, app_id="blob", session_id = "session"):
+    """ Forwards the blob metadata to the application's upload handler.
+    
+    Args:
+      app_id: The application triggering the upload.
+      session_id: Authentication token to validate the upload.
+    """
+    if self._finished:
+      return
+
+    if not self._parser.complete:
+      self.send_error(400, reason='Upload ended before the form was complete.')
+      return
+
+    success_path = self._session["success_path"]
 
     server_host = success_path[:success_path.rfind("/", 3)]
     if server_host.startswith("http://"):
@@ -272,22 +688,11 @@ class UploadHandler(tornado.web.RequestHandler):
       server_host = server_host[len("http://"):]
     server_host = server_host.split('/')[0]
 
-    blob_storage = datastore_blob_storage.DatastoreBlobStorage(app_id)
-    uploadhandler = dev_appserver_upload.UploadCGIHandler(blob_storage)
-
-    datastore.Delete(blob_session)
-
     # This request is sent to the upload handler of the app
     # in the hope it returns a redirect to be forwarded to the user
     urlrequest = urllib2.Request(success_path)
 
     # Forward all relevant headers and create data for request
-    content_type = self.request.headers["Content-Type"]
-    kv = split_content_type(content_type)
-    boundary = None
-    if "boundary" in kv:
-      boundary = kv["boundary"]
-
     urlrequest.add_header("Content-Type",
                           'application/x-www-form-urlencoded')
 
@@ -299,93 +704,9 @@ class UploadHandler(tornado.web.RequestHandler):
     # to this port.
     urlrequest.add_header("Host", server_host)
 
-    form = MultiPartForm(boundary)
-    creation = datetime.datetime.now()
-
-    # Loop on all files in the form.
-    for filekey in self.request.files.keys():
-      data = {"blob_info_metadata": {filekey: []}}
-      file = self.request.files[filekey][0] 
-      body = file["body"]
-      size = len(body)
-      filename = file["filename"]
-      file_content_type = file["content_type"]
-
-      gs_path = ''
-      if 'gcs_bucket' in blob_session:
-        gcs_config = {'scheme': 'https', 'port': 443}
-        try:
-          gcs_config.update(deployment_config.get_config('gcs'))
-        except ConfigInaccessible:
-          self.send_error('Unable to fetch GCS configuration.')
-          return
-
-        if 'host' not in gcs_config:
-          self.send_error('GCS host is not defined.')
-          return
-
-        gcs_path = '{scheme}://{host}:{port}'.format(**gcs_config)
-        gcs_bucket_name = blob_session['gcs_bucket']
-        gcs_url = '/'.join([gcs_path, gcs_bucket_name, filename])
-        response = requests.post(gcs_url,
-                                 headers={'x-goog-resumable': 'start'})
-        if (response.status_code != 201 or
-            GCS_UPLOAD_ID_HEADER not in response.headers):
-          self.send_error(reason='Unable to start resumable GCS upload.')
-          return
-        upload_id = response.headers[GCS_UPLOAD_ID_HEADER]
-
-        total_chunks = int(math.ceil(float(size) / GCS_CHUNK_SIZE))
-        for chunk_num in range(total_chunks):
-          offset = GCS_CHUNK_SIZE * chunk_num
-          current_chunk_size = min(GCS_CHUNK_SIZE, size - offset)
-          end_byte = offset + current_chunk_size
-          current_range = '{}-{}'.format(offset, end_byte - 1)
-          content_range = 'bytes {}/{}'.format(current_range, size)
-          response = requests.put(gcs_url, data=body[offset:end_byte],
-                                  headers={'Content-Range': content_range},
-                                  params={'upload_id': upload_id})
-          if chunk_num == total_chunks - 1:
-            if response.status_code != 200:
-              self.send_error(reason='Unable to complete GCS upload.')
-              return
-          else:
-            if response.status_code != 308:
-              self.send_error(reason='Unable to continue GCS upload.')
-              return
-        gs_path = '/gs/{}/{}'.format(gcs_bucket_name, filename)
-        blob_key = 'encoded_gs_key:' + base64.b64encode(gs_path)
-      else:
-        form_item = cgi.FieldStorage(
-          headers={'content-type': file_content_type})
-        form_item.file = cStringIO.StringIO(body)
-        form_item.filename = filename
-
-        blob_entity = uploadhandler.StoreBlob(form_item, creation)
-        blob_key = str(blob_entity.key().name())
-
-      if not blob_key: 
-        self.finish('Status: 500\n\n')
-        return 
-      creation_formatted = blobstore._format_creation(creation)
-      form.add_file(filekey, filename, cStringIO.StringIO(blob_key), blob_key,
-                    blobstore.BLOB_KEY_HEADER, size, creation_formatted)
-
-      md5_handler = hashlib.md5(str(body))
-      blob_info = {"filename": filename,
-                   "creation-date": creation_formatted,
-                   "key": blob_key,
-                   "size": str(size),
-                   "content-type": file_content_type,
-                   "md5-hash": md5_handler.hexdigest()}
-      if 'gcs_bucket' in blob_session:
-        blob_info['gs-name'] = gs_path
-      data["blob_info_metadata"][filekey].append(blob_info)
-
-    # Loop through form fields
-    for fieldkey in self.request.arguments.keys():
-      form.add_field(fieldkey, self.request.arguments[fieldkey][0])
-      data[fieldkey] = self.request.arguments[fieldkey][0]
+    # The callback only contains the metadata of the stored blobs.
+    data = {"blob_info_metadata": self._blob_infos}
+    data.update(self._fields)
 
     logging.debug("Callback data: \n{}".format(data))
     data = urllib.urlencode(data)
@@ -395,13 +716,7 @@ class UploadHandler(tornado.web.RequestHandler):
     # We are catching the redirect error here
     # and extracting the Location to post the redirect.
     try:
-      response = urllib2.urlopen(urlrequest)
-      output = response.read()
-      if response.info().get('Content-Encoding') == 'gzip':
-        buf = StringIO(output)
-        f = gzip.GzipFile(fileobj=buf)
-        data = f.read()
-        output = data
+      output = yield self._thread_pool.submit(forward_callback, urlrequest)
       self.finish(output)
     except urllib2.HTTPError, e: 
       if "Location" in e.hdrs:
@@ -416,6 +731,60 @@ class UploadHandler(tornado.web.RequestHandler):
         self.finish(UPLOAD_ERROR + "</br>" + str(e.hdrs) + "</br>" + str(e))
         return
 
+  @gen.coroutine
+  def _start_part(self, headers):
+    """ Prepares to store a part of the form.
+
+    Args:
+      headers: The HTTPHeaders of the part.
+    """
+    _, disposition = cgi.parse_header(headers.get('Content-Disposition', ''))
+    self._part_name = disposition.get('name')
+    self._field_pieces = []
+    filename = disposition.get('filename')
+    if not filename:
+      self._upload = None
+      return
+
+    content_type = headers.get('Content-Type', DEFAULT_FILE_CONTENT_TYPE)
+    if 'gcs_bucket' in self._session:
+      self._upload = yield self._thread_pool.submit(
+        GCSUpload, self._session['gcs_bucket'], filename, content_type,
+        self._creation)
+    else:
+      self._upload = yield self._thread_pool.submit(
+        DatastoreUpload, self._app_id, filename, content_type,
+        self._creation)
+
+  @gen.coroutine
+  def _write_part(self, data):
+    """ Stores the next part of a file or form field.
+
+    Args:
+      data: A string containing the next part of the part's body.
+    """
+    if self._upload is None:
+      self._field_pieces.append(data)
+      return
+
+    yield self._thread_pool.submit(self._upload.write, data)
+
+  @gen.coroutine
+  def _finish_part(self):
+    """ Stores the rest of a file or form field. """
+    if self._upload is None:
+      # Like Tornado's form parsing, only the first value of a field is used.
+      self._fields.setdefault(self._part_name, ''.join(self._field_pieces))
+      self._field_pieces = []
+      return
+
+    blob_info = yield self._thread_pool.submit(self._upload.finish)
+    if isinstance(self._upload, GCSUpload):
+      blob_info['gs-name'] = self._upload.gs_path
+
+    self._blob_infos.setdefault(self._part_name, []).append(blob_info)
+    self._upload = None
+
 
 def main():
   global datastore_path
@@ -436,9 +805,11 @@ def main():
   zk_client.start()
   deployment_config = DeploymentConfig(zk_client)
   setup_env()
+  apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', datastore_router)
 
+  thread_pool = ThreadPoolExecutor(UPLOAD_THREADS)
   http_server = tornado.httpserver.HTTPServer(
-    Application(), max_buffer_size=MAX_REQUEST_BUFF_SIZE)
+    Application(thread_pool), max_body_size=MAX_REQUEST_BUFF_SIZE)
 
   http_server.listen(args.port)
 
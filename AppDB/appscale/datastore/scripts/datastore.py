@@ -12,6 +12,7 @@ import os
 import sys
 import time
 import tornado.httpserver
+import tornado.process
 import tornado.web
 
 from appscale.common import appscale_info
@@ -27,10 +28,16 @@ from tornado.options import options
 from .. import dbconstants
 from ..appscale_datastore_batch import DatastoreFactory
 from ..datastore_distributed import DatastoreDistributed
+from ..entity_cache import EntityCache
+from ..index_backfill import BuildingIndexes
+from ..prefork import LOOPBACK, bind_shared_socket, fork_workers, merge_stats
+from ..request_trace import Category, RequestTrace, timed
+from ..statistics import service_stats
 from ..utils import (clean_app_id,
                      logger,
                      UnprocessedQueryResult)
 from ..zkappscale import zktransaction
+from ..zkappscale.entity_lock import lock_stats
 from ..zkappscale.transaction_manager import TransactionManager
 
 sys.path.append(APPSCALE_PYTHON_APPSERVER)
@@ -48,6 +55,12 @@ datastore_access = None
 # A record of active datastore servers.
 datastore_servers = set()
 
+# The ID of this worker process.
+worker_id = 0
+
+# The loopback ports of the other worker processes on this node.
+worker_ports = []
+
 # The ZooKeeper path where this server registers its availability.
 server_node = None
 
@@ -64,29 +77,73 @@ STATS = {}
 # The ZooKeeper path where a list of active datastore servers is stored.
 DATASTORE_SERVERS_NODE = '/appscale/datastore/servers'
 
+# The number of seconds to keep an idle client connection open. AppServers
+# reuse connections between requests, so this should be longer than their
+# pool's idle timeout.
+IDLE_CONNECTION_TIMEOUT = 60
+
+# The default number of seconds an entity can stay in the entity cache. Since
+# other datastore servers do not invalidate this server's cache, this bounds
+# how stale a non-transactional read can be.
+DEFAULT_ENTITY_CACHE_TTL = 1
 
-class ClearHandler(tornado.web.RequestHandler):
+
+class WorkerRelayHandler(tornado.web.RequestHandler):
+  """ A handler for requests that apply to every worker process. """
+  def initialize(self, relay=True):
+    """ Sets up the handler.
+
+    Args:
+      relay: A boolean indicating that requests should be relayed to the
+        other worker processes on this node.
+    """
+    self.relay = relay
+
+  @gen.coroutine
+  def relay_to_workers(self):
+    """ Sends a copy of the request to the other worker processes.
+
+    Returns:
+      A list of HTTPResponse objects.
+    """
+    if not self.relay or not worker_ports:
+      raise gen.Return([])
+
+    headers = {}
+    if 'appdata' in self.request.headers:
+      headers['appdata'] = self.request.headers['appdata']
+
+    body = self.request.body if self.request.method == 'POST' else None
+    client = AsyncHTTPClient()
+    responses = yield [
+      client.fetch('http://{}:{}{}'.format(LOOPBACK, port, self.request.uri),
+                   method=self.request.method, headers=headers, body=body)
+      for port in worker_ports]
+    raise gen.Return(responses)
+
+
+class ClearHandler(WorkerRelayHandler):
   """ Defines what to do when the webserver receives a /clear HTTP request. """
   def set_default_headers(self):
     """ Instructs clients to close the connection after each response. """
     self.set_header('Connection', 'close')
 
-  @tornado.web.asynchronous
+  @gen.coroutine
   def post(self):
     """ Handles POST requests for clearing datastore server stats. """
     global STATS
     STATS = {}
+    yield self.relay_to_workers()
     self.write({"message": "Statistics for this server cleared."})
-    self.finish()
 
 
-class ReadOnlyHandler(tornado.web.RequestHandler):
+class ReadOnlyHandler(WorkerRelayHandler):
   """ Handles requests to check or set read-only mode. """
   def set_default_headers(self):
     """ Instructs clients to close the connection after each response. """
     self.set_header('Connection', 'close')
 
-  @tornado.web.asynchronous
+  @gen.coroutine
   def post(self):
     """ Handle requests to turn read-only mode on or off. """
     global READ_ONLY
@@ -103,12 +160,12 @@ class ReadOnlyHandler(tornado.web.RequestHandler):
       READ_ONLY = False
       message = 'Write operations now enabled.'
 
+    yield self.relay_to_workers()
     logger.info(message)
     self.write({'message': message})
-    self.finish()
 
 
-class ReserveKeysHandler(tornado.web.RequestHandler):
+class ReserveKeysHandler(WorkerRelayHandler):
   """ Handles v4 AllocateIds requests from other servers. """
   @gen.coroutine
   def post(self):
@@ -116,18 +173,83 @@ class ReserveKeysHandler(tornado.web.RequestHandler):
     project_id = self.request.headers['appdata']
     request = datastore_v4_pb.AllocateIdsRequest(self.request.body)
     ids = [key.path_element_list()[-1].id() for key in request.reserve_list()]
-    yield datastore_access.reserve_ids(project_id, ids)
+    yield [datastore_access.reserve_ids(project_id, ids),
+           self.relay_to_workers()]
+
+
+class ExplainHandler(tornado.web.RequestHandler):
+  """ Describes how queries would be executed. """
+  @gen.coroutine
+  def post(self):
+    """ Returns the query plan for an encoded datastore_pb.Query. """
+    try:
+      query = datastore_pb.Query(self.request.body)
+    except ProtocolBufferDecodeError as error:
+      self.set_status(dbconstants.HTTP_BAD_REQUEST)
+      self.write({'message': 'Invalid query: {}'.format(error)})
+      return
+
+    plan = yield datastore_access.explain_query(query)
+    self.write(json.dumps(plan))
+
+
+class IndexBuildHandler(tornado.web.RequestHandler):
+  """ Reports the progress of composite index backfill jobs. """
+  @gen.coroutine
+  def get(self):
+    """ Responds with the completion status of each index being built. """
+    progress = yield datastore_access.building_indexes.progress()
+    self.write(json.dumps(progress))
+
+
+class StatsHandler(WorkerRelayHandler):
+  """ Provides latency statistics for recent requests. """
+  @gen.coroutine
+  def get(self):
+    """ Responds with cumulative counters and metrics for recent requests.
+
+    Each worker process keeps its own statistics, and percentiles cannot be
+    combined across processes, so the response lists each worker's stats
+    separately.
+    """
+    cursor = self.get_argument('cursor', None)
+    last_milliseconds = self.get_argument('last_milliseconds', None)
+    try:
+      if cursor:
+        recent_stats = service_stats.scroll_recent(int(cursor))
+      elif last_milliseconds:
+        recent_stats = service_stats.get_recent(int(last_milliseconds))
+      else:
+        recent_stats = service_stats.get_recent()
+    except ValueError:
+      self.set_status(dbconstants.HTTP_BAD_REQUEST,
+                      'cursor and last_milliseconds arguments should be '
+                      'integers')
+      return
 
+    stats = {
+      'worker_id': worker_id,
+      'current_requests': service_stats.current_requests,
+      'cumulative_counters': service_stats.get_cumulative_counters(),
+      'recent_stats': recent_stats
+    }
 
-class MainHandler(tornado.web.RequestHandler):
+    # The worker that received the original request reports for the server.
+    if not self.relay:
+      self.write(json.dumps(stats))
+      return
+
+    responses = yield self.relay_to_workers()
+    workers = [stats] + [json.loads(response.body) for response in responses]
+    workers.sort(key=lambda worker_stats: worker_stats['worker_id'])
+    self.write(json.dumps({'workers': workers}))
+
+
+class MainHandler(WorkerRelayHandler):
   """
   Defines what to do when the webserver receives different types of 
   HTTP requests.
   """
-  def set_default_headers(self):
-    """ Instructs clients to close the connection after each response. """
-    self.set_header('Connection', 'close')
-
   def unknown_request(self, app_id, http_request_data, pb_type):
     """ Function which handles unknown protocol buffers.
 
@@ -168,22 +290,44 @@ class MainHandler(tornado.web.RequestHandler):
     app_id = clean_app_id(app_id)
 
     if pb_type == "Request":
-      yield self.remote_request(app_id, http_request_data,
-                                service_id=request.headers.get('Module'),
-                                version_id=request.headers.get('Version'))
+      # The trace follows the request while it is being handled, but the
+      # coroutine has to be yielded outside of the trace's context.
+      trace = RequestTrace()
+      with trace.activate():
+        future = self.remote_request(
+          app_id, http_request_data, trace,
+          service_id=request.headers.get('Module'),
+          version_id=request.headers.get('Version'))
+
+      yield future
     else:
       self.unknown_request(app_id, http_request_data, pb_type)
 
-  @tornado.web.asynchronous
+  @gen.coroutine
   def get(self):
     """ Handles get request for the web server. Returns that it is currently
         up in json.
     """
-    self.write(json.dumps(STATS))
-    self.finish()
+    stats = dict(STATS)
+    if datastore_access.entity_cache is not None:
+      stats['EntityCache'] = datastore_access.entity_cache.stats()
+
+    stats['PreparedStatements'] = \
+      datastore_access.datastore_batch.statement_cache.stats()
+    stats['EntityLocks'] = lock_stats.stats()
+
+    responses = yield self.relay_to_workers()
+    if responses:
+      # Normalize the local stats to match the other workers' encoding.
+      stats = json.loads(json.dumps(stats))
+      for response in responses:
+        merge_stats(stats, json.loads(response.body))
+
+    self.write(json.dumps(stats))
 
   @gen.coroutine
-  def remote_request(self, app_id, http_request_data, service_id, version_id):
+  def remote_request(self, app_id, http_request_data, trace, service_id,
+                     version_id):
     """ Receives a remote request to which it should give the correct 
         response. The http_request_data holds an encoded protocol buffer
         of a certain type. Each type has a particular response type. 
@@ -191,89 +335,112 @@ class MainHandler(tornado.web.RequestHandler):
     Args:
       app_id: The application ID that is sending this request.
       http_request_data: Encoded protocol buffer.
+      trace: A RequestTrace object.
       service_id: A string specifying the client's service ID.
       version_id: A string specifying the client's version ID.
     """
-    apirequest = remote_api_pb.Request()
-    apirequest.ParseFromString(http_request_data)
-    apiresponse = remote_api_pb.Response()
-    response = None
-    if not apirequest.has_method():
-      apirequest.set_method("NOT_FOUND")
-    if not apirequest.has_request():
-      apirequest.set_method("NOT_FOUND")
-      apirequest.clear_request()
-    method = apirequest.method()
-    http_request_data = apirequest.request()
-    start = time.time()
-
+    stats_info = service_stats.start_request(app=app_id)
+    method = 'NOT_FOUND'
+    request_id = None
     request_log = method
-    if apirequest.has_request_id():
-      request_log += ': {}'.format(apirequest.request_id())
-    logger.debug(request_log)
-
-    if method == "Put":
-      response, errcode, errdetail = yield self.put_request(
-        app_id, http_request_data)
-    elif method == "Get":
-      response, errcode, errdetail = yield self.get_request(
-        app_id, http_request_data)
-    elif method == "Delete":
-      response, errcode, errdetail = yield self.delete_request(
-        app_id, http_request_data)
-    elif method == "RunQuery":
-      response, errcode, errdetail = yield self.run_query(http_request_data)
-    elif method == "BeginTransaction":
-      response, errcode, errdetail = yield self.begin_transaction_request(
-        app_id, http_request_data)
-    elif method == "Commit":
-      response, errcode, errdetail = yield self.commit_transaction_request(
-        app_id, http_request_data)
-    elif method == "Rollback":
-      response, errcode, errdetail = self.rollback_transaction_request(
-        app_id, http_request_data)
-    elif method == "AllocateIds":
-      response, errcode, errdetail = yield self.allocate_ids_request(
-        app_id, http_request_data)
-    elif method == "CreateIndex":
-      response, errcode, errdetail = yield self.create_index_request(
-        app_id, http_request_data)
-    elif method == "GetIndices":
-      response, errcode, errdetail = yield self.get_indices_request(app_id)
-    elif method == "UpdateIndex":
-      response, errcode, errdetail = self.update_index_request(
-        app_id, http_request_data)
-    elif method == "DeleteIndex":
-      response, errcode, errdetail = yield self.delete_index_request(
-        app_id, http_request_data)
-    elif method == 'AddActions':
-      response, errcode, errdetail = yield self.add_actions_request(
-        app_id, http_request_data, service_id, version_id)
-    elif method == 'datastore_v4.AllocateIds':
-      response, errcode, errdetail = yield self.v4_allocate_ids_request(
-        app_id, http_request_data)
-    else:
-      errcode = datastore_pb.Error.BAD_REQUEST
-      errdetail = "Unknown datastore message"
-
-    time_taken = time.time() - start
-    if method in STATS:
-      if errcode in STATS[method]:
-        prev_req, pre_time = STATS[method][errcode]
-        STATS[method][errcode] = prev_req + 1, pre_time + time_taken
+    # Requests that raise an exception are still recorded as failures.
+    status = 'UNKNOWN_ERROR'
+    try:
+      apirequest = remote_api_pb.Request()
+      with trace.timer(Category.DECODE):
+        apirequest.ParseFromString(http_request_data)
+      apiresponse = remote_api_pb.Response()
+      response = None
+      if not apirequest.has_method():
+        apirequest.set_method("NOT_FOUND")
+      if not apirequest.has_request():
+        apirequest.set_method("NOT_FOUND")
+        apirequest.clear_request()
+      method = apirequest.method()
+      http_request_data = apirequest.request()
+      start = time.time()
+
+      request_log = method
+      if apirequest.has_request_id():
+        request_id = apirequest.request_id()
+        request_log += ': {}'.format(request_id)
+      logger.debug(request_log)
+
+      if method == "Put":
+        response, errcode, errdetail = yield self.put_request(
+          app_id, http_request_data)
+      elif method == "Get":
+        response, errcode, errdetail = yield self.get_request(
+          app_id, http_request_data)
+      elif method == "Delete":
+        response, errcode, errdetail = yield self.delete_request(
+          app_id, http_request_data)
+      elif method == "RunQuery":
+        response, errcode, errdetail = yield self.run_query(http_request_data)
+      elif method == "BeginTransaction":
+        response, errcode, errdetail = yield self.begin_transaction_request(
+          app_id, http_request_data)
+      elif method == "Commit":
+        response, errcode, errdetail = yield self.commit_transaction_request(
+          app_id, http_request_data)
+      elif method == "Rollback":
+        response, errcode, errdetail = self.rollback_transaction_request(
+          app_id, http_request_data)
+      elif method == "AllocateIds":
+        response, errcode, errdetail = yield self.allocate_ids_request(
+          app_id, http_request_data)
+      elif method == "CreateIndex":
+        response, errcode, errdetail = yield self.create_index_request(
+          app_id, http_request_data)
+      elif method == "GetIndices":
+        response, errcode, errdetail = yield self.get_indices_request(app_id)
+      elif method == "UpdateIndex":
+        response, errcode, errdetail = self.update_index_request(
+          app_id, http_request_data)
+      elif method == "DeleteIndex":
+        response, errcode, errdetail = yield self.delete_index_request(
+          app_id, http_request_data)
+      elif method == 'AddActions':
+        response, errcode, errdetail = yield self.add_actions_request(
+          app_id, http_request_data, service_id, version_id)
+      elif method == 'datastore_v4.AllocateIds':
+        response, errcode, errdetail = yield self.v4_allocate_ids_request(
+          app_id, http_request_data)
+      else:
+        errcode = datastore_pb.Error.BAD_REQUEST
+        errdetail = "Unknown datastore message"
+
+      time_taken = time.time() - start
+      if method in STATS:
+        if errcode in STATS[method]:
+          prev_req, pre_time = STATS[method][errcode]
+          STATS[method][errcode] = prev_req + 1, pre_time + time_taken
+        else:
+          STATS[method][errcode] = (1, time_taken)
       else:
+        STATS[method] = {}
         STATS[method][errcode] = (1, time_taken)
-    else:
-      STATS[method] = {}
-      STATS[method][errcode] = (1, time_taken)
 
-    apiresponse.set_response(response)
-    if errcode != 0:
-      apperror_pb = apiresponse.mutable_application_error()
-      apperror_pb.set_code(errcode)
-      apperror_pb.set_detail(errdetail)
+      apiresponse.set_response(response)
+      if errcode != 0:
+        apperror_pb = apiresponse.mutable_application_error()
+        apperror_pb.set_code(errcode)
+        apperror_pb.set_detail(errdetail)
+
+      with trace.timer(Category.ENCODE):
+        encoded_response = apiresponse.Encode()
 
-    self.write(apiresponse.Encode())
+      self.write(encoded_response)
+
+      if errcode == 0:
+        status = 'OK'
+      else:
+        status = datastore_pb.Error.ErrorCode_Name(errcode) or str(errcode)
+    finally:
+      stats_info.finalize(method=method, status=status, request_id=request_id,
+                          **trace.fields())
+      logger.debug('{} finished in {}ms: {}'.format(
+        request_log, stats_info.latency, trace))
 
   @gen.coroutine
   def begin_transaction_request(self, app_id, http_request_data):
@@ -385,12 +552,16 @@ class MainHandler(tornado.web.RequestHandler):
       Returns an encoded query response.
     """
     global datastore_access
-    query = datastore_pb.Query(http_request_data)
+    with timed(Category.DECODE):
+      query = datastore_pb.Query(http_request_data)
+
     clone_qr_pb = UnprocessedQueryResult()
     try:
       yield datastore_access._dynamic_run_query(query, clone_qr_pb)
     except dbconstants.BadRequest as error:
       raise gen.Return( ('', datastore_pb.Error.BAD_REQUEST, str(error)))
+    except dbconstants.NeedIndex as error:
+      raise gen.Return(('', datastore_pb.Error.NEED_INDEX, str(error)))
     except zktransaction.ZKBadRequest as error:
       logger.exception(
         'Illegal arguments in transaction during {}'.format(query))
@@ -405,7 +576,11 @@ class MainHandler(tornado.web.RequestHandler):
     except dbconstants.AppScaleDBConnectionError as error:
       logger.exception('DB connection error during query')
       raise gen.Return(('', datastore_pb.Error.INTERNAL_ERROR, str(error)))
-    raise gen.Return((clone_qr_pb.Encode(), 0, ''))
+
+    with timed(Category.ENCODE):
+      encoded_response = clone_qr_pb.Encode()
+
+    raise gen.Return((encoded_response, 0, ''))
 
   @gen.coroutine
   def create_index_request(self, app_id, http_request_data):
@@ -603,6 +778,13 @@ class MainHandler(tornado.web.RequestHandler):
                             body=http_request_data)
       futures.append(future)
 
+    # Other workers on this node have their own allocators as well.
+    for port in worker_ports:
+      url = 'http://{}:{}/reserve-keys'.format(LOOPBACK, port)
+      future = client.fetch(url, method='POST', headers=headers,
+                            body=http_request_data)
+      futures.append(future)
+
     for future in futures:
       yield future
 
@@ -620,7 +802,9 @@ class MainHandler(tornado.web.RequestHandler):
     """
     global datastore_access
 
-    putreq_pb = datastore_pb.PutRequest(http_request_data)
+    with timed(Category.DECODE):
+      putreq_pb = datastore_pb.PutRequest(http_request_data)
+
     putresp_pb = datastore_pb.PutResponse()
 
     if READ_ONLY:
@@ -656,7 +840,9 @@ class MainHandler(tornado.web.RequestHandler):
       An encoded get response.
     """
     global datastore_access
-    getreq_pb = datastore_pb.GetRequest(http_request_data)
+    with timed(Category.DECODE):
+      getreq_pb = datastore_pb.GetRequest(http_request_data)
+
     getresp_pb = datastore_pb.GetResponse()
     try:
       yield datastore_access.dynamic_get(app_id, getreq_pb, getresp_pb)
@@ -676,7 +862,10 @@ class MainHandler(tornado.web.RequestHandler):
         ('', datastore_pb.Error.INTERNAL_ERROR,
          'Datastore connection error on get.'))
 
-    raise gen.Return((getresp_pb.Encode(), 0, ''))
+    with timed(Category.ENCODE):
+      encoded_response = getresp_pb.Encode()
+
+    raise gen.Return((encoded_response, 0, ''))
 
   @gen.coroutine
   def delete_request(self, app_id, http_request_data):
@@ -690,7 +879,9 @@ class MainHandler(tornado.web.RequestHandler):
     """
     global datastore_access
 
-    delreq_pb = datastore_pb.DeleteRequest( http_request_data )
+    with timed(Category.DECODE):
+      delreq_pb = datastore_pb.DeleteRequest(http_request_data)
+
     delresp_pb = api_base_pb.VoidProto()
 
     if READ_ONLY:
@@ -829,15 +1020,29 @@ pb_application = tornado.web.Application([
   ('/clear', ClearHandler),
   ('/read-only', ReadOnlyHandler),
   ('/reserve-keys', ReserveKeysHandler),
+  ('/explain', ExplainHandler),
+  ('/index-builds', IndexBuildHandler),
+  ('/service-stats', StatsHandler),
   (r'/*', MainHandler),
 ])
 
+# Handles requests that other worker processes on this node relay.
+worker_application = tornado.web.Application([
+  ('/clear', ClearHandler, {'relay': False}),
+  ('/read-only', ReadOnlyHandler, {'relay': False}),
+  ('/reserve-keys', ReserveKeysHandler, {'relay': False}),
+  ('/service-stats', StatsHandler, {'relay': False}),
+  (r'/*', MainHandler, {'relay': False}),
+])
+
 
 def main():
   """ Starts a web service for handing datastore requests. """
 
   global datastore_access
   global server_node
+  global worker_id
+  global worker_ports
   global zookeeper
   zookeeper_locations = appscale_info.get_zk_locations_string()
 
@@ -850,6 +1055,19 @@ def main():
                       help='Datastore server port')
   parser.add_argument('-v', '--verbose', action='store_true',
                       help='Output debug-level logging')
+  parser.add_argument('--entity-cache-size', type=int, default=0,
+                      help='The number of megabytes each project can use to '
+                           'cache entities for non-transactional reads. The '
+                           'cache is disabled by default')
+  parser.add_argument('--entity-cache-ttl', type=float,
+                      default=DEFAULT_ENTITY_CACHE_TTL,
+                      help='The number of seconds an entity can stay cached')
+  parser.add_argument('--workers', type=int, default=1,
+                      help='The number of processes that share the port. '
+                           'Use 0 to start one for each CPU core')
+  parser.add_argument('--txid-block-size', type=int, default=1,
+                      help='The number of transaction IDs to reserve with '
+                           'each ZooKeeper request')
   args = parser.parse_args()
 
   if args.verbose:
@@ -862,26 +1080,52 @@ def main():
   server_node = '{}/{}:{}'.format(DATASTORE_SERVERS_NODE, options.private_ip,
                                   options.port)
 
+  # Each worker needs its own database session and ZooKeeper client, so the
+  # processes have to be started before any connections are made.
+  private_socket = None
+  num_workers = args.workers or tornado.process.cpu_count()
+  if num_workers > 1:
+    worker_id, private_socket, worker_ports = fork_workers(num_workers)
+
   datastore_batch = DatastoreFactory.getDatastore(
     args.type, log_level=logger.getEffectiveLevel())
   zookeeper = zktransaction.ZKTransaction(
     host=zookeeper_locations, db_access=datastore_batch,
     log_level=logger.getEffectiveLevel())
 
-  zookeeper.handle.add_listener(zk_state_listener)
   zookeeper.handle.ensure_path(DATASTORE_SERVERS_NODE)
-  # Since the client was started before adding the listener, make sure the
-  # server node gets created.
-  zk_state_listener(zookeeper.handle.state)
+
+  # The workers share a port, so only one of them registers the server.
+  if worker_id == 0:
+    zookeeper.handle.add_listener(zk_state_listener)
+    # Since the client was started before adding the listener, make sure the
+    # server node gets created.
+    zk_state_listener(zookeeper.handle.state)
+
   zookeeper.handle.ChildrenWatch(DATASTORE_SERVERS_NODE, update_servers_watch)
 
-  transaction_manager = TransactionManager(zookeeper.handle)
+  entity_cache = None
+  if args.entity_cache_size > 0:
+    entity_cache = EntityCache(args.entity_cache_size * 1024 * 1024,
+                               args.entity_cache_ttl)
+
+  transaction_manager = TransactionManager(zookeeper.handle,
+                                           args.txid_block_size)
   datastore_access = DatastoreDistributed(
     datastore_batch, transaction_manager, zookeeper=zookeeper,
     log_level=logger.getEffectiveLevel(),
-    taskqueue_locations=taskqueue_locations)
-
-  server = tornado.httpserver.HTTPServer(pb_application)
-  server.listen(args.port)
+    taskqueue_locations=taskqueue_locations,
+    entity_cache=entity_cache,
+    building_indexes=BuildingIndexes(zookeeper.handle))
+
+  server = tornado.httpserver.HTTPServer(
+    pb_application, idle_connection_timeout=IDLE_CONNECTION_TIMEOUT)
+  if num_workers > 1:
+    server.add_socket(bind_shared_socket(args.port))
+    worker_server = tornado.httpserver.HTTPServer(worker_application)
+    worker_server.add_socket(private_socket)
+    logger.info('Worker {} started'.format(worker_id))
+  else:
+    server.listen(args.port)
 
   IOLoop.current().start()
@@ -0,0 +1,46 @@
+""" A daemon that builds composite indexes for existing entities. """
+import argparse
+import logging
+
+from kazoo.client import KazooClient
+from kazoo.retry import KazooRetry
+
+from appscale.common import appscale_info
+from appscale.common.constants import LOG_FORMAT
+from appscale.common.constants import ZK_PERSISTENT_RECONNECTS
+from ..cassandra_env.cassandra_interface import DatastoreProxy
+from ..cassandra_env.token_ranges import DEFAULT_WORKERS
+from ..index_backfill import IndexBackfill
+
+logger = logging.getLogger('appscale-index-backfill')
+
+
+def main():
+  """ Starts the index backfill worker. """
+  logging.basicConfig(format=LOG_FORMAT, level=logging.INFO)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-v', '--verbose', action='store_true',
+                      help='Output debug-level logging')
+  parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                      help='The number of key ranges to scan at once')
+  parser.add_argument('--rate-limit', type=float, default=None,
+                      help='The maximum number of kind table rows to process '
+                           'per second. There is no limit by default')
+  args = parser.parse_args()
+
+  if args.verbose:
+    logging.getLogger('appscale').setLevel(logging.DEBUG)
+
+  zk_hosts = appscale_info.get_zk_node_ips()
+  zk_client = KazooClient(hosts=','.join(zk_hosts),
+                          connection_retry=ZK_PERSISTENT_RECONNECTS,
+                          command_retry=KazooRetry(max_tries=-1))
+  zk_client.start()
+
+  db_access = DatastoreProxy()
+
+  backfill = IndexBackfill(zk_client, db_access, workers=args.workers,
+                           rate_limit=args.rate_limit)
+  logger.info('Starting index backfill worker')
+  backfill.run()
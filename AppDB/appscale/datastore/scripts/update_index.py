@@ -6,6 +6,7 @@ from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
 from appscale.datastore.utils import tornado_synchronous
 from .. import appscale_datastore_batch
 from ..datastore_distributed import DatastoreDistributed
+from ..index_backfill import BuildingIndexes
 from ..zkappscale import zktransaction as zk
 from ..zkappscale.transaction_manager import TransactionManager
 
@@ -49,7 +50,8 @@ def main():
   zookeeper = zk.ZKTransaction(host=zookeeper_locations)
   transaction_manager = TransactionManager(zookeeper.handle)
   datastore_access = DatastoreDistributed(
-    datastore_batch, transaction_manager, zookeeper=zookeeper)
+    datastore_batch, transaction_manager, zookeeper=zookeeper,
+    building_indexes=BuildingIndexes(zookeeper.handle))
 
   pb_indices = datastore_access.datastore_batch.get_indices_sync(args.app_id)
   indices = [datastore_pb.CompositeIndex(index) for index in pb_indices]
@@ -64,7 +66,8 @@ def main():
   if args.all:
     for index in indices:
       update_composite_index_sync(args.app_id, index)
-    print('Successfully updated all composite indexes')
+    zookeeper.close()
+    print('Scheduled builds for all composite indexes')
     return
 
   selection = -1
@@ -85,4 +88,6 @@ def main():
   update_composite_index_sync(args.app_id, selected_index)
 
   zookeeper.close()
-  print('Index successfully updated')
+  print('Scheduled index build. The appscale-index-backfill service builds '
+        'the index, and the datastore server reports its progress at '
+        '/index-builds')
@@ -0,0 +1,94 @@
+""" Collects latency statistics for datastore requests. """
+from appscale.common.service_stats import (
+  categorizers, metrics, matchers, stats_manager
+)
+
+from .request_trace import Category
+
+# The upper bounds (in milliseconds) of the latency histogram buckets.
+LATENCY_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class FailedRequestMatcher(matchers.RequestMatcher):
+  def matches(self, request_info):
+    return request_info.status != 'OK'
+
+
+FAILED_REQUEST = FailedRequestMatcher()
+
+METHOD_CATEGORIZER = categorizers.ExactValueCategorizer(
+  'by_method', field='method')
+APP_CATEGORIZER = categorizers.ExactValueCategorizer('by_app', field='app')
+
+TRACE_FIELDS = ['{}_time'.format(category) for category in Category.ALL]
+
+REQUEST_STATS_FIELDS = (
+  ['app', 'method', 'status', 'request_id', 'round_trips'] + TRACE_FIELDS)
+
+CUMULATIVE_COUNTERS = {
+  'all': matchers.ANY,
+  'failed': FAILED_REQUEST,
+  METHOD_CATEGORIZER: {
+    'all': matchers.ANY,
+    'failed': FAILED_REQUEST
+  },
+  APP_CATEGORIZER: {
+    'all': matchers.ANY,
+    'failed': FAILED_REQUEST
+  }
+}
+
+REQUEST_METRICS = {
+  'all': metrics.CountOf(matchers.ANY),
+  'failed': metrics.CountOf(FAILED_REQUEST),
+  'avg_latency': metrics.Avg('latency'),
+  'p50_latency': metrics.Percentile('latency', 50),
+  'p95_latency': metrics.Percentile('latency', 95),
+  'p99_latency': metrics.Percentile('latency', 99),
+  'latency_histogram': metrics.Histogram('latency', LATENCY_BUCKETS),
+  'avg_round_trips': metrics.Avg('round_trips')
+}
+REQUEST_METRICS.update({'avg_{}'.format(field): metrics.Avg(field)
+                        for field in TRACE_FIELDS})
+
+APP_METRICS = dict(REQUEST_METRICS)
+APP_METRICS[METHOD_CATEGORIZER] = REQUEST_METRICS
+
+METRICS_CONFIG = dict(REQUEST_METRICS)
+METRICS_CONFIG[METHOD_CATEGORIZER] = REQUEST_METRICS
+METRICS_CONFIG[APP_CATEGORIZER] = APP_METRICS
+# This metrics config corresponds to the following output:
+# {
+#   "from": 1515699718987,
+#   "to": 1515735126789,
+#   "all": 1225,
+#   "failed": 3,
+#   "avg_latency": 25,
+#   "p50_latency": 12,
+#   "p95_latency": 80,
+#   "p99_latency": 210,
+#   "latency_histogram": {"5": 320, "10": 290, ..., "inf": 0},
+#   "avg_round_trips": 3,
+#   "avg_lock_time": 2,
+#   "avg_read_time": 15,
+#   "avg_write_time": 6,
+#   "avg_decode_time": 0,
+#   "avg_encode_time": 0,
+#   "by_method": {
+#     "Get": {"all": 800, "failed": 0, "avg_latency": 9, ...},
+#     ...
+#   },
+#   "by_app": {
+#     "guestbook": {
+#       "all": 1225, ...,
+#       "by_method": {"Get": {...}, ...}
+#     }
+#   }
+# }
+
+# Instantiate singleton ServiceStats
+service_stats = stats_manager.ServiceStats(
+  'datastore', request_fields=REQUEST_STATS_FIELDS,
+  cumulative_counters=CUMULATIVE_COUNTERS,
+  default_metrics_for_recent=METRICS_CONFIG
+)
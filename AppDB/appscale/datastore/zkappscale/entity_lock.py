@@ -1,12 +1,16 @@
 import base64
+import bisect
+import time
 import uuid
 
 from kazoo.exceptions import (
   CancelledError,
+  ConnectionLoss,
   KazooException,
   LockTimeout,
   NoNodeError,
-  NotEmptyError
+  NotEmptyError,
+  OperationTimeoutError
 )
 from kazoo.retry import (
   ForceRetryError,
@@ -14,14 +18,24 @@ from kazoo.retry import (
   RetryFailedError
 )
 from tornado import gen, ioloop
+from tornado.locks import Event as TornadoEvent
 from tornado.locks import Lock as TornadoLock
 
+from .tornado_kazoo import TornadoKazoo
+from ..request_trace import Category, timed
+
 # The ZooKeeper node that contains lock entries for an entity group.
 LOCK_PATH_TEMPLATE = u'/appscale/apps/{project}/locks/{namespace}/{group}'
 
 # The number of seconds to wait for a lock before raising a timeout error.
 LOCK_TIMEOUT = 10
 
+# The number of seconds to wait before retrying a failed lock attempt.
+RETRY_DELAY = .1
+
+# ZooKeeper errors that indicate a lock attempt should be retried.
+RETRYABLE_ERRORS = (ForceRetryError, ConnectionLoss, OperationTimeoutError)
+
 
 def zk_group_path(key):
   """ Retrieve the ZooKeeper lock path for a given entity key.
@@ -53,6 +67,123 @@ def zk_group_path(key):
                                    group=group)
 
 
+class LockStats(object):
+  """ Keeps track of how long requests wait for entity group locks. """
+
+  # The upper bounds (in milliseconds) of the wait time histogram buckets.
+  WAIT_BUCKETS = [1, 10, 100, 1000, 10000]
+
+  def __init__(self):
+    """ Creates a new LockStats object. """
+    self.waiting = 0
+    self.acquired = 0
+    self.failed = 0
+    self.timeouts = 0
+    self.wait_time = 0.0
+    self.wait_histogram = [0] * (len(self.WAIT_BUCKETS) + 1)
+
+  def record(self, wait, acquired, timed_out=False):
+    """ Records the outcome of an acquire attempt.
+
+    Args:
+      wait: The number of seconds spent waiting for the lock.
+      acquired: A boolean indicating that the lock was acquired.
+      timed_out: A boolean indicating that the attempt timed out.
+    """
+    wait_ms = wait * 1000
+    self.wait_time += wait_ms
+    self.wait_histogram[bisect.bisect_left(self.WAIT_BUCKETS, wait_ms)] += 1
+    if acquired:
+      self.acquired += 1
+    else:
+      self.failed += 1
+
+    if timed_out:
+      self.timeouts += 1
+
+  def stats(self):
+    """ Reports lock metrics.
+
+    Returns:
+      A dictionary containing lock metrics.
+    """
+    bucket_names = [str(bucket) for bucket in self.WAIT_BUCKETS] + ['inf']
+    return {
+      'waiting': self.waiting,
+      'acquired': self.acquired,
+      'failed': self.failed,
+      'timeouts': self.timeouts,
+      'wait_time': int(self.wait_time),
+      'wait_histogram': dict(zip(bucket_names, self.wait_histogram))
+    }
+
+
+class GroupLocks(object):
+  """ Serializes lock attempts for the same entity groups within a process.
+
+  Attempts for disjoint groups can proceed concurrently. Only one local
+  contender for a group waits on ZooKeeper at a time, and the others queue on
+  the IOLoop instead of occupying a thread.
+  """
+  def __init__(self):
+    """ Creates a new GroupLocks object. """
+    # Maps lock paths to [TornadoLock, number of users] lists.
+    self._locks = {}
+
+  @gen.coroutine
+  def acquire(self, paths, deadline):
+    """ Acquires the local locks for a list of groups.
+
+    The locks are taken in a consistent order so that concurrent cross-group
+    attempts cannot deadlock each other.
+
+    Args:
+      paths: A list of ZooKeeper lock paths.
+      deadline: A number specifying the IOLoop time to give up at.
+    Raises:
+      LockTimeout if the locks could not be acquired before the deadline.
+    """
+    acquired = []
+    try:
+      for path in sorted(set(paths)):
+        entry = self._locks.setdefault(path, [TornadoLock(), 0])
+        entry[1] += 1
+        try:
+          yield entry[0].acquire(deadline)
+        except gen.TimeoutError:
+          self._discard(path)
+          raise LockTimeout('Timed out waiting for {}'.format(path))
+
+        acquired.append(path)
+    except Exception:
+      self.release(acquired)
+      raise
+
+  def release(self, paths):
+    """ Releases the local locks for a list of groups.
+
+    Args:
+      paths: A list of ZooKeeper lock paths.
+    """
+    for path in set(paths):
+      self._locks[path][0].release()
+      self._discard(path)
+
+  def _discard(self, path):
+    """ Removes a user from a group's lock entry.
+
+    Args:
+      path: A string specifying a ZooKeeper lock path.
+    """
+    entry = self._locks[path]
+    entry[1] -= 1
+    if entry[1] == 0:
+      del self._locks[path]
+
+
+lock_stats = LockStats()
+
+
 class EntityLock(object):
   """ A ZooKeeper-based entity lock that allows test-and-set operations.
 
@@ -62,9 +193,9 @@ class EntityLock(object):
   """
   _NODE_NAME = '__lock__'
 
-  # Tornado lock which allows tornado to switch to different coroutine
-  # if current one is waiting for entity group lock
-  _tornado_lock = TornadoLock()
+  # Local locks which let coroutines wait for busy groups without blocking
+  # attempts for other groups.
+  _group_locks = GroupLocks()
 
   def __init__(self, client, keys, txid=None):
     """ Create an entity lock.
@@ -75,13 +206,12 @@ class EntityLock(object):
       txid: An integer specifying the transaction ID.
     """
     self.client = client
+    self.tornado_zk = TornadoKazoo(client)
     self.paths = [zk_group_path(key) for key in keys]
 
     # The txid is written to the contender nodes for deadlock resolution.
     self.data = str(txid or '')
 
-    self.wake_event = client.handler.event_object()
-
     # Give the contender nodes a uniquely identifiable prefix in case its
     # existence is in question.
     self.prefix = uuid.uuid4().hex + self._NODE_NAME
@@ -90,34 +220,83 @@ class EntityLock(object):
 
     self.create_tried = False
     self.is_acquired = False
+    self.holds_group_locks = False
     self.cancelled = False
     self._retry = KazooRetry(max_tries=None,
                              sleep_func=client.handler.sleep_func)
     self._lock = client.handler.lock_object()
 
-  def _ensure_path(self):
-    """ Make sure the ZooKeeper lock paths have been created. """
-    for path in self.paths:
-      self.client.ensure_path(path)
-
   def cancel(self):
     """ Cancel a pending lock acquire. """
     self.cancelled = True
-    self.wake_event.set()
 
   @gen.coroutine
   def acquire(self):
-    now = ioloop.IOLoop.current().time()
-    yield EntityLock._tornado_lock.acquire(now + LOCK_TIMEOUT)
+    """ Acquire the lock without blocking the IOLoop.
+
+    Returns:
+      A boolean indicating whether or not the lock was acquired.
+    Raises:
+      LockTimeout if the lock could not be acquired in time.
+    """
+    start = time.time()
+    timed_out = False
+    lock_stats.waiting += 1
     try:
-      locked = self.unsafe_acquire()
-      raise gen.Return(locked)
+      with timed(Category.LOCK):
+        deadline = ioloop.IOLoop.current().time() + LOCK_TIMEOUT
+        yield EntityLock._group_locks.acquire(self.paths, deadline)
+        self.holds_group_locks = True
+        try:
+          locked = yield self._acquire_async(deadline)
+          raise gen.Return(locked)
+        finally:
+          if not self.is_acquired:
+            self._release_group_locks()
+    except LockTimeout:
+      timed_out = True
+      raise
     finally:
-      if not self.is_acquired:
-        EntityLock._tornado_lock.release()
+      lock_stats.waiting -= 1
+      lock_stats.record(time.time() - start, self.is_acquired, timed_out)
+
+  @gen.coroutine
+  def _acquire_async(self, deadline):
+    """ Acquire the ZooKeeper lock using asynchronous operations.
+
+    Args:
+      deadline: A number specifying the IOLoop time to give up at.
+    Returns:
+      A boolean indicating whether or not the lock was acquired.
+    """
+    io_loop = ioloop.IOLoop.current()
+    while True:
+      try:
+        gotten = yield self._inner_acquire_async(deadline)
+        break
+      except RETRYABLE_ERRORS:
+        if io_loop.time() + RETRY_DELAY >= deadline:
+          yield self._best_effort_cleanup_async()
+          raise gen.Return(False)
+
+        yield gen.sleep(RETRY_DELAY)
+      except KazooException:
+        yield self._best_effort_cleanup_async()
+        self.cancelled = False
+        raise
+
+    if gotten:
+      self.is_acquired = gotten
+    else:
+      yield self._delete_nodes_async(self.nodes)
+
+    raise gen.Return(gotten)
 
   def unsafe_acquire(self):
-    """ Acquire the lock. By default blocks and waits forever.
+    """ Acquire the lock from a thread that is not running an IOLoop.
+
+    This blocks the calling thread until the lock is acquired or the attempt
+    times out.
 
     Returns:
       A boolean indicating whether or not the lock was acquired.
@@ -141,37 +320,57 @@ class EntityLock(object):
       except RetryFailedError:
         return False
 
-    already_acquired = self.is_acquired
     try:
-      gotten = False
-      try:
-        gotten = retry(self._inner_acquire)
-      except RetryFailedError:
-        if not already_acquired:
-          self._best_effort_cleanup()
-      except KazooException:
-        if not already_acquired:
-          self._best_effort_cleanup()
-          self.cancelled = False
-        raise
-      if gotten:
-        self.is_acquired = gotten
-      if not gotten and not already_acquired:
-        self._delete_nodes(self.nodes)
-      return gotten
+      if self.is_acquired:
+        return True
+
+      return self._run_sync(
+        lambda: self._acquire_async(ioloop.IOLoop.current().time() +
+                                    LOCK_TIMEOUT))
     finally:
       self._lock.release()
 
-  def _watch_session(self, state):
-    """ A callback function for handling connection state changes.
+  @staticmethod
+  def _run_sync(func):
+    """ Runs a coroutine to completion on a private IOLoop.
 
     Args:
-      state: The new connection state.
+      func: A function that returns a Future.
+    Returns:
+      The result of the Future.
     """
-    self.wake_event.set()
-    return True
+    io_loop = ioloop.IOLoop(make_current=False)
+    try:
+      return io_loop.run_sync(func)
+    finally:
+      io_loop.close()
 
-  def _resolve_deadlocks(self, children_list):
+  def _predecessors(self, children_list):
+    """ Find the contenders that this lock is waiting for.
+
+    Args:
+      children_list: A list of sorted contenders for each group.
+    Returns:
+      A list of ZooKeeper paths.
+    Raises:
+      ForceRetryError if a contender node is missing.
+    """
+    predecessors = []
+    for index, children in enumerate(children_list):
+      try:
+        our_index = children.index(self.nodes[index])
+      except ValueError:
+        raise ForceRetryError()
+
+      # If the lock for this group hasn't been acquired, get the predecessor.
+      if our_index != 0:
+        predecessors.append(
+          self.paths[index] + "/" + children[our_index - 1])
+
+    return predecessors
+
+  @gen.coroutine
+  def _resolve_deadlocks_async(self, children_list):
     """ Check if there are any concurrent cross-group locks.
 
     Args:
@@ -188,7 +387,7 @@ class EntityLock(object):
       # Get transaction IDs for earlier contenders.
       for child in children[:our_index - 1]:
         try:
-          data, _ = self.client.get(
+          data, _ = yield self.tornado_zk.get(
             self.paths[index] + '/' + child)
         except NoNodeError:
           continue
@@ -203,18 +402,26 @@ class EntityLock(object):
         # resolve deadlocks.
         if current_txid > child_txid:
           # TODO: Implement a more graceful deadlock detection.
-          self.client.retry(self._delete_nodes(self.nodes))
+          yield self._delete_nodes_async(self.nodes)
           raise ForceRetryError()
 
-  def _inner_acquire(self):
-    """ Create contender node(s) and wait until the lock is acquired. """
+  @gen.coroutine
+  def _inner_acquire_async(self, deadline):
+    """ Create contender node(s) and wait until the lock is acquired.
 
-    # Make sure the group lock node exists.
-    self._ensure_path()
+    Args:
+      deadline: A number specifying the IOLoop time to give up at.
+    Returns:
+      True once the lock is acquired.
+    Raises:
+      LockTimeout if a predecessor is not removed before the deadline.
+    """
+    # Make sure the group lock nodes exist.
+    yield [self.tornado_zk.ensure_path(path) for path in self.paths]
 
     nodes = [None for _ in self.paths]
     if self.create_tried:
-      nodes = self._find_nodes()
+      nodes = yield self._find_nodes_async()
     else:
       self.create_tried = True
 
@@ -226,11 +433,11 @@ class EntityLock(object):
       try_num = 0
       while True:
         try:
-          node = self.client.create(
+          node = yield self.tornado_zk.create(
             self.create_paths[index], self.data, sequence=True)
           break
         except NoNodeError:
-          self.client.ensure_path(self.paths[index])
+          yield self.tornado_zk.ensure_path(self.paths[index])
           if try_num > 3:
             raise ForceRetryError()
         try_num += 1
@@ -242,74 +449,83 @@ class EntityLock(object):
     self.nodes = nodes
 
     while True:
-      self.wake_event.clear()
-
       # Bail out with an exception if cancellation has been requested.
       if self.cancelled:
         raise CancelledError()
 
-      children_list = self._get_sorted_children()
-
-      predecessors = []
-      for index, children in enumerate(children_list):
-        try:
-          our_index = children.index(nodes[index])
-        except ValueError:
-          raise ForceRetryError()
-
-        # If the lock for this group hasn't been acquired, get the predecessor.
-        if our_index != 0:
-          predecessors.append(
-            self.paths[index] + "/" + children[our_index - 1])
+      children_list = yield [self._get_contenders_async(path)
+                             for path in self.paths]
 
+      predecessors = self._predecessors(children_list)
       if not predecessors:
-        return True
+        raise gen.Return(True)
 
       if len(nodes) > 1:
-        self._resolve_deadlocks(children_list)
+        yield self._resolve_deadlocks_async(children_list)
 
-      # Wait for predecessor to be removed.
-      # TODO: Listen for all at the same time.
-      for index, predecessor in enumerate(predecessors):
-        self.client.add_listener(self._watch_session)
-        try:
-          if self.client.exists(predecessor, self._watch_predecessor):
-            self.wake_event.wait(LOCK_TIMEOUT)
-            if not self.wake_event.isSet():
-              error = 'Failed to acquire lock on {} after {} '\
-                'seconds'.format(self.paths, LOCK_TIMEOUT * (index + 1))
-              raise LockTimeout(error)
-        finally:
-          self.client.remove_listener(self._watch_session)
+      for predecessor in predecessors:
+        yield self._wait_for_removal(predecessor, deadline)
+
+  @gen.coroutine
+  def _wait_for_removal(self, path, deadline):
+    """ Wait until a contender node is deleted.
 
-  def _watch_predecessor(self, event):
-    """ A callback function for handling contender deletions.
+    The wait also ends if the connection state changes, since the watch may
+    not fire in that case.
 
     Args:
-      event: A ZooKeeper event.
+      path: A string specifying the contender's ZooKeeper path.
+      deadline: A number specifying the IOLoop time to give up at.
+    Raises:
+      LockTimeout if the node still exists at the deadline.
     """
-    self.wake_event.set()
+    io_loop = ioloop.IOLoop.current()
+    changed = TornadoEvent()
+
+    # Kazoo runs watches and listeners in its own thread. ZooKeeper does not
+    # allow removing the watch, so it can fire after the private IOLoop used
+    # by the synchronous methods has been closed.
+    def wake(*args):
+      try:
+        io_loop.add_callback(changed.set)
+      except RuntimeError:
+        pass
 
-  def _get_sorted_children(self):
-    """ Retrieve a list of sorted contenders for each group.
+    self.client.add_listener(wake)
+    try:
+      exists = yield self.tornado_zk.exists(path, wake)
+      if not exists:
+        return
 
+      try:
+        yield changed.wait(deadline)
+      except gen.TimeoutError:
+        raise LockTimeout('Failed to acquire lock on {} after {} '
+                          'seconds'.format(self.paths, LOCK_TIMEOUT))
+    finally:
+      self.client.remove_listener(wake)
+
+  @gen.coroutine
+  def _get_contenders_async(self, path):
+    """ Retrieve a sorted list of contenders for a group.
+
+    Args:
+      path: A string specifying the group's lock path.
     Returns:
-      A list of contenders for each group.
+      A list of contender node names.
     """
-    children = []
-    for path in self.paths:
-      try:
-        children.append(self.client.get_children(path))
-      except NoNodeError:
-        children.append([])
+    try:
+      children = yield self.tornado_zk.get_children(path)
+    except NoNodeError:
+      children = []
 
     # Ignore lock path prefix when sorting contenders.
     lockname = self._NODE_NAME
-    for child_list in children:
-      child_list.sort(key=lambda c: c[c.find(lockname) + len(lockname):])
-    return children
+    children.sort(key=lambda c: c[c.find(lockname) + len(lockname):])
+    raise gen.Return(children)
 
-  def _find_nodes(self):
+  @gen.coroutine
+  def _find_nodes_async(self):
     """ Retrieve a list of paths this lock has created.
 
     Returns:
@@ -318,7 +534,7 @@ class EntityLock(object):
     nodes = []
     for path in self.paths:
       try:
-        children = self.client.get_children(path)
+        children = yield self.tornado_zk.get_children(path)
       except NoNodeError:
         children = []
 
@@ -327,65 +543,86 @@ class EntityLock(object):
         if child.startswith(self.prefix):
           node = child
       nodes.append(node)
-    return nodes
+    raise gen.Return(nodes)
 
-  def _delete_nodes(self, nodes):
+  @gen.coroutine
+  def _delete_nodes_async(self, nodes):
     """ Remove ZooKeeper nodes.
 
     Args:
       nodes: A list of nodes to delete.
     """
-    for index, node in enumerate(nodes):
-      if node is None:
-        continue
-      self.client.delete(self.paths[index] + "/" + node)
+    yield [self.tornado_zk.delete(self.paths[index] + "/" + node)
+           for index, node in enumerate(nodes) if node is not None]
 
-  def _best_effort_cleanup(self):
+  @gen.coroutine
+  def _best_effort_cleanup_async(self):
     """ Attempt to delete nodes that this lock has created. """
     try:
-      nodes = self._find_nodes()
-      self._delete_nodes(nodes)
+      nodes = yield self._find_nodes_async()
+      yield self._delete_nodes_async(nodes)
     except KazooException:
       pass
 
   def release(self):
-    """ Release the lock immediately. """
+    """ Release the lock from a thread that is not running an IOLoop. """
+    self._run_sync(self.release_async)
+
+  @gen.coroutine
+  def release_async(self):
+    """ Release the lock without blocking the IOLoop. """
     try:
-      self.client.retry(self._inner_release)
+      deadline = ioloop.IOLoop.current().time() + LOCK_TIMEOUT
+      while True:
+        try:
+          yield self._inner_release_async()
+          break
+        except RETRYABLE_ERRORS:
+          if ioloop.IOLoop.current().time() + RETRY_DELAY >= deadline:
+            raise
+
+          yield gen.sleep(RETRY_DELAY)
 
-      # Try to clean up the group lock path.
+      # Try to clean up the group lock paths.
       for path in self.paths:
         try:
-          self.client.delete(path)
+          yield self.tornado_zk.delete(path)
         except (NotEmptyError, NoNodeError):
           pass
-      return
     finally:
       if not self.is_acquired:
-        EntityLock._tornado_lock.release()
+        self._release_group_locks()
 
   def ensure_release_tornado_lock(self):
-    """ Ensures that tornado lock (which is global for datastore server)
-    is released.
+    """ Ensures that the local group locks are released.
     It MUST BE CALLED any time when lock is acquired
     even if entity group lock in zookeeper left acquired after failure.
     """
-    if self.is_acquired:
-      EntityLock._tornado_lock.release()
+    self._release_group_locks()
+
+  def _release_group_locks(self):
+    """ Lets other local contenders for the groups proceed. """
+    if self.holds_group_locks:
+      EntityLock._group_locks.release(self.paths)
+      self.holds_group_locks = False
 
-  def _inner_release(self):
+  @gen.coroutine
+  def _inner_release_async(self):
     """ Release the lock by removing created nodes. """
     if not self.is_acquired:
-      return False
+      return
 
-    try:
-      self._delete_nodes(self.nodes)
-    except NoNodeError:
-      pass
+    for index, node in enumerate(self.nodes):
+      if node is None:
+        continue
+
+      try:
+        yield self.tornado_zk.delete(self.paths[index] + "/" + node)
+      except NoNodeError:
+        pass
 
     self.is_acquired = False
     self.nodes = [None for _ in self.paths]
-    return True
 
   def __enter__(self):
     self.unsafe_acquire()
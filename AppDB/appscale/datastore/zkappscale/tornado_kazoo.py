@@ -1,4 +1,6 @@
 """ A wrapper that converts Kazoo operations to Tornado futures. """
+from kazoo.exceptions import NoNodeError, NotEmptyError
+from tornado import gen
 from tornado.concurrent import Future as TornadoFuture
 from tornado.ioloop import IOLoop
 
@@ -10,24 +12,105 @@ class IncompleteOperation(Exception):
 
 class TornadoKazooFuture(TornadoFuture):
   """ A TornadoFuture that handles Kazoo results. """
+  def __init__(self):
+    """ Creates a new TornadoKazooFuture. """
+    super(TornadoKazooFuture, self).__init__()
+
+    # Kazoo calls the result handler from its own thread, so the result is
+    # passed to the IOLoop that the operation was started from.
+    self._io_loop = IOLoop.current()
+
   def handle_zk_result(self, async_result):
     """ Completes the TornadoFuture.
 
     Args:
       async_result: An IAsyncResult.
     """
-    io_loop = IOLoop.instance()
-
     # This method should not be called if the result is not ready.
     if not async_result.ready():
       error = IncompleteOperation('Kazoo operation is not ready')
-      io_loop.add_callback(self.set_exception, error)
+      self._io_loop.add_callback(self.set_exception, error)
       return
 
     if async_result.successful():
-      io_loop.add_callback(self.set_result, async_result.value)
+      self._io_loop.add_callback(self.set_result, async_result.value)
     else:
-      io_loop.add_callback(self.set_exception, async_result.exception)
+      self._io_loop.add_callback(self.set_exception, async_result.exception)
+
+
+def _wrap(zk_future):
+  """ Creates a TornadoKazooFuture that completes with a Kazoo operation.
+
+  Args:
+    zk_future: An IAsyncResult.
+  Returns:
+    A TornadoKazooFuture.
+  """
+  tornado_future = TornadoKazooFuture()
+  zk_future.rawlink(tornado_future.handle_zk_result)
+  return tornado_future
+
+
+class TornadoTransaction(object):
+  """ Collects ZooKeeper operations that are committed together. """
+  def __init__(self, zk_transaction):
+    """ Creates a new TornadoTransaction.
+
+    Args:
+      zk_transaction: A kazoo TransactionRequest.
+    """
+    self._zk_transaction = zk_transaction
+
+  def create(self, path, value=b'', acl=None, ephemeral=False,
+             sequence=False):
+    """ Adds a create operation to the transaction.
+
+    Args:
+      path: A string specifying the path of the node.
+      value: A byte string specifying the node contents.
+      acl: A list of ACLs for the node.
+      ephemeral: A boolean indicating that the node should be ephemeral.
+      sequence: A boolean indicating that the path should be suffixed with a
+        unique sequence number.
+    """
+    self._zk_transaction.create(path, value, acl, ephemeral, sequence)
+
+  def delete(self, path, version=-1):
+    """ Adds a delete operation to the transaction.
+
+    Args:
+      path: A string specifying the path of the node.
+      version: An integer specifying the expected version of the node.
+    """
+    self._zk_transaction.delete(path, version)
+
+  def set_data(self, path, value, version=-1):
+    """ Adds a set operation to the transaction.
+
+    Args:
+      path: A string specifying the path of the node.
+      value: A byte string specifying the node contents.
+      version: An integer specifying the expected version of the node.
+    """
+    self._zk_transaction.set_data(path, value, version)
+
+  def check(self, path, version):
+    """ Makes the transaction depend on the version of a node.
+
+    Args:
+      path: A string specifying the path of the node.
+      version: An integer specifying the expected version of the node.
+    """
+    self._zk_transaction.check(path, version)
+
+  def commit(self):
+    """ Applies all of the operations atomically.
+
+    Returns:
+      A TornadoKazooFuture that resolves to a list with the result of each
+      operation. Failed operations have exception instances as results.
+    """
+    return _wrap(self._zk_transaction.commit_async())
 
 
 class TornadoKazoo(object):
@@ -40,6 +123,49 @@ class TornadoKazoo(object):
     """
     self._zk_client = zk_client
 
+  def create(self, path, value=b'', acl=None, ephemeral=False,
+             sequence=False, makepath=False):
+    """ Creates a node.
+
+    Args:
+      path: A string specifying the path of the node.
+      value: A byte string specifying the node contents.
+      acl: A list of ACLs for the node.
+      ephemeral: A boolean indicating that the node should be ephemeral.
+      sequence: A boolean indicating that the path should be suffixed with a
+        unique sequence number.
+      makepath: A boolean indicating that missing parent nodes should be
+        created.
+    Returns:
+      A TornadoKazooFuture that resolves to the path of the created node.
+    """
+    return _wrap(self._zk_client.create_async(
+      path, value, acl=acl, ephemeral=ephemeral, sequence=sequence,
+      makepath=makepath))
+
+  def ensure_path(self, path, acl=None):
+    """ Creates a node and its parents if they do not exist.
+
+    Args:
+      path: A string specifying the path of the node.
+      acl: A list of ACLs for the created nodes.
+    Returns:
+      A TornadoKazooFuture.
+    """
+    return _wrap(self._zk_client.ensure_path_async(path, acl))
+
+  def exists(self, path, watch=None):
+    """ Checks if a node exists.
+
+    Args:
+      path: A string specifying the path of the node.
+      watch: A function that is called when the node is created, changed or
+        deleted.
+    Returns:
+      A TornadoKazooFuture that resolves to a ZnodeStat or None.
+    """
+    return _wrap(self._zk_client.exists_async(path, watch))
+
   def get(self, path, watch=None):
     """ Gets the value of a node.
 
@@ -49,10 +175,7 @@ class TornadoKazoo(object):
     Returns:
       A TornadoKazooFuture.
     """
-    tornado_future = TornadoKazooFuture()
-    zk_future = self._zk_client.get_async(path, watch)
-    zk_future.rawlink(tornado_future.handle_zk_result)
-    return tornado_future
+    return _wrap(self._zk_client.get_async(path, watch))
 
   def get_children(self, path, watch=None, include_data=False):
     """ Gets a list of child nodes of a path.
@@ -65,21 +188,65 @@ class TornadoKazoo(object):
     Returns:
       A TornadoKazooFuture.
     """
-    tornado_future = TornadoKazooFuture()
-    zk_future = self._zk_client.get_children_async(path, watch, include_data)
-    zk_future.rawlink(tornado_future.handle_zk_result)
-    return tornado_future
+    return _wrap(self._zk_client.get_children_async(path, watch, include_data))
 
-  def delete(self, path, version=-1):
+  def set(self, path, value, version=-1):
+    """ Sets the value of a node.
+
+    Args:
+      path: A string specifying the path of the node.
+      value: A byte string specifying the node contents.
+      version: An integer specifying the expected version of the node.
+    Returns:
+      A TornadoKazooFuture that resolves to a ZnodeStat.
+    """
+    return _wrap(self._zk_client.set_async(path, value, version))
+
+  def delete(self, path, version=-1, recursive=False):
     """ Deletes a node.
 
     Args:
       path: A string specifying the path of the node.
       version: An integer specifying the expected version of the node.
+      recursive: A boolean indicating that the node's children should be
+        deleted as well.
     Returns:
-      A TornadoKazooFuture.
+      A Tornado future.
+    """
+    if recursive:
+      return self._delete_recursive(path)
+
+    return _wrap(self._zk_client.delete_async(path, version=version))
+
+  def transaction(self):
+    """ Starts a set of operations that are applied atomically.
+
+    Returns:
+      A TornadoTransaction.
+    """
+    return TornadoTransaction(self._zk_client.transaction())
+
+  @gen.coroutine
+  def _delete_recursive(self, path):
+    """ Deletes a node and all of its children.
+
+    Args:
+      path: A string specifying the path of the node.
     """
-    tornado_future = TornadoKazooFuture()
-    zk_future = self._zk_client.delete_async(path, version=version)
-    zk_future.rawlink(tornado_future.handle_zk_result)
-    return tornado_future
+    while True:
+      try:
+        children = yield self.get_children(path)
+      except NoNodeError:
+        return
+
+      yield [self._delete_recursive('/'.join([path, child]))
+             for child in children]
+
+      try:
+        yield self.delete(path)
+        return
+      except NoNodeError:
+        return
+      except NotEmptyError:
+        # Another client added a child in the meantime.
+        continue
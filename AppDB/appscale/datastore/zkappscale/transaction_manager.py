@@ -4,9 +4,11 @@ from __future__ import division
 import json
 import logging
 import time
+from collections import deque
 
 from kazoo.exceptions import KazooException
 from kazoo.exceptions import NodeExistsError
+from tornado import gen
 from tornado.ioloop import IOLoop
 
 from appscale.common.async_retrying import retry_children_watch_coroutine
@@ -15,6 +17,7 @@ from .constants import COUNTER_NODE_PREFIX
 from .constants import MAX_SEQUENCE_COUNTER
 from .constants import OFFSET_NODE
 from .entity_lock import zk_group_path
+from .tornado_kazoo import TornadoKazoo
 from ..dbconstants import BadRequest
 from ..dbconstants import InternalError
 
@@ -23,17 +26,34 @@ logger = logging.getLogger('appscale-datastore')
 # Nodes that indicate a cross-group transaction start with this string.
 XG_PREFIX = 'xg'
 
+# The number of seconds a reserved transaction ID can wait to be handed out.
+# The groomer measures a transaction's age from the time its ID was reserved,
+# so this needs to be small compared to MAX_TX_DURATION.
+RESERVATION_TTL = 5
+
 
 class ProjectTransactionManager(object):
   """ Generates and keeps track of transaction IDs for a project. """
-  def __init__(self, project_id, zk_client):
+  def __init__(self, project_id, zk_client, txid_block_size=1):
     """ Creates a new ProjectTransactionManager.
 
     Args:
       project_id: A string specifying a project ID.
+      zk_client: A KazooClient.
+      txid_block_size: An integer specifying how many transaction IDs to
+        reserve with each ZooKeeper request.
     """
     self.project_id = project_id
     self.zk_client = zk_client
+    self._tornado_zk = TornadoKazoo(zk_client)
+    self._txid_block_size = txid_block_size
+
+    # Transaction IDs that have been reserved but not handed out yet, stored
+    # as (txid, reservation time) tuples.
+    self._reserved = deque()
+
+    # A future that resolves when an in-flight reservation completes.
+    self._reservation = None
 
     self._project_node = '/appscale/apps/{}'.format(self.project_id)
 
@@ -52,6 +72,7 @@ class ProjectTransactionManager(object):
     # Containers that do not need to be checked for open transactions.
     self._inactive_containers = set()
 
+  @gen.coroutine
   def create_transaction_id(self, xg):
     """ Generates a new transaction ID.
 
@@ -62,10 +83,16 @@ class ProjectTransactionManager(object):
     Raises:
       InternalError if unable to create a new transaction ID.
     """
+    if self._txid_block_size > 1:
+      # Nothing reads the cross-group marker node, so it is not created for
+      # reserved IDs.
+      txid = yield self._next_reserved_txid()
+      raise gen.Return(txid)
+
     current_time = time.time()
     counter_path_prefix = '/'.join([self._counter_path, COUNTER_NODE_PREFIX])
     try:
-      new_path = self.zk_client.create(
+      new_path = yield self._tornado_zk.create(
         counter_path_prefix, value=str(current_time), sequence=True)
     except KazooException:
       message = 'Unable to create new transaction ID'
@@ -76,28 +103,31 @@ class ProjectTransactionManager(object):
 
     if counter < 0:
       logger.debug('Removing invalid counter')
-      self._delete_counter(new_path)
-      self._update_auto_offset()
-      return self.create_transaction_id(xg)
+      yield self._delete_counter(new_path)
+      yield self._update_auto_offset()
+      txid = yield self.create_transaction_id(xg)
+      raise gen.Return(txid)
 
     txid = self._txid_manual_offset + self._txid_automatic_offset + counter
 
     if txid == 0:
-      self._delete_counter(new_path)
-      return self.create_transaction_id(xg)
+      yield self._delete_counter(new_path)
+      txid = yield self.create_transaction_id(xg)
+      raise gen.Return(txid)
 
     if xg:
       xg_path = '/'.join([new_path, XG_PREFIX])
       try:
-        self.zk_client.create(xg_path, value=str(current_time))
+        yield self._tornado_zk.create(xg_path, value=str(current_time))
       except KazooException:
         message = 'Unable to create new cross-group transaction ID'
         logger.exception(message)
         raise InternalError(message)
 
     self._last_txid_created = txid
-    return txid
+    raise gen.Return(txid)
 
+  @gen.coroutine
   def delete_transaction_id(self, txid):
     """ Removes a transaction ID from the list of active transactions.
 
@@ -105,8 +135,9 @@ class ProjectTransactionManager(object):
       txid: An integer specifying a transaction ID.
     """
     path = self._txid_to_path(txid)
-    self._delete_counter(path)
+    yield self._delete_counter(path)
 
+  @gen.coroutine
   def get_open_transactions(self):
     """ Fetches a list of active transactions.
 
@@ -117,6 +148,14 @@ class ProjectTransactionManager(object):
     """
     txids = []
     active_containers = self._active_containers()
+    try:
+      container_paths = yield [self._tornado_zk.get_children(container)
+                               for container in active_containers]
+    except KazooException:
+      message = 'Unable to fetch list of counters'
+      logger.exception(message)
+      raise InternalError(message)
+
     for index, container in enumerate(active_containers):
       container_name = container.split('/')[-1]
       container_count = int(container_name[len(CONTAINER_PREFIX):] or 1)
@@ -124,12 +163,7 @@ class ProjectTransactionManager(object):
       auto_offset = (container_count - 1) * container_size
       offset = self._txid_manual_offset + auto_offset
 
-      try:
-        paths = self.zk_client.get_children(container)
-      except KazooException:
-        message = 'Unable to fetch list of counters'
-        logger.exception(message)
-        raise InternalError(message)
+      paths = container_paths[index]
 
       counter_nodes = [path.split('/')[-1] for path in paths]
       txids.extend([offset + int(node.lstrip(COUNTER_NODE_PREFIX))
@@ -139,8 +173,9 @@ class ProjectTransactionManager(object):
       if not counter_nodes and index < len(active_containers) - 1:
         self._inactive_containers.add(container_name)
 
-    return txids
+    raise gen.Return(txids)
 
+  @gen.coroutine
   def set_groups(self, txid, groups):
     """ Defines which groups will be involved in a transaction.
 
@@ -152,12 +187,125 @@ class ProjectTransactionManager(object):
     groups_path = '/'.join([txid_path, 'groups'])
     encoded_groups = [zk_group_path(group) for group in groups]
     try:
-      self.zk_client.create(groups_path, value=json.dumps(encoded_groups))
+      yield self._tornado_zk.create(groups_path,
+                                    value=json.dumps(encoded_groups))
     except KazooException:
       message = 'Unable to set lock list for transaction'
       logger.exception(message)
       raise InternalError(message)
 
+  @gen.coroutine
+  def _next_reserved_txid(self):
+    """ Hands out a reserved transaction ID.
+
+    Reserved IDs have counter nodes like any other transaction, so they are
+    reported by get_open_transactions until they are used and deleted. This
+    keeps transactions from missing writes made with a lower ID that another
+    server hands out later.
+
+    Returns:
+      An integer specifying a transaction ID.
+    Raises:
+      InternalError if unable to reserve transaction IDs.
+    """
+    while True:
+      self._discard_stale_reservations()
+      if self._reserved:
+        txid = self._reserved.popleft()[0]
+        self._last_txid_created = txid
+        raise gen.Return(txid)
+
+      # Concurrent requests wait for the same reservation.
+      reservation = self._reservation
+      if reservation is None:
+        reservation = self._reserve_txids()
+        self._reservation = reservation
+        reservation.add_done_callback(self._clear_reservation)
+
+      yield reservation
+
+  def _clear_reservation(self, _):
+    """ Allows the next request to start a reservation. """
+    self._reservation = None
+
+  @gen.coroutine
+  def _reserve_txids(self):
+    """ Creates a block of counter nodes with a single ZooKeeper request.
+
+    Raises:
+      InternalError if unable to reserve transaction IDs.
+    """
+    reserve_time = time.time()
+    counter_path_prefix = '/'.join([self._counter_path, COUNTER_NODE_PREFIX])
+    zk_transaction = self._tornado_zk.transaction()
+    for _ in range(self._txid_block_size):
+      zk_transaction.create(counter_path_prefix, value=str(reserve_time),
+                            sequence=True)
+
+    try:
+      new_paths = yield zk_transaction.commit()
+    except KazooException:
+      message = 'Unable to reserve transaction IDs'
+      logger.exception(message)
+      raise InternalError(message)
+
+    # The operations are applied atomically, so they all fail together.
+    if any(isinstance(result, Exception) for result in new_paths):
+      message = 'Unable to reserve transaction IDs: {}'.format(new_paths)
+      logger.error(message)
+      raise InternalError(message)
+
+    invalid_paths = []
+    exhausted = False
+    for new_path in new_paths:
+      counter = int(new_path.split('/')[-1].lstrip(COUNTER_NODE_PREFIX))
+      if counter < 0:
+        invalid_paths.append(new_path)
+        exhausted = True
+        continue
+
+      txid = self._txid_manual_offset + self._txid_automatic_offset + counter
+      if txid == 0:
+        invalid_paths.append(new_path)
+        continue
+
+      self._reserved.append((txid, reserve_time))
+
+    if invalid_paths:
+      logger.debug('Removing invalid counters')
+      yield [self._delete_counter(path) for path in invalid_paths]
+
+    if exhausted:
+      yield self._update_auto_offset()
+
+  def _discard_stale_reservations(self):
+    """ Releases reserved IDs that are too old to hand out. """
+    cutoff = time.time() - RESERVATION_TTL
+    stale_txids = []
+    while self._reserved and self._reserved[0][1] < cutoff:
+      stale_txids.append(self._reserved.popleft()[0])
+
+    if stale_txids:
+      IOLoop.current().spawn_callback(self._release_txids, stale_txids)
+
+  @gen.coroutine
+  def _release_txids(self, txids):
+    """ Removes the counter nodes for unused transaction IDs.
+
+    Args:
+      txids: A list of integers specifying transaction IDs.
+    """
+    zk_transaction = self._tornado_zk.transaction()
+    for txid in txids:
+      zk_transaction.delete(self._txid_to_path(txid))
+
+    try:
+      yield zk_transaction.commit()
+    except KazooException:
+      # Let the transaction groomer clean them up.
+      logger.exception('Unable to release reserved transaction IDs')
+
+  @gen.coroutine
   def _delete_counter(self, path):
     """ Removes a counter node.
 
@@ -165,7 +313,7 @@ class ProjectTransactionManager(object):
       path: A string specifying a ZooKeeper path.
     """
     try:
-      self.zk_client.delete(path, recursive=True)
+      yield self._tornado_zk.delete(path, recursive=True)
     except KazooException:
       # Let the transaction groomer clean it up.
       logger.exception('Unable to delete counter')
@@ -209,6 +357,7 @@ class ProjectTransactionManager(object):
     node_name = COUNTER_NODE_PREFIX + str(counter_value).zfill(10)
     return '/'.join([container_path, node_name])
 
+  @gen.coroutine
   def _update_auto_offset(self):
     """ Ensures there is a usable sequence container. """
     container_name = self._counter_path.split('/')[-1]
@@ -217,7 +366,7 @@ class ProjectTransactionManager(object):
     next_path = '/'.join([self._project_node, next_node])
 
     try:
-      self.zk_client.create(next_path)
+      yield self._tornado_zk.create(next_path)
     except NodeExistsError:
       # Another process may have already created the new counter.
       pass
@@ -227,7 +376,7 @@ class ProjectTransactionManager(object):
       raise InternalError(message)
 
     try:
-      node_list = self.zk_client.get_children(self._project_node)
+      node_list = yield self._tornado_zk.get_children(self._project_node)
     except KazooException:
       message = 'Unable to find transaction ID counter'
       logger.exception(message)
@@ -262,13 +411,16 @@ class ProjectTransactionManager(object):
 
 class TransactionManager(object):
   """ Generates and keeps track of transaction IDs. """
-  def __init__(self, zk_client):
+  def __init__(self, zk_client, txid_block_size=1):
     """ Creates a new TransactionManager.
 
     Args:
       zk_client: A KazooClient.
+      txid_block_size: An integer specifying how many transaction IDs each
+        project should reserve with each ZooKeeper request.
     """
     self.zk_client = zk_client
+    self.txid_block_size = txid_block_size
     self.zk_client.ensure_path('/appscale/projects')
     self.projects = {}
 
@@ -355,8 +507,8 @@ class TransactionManager(object):
     """
     for project_id in new_project_ids:
       if project_id not in self.projects:
-        self.projects[project_id] = ProjectTransactionManager(project_id,
-                                                              self.zk_client)
+        self.projects[project_id] = ProjectTransactionManager(
+          project_id, self.zk_client, self.txid_block_size)
 
     for project_id in self.projects.keys():
       if project_id not in new_project_ids:
@@ -44,6 +44,7 @@ setup(
     'appscale-get-token=appscale.datastore.cassandra_env.get_token:main',
     'appscale-groomer=appscale.datastore.groomer:main',
     'appscale-groomer-service=appscale.datastore.scripts.groomer_service:main',
+    'appscale-index-backfill=appscale.datastore.scripts.index_backfill:main',
     'appscale-prime-cassandra=appscale.datastore.scripts.prime_cassandra:main',
     'appscale-rebalance=appscale.datastore.cassandra_env.rebalance:main',
     'appscale-restore-data=appscale.datastore.scripts.restore_data:main',
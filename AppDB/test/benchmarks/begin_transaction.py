@@ -0,0 +1,164 @@
+""" Measures how many transactions the datastore server can start per second.
+
+This needs a running ZooKeeper server. It creates a project node (and
+transaction ID counters) under /appscale/apps, so it should not be pointed at
+a deployment that is in use.
+
+Each simulated transaction gets an ID and then removes it, which is what a
+short transaction does to ZooKeeper. The test runs once for each transaction
+ID block size, so allocating one ID per request can be compared with
+reserving blocks of IDs.
+
+Example:
+  python test/benchmarks/begin_transaction.py --requests 2000 \
+    --concurrency 50 --block-sizes 1 20
+"""
+import argparse
+import time
+
+from kazoo.client import KazooClient
+from tornado import gen, ioloop
+
+from appscale.datastore.zkappscale.constants import (
+  CONTAINER_PREFIX, COUNTER_NODE_PREFIX)
+from appscale.datastore.zkappscale.transaction_manager import (
+  ProjectTransactionManager)
+
+PROJECT_ID = 'begin-transaction-benchmark'
+
+
+class CountingKazoo(object):
+  """ Counts the write requests that a TornadoKazoo sends to ZooKeeper. """
+  def __init__(self, tornado_zk):
+    """ Creates a new CountingKazoo.
+
+    Args:
+      tornado_zk: A TornadoKazoo object.
+    """
+    self._tornado_zk = tornado_zk
+    self.writes = 0
+
+  def create(self, *args, **kwargs):
+    self.writes += 1
+    return self._tornado_zk.create(*args, **kwargs)
+
+  def delete(self, *args, **kwargs):
+    self.writes += 1
+    return self._tornado_zk.delete(*args, **kwargs)
+
+  def transaction(self):
+    # A transaction is committed with a single request.
+    self.writes += 1
+    return self._tornado_zk.transaction()
+
+  def __getattr__(self, name):
+    return getattr(self._tornado_zk, name)
+
+
+@gen.coroutine
+def run_async(tx_manager, requests, concurrency, xg):
+  """ Starts transactions from several coroutines at once.
+
+  Args:
+    tx_manager: A ProjectTransactionManager.
+    requests: The number of transactions to start.
+    concurrency: The number of coroutines to use.
+    xg: A boolean indicating cross-group transactions.
+  Returns:
+    A list of transaction IDs.
+  """
+  remaining = [requests]
+  txids = []
+
+  @gen.coroutine
+  def worker():
+    while remaining[0] > 0:
+      remaining[0] -= 1
+      txid = yield tx_manager.create_transaction_id(xg)
+      txids.append(txid)
+      yield tx_manager.delete_transaction_id(txid)
+
+  yield [worker() for _ in range(concurrency)]
+  raise gen.Return(txids)
+
+
+@gen.coroutine
+def run_blocking(zk_client, requests, xg):
+  """ Starts transactions with blocking ZooKeeper calls.
+
+  This is how transactions were started before the transaction manager used
+  asynchronous operations, so the IOLoop handles one request at a time.
+
+  Args:
+    zk_client: A KazooClient.
+    requests: The number of transactions to start.
+    xg: A boolean indicating cross-group transactions.
+  Returns:
+    A list of counter paths.
+  """
+  prefix = '/'.join(['/appscale/apps', PROJECT_ID, CONTAINER_PREFIX,
+                     COUNTER_NODE_PREFIX])
+  paths = []
+  for _ in range(requests):
+    path = zk_client.create(prefix, value=str(time.time()), sequence=True)
+    if xg:
+      zk_client.create('/'.join([path, 'xg']), value=str(time.time()))
+
+    paths.append(path)
+    zk_client.delete(path, recursive=True)
+    yield gen.moment
+
+  raise gen.Return(paths)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--zk-locations', default='localhost:2181',
+                      help='The ZooKeeper hosts to connect to')
+  parser.add_argument('--requests', type=int, default=1000,
+                      help='The number of transactions to start')
+  parser.add_argument('--concurrency', type=int, default=20,
+                      help='The number of concurrent requests')
+  parser.add_argument('--xg', action='store_true',
+                      help='Start cross-group transactions')
+  parser.add_argument('--block-sizes', type=int, nargs='+', default=[1, 20],
+                      help='The transaction ID block sizes to compare')
+  parser.add_argument('--blocking', action='store_true',
+                      help='Use blocking ZooKeeper calls for comparison')
+  args = parser.parse_args()
+
+  zk_client = KazooClient(hosts=args.zk_locations)
+  zk_client.start()
+  project_node = '/appscale/apps/{}'.format(PROJECT_ID)
+  io_loop = ioloop.IOLoop.current()
+  try:
+    if args.blocking:
+      start = time.time()
+      io_loop.run_sync(
+        lambda: run_blocking(zk_client, args.requests, args.xg))
+      elapsed = time.time() - start
+      print('Blocking: {:.1f} transactions per second'.format(
+        args.requests / elapsed))
+      return
+
+    print('Block size | Elapsed | Transactions/s | ZooKeeper writes/tx')
+    for block_size in args.block_sizes:
+      tx_manager = ProjectTransactionManager(PROJECT_ID, zk_client,
+                                             txid_block_size=block_size)
+      counting_zk = CountingKazoo(tx_manager._tornado_zk)
+      tx_manager._tornado_zk = counting_zk
+
+      start = time.time()
+      io_loop.run_sync(lambda: run_async(
+        tx_manager, args.requests, args.concurrency, args.xg))
+      elapsed = time.time() - start
+      print('{:>10} | {:>6.3f}s | {:>14.1f} | {:>19.2f}'.format(
+        block_size, elapsed, args.requests / elapsed,
+        counting_zk.writes / float(args.requests)))
+  finally:
+    zk_client.delete(project_node, recursive=True)
+    zk_client.stop()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,179 @@
+""" Measures how quickly index keys are built for entity writes.
+
+The keys are built with the functions in appscale.datastore.utils (one key at
+a time) and with IndexEncoder (one pass per batch) so that the two can be
+compared. Typical entities have a few properties, while wide entities have
+many properties, including list properties.
+
+Example:
+  python test/benchmarks/index_encoding.py --entities 2000 --batch-size 100
+"""
+import argparse
+import random
+import sys
+import time
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore import dbconstants
+from appscale.datastore.index_encoder import IndexEncoder
+from appscale.datastore.utils import (
+  get_composite_indexes_rows,
+  get_entity_key,
+  get_index_kv_from_tuple,
+  get_kind_key
+)
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import entity_pb
+
+PROJECT_ID = 'guestbook'
+
+KIND = 'Greeting'
+
+
+def make_entity(entity_id, num_properties, list_length):
+  """ Creates an entity with random property values.
+
+  Args:
+    entity_id: An integer specifying the entity's ID.
+    num_properties: The number of distinct property names.
+    list_length: The number of values in each list property. Every fifth
+      property is a list property.
+  Returns:
+    An entity_pb.EntityProto.
+  """
+  entity = entity_pb.EntityProto()
+  key = entity.mutable_key()
+  key.set_app(PROJECT_ID)
+  element = key.mutable_path().add_element()
+  element.set_type(KIND)
+  element.set_id(entity_id)
+  for prop_num in range(num_properties):
+    is_list = prop_num % 5 == 4
+    for _ in range(list_length if is_list else 1):
+      prop = entity.add_property()
+      prop.set_name('prop{}'.format(prop_num))
+      prop.set_multiple(is_list)
+      if prop_num % 2:
+        prop.mutable_value().set_int64value(random.randint(-2 ** 40, 2 ** 40))
+      else:
+        prop.mutable_value().set_stringvalue(
+          'value-{}'.format(random.random()))
+
+  return entity
+
+
+def make_indexes():
+  """ Creates composite index definitions for the benchmark kind.
+
+  Returns:
+    A list of entity_pb.CompositeIndex objects.
+  """
+  indexes = []
+  for index_id, properties in enumerate([['prop0', 'prop1'],
+                                         ['prop2', 'prop4', 'prop1']]):
+    index = entity_pb.CompositeIndex()
+    index.set_id(index_id + 1)
+    index.set_app_id(PROJECT_ID)
+    index.set_state(entity_pb.CompositeIndex.READ_WRITE)
+    definition = index.mutable_definition()
+    definition.set_entity_type(KIND)
+    definition.set_ancestor(False)
+    for name in properties:
+      prop = definition.add_property()
+      prop.set_name(name)
+      prop.set_direction(entity_pb.Index_Property.ASCENDING)
+
+    indexes.append(index)
+
+  return indexes
+
+
+def legacy_keys(entities, indexes):
+  """ Builds index keys with the functions in appscale.datastore.utils.
+
+  Args:
+    entities: A list of entity_pb.EntityProto objects.
+    indexes: A list of entity_pb.CompositeIndex objects.
+  Returns:
+    The number of keys built.
+  """
+  count = 0
+  for entity in entities:
+    prefix = dbconstants.KEY_DELIMITER.join(
+      [PROJECT_ID, entity.key().name_space()])
+    get_entity_key(prefix, entity.key().path())
+    get_kind_key(prefix, entity.key().path())
+    count += 2
+    count += len(get_index_kv_from_tuple([(prefix, entity)]))
+    count += len(get_index_kv_from_tuple([(prefix, entity)], reverse=True))
+    count += len(get_composite_indexes_rows([entity], indexes))
+
+  return count
+
+
+def encoder_keys(entities, indexes):
+  """ Builds index keys with an IndexEncoder.
+
+  Args:
+    entities: A list of entity_pb.EntityProto objects.
+    indexes: A list of entity_pb.CompositeIndex objects.
+  Returns:
+    The number of keys built.
+  """
+  count = 0
+  for rows in IndexEncoder(indexes).encode(entities):
+    count += 2 + len(rows.asc_keys) + len(rows.dsc_keys)
+    count += len(rows.composite_keys)
+
+  return count
+
+
+def measure(function, batches, indexes):
+  """ Builds the keys for every batch.
+
+  Args:
+    function: The key building function to measure.
+    batches: A list of entity lists.
+    indexes: A list of entity_pb.CompositeIndex objects.
+  Returns:
+    A tuple containing the elapsed time and the number of keys.
+  """
+  start = time.time()
+  count = 0
+  for batch in batches:
+    count += function(batch, indexes)
+
+  return time.time() - start, count
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--entities', type=int, default=2000,
+                      help='The number of entities in each scenario')
+  parser.add_argument('--batch-size', type=int, default=100,
+                      help='The number of entities written together')
+  parser.add_argument('--wide-properties', type=int, default=100,
+                      help='The number of properties that wide entities have')
+  parser.add_argument('--list-length', type=int, default=4,
+                      help='The number of values in list properties')
+  args = parser.parse_args()
+
+  scenarios = [('typical', 5, 1),
+               ('wide', args.wide_properties, args.list_length)]
+  indexes = make_indexes()
+  print('Scenario | Implementation | Elapsed | Entities/s | Keys')
+  for name, num_properties, list_length in scenarios:
+    entities = [make_entity(entity_id, num_properties, list_length)
+                for entity_id in range(1, args.entities + 1)]
+    batches = [entities[index:index + args.batch_size]
+               for index in range(0, len(entities), args.batch_size)]
+    for label, function in [('utils', legacy_keys),
+                            ('IndexEncoder', encoder_keys)]:
+      elapsed, count = measure(function, batches, indexes)
+      print('{:>8} | {:>14} | {:>6.3f}s | {:>10.1f} | {}'.format(
+        name, label, elapsed, args.entities / elapsed, count))
+
+
+if __name__ == '__main__':
+  main()
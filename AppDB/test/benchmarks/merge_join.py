@@ -0,0 +1,157 @@
+""" Measures the database requests needed for zigzag merge joins.
+
+The index is kept in memory, and each range query waits for a simulated
+round trip. This makes it possible to compare page sizes and value
+distributions without a Cassandra cluster.
+
+Example:
+  python test/benchmarks/merge_join.py --dense 100000 --sparse 200
+"""
+import argparse
+import bisect
+import random
+import sys
+import time
+
+from tornado import gen, ioloop
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore.datastore_distributed import DatastoreDistributed
+from appscale.datastore.range_iterator import RangeIterator
+from appscale.datastore.utils import encode_index_pb
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import entity_pb
+from google.appengine.datastore.datastore_pb import Path
+
+PROJECT_ID = 'guestbook'
+
+KIND = 'Greeting'
+
+
+class MemoryIndex(object):
+  """ Stores index entries in memory and counts range queries. """
+  def __init__(self, latency):
+    """ Creates a new MemoryIndex.
+
+    Args:
+      latency: The number of seconds each range query takes.
+    """
+    self.latency = latency
+    self.keys = []
+    self.rows = {}
+    self.queries = 0
+
+  def add_entries(self, prop_name, value, entity_ids):
+    """ Adds index entries for a property value.
+
+    Args:
+      prop_name: A string specifying the property name.
+      value: A string specifying the property value.
+      entity_ids: A list of integers specifying entity IDs.
+    """
+    prefix = new_range(self, prop_name, value).prefix
+    for entity_id in entity_ids:
+      path = Path()
+      element = path.add_element()
+      element.set_type(KIND)
+      element.set_id(entity_id)
+      key = prefix + str(encode_index_pb(path))
+      self.rows[key] = {'reference': '{}:{}'.format(KIND, entity_id)}
+
+    self.keys = sorted(self.rows)
+
+  @gen.coroutine
+  def range_query(self, table, schema, start, end, limit, start_inclusive=True):
+    """ Fetches a range of index entries after a simulated delay. """
+    self.queries += 1
+    yield gen.sleep(self.latency)
+    if start_inclusive:
+      first = bisect.bisect_left(self.keys, start)
+    else:
+      first = bisect.bisect_right(self.keys, start)
+
+    last = bisect.bisect_right(self.keys, end)
+    keys = self.keys[first:min(last, first + limit)]
+    raise gen.Return([{key: self.rows[key]} for key in keys])
+
+
+def new_range(index, prop_name, value):
+  """ Creates a RangeIterator for a property value.
+
+  Args:
+    index: A MemoryIndex.
+    prop_name: A string specifying the property name.
+    value: A string specifying the property value.
+  Returns:
+    A RangeIterator.
+  """
+  prop_value = entity_pb.PropertyValue()
+  prop_value.set_stringvalue(value)
+  return RangeIterator(index, PROJECT_ID, '', KIND, prop_name, prop_value)
+
+
+@gen.coroutine
+def run_join(index, limit):
+  """ Runs a merge join across a dense and a sparse property value.
+
+  Args:
+    index: A MemoryIndex.
+    limit: The number of results to request at a time.
+  Returns:
+    A tuple containing the number of results and the number of queries.
+  """
+  ranges = [new_range(index, 'common', 'yes'),
+            new_range(index, 'rare', 'yes')]
+  results = 0
+  index.queries = 0
+  while True:
+    refs = yield DatastoreDistributed._common_refs_from_ranges(ranges, limit)
+    results += len(refs)
+    if len(refs) < limit:
+      break
+
+  raise gen.Return((results, index.queries))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--dense', type=int, default=100000,
+                      help='The number of entities with the common value')
+  parser.add_argument('--sparse', type=int, default=100,
+                      help='The number of entities with the rare value')
+  parser.add_argument('--limit', type=int, default=20,
+                      help='The number of results in each batch')
+  parser.add_argument('--latency', type=float, default=0.002,
+                      help='The seconds each database request takes')
+  parser.add_argument('--chunk-size', type=int,
+                      help='Use a fixed page size instead of adaptive pages')
+  parser.add_argument('--seed', type=int, default=0,
+                      help='The seed used to distribute the entities')
+  args = parser.parse_args()
+
+  random.seed(args.seed)
+
+  if args.chunk_size is not None:
+    RangeIterator.CHUNK_SIZE = args.chunk_size
+    RangeIterator.INITIAL_CHUNK_SIZE = args.chunk_size
+
+  total = args.dense * 10
+  index = MemoryIndex(args.latency)
+  index.add_entries('common', 'yes', random.sample(xrange(1, total), args.dense))
+  index.add_entries('rare', 'yes', random.sample(xrange(1, total), args.sparse))
+
+  start = time.time()
+  results, queries = ioloop.IOLoop.current().run_sync(
+    lambda: run_join(index, args.limit))
+  elapsed = time.time() - start
+
+  print('Results: {}'.format(results))
+  print('Range queries: {}'.format(queries))
+  print('Round trips per result: {:.2f}'.format(
+    queries / float(max(results, 1))))
+  print('Elapsed: {:.3f}s'.format(elapsed))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,157 @@
+import threading
+import urlparse
+
+from concurrent.futures import ThreadPoolExecutor
+from flexmock import flexmock
+from tornado import testing
+
+from appscale.datastore.scripts import blobstore
+from appscale.datastore.scripts.blobstore import (
+  MalformedUpload, MultipartParser)
+
+BOUNDARY = 'boundary'
+
+FORM_BODY = '\r\n'.join([
+  '--' + BOUNDARY,
+  'Content-Disposition: form-data; name="title"',
+  '',
+  'A title',
+  '--' + BOUNDARY,
+  'Content-Disposition: form-data; name="file"; filename="a.txt"',
+  'Content-Type: text/plain',
+  '',
+  'line one\r\n--not a boundary\r\nline two',
+  '--' + BOUNDARY + '--',
+  ''
+])
+
+
+def parse(body, chunk_size):
+  """ Feeds a body to a parser in chunks and collects the parts. """
+  parser = MultipartParser(BOUNDARY)
+  parts = []
+  for offset in range(0, len(body), chunk_size):
+    for event, value in parser.feed(body[offset:offset + chunk_size]):
+      if event == MultipartParser.PART_START:
+        parts.append([value, ''])
+      elif event == MultipartParser.PART_DATA:
+        parts[-1][1] += value
+
+  return parser, parts
+
+
+class FakeWriter(object):
+  def __init__(self):
+    self.data = ''
+    self.closed = False
+
+  def write(self, data):
+    self.data += data
+
+  def close(self):
+    self.closed = True
+
+
+class TestMultipartParser(testing.AsyncTestCase):
+  def test_chunk_sizes(self):
+    # The result does not depend on where the body is split.
+    for chunk_size in (1, 2, 7, 64, len(FORM_BODY)):
+      parser, parts = parse(FORM_BODY, chunk_size)
+      self.assertTrue(parser.complete)
+      self.assertEqual(len(parts), 2)
+      self.assertEqual(parts[0][1], 'A title')
+      self.assertEqual(parts[1][0]['Content-Type'], 'text/plain')
+      self.assertEqual(parts[1][1], 'line one\r\n--not a boundary\r\nline two')
+
+  def test_incomplete_body(self):
+    parser, parts = parse(FORM_BODY[:-20], 64)
+    self.assertFalse(parser.complete)
+
+  def test_large_headers(self):
+    parser = MultipartParser(BOUNDARY)
+    parser.feed('--{}\r\n'.format(BOUNDARY))
+    self.assertRaises(MalformedUpload, parser.feed,
+                      'X' * (MultipartParser.MAX_HEADERS_SIZE + 1))
+
+
+class TestUploadHandler(testing.AsyncHTTPTestCase):
+  def get_app(self):
+    return blobstore.Application(ThreadPoolExecutor(2))
+
+  def get_httpserver_options(self):
+    # Deliver the body in several chunks.
+    return {'chunk_size': 16}
+
+  def test_streaming_upload(self):
+    session = {'success_path': 'http://192.168.33.10:8080/upload-done'}
+    flexmock(blobstore).should_receive('get_session').and_return(session)
+    flexmock(blobstore.datastore).should_receive('Delete')
+    flexmock(blobstore.dev_appserver_upload).\
+      should_receive('GenerateBlobKey').with_args(app_id='guestbook').\
+      and_return('blob-key')
+    writer = FakeWriter()
+    flexmock(blobstore.datastore_blob_storage.DatastoreBlobStorage).\
+      should_receive('CreateBlobWriter').with_args('blob-key').\
+      and_return(writer)
+    blob_infos = []
+
+    def put(entity):
+      # Datastore calls are made for the upload's project.
+      self.assertEqual(entity.app(), 'guestbook')
+      self.assertEqual(blobstore.datastore_router._local.app_id, 'guestbook')
+      blob_infos.append(entity)
+
+    flexmock(blobstore.datastore).should_receive('Put').replace_with(put)
+    callbacks = []
+
+    def forward_callback(urlrequest):
+      callbacks.append(urlrequest)
+      return 'uploaded'
+
+    flexmock(blobstore).should_receive('forward_callback').\
+      replace_with(forward_callback)
+
+    response = self.fetch(
+      '/_ah/upload/guestbook/session-id', method='POST', body=FORM_BODY,
+      headers={'Content-Type':
+               'multipart/form-data; boundary={}'.format(BOUNDARY)})
+    self.assertEqual(response.body, 'uploaded')
+
+    self.assertEqual(writer.data, 'line one\r\n--not a boundary\r\nline two')
+    self.assertTrue(writer.closed)
+    self.assertEqual(blob_infos[0]['size'], len(writer.data))
+
+    # The callback contains the metadata instead of the file.
+    callback_data = dict(urlparse.parse_qsl(callbacks[0].get_data()))
+    self.assertEqual(callback_data['title'], 'A title')
+    self.assertIn("'key': 'blob-key'", callback_data['blob_info_metadata'])
+    self.assertNotIn('line one', callbacks[0].get_data())
+
+
+class TestProjectDatastoreRouter(testing.AsyncTestCase):
+  def test_concurrent_projects(self):
+    stubs = {app_id: flexmock(CreateRPC=lambda app_id=app_id: app_id)
+             for app_id in ('app1', 'app2')}
+    flexmock(blobstore.datastore_distributed).\
+      should_receive('DatastoreDistributed').\
+      replace_with(lambda app_id, *args, **kwargs: stubs[app_id])
+    router = blobstore.ProjectDatastoreRouter()
+    self.assertRaises(blobstore.datastore_errors.BadRequestError,
+                      router.CreateRPC)
+
+    # Each thread's calls go to its own project without waiting for others.
+    results = {}
+
+    def create_rpc(app_id):
+      with router.project(app_id):
+        results[app_id] = router.CreateRPC()
+
+    with router.project('app1'):
+      thread = threading.Thread(target=create_rpc, args=('app2',))
+      thread.start()
+      thread.join(5)
+      results['app1'] = router.CreateRPC()
+
+    self.assertDictEqual(results, {'app1': 'app1', 'app2': 'app2'})
+    self.assertRaises(blobstore.datastore_errors.BadRequestError,
+                      router.CreateRPC)
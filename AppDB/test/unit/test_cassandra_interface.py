@@ -30,6 +30,8 @@ class TestCassandra(testing.AsyncTestCase):
     self.connect_mock = mock.MagicMock(return_value=self.session_mock)
     self.cluster_mock = mock.MagicMock(connect=self.connect_mock)
     self.cluster_class_mock.return_value = self.cluster_mock
+    self.session_mock.prepare = mock.MagicMock(
+      side_effect=lambda query_str: mock.MagicMock(query_string=query_str))
 
     # Instantiate Datastore proxy
     self.db = cassandra_interface.DatastoreProxy()
@@ -61,7 +63,7 @@ class TestCassandra(testing.AsyncTestCase):
     parameters = self.execute_mock.call_args[1]["parameters"]
     self.assertEqual(
       query.query_string,
-      'SELECT * FROM "table" WHERE key IN %s and column1 IN %s')
+      'SELECT * FROM "table" WHERE key IN ? and column1 IN ?')
     self.assertEqual(parameters, ([b'a', b'b', b'c'], ['c1', 'c2', 'c3']) )
     # And result matches expectation
     self.assertEqual(result, {
@@ -149,12 +151,13 @@ class TestCassandra(testing.AsyncTestCase):
     self.assertEqual(
       query.query_string,
       'SELECT * FROM "tableZ" WHERE '
-      'token(key) >= %s AND '
-      'token(key) <= %s AND '
-      'column1 IN %s '
-      'LIMIT 10 '    # 5 * number of columns
+      'token(key) >= ? AND '
+      'token(key) <= ? AND '
+      'column1 IN ? '
+      'LIMIT ? '
       'ALLOW FILTERING')
-    self.assertEqual(parameters, (b'keyA', b'keyC', ['c1', 'c2']) )
+    # The limit is 5 * number of columns.
+    self.assertEqual(parameters, [b'keyA', b'keyC', ['c1', 'c2'], 10])
     # And result matches expectation
     self.assertEqual(result, [
       {'keyA': {'c1': '1', 'c2': '2'}},
@@ -162,6 +165,84 @@ class TestCassandra(testing.AsyncTestCase):
       {'keyC': {'c1': '7', 'c2': '8'}}
     ])
 
+  @testing.gen_test
+  def test_range_scan(self):
+    # Return rows in two pages, splitting the rows for keyB between them.
+    first_page = Future()
+    first_page.set_result(([
+      ('keyA', 'c1', '1'), ('keyA', 'c2', '2'), ('keyB', 'c1', '4')
+    ], 'page2'))
+    second_page = Future()
+    second_page.set_result(([
+      ('keyB', 'c2', '5'), ('keyC', 'c1', '7'), ('keyC', 'c2', '8')
+    ], None))
+
+    with mock.patch.object(cassandra_interface.TornadoCassandra,
+                           'execute_page') as execute_page_mock:
+      execute_page_mock.side_effect = [first_page, second_page]
+
+      columns = ['c1', 'c2']
+      scan = self.db.range_scan('tableZ', columns, 'keyA', 'keyC', limit=1,
+                                offset=1)
+      rows = yield scan.next_page()
+      self.assertEqual(rows, [('keyB', {'c1': '4', 'c2': '5'})])
+      self.assertTrue(scan.done)
+      rows = yield scan.next_page()
+      self.assertEqual(rows, [])
+
+      # Make sure the offset is counted in the query limit and page size.
+      query = execute_page_mock.call_args_list[0][0][0]
+      prepared = self.db.statement_cache.get(
+        ('range_query', 'tableZ', '>=', '<=', True), None)
+      prepared.bind.assert_called_once_with(
+        [b'keyA', b'keyC', ['c1', 'c2'], 4])
+      self.assertEqual(query.fetch_size, 4)
+      self.assertEqual(
+        execute_page_mock.call_args_list[1][1]['paging_state'], 'page2')
+
+  @testing.gen_test
+  def test_statements_are_prepared_once(self):
+    async_response = Future()
+    async_response.set_result([])
+    self.execute_mock.return_value = async_response
+
+    yield self.db.batch_get_entity('table', ['a'], ['c1'])
+    yield self.db.batch_get_entity('table', ['b', 'c'], ['c1', 'c2'])
+    yield self.db.range_query('table', ['c1'], 'a', 'b', 5)
+    yield self.db.range_query('table', ['c1'], 'b', 'c', 10)
+    yield self.db.range_query('table', ['c1'], 'b', 'c', None)
+
+    # Statements only differ by shape when the limit is omitted.
+    self.assertEqual(self.session_mock.prepare.call_count, 3)
+    stats = self.db.statement_cache.stats()
+    self.assertEqual(stats['prepared'], 3)
+    self.assertEqual(stats['uses']['batch_get_entity table'], 2)
+    self.assertEqual(stats['uses']['range_query table >= <= True'], 2)
+
 
 if __name__ == "__main__":
   unittest.main()
+
+  @testing.gen_test
+  def test_bulk_write(self):
+    async_response = Future()
+    async_response.set_result(None)
+    self.execute_mock.return_value = async_response
+
+    mutations = [
+      {'table': 'entities', 'key': 'a', 'operation': 'put',
+       'values': {'entity': 'value', 'txnID': '1'}},
+      {'table': 'ascending_property', 'key': 'b', 'operation': 'put',
+       'values': {'reference': 'a'}},
+      {'table': 'descending_property', 'key': 'c', 'operation': 'delete'},
+      {'table': 'group_updates', 'key': bytearray('g'), 'last_update': 1}
+    ]
+    yield self.db.bulk_write(mutations, 1, max_in_flight=2)
+
+    # Each row is written with a single request.
+    self.assertEqual(self.execute_mock.call_count, 4)
+    batches = [call[0][0] for call in self.execute_mock.call_args_list
+               if isinstance(call[0][0], cassandra_interface.BatchStatement)]
+    self.assertEqual(len(batches), 1)
+    self.assertEqual(batches[0].batch_type,
+                     cassandra_interface.BatchType.UNLOGGED)
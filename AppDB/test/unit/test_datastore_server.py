@@ -302,7 +302,7 @@ class TestDatastoreServer(testing.AsyncTestCase):
 
     zookeeper = flexmock(handle=zk_client)
     transaction_manager = flexmock(
-      delete_transaction_id=lambda project, txid: None)
+      delete_transaction_id=lambda project, txid: ASYNC_NONE)
     dd = DatastoreDistributed(db_batch, transaction_manager, zookeeper)
     flexmock(dd).should_receive('apply_txn_changes').and_return(ASYNC_NONE)
     commit_request = datastore_pb.Transaction()
@@ -358,7 +358,7 @@ class TestDatastoreServer(testing.AsyncTestCase):
 
   @testing.gen_test
   def test_dynamic_put(self):
-    db_batch = flexmock(session=flexmock())
+    db_batch = flexmock(session=flexmock(), statement_cache=flexmock())
     db_batch.should_receive('valid_data_version_sync').and_return(True)
 
     entity_proto1 = self.get_new_entity_proto(
@@ -373,9 +373,9 @@ class TestDatastoreServer(testing.AsyncTestCase):
     db_batch.should_receive('batch_get_entity').and_return(async_result)
     db_batch.should_receive('normal_batch').and_return(ASYNC_NONE)
     transaction_manager = flexmock(
-      create_transaction_id=lambda project, xg: 1,
-      delete_transaction_id=lambda project, txid: None,
-      set_groups=lambda project, txid, groups: None)
+      create_transaction_id=lambda project, xg: gen.maybe_future(1),
+      delete_transaction_id=lambda project, txid: ASYNC_NONE,
+      set_groups=lambda project, txid, groups: ASYNC_NONE)
     dd = DatastoreDistributed(db_batch, transaction_manager,
                               self.get_zookeeper())
     putreq_pb = datastore_pb.PutRequest()
@@ -390,7 +390,7 @@ class TestDatastoreServer(testing.AsyncTestCase):
     async_true.set_result(True)
     entity_lock = flexmock(EntityLock)
     entity_lock.should_receive('acquire').and_return(async_true)
-    entity_lock.should_receive('release')
+    entity_lock.should_receive('release_async').and_return(ASYNC_NONE)
 
     flexmock(ScatteredAllocator).should_receive('next').\
       and_return(random.randint(1, 500))
@@ -417,9 +417,9 @@ class TestDatastoreServer(testing.AsyncTestCase):
     db_batch.should_receive('batch_get_entity').and_return(async_result)
     db_batch.should_receive('normal_batch').and_return(ASYNC_NONE)
     transaction_manager = flexmock(
-      create_transaction_id=lambda project, xg: 1,
-      delete_transaction_id=lambda project, txid: None,
-      set_groups=lambda project, txid, groups: None)
+      create_transaction_id=lambda project, xg: gen.maybe_future(1),
+      delete_transaction_id=lambda project, txid: ASYNC_NONE,
+      set_groups=lambda project, txid, groups: ASYNC_NONE)
     dd = DatastoreDistributed(db_batch, transaction_manager,
                               self.get_zookeeper())
 
@@ -427,10 +427,122 @@ class TestDatastoreServer(testing.AsyncTestCase):
     async_true.set_result(True)
     entity_lock = flexmock(EntityLock)
     entity_lock.should_receive('acquire').and_return(async_true)
-    entity_lock.should_receive('release')
+    entity_lock.should_receive('release_async').and_return(ASYNC_NONE)
 
     yield dd.put_entities(app_id, entity_list)
 
+  @testing.gen_test
+  def test_bulk_put(self):
+    app_id = 'test'
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version_sync').and_return(True)
+
+    entity_proto1 = self.get_new_entity_proto(
+      app_id, "test_kind", "bob", "prop1name", "prop1val", ns="blah")
+    entity_key1 = 'test\x00blah\x00test_kind:bob\x01'
+    entity_proto2 = self.get_new_entity_proto(
+      app_id, "test_kind", "nancy", "prop1name", "prop2val", ns="blah")
+    entity_key2 = 'test\x00blah\x00test_kind:nancy\x01'
+    old_entity = self.get_new_entity_proto(
+      app_id, "test_kind", "bob", "prop1name", "oldval", ns="blah")
+    async_result = gen.Future()
+    async_result.set_result({
+      entity_key1: {APP_ENTITY_SCHEMA[0]: old_entity.Encode()},
+      entity_key2: {}})
+
+    mutations = []
+    db_batch.should_receive('batch_get_entity').and_return(async_result).once()
+    db_batch.should_receive('bulk_write').replace_with(
+      lambda batch, txid: mutations.extend(batch) or ASYNC_NONE)
+    transaction_manager = flexmock()
+    transaction_manager.should_receive('create_transaction_id').\
+      and_return(gen.maybe_future(5)).once()
+    transaction_manager.should_receive('delete_transaction_id').\
+      with_args(app_id, 5).and_return(ASYNC_NONE).once()
+    dd = DatastoreDistributed(db_batch, transaction_manager,
+                              self.get_zookeeper())
+
+    # Entity groups are not locked.
+    flexmock(EntityLock).should_receive('acquire').never()
+
+    yield dd.bulk_put(app_id, [entity_proto1, entity_proto2])
+
+    # The old index entry for the existing entity gets deleted.
+    deleted = {mutation['table']: mutation['key'] for mutation in mutations
+               if mutation.get('operation') == dbconstants.Operations.DELETE}
+    self.assertEqual(len(deleted), 2)
+    self.assertIn('oldval', deleted[dbconstants.ASC_PROPERTY_TABLE])
+    self.assertEqual(len([mutation for mutation in mutations
+                          if mutation['table'] == 'group_updates']), 2)
+
+    # Entities need complete keys.
+    incomplete = self.get_new_entity_proto(
+      app_id, "test_kind", "bob", "prop1name", "prop1val")
+    incomplete.mutable_key().mutable_path().element(0).clear_name()
+    with self.assertRaises(dbconstants.BadRequest):
+      yield dd.bulk_put(app_id, [incomplete])
+
+  @testing.gen_test
+  def test_bulk_put_retry(self):
+    app_id = 'test'
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version_sync').and_return(True)
+
+    old_entities = [
+      self.get_new_entity_proto(app_id, "test_kind", name, "prop1name",
+                                "old{}".format(name), ns="blah")
+      for name in ("bob", "nancy")]
+    new_entities = [
+      self.get_new_entity_proto(app_id, "test_kind", name, "prop1name",
+                                "new{}".format(name), ns="blah")
+      for name in ("bob", "nancy")]
+    stored = {
+      'test\x00blah\x00test_kind:{}\x01'.format(name):
+        {APP_ENTITY_SCHEMA[0]: entity.Encode()}
+      for name, entity in zip(("bob", "nancy"), old_entities)}
+
+    db_batch.should_receive('batch_get_entity').replace_with(
+      lambda table, keys, schema: gen.maybe_future(
+        {key: dict(stored[key]) for key in keys}))
+
+    deleted = []
+    failures = [1]
+
+    def bulk_write(mutations, txid):
+      entity_puts = [mutation for mutation in mutations
+                     if mutation['table'] == dbconstants.APP_ENTITY_TABLE]
+      if entity_puts and failures:
+        # Only the first entity is written before the connection fails.
+        failures.pop()
+        stored[entity_puts[0]['key']] = entity_puts[0]['values']
+        raise dbconstants.AppScaleDBConnectionError('Unable to write')
+
+      for mutation in mutations:
+        if mutation.get('operation') == dbconstants.Operations.DELETE:
+          deleted.append(mutation['key'])
+        elif mutation['table'] == dbconstants.APP_ENTITY_TABLE:
+          stored[mutation['key']] = mutation['values']
+
+      return ASYNC_NONE
+
+    db_batch.should_receive('bulk_write').replace_with(bulk_write)
+    transaction_manager = flexmock()
+    transaction_manager.should_receive('create_transaction_id').\
+      and_return(gen.maybe_future(5))
+    transaction_manager.should_receive('delete_transaction_id').\
+      and_return(ASYNC_NONE)
+    dd = DatastoreDistributed(db_batch, transaction_manager,
+                              self.get_zookeeper())
+
+    with self.assertRaises(dbconstants.AppScaleDBConnectionError):
+      yield dd.bulk_put(app_id, new_entities)
+
+    yield dd.bulk_put(app_id, new_entities)
+
+    # The old index entries of both entities are deleted.
+    for name in ("bob", "nancy"):
+      self.assertTrue(any('old{}'.format(name) in key for key in deleted))
+
   def test_acquire_locks_for_trans(self):
     zk_client = flexmock()
     zk_client.should_receive('add_listener')
@@ -669,24 +781,25 @@ class TestDatastoreServer(testing.AsyncTestCase):
       }
     })
 
-    tombstone1 = {'key': {APP_ENTITY_SCHEMA[0]:TOMBSTONE, APP_ENTITY_SCHEMA[1]: 1}}
+    tombstone1 = ('key', {APP_ENTITY_SCHEMA[0]: TOMBSTONE,
+                          APP_ENTITY_SCHEMA[1]: 1})
     db_batch = flexmock()
     db_batch.should_receive('valid_data_version_sync').and_return(True)
     db_batch.should_receive("batch_get_entity").and_return(async_result)
 
-    entity_proto1 = {
-      'test\x00blah\x00test_kind:nancy\x01': {
-        APP_ENTITY_SCHEMA[0]:entity_proto1.Encode(),
-        APP_ENTITY_SCHEMA[1]: 1
-      }
-    }
+    entity_proto1 = (
+      'test\x00blah\x00test_kind:nancy\x01',
+      {APP_ENTITY_SCHEMA[0]: entity_proto1.Encode(), APP_ENTITY_SCHEMA[1]: 1}
+    )
     async_result_1 = gen.Future()
     async_result_1.set_result([entity_proto1, tombstone1])
     async_result_2 = gen.Future()
     async_result_2.set_result([])
-    db_batch.should_receive("range_query").\
+    scan = flexmock()
+    scan.should_receive('next_page').\
       and_return(async_result_1).\
       and_return(async_result_2)
+    db_batch.should_receive("range_scan").and_return(scan)
 
     zk_client = flexmock()
     zk_client.should_receive('add_listener')
@@ -708,7 +821,7 @@ class TestDatastoreServer(testing.AsyncTestCase):
     async_true.set_result(True)
     entity_lock = flexmock(EntityLock)
     entity_lock.should_receive('acquire').and_return(async_true)
-    entity_lock.should_receive('release')
+    entity_lock.should_receive('release_async').and_return(ASYNC_NONE)
 
     del_request = flexmock()
     del_request.should_receive("key_list")
@@ -717,9 +830,9 @@ class TestDatastoreServer(testing.AsyncTestCase):
     db_batch = flexmock()
     db_batch.should_receive('valid_data_version_sync').and_return(True)
     transaction_manager = flexmock(
-      create_transaction_id=lambda project, xg: 1,
-      delete_transaction_id=lambda project, txid: None,
-      set_groups=lambda project_id, txid, groups: None)
+      create_transaction_id=lambda project, xg: gen.maybe_future(1),
+      delete_transaction_id=lambda project, txid: ASYNC_NONE,
+      set_groups=lambda project_id, txid, groups: ASYNC_NONE)
     dd = DatastoreDistributed(db_batch, transaction_manager,
                               self.get_zookeeper())
     yield dd.dynamic_delete("appid", del_request)
@@ -836,6 +949,56 @@ class TestDatastoreServer(testing.AsyncTestCase):
     result = yield dd.zigzag_merge_join(query, filter_info, [])
     self.assertEquals(result, None)
 
+  @testing.gen_test
+  def test_filtered_single_property_query(self):
+    zk_client = flexmock()
+    zk_client.should_receive('add_listener')
+
+    zookeeper = flexmock(handle=zk_client)
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version_sync').and_return(True)
+
+    transaction_manager = flexmock()
+    dd = DatastoreDistributed(db_batch, transaction_manager, zookeeper)
+
+    query = datastore_pb.Query()
+    query.set_app('appid')
+    query.set_kind('kind')
+    for prop_name in ('prop1', 'prop2'):
+      query_filter = query.add_filter()
+      query_filter.set_op(datastore_pb.Query_Filter.EQUAL)
+      prop = query_filter.add_property()
+      prop.set_name(prop_name)
+      prop.set_multiple(False)
+      prop.mutable_value().set_stringvalue('value')
+
+    # A projection on another property adds an EXISTS filter for it.
+    query.add_property_name('prop3')
+    exists_filter = query.add_filter()
+    exists_filter.set_op(datastore_pb.Query_Filter.EXISTS)
+    prop = exists_filter.add_property()
+    prop.set_name('prop3')
+    prop.set_multiple(False)
+
+    filter_info = dd.generate_filter_info(query.filter_list())
+    flexmock(dd).should_receive('_DatastoreDistributed__single_property_query').\
+      never()
+    result = yield dd._DatastoreDistributed__filtered_single_property_query(
+      query, filter_info, 'prop1')
+    self.assertIsNone(result)
+
+    # Without the EXISTS filter, the other equality filters are applied to
+    # the fetched entities.
+    query.filter_list().pop()
+    filter_info = dd.generate_filter_info(query.filter_list())
+    entities = ['entity']
+    flexmock(dd).should_receive('_DatastoreDistributed__single_property_query').\
+      with_args(query, {'prop1': filter_info['prop1']}, [], dict).\
+      and_return(gen.maybe_future(entities)).once()
+    result = yield dd._DatastoreDistributed__filtered_single_property_query(
+      query, filter_info, 'prop1')
+    self.assertEquals(result, entities)
+
   def test_index_deletions(self):
     old_entity = self.get_new_entity_proto(*self.BASIC_ENTITY)
 
@@ -1025,8 +1188,8 @@ class TestDatastoreServer(testing.AsyncTestCase):
     db_batch.should_receive('get_indices').and_return([])
 
     transaction_manager = flexmock(
-      delete_transaction_id=lambda project_id, txid: None,
-      set_groups=lambda project_id, txid, groups: None)
+      delete_transaction_id=lambda project_id, txid: ASYNC_NONE,
+      set_groups=lambda project_id, txid, groups: ASYNC_NONE)
     dd = DatastoreDistributed(db_batch, transaction_manager,
                               self.get_zookeeper())
     prefix = dd.get_table_prefix(entity)
@@ -1042,7 +1205,7 @@ class TestDatastoreServer(testing.AsyncTestCase):
     async_true.set_result(True)
     entity_lock = flexmock(EntityLock)
     entity_lock.should_receive('acquire').and_return(async_true)
-    entity_lock.should_receive('release')
+    entity_lock.should_receive('release_async').and_return(ASYNC_NONE)
 
     yield dd.apply_txn_changes(app, txn)
 
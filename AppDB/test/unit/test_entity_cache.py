@@ -0,0 +1,93 @@
+import unittest
+
+from flexmock import flexmock
+
+from appscale.datastore import entity_cache
+from appscale.datastore.entity_cache import EntityCache
+
+
+class TestEntityCache(unittest.TestCase):
+  def test_get_and_put(self):
+    cache = EntityCache(1024, ttl=10)
+    self.assertIsNone(cache.get('guestbook\x00\x00Greeting:1\x01'))
+
+    generation = cache.start_fetch()
+    cache.finish_fetch(generation, {
+      'guestbook\x00\x00Greeting:1\x01': {'entity': 'a', 'txnID': '1'},
+      'guestbook\x00\x00Greeting:2\x01': {}
+    })
+
+    self.assertEqual(cache.get('guestbook\x00\x00Greeting:1\x01'),
+                     {'entity': 'a', 'txnID': '1'})
+    self.assertEqual(cache.get('guestbook\x00\x00Greeting:2\x01'), {})
+    self.assertEqual(cache.hits, 2)
+    self.assertEqual(cache.misses, 1)
+
+  def test_expiration(self):
+    cache = EntityCache(1024, ttl=10)
+    flexmock(entity_cache.time).should_receive('time').\
+      and_return(100).and_return(111)
+    generation = cache.start_fetch()
+    cache.finish_fetch(generation, {'guestbook\x00\x00Greeting:1\x01': {}})
+    self.assertIsNone(cache.get('guestbook\x00\x00Greeting:1\x01'))
+
+  def test_eviction(self):
+    key1 = 'guestbook\x00\x00Greeting:1\x01'
+    key2 = 'guestbook\x00\x00Greeting:2\x01'
+    key3 = 'guestbook\x00\x00Greeting:3\x01'
+    row = {'entity': 'x' * 20}
+    row_size = len(key1) + len('entity') + 20
+    cache = EntityCache(row_size * 2, ttl=10)
+
+    generation = cache.start_fetch()
+    cache.finish_fetch(generation, {key1: row})
+    generation = cache.start_fetch()
+    cache.finish_fetch(generation, {key2: row})
+
+    # Accessing the first key makes the second one the least recently used.
+    cache.get(key1)
+    generation = cache.start_fetch()
+    cache.finish_fetch(generation, {key3: row})
+
+    self.assertEqual(cache.evictions, 1)
+    self.assertIsNone(cache.get(key2))
+    self.assertIsNotNone(cache.get(key1))
+    self.assertIsNotNone(cache.get(key3))
+
+  def test_projects_are_bounded_separately(self):
+    key1 = 'app1\x00\x00Greeting:1\x01'
+    key2 = 'app2\x00\x00Greeting:1\x01'
+    row = {'entity': 'x' * 20}
+    cache = EntityCache(len(key1) + len('entity') + 20, ttl=10)
+
+    generation = cache.start_fetch()
+    cache.finish_fetch(generation, {key1: row, key2: row})
+    self.assertIsNotNone(cache.get(key1))
+    self.assertIsNotNone(cache.get(key2))
+    self.assertEqual(cache.evictions, 0)
+
+  def test_invalidate(self):
+    key = 'guestbook\x00\x00Greeting:1\x01'
+    cache = EntityCache(1024, ttl=10)
+    generation = cache.start_fetch()
+    cache.finish_fetch(generation, {key: {'entity': 'a'}})
+
+    cache.invalidate([key])
+    self.assertIsNone(cache.get(key))
+    self.assertEqual(cache.invalidations, 1)
+
+  def test_invalidate_during_fetch(self):
+    key = 'guestbook\x00\x00Greeting:1\x01'
+    cache = EntityCache(1024, ttl=10)
+
+    # A write that completes while a read is in progress should prevent the
+    # read from caching the old value.
+    generation = cache.start_fetch()
+    cache.invalidate([key])
+    cache.finish_fetch(generation, {key: {'entity': 'old'}})
+    self.assertIsNone(cache.get(key))
+
+    # Reads that start after the write can populate the cache.
+    generation = cache.start_fetch()
+    cache.finish_fetch(generation, {key: {'entity': 'new'}})
+    self.assertEqual(cache.get(key), {'entity': 'new'})
@@ -0,0 +1,202 @@
+import sys
+import unittest
+
+from flexmock import flexmock
+from kazoo.exceptions import LockTimeout, NotEmptyError
+from kazoo.handlers.threading import SequentialThreadingHandler
+from tornado import gen, testing
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore.zkappscale.entity_lock import (
+  EntityLock, GroupLocks, LockStats)
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import entity_pb
+
+
+def group_key(group_id):
+  key = entity_pb.Reference()
+  key.set_app('guestbook')
+  element = key.mutable_path().add_element()
+  element.set_type('Greeting')
+  element.set_id(group_id)
+  return key
+
+
+class SlowLock(EntityLock):
+  """ An EntityLock that takes some time to acquire the ZooKeeper lock. """
+  active = 0
+  max_active = 0
+
+  @gen.coroutine
+  def _acquire_async(self, deadline):
+    SlowLock.active += 1
+    SlowLock.max_active = max(SlowLock.max_active, SlowLock.active)
+    yield gen.sleep(0.01)
+    SlowLock.active -= 1
+
+    self.is_acquired = True
+    raise gen.Return(True)
+
+  @gen.coroutine
+  def release_async(self):
+    self.is_acquired = False
+    self.ensure_release_tornado_lock()
+
+
+class TestEntityLock(testing.AsyncTestCase):
+  def setUp(self):
+    super(TestEntityLock, self).setUp()
+    SlowLock.active = 0
+    SlowLock.max_active = 0
+    self.client = flexmock(handler=SequentialThreadingHandler(),
+                           add_listener=lambda listener: None,
+                           remove_listener=lambda listener: None)
+
+  @gen.coroutine
+  def hold_lock(self, keys):
+    lock = SlowLock(self.client, keys)
+    yield lock.acquire()
+    yield lock.release_async()
+
+  @testing.gen_test
+  def test_disjoint_groups(self):
+    yield [self.hold_lock([group_key(group_id)]) for group_id in range(1, 5)]
+    self.assertGreater(SlowLock.max_active, 1)
+
+  @testing.gen_test
+  def test_same_group(self):
+    yield [self.hold_lock([group_key(1)]) for _ in range(4)]
+    self.assertEqual(SlowLock.max_active, 1)
+    self.assertEqual(EntityLock._group_locks._locks, {})
+
+  @testing.gen_test
+  def test_overlapping_groups(self):
+    # Cross-group attempts that list groups in different orders should not
+    # deadlock each other.
+    yield [self.hold_lock([group_key(1), group_key(2)]),
+           self.hold_lock([group_key(2), group_key(1)]),
+           self.hold_lock([group_key(3)])]
+    self.assertEqual(EntityLock._group_locks._locks, {})
+
+  def mock_contenders(self, lock, children_responses):
+    """ Makes a lock's ZooKeeper calls return the given contenders. """
+    node = lock.prefix + '0000000001'
+    tornado_zk = flexmock()
+    tornado_zk.should_receive('ensure_path').and_return(gen.maybe_future(None))
+    tornado_zk.should_receive('create').\
+      and_return(gen.maybe_future(lock.paths[0] + '/' + node))
+    expectation = tornado_zk.should_receive('get_children')
+    for children in children_responses:
+      expectation.and_return(gen.maybe_future(
+        [child.replace('ours', node) for child in children]))
+
+    lock.tornado_zk = tornado_zk
+    return tornado_zk
+
+  @testing.gen_test
+  def test_acquire_async(self):
+    lock = EntityLock(self.client, [group_key(1)], txid=5)
+    tornado_zk = self.mock_contenders(
+      lock, [['ours', 'other__lock__0000000000'], ['ours']])
+
+    # The predecessor gets removed after the watch is set.
+    def exists(path, watch):
+      self.assertTrue(path.endswith('other__lock__0000000000'))
+      watch(None)
+      return gen.maybe_future(True)
+
+    tornado_zk.should_receive('exists').replace_with(exists).once()
+    acquired = yield lock._acquire_async(self.io_loop.time() + 1)
+    self.assertTrue(acquired)
+    self.assertTrue(lock.is_acquired)
+
+  @testing.gen_test
+  def test_acquire_async_timeout(self):
+    lock = EntityLock(self.client, [group_key(1)], txid=5)
+    tornado_zk = self.mock_contenders(
+      lock, [['other__lock__0000000000', 'ours']])
+    tornado_zk.should_receive('exists').and_return(gen.maybe_future(True))
+
+    # The contender node is cleaned up when giving up.
+    tornado_zk.should_receive('delete').\
+      with_args(lock.paths[0] + '/' + lock.prefix + '0000000001').\
+      and_return(gen.maybe_future(None)).once()
+    with self.assertRaises(LockTimeout):
+      yield lock._acquire_async(self.io_loop.time() + 0.01)
+
+    self.assertFalse(lock.is_acquired)
+
+  @testing.gen_test
+  def test_release_async(self):
+    lock = EntityLock(self.client, [group_key(1)], txid=5)
+    tornado_zk = self.mock_contenders(lock, [['ours']])
+    acquired = yield lock._acquire_async(self.io_loop.time() + 1)
+    self.assertTrue(acquired)
+
+    # The contender node is removed, but the group path still has others.
+    tornado_zk.should_receive('delete').\
+      with_args(lock.paths[0] + '/' + lock.prefix + '0000000001').\
+      and_return(gen.maybe_future(None)).once()
+    tornado_zk.should_receive('delete').with_args(lock.paths[0]).\
+      and_raise(NotEmptyError).once()
+    yield lock.release_async()
+    self.assertFalse(lock.is_acquired)
+
+  def test_sync_acquire(self):
+    # The synchronous methods are run on a private IOLoop.
+    lock = EntityLock(self.client, [group_key(1)], txid=5)
+    tornado_zk = self.mock_contenders(lock, [['ours']])
+    with lock:
+      self.assertTrue(lock.is_acquired)
+      tornado_zk.should_receive('delete').and_return(gen.maybe_future(None))
+
+    self.assertFalse(lock.is_acquired)
+
+  def test_late_watch(self):
+    lock = EntityLock(self.client, [group_key(1)], txid=5)
+    tornado_zk = self.mock_contenders(
+      lock, [['ours', 'other__lock__0000000000'], ['ours']])
+    watches = []
+
+    def exists(path, watch):
+      watches.append(watch)
+      return gen.maybe_future(False)
+
+    tornado_zk.should_receive('exists').replace_with(exists)
+    tornado_zk.should_receive('delete').and_return(gen.maybe_future(None))
+    with lock:
+      self.assertTrue(lock.is_acquired)
+
+    # The watch fires after the private IOLoop has been closed.
+    watches[0](None)
+
+  @testing.gen_test
+  def test_local_timeout(self):
+    group_locks = GroupLocks()
+    paths = ['/locks/a', '/locks/b']
+    yield group_locks.acquire(paths, self.io_loop.time() + 1)
+    with self.assertRaises(LockTimeout):
+      yield group_locks.acquire(['/locks/c', '/locks/b'],
+                                self.io_loop.time() + 0.01)
+
+    # The lock that was taken before the timeout should have been released.
+    self.assertNotIn('/locks/c', group_locks._locks)
+    group_locks.release(paths)
+    self.assertEqual(group_locks._locks, {})
+
+
+class TestLockStats(unittest.TestCase):
+  def test_stats(self):
+    stats = LockStats()
+    stats.record(0.0005, acquired=True)
+    stats.record(0.05, acquired=True)
+    stats.record(10, acquired=False, timed_out=True)
+    report = stats.stats()
+    self.assertEqual(report['acquired'], 2)
+    self.assertEqual(report['failed'], 1)
+    self.assertEqual(report['timeouts'], 1)
+    self.assertEqual(report['wait_time'], 10050)
+    self.assertEqual(report['wait_histogram'],
+                     {'1': 1, '10': 0, '100': 1, '1000': 0, '10000': 1,
+                      'inf': 0})
@@ -36,6 +36,9 @@ class FakeDatastore():
   def range_query(self, table, schema, start, end, batch_size,
     start_inclusive=True, end_inclusive=True):
     return []
+  def range_scan(self, table, schema, start, end, limit=None, offset=0,
+    start_inclusive=True, end_inclusive=True, page_size=100):
+    return None
   def batch_delete(self, table, row_keys):
     raise dbconstants.AppScaleDBConnectionError("Bad connection")
 
@@ -65,6 +68,8 @@ class FakeEntity():
     return 'kind'
   def key(self):
     return FakeReference()
+  def property_list(self):
+    return []
   def delete(self):
     raise Exception()
   def put(self):
@@ -107,7 +112,7 @@ class TestGroomer(unittest.TestCase):
     zookeeper = flexmock()
     dsg = groomer.DatastoreGroomer(zookeeper, "cassandra", "localhost:8888")
     dsg = flexmock(dsg)
-    dsg.should_receive("get_entity_batch").and_return([])
+    dsg.should_receive("scan_table")
     dsg.should_receive("process_entity")
     dsg.should_receive("update_statistics").and_raise(Exception)
     dsg.should_receive("remove_old_logs").and_return()
@@ -116,6 +121,19 @@ class TestGroomer(unittest.TestCase):
     ds_factory.should_receive("getDatastore").and_return(FakeDatastore())
     self.assertRaises(Exception, dsg.run_groomer)
 
+  def test_get_scan_ranges(self):
+    zookeeper = flexmock()
+    dsg = groomer.DatastoreGroomer(zookeeper, "cassandra", "localhost:8888")
+
+    dsg.groomer_state = [dsg.CLEAN_ENTITIES_TASK, 'a', 'b', 'c', '']
+    self.assertEquals(dsg.get_scan_ranges(dsg.CLEAN_ENTITIES_TASK),
+                      [('a', 'b'), ('c', '')])
+
+    # State written by older versions only contains the last key.
+    dsg.groomer_state = [dsg.CLEAN_ENTITIES_TASK, 'a']
+    self.assertEquals(dsg.get_scan_ranges(dsg.CLEAN_ENTITIES_TASK),
+                      [('a', '')])
+
   def test_process_entity(self):
     zookeeper = flexmock()
     flexmock(entity_pb).should_receive('EntityProto').and_return(FakeEntity())
@@ -0,0 +1,234 @@
+import sys
+import unittest
+
+from flexmock import flexmock
+from kazoo.exceptions import NoNodeError
+from tornado import gen
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore import dbconstants
+from appscale.datastore.cassandra_env import token_ranges
+from appscale.datastore.index_backfill import (
+  BuildingIndexes, IndexBackfill, decode_job, encode_job, index_metadata_key,
+  job_node, job_progress)
+from appscale.datastore.index_encoder import IndexEncoder
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import entity_pb
+
+
+def make_index():
+  index = entity_pb.CompositeIndex()
+  index.set_id(7)
+  index.set_app_id('guestbook')
+  index.set_state(entity_pb.CompositeIndex.WRITE_ONLY)
+  definition = index.mutable_definition()
+  definition.set_entity_type('Greeting')
+  definition.set_ancestor(False)
+  for name in ('author', 'date'):
+    prop = definition.add_property()
+    prop.set_name(name)
+    prop.set_direction(entity_pb.Index_Property.ASCENDING)
+
+  return index
+
+
+def make_entity(kind, entity_id, namespace=''):
+  entity = entity_pb.EntityProto()
+  key = entity.mutable_key()
+  key.set_app('guestbook')
+  key.set_name_space(namespace)
+  element = key.mutable_path().add_element()
+  element.set_type(kind)
+  element.set_id(entity_id)
+  entity.mutable_entity_group().add_element().CopyFrom(element)
+  for name, value in (('author', 'bob'), ('date', str(entity_id))):
+    prop = entity.add_property()
+    prop.set_name(name)
+    prop.set_multiple(False)
+    prop.mutable_value().set_stringvalue(value)
+
+  return entity
+
+
+class FakeScan(object):
+  def __init__(self, rows):
+    self.rows = rows
+
+  @gen.coroutine
+  def next_page(self):
+    rows, self.rows = self.rows, []
+    raise gen.Return(rows)
+
+
+class FakeDatastore(object):
+  """ Stores the tables that a backfill reads and writes in memory. """
+  def __init__(self, entities, index):
+    self.cluster = None
+    self.scans = []
+    self.tables = {dbconstants.APP_ENTITY_TABLE: {},
+                   dbconstants.APP_KIND_TABLE: {},
+                   dbconstants.COMPOSITE_TABLE: {},
+                   dbconstants.METADATA_TABLE: {}}
+    encoder = IndexEncoder()
+    for entity in entities:
+      rows = encoder.entity_rows(entity)
+      self.tables[dbconstants.APP_ENTITY_TABLE][rows.entity_key] = {
+        dbconstants.APP_ENTITY_SCHEMA[0]: entity.Encode()}
+      self.tables[dbconstants.APP_KIND_TABLE][rows.kind_key] = {
+        'reference': rows.entity_key}
+
+    metadata_key = index_metadata_key('guestbook', index.id())
+    self.tables[dbconstants.METADATA_TABLE][metadata_key] = {
+      dbconstants.METADATA_SCHEMA[0]: index.Encode()}
+
+  def range_scan(self, table, schema, start, end, limit=None,
+                 start_inclusive=True, page_size=100):
+    self.scans.append((table, start, end))
+    rows = sorted((key, columns)
+                  for key, columns in self.tables[table].iteritems()
+                  if key > start and (not end or key <= end))
+    return FakeScan(rows[:limit])
+
+  def batch_get_entity_sync(self, table, keys, schema):
+    return {key: self.tables[table].get(key, {}) for key in keys}
+
+  def batch_put_entity_sync(self, table, keys, schema, values):
+    for key in keys:
+      self.tables[table][key] = values[key]
+
+
+class TestIndexBackfill(unittest.TestCase):
+  def setUp(self):
+    flexmock(token_ranges).should_receive('get_boundaries').and_return([])
+
+  def make_zk_client(self, job):
+    zk_client = flexmock(nodes={job_node(7): encode_job(job)})
+    zk_client.retry = lambda function, *args: function(*args)
+
+    def get(path):
+      try:
+        return zk_client.nodes[path], None
+      except KeyError:
+        raise NoNodeError()
+
+    def set_data(path, value):
+      if path not in zk_client.nodes:
+        raise NoNodeError()
+
+      zk_client.nodes[path] = value
+
+    zk_client.get = get
+    zk_client.set = set_data
+    zk_client.delete = lambda path: zk_client.nodes.pop(path)
+    return zk_client
+
+  def test_build(self):
+    index = make_index()
+    entities = [make_entity('Greeting', 1), make_entity('Greeting', 2, 'ns'),
+                make_entity('Other', 3)]
+    db = FakeDatastore(entities, index)
+    job = {'project': 'guestbook', 'index': index, 'ranges': None,
+           'remaining': None, 'processed': 0}
+    zk_client = self.make_zk_client(job)
+
+    backfill = IndexBackfill(zk_client, db, workers=2)
+    backfill.SCAN_RANGES = 4
+    backfill.build('7')
+
+    # Entities of other kinds should be skipped.
+    encoder = IndexEncoder()
+    expected = set()
+    for entity in entities[:2]:
+      expected.update(encoder.composite_keys(index, entity))
+
+    self.assertSetEqual(set(db.tables[dbconstants.COMPOSITE_TABLE]), expected)
+    self.assertNotIn(job_node(7), zk_client.nodes)
+
+    metadata_key = index_metadata_key('guestbook', index.id())
+    stored = entity_pb.CompositeIndex(
+      db.tables[dbconstants.METADATA_TABLE][metadata_key]['data'])
+    self.assertEqual(stored.state(), entity_pb.CompositeIndex.READ_WRITE)
+
+  def test_kind_ranges(self):
+    index = make_index()
+    entities = [make_entity('Greeting', 1), make_entity('Other', 2, 'ns'),
+                make_entity('Greeting', 3, 'ns2')]
+    db = FakeDatastore(entities, index)
+    backfill = IndexBackfill(None, db)
+    backfill.SCAN_RANGES = 6
+
+    # Only the kind's rows in each namespace are scanned.
+    ranges = backfill._kind_ranges('guestbook', 'Greeting')
+    self.assertEqual(len(ranges), 6)
+    prefixes = [dbconstants.KEY_DELIMITER.join(
+                  ['guestbook', namespace,
+                   'Greeting' + dbconstants.KIND_SEPARATOR])
+                for namespace in ('', 'ns', 'ns2')]
+    for prefix in prefixes:
+      self.assertEqual(
+        len([(start, end) for start, end in ranges
+             if start.startswith(prefix) and end.startswith(prefix)]), 2)
+
+    # Each namespace is found with a single-row scan.
+    self.assertEqual(len(db.scans), 4)
+
+  def test_resume(self):
+    index = make_index()
+    entities = [make_entity('Greeting', entity_id)
+                for entity_id in range(1, 5)]
+    db = FakeDatastore(entities, index)
+    kind_keys = sorted(db.tables[dbconstants.APP_KIND_TABLE])
+
+    # The first two entities were handled before the worker stopped.
+    start = 'guestbook' + dbconstants.KEY_DELIMITER
+    end = start + dbconstants.TERMINATING_STRING
+    job = {'project': 'guestbook', 'index': index, 'ranges': [(start, end)],
+           'remaining': [(kind_keys[1], end)], 'processed': 2}
+    zk_client = self.make_zk_client(job)
+
+    IndexBackfill(zk_client, db).build('7')
+    encoder = IndexEncoder()
+    expected = set()
+    for entity in entities[2:]:
+      expected.update(encoder.composite_keys(index, entity))
+
+    self.assertSetEqual(set(db.tables[dbconstants.COMPOSITE_TABLE]), expected)
+
+  def test_deleted_index(self):
+    index = make_index()
+    db = FakeDatastore([make_entity('Greeting', 1)], index)
+    db.tables[dbconstants.METADATA_TABLE] = {}
+    job = {'project': 'guestbook', 'index': index, 'ranges': None,
+           'remaining': None, 'processed': 0}
+    zk_client = self.make_zk_client(job)
+
+    IndexBackfill(zk_client, db).build('7')
+    self.assertDictEqual(db.tables[dbconstants.COMPOSITE_TABLE], {})
+    self.assertNotIn(job_node(7), zk_client.nodes)
+
+  def test_progress(self):
+    index = make_index()
+    job = {'project': 'guestbook', 'index': index,
+           'ranges': [('a', 'c'), ('c', 'e'), ('e', 'g')],
+           'remaining': [('b', 'c'), ('e', 'g')], 'processed': 5}
+    decoded = decode_job(encode_job(job))
+    self.assertEqual(decoded['remaining'], job['remaining'])
+    self.assertEqual(decoded['index'].id(), 7)
+    self.assertEqual(job_progress(decoded), 50)
+
+    job['ranges'] = None
+    self.assertEqual(job_progress(job), 0)
+
+  def test_building_indexes(self):
+    watches = []
+    zk_client = flexmock(ensure_path=lambda path: None)
+    zk_client.ChildrenWatch = lambda path, func: watches.append(func)
+    building_indexes = BuildingIndexes(zk_client)
+
+    watches[0](['7'])
+    self.assertTrue(building_indexes.is_building(7))
+    self.assertFalse(building_indexes.is_building(8))
+
+    watches[0]([])
+    self.assertFalse(building_indexes.is_building(7))
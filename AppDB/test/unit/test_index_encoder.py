@@ -0,0 +1,149 @@
+import sys
+import unittest
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore import dbconstants
+from appscale.datastore.index_encoder import IndexEncoder
+from appscale.datastore.utils import (
+  get_composite_index_keys,
+  get_composite_indexes_rows,
+  get_entity_key,
+  get_index_kv_from_tuple,
+  get_kind_key,
+  get_scatter_prop
+)
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import entity_pb
+
+ASC = entity_pb.Index_Property.ASCENDING
+DSC = entity_pb.Index_Property.DESCENDING
+
+
+def make_entity(path, properties, namespace=''):
+  entity = entity_pb.EntityProto()
+  key = entity.mutable_key()
+  key.set_app('guestbook')
+  key.set_name_space(namespace)
+  for kind, key_id in path:
+    element = key.mutable_path().add_element()
+    element.set_type(kind)
+    if isinstance(key_id, basestring):
+      element.set_name(key_id)
+    else:
+      element.set_id(key_id)
+
+  for name, value in properties:
+    prop = entity.add_property()
+    prop.set_name(name)
+    prop.set_multiple(len([prop_name for prop_name, _ in properties
+                           if prop_name == name]) > 1)
+    if isinstance(value, basestring):
+      prop.mutable_value().set_stringvalue(value)
+    elif isinstance(value, dict):
+      user_value = prop.mutable_value().mutable_uservalue()
+      user_value.set_email(value['email'])
+      user_value.set_auth_domain(value['auth_domain'])
+      user_value.set_gaiaid(value['gaiaid'])
+    else:
+      prop.mutable_value().set_int64value(value)
+
+  return entity
+
+
+def make_index(index_id, kind, properties, ancestor=False):
+  index = entity_pb.CompositeIndex()
+  index.set_id(index_id)
+  index.set_app_id('guestbook')
+  index.set_state(entity_pb.CompositeIndex.READ_WRITE)
+  definition = index.mutable_definition()
+  definition.set_entity_type(kind)
+  definition.set_ancestor(ancestor)
+  for name, direction in properties:
+    prop = definition.add_property()
+    prop.set_name(name)
+    prop.set_direction(direction)
+
+  return index
+
+
+INDEXES = [
+  make_index(1, 'Greeting', [('author', ASC), ('date', DSC)]),
+  make_index(2, 'Greeting', [('tag', ASC), ('__key__', DSC)], ancestor=True),
+  make_index(3, 'Greeting', [('missing', ASC), ('date', ASC)]),
+  make_index(4, 'Other', [('author', ASC)])
+]
+
+
+class TestIndexEncoder(unittest.TestCase):
+  def assert_matches_utils(self, entity):
+    prefix = dbconstants.KEY_DELIMITER.join(
+      ['guestbook', entity.key().name_space()])
+    rows = IndexEncoder(INDEXES).entity_rows(entity)
+
+    self.assertEqual(rows.entity_key,
+                     get_entity_key(prefix, entity.key().path()))
+    self.assertEqual(rows.kind_key, get_kind_key(prefix, entity.key().path()))
+    self.assertListEqual(
+      rows.asc_keys,
+      [row[0] for row in get_index_kv_from_tuple([(prefix, entity)])])
+    self.assertListEqual(
+      rows.dsc_keys,
+      [row[0] for row
+       in get_index_kv_from_tuple([(prefix, entity)], reverse=True)])
+    self.assertListEqual(rows.composite_keys,
+                         get_composite_indexes_rows([entity], INDEXES))
+
+  def test_simple_entity(self):
+    entity = make_entity([('Greeting', 5)],
+                         [('author', 'bob'), ('date', 1500000000)])
+    self.assert_matches_utils(entity)
+
+  def test_multiple_values(self):
+    entity = make_entity(
+      [('Guestbook', 'main'), ('Greeting', 'hello')],
+      [('author', 'bob'), ('date', 3), ('tag', 'a'), ('tag', 'b\x00\x01c'),
+       ('date', -7)], namespace='ns')
+    self.assert_matches_utils(entity)
+
+  def test_ancestors(self):
+    entity = make_entity(
+      [('Guestbook', 1), ('Page', 'two'), ('Greeting', 3)],
+      [('tag', 'x'), ('tag', 'y')])
+    self.assert_matches_utils(entity)
+
+  def test_user_value(self):
+    user = {'email': 'a@example.com', 'auth_domain': 'example.com',
+            'gaiaid': 12}
+    entity = make_entity([('Greeting', 9)],
+                         [('author', user), ('date', 1)])
+    self.assert_matches_utils(entity)
+
+  def test_scatter_property(self):
+    entity_id = next(entity_id for entity_id in range(1, 100000)
+                     if get_scatter_prop(make_entity(
+                       [('Greeting', entity_id)], []).key().path().
+                       element_list()) is not None)
+    entity = make_entity([('Greeting', entity_id)],
+                         [('author', 'bob'), ('date', 2)])
+    rows = IndexEncoder(INDEXES).entity_rows(entity)
+    self.assertEqual(len(rows.asc_keys), 3)
+    self.assert_matches_utils(entity)
+
+  def test_composite_keys(self):
+    encoder = IndexEncoder()
+    entity = make_entity([('Guestbook', 1), ('Greeting', 'hello')],
+                         [('tag', 'x'), ('author', 'bob'), ('date', 4)])
+    for index in INDEXES:
+      self.assertListEqual(encoder.composite_keys(index, entity),
+                           get_composite_index_keys(index, entity))
+
+  def test_layout_cache(self):
+    encoder = IndexEncoder(INDEXES)
+    entities = [make_entity([('Greeting', entity_id)], [('author', 'bob')])
+                for entity_id in range(1, 4)]
+    encoder.encode(entities)
+    self.assertEqual(len(encoder._layouts), 1)
+
+    encoder.encode([make_entity([('Greeting', 1)], [], namespace='ns')])
+    self.assertEqual(len(encoder._layouts), 2)
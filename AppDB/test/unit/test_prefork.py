@@ -0,0 +1,75 @@
+import json
+import socket
+import unittest
+
+import tornado.web
+from flexmock import flexmock
+from tornado import gen, testing
+
+from appscale.datastore.prefork import bind_shared_socket, merge_stats
+from appscale.datastore.scripts import datastore
+
+
+class TestPrefork(unittest.TestCase):
+  def test_bind_shared_socket(self):
+    first = bind_shared_socket(0, address='127.0.0.1')
+    port = first.getsockname()[1]
+    try:
+      # Another worker can listen on the same port.
+      second = bind_shared_socket(port, address='127.0.0.1')
+      second.close()
+    finally:
+      first.close()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1)
+    try:
+      # Sockets without SO_REUSEPORT keep the port to themselves.
+      self.assertRaises(socket.error, bind_shared_socket,
+                        sock.getsockname()[1], '127.0.0.1')
+    finally:
+      sock.close()
+
+  def test_merge_stats(self):
+    total = {'Get': {'0': [2, 0.5]},
+             'EntityCache': {'hits': 3, 'bytes': {'guestbook': 100}}}
+    merge_stats(total, {'Get': {'0': [1, 0.25], '1': [1, 0.1]},
+                        'Put': {'0': [4, 1.0]},
+                        'EntityCache': {'hits': 2, 'bytes': {'guestbook': 50,
+                                                             'other': 10}}})
+    self.assertEqual(total, {
+      'Get': {'0': [3, 0.75], '1': [1, 0.1]},
+      'Put': {'0': [4, 1.0]},
+      'EntityCache': {'hits': 5, 'bytes': {'guestbook': 150, 'other': 10}}
+    })
+
+
+class TestStatsHandler(testing.AsyncHTTPTestCase):
+  def get_app(self):
+    return tornado.web.Application([
+      ('/service-stats', datastore.StatsHandler),
+      ('/worker-stats', datastore.StatsHandler, {'relay': False})
+    ])
+
+  def test_worker_stats(self):
+    response = self.fetch('/worker-stats')
+    stats = json.loads(response.body)
+    self.assertEqual(stats['worker_id'], 0)
+    self.assertIn('recent_stats', stats)
+
+  def test_stats_for_each_worker(self):
+    other_worker = {'worker_id': 1, 'current_requests': 2,
+                    'cumulative_counters': {'all': 5}, 'recent_stats': {}}
+    relayed = gen.Future()
+    relayed.set_result([flexmock(body=json.dumps(other_worker))])
+    flexmock(datastore.StatsHandler).should_receive('relay_to_workers').\
+      and_return(relayed)
+
+    response = self.fetch('/service-stats?last_milliseconds=1000')
+    workers = json.loads(response.body)['workers']
+    self.assertListEqual([stats['worker_id'] for stats in workers], [0, 1])
+    self.assertDictEqual(workers[1], other_worker)
+
+    response = self.fetch('/service-stats?cursor=invalid')
+    self.assertEqual(response.code, 400)
@@ -0,0 +1,145 @@
+import json
+import sys
+import unittest
+
+from flexmock import flexmock
+from tornado import gen, testing
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore.dbconstants import AppScaleDBConnectionError
+from appscale.datastore.query_planner import (
+  PropertyStatsCollector, QueryPlanner, Strategy, property_stats_key)
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import datastore_pb
+from google.appengine.datastore import entity_pb
+
+EQUAL = datastore_pb.Query_Filter.EQUAL
+
+
+def new_entity(properties):
+  entity = entity_pb.EntityProto()
+  for name, value in properties.iteritems():
+    prop = entity.add_property()
+    prop.set_name(name)
+    prop.set_multiple(False)
+    prop.mutable_value().set_stringvalue(value)
+
+  return entity
+
+
+def new_query(kind='Greeting'):
+  query = datastore_pb.Query()
+  query.set_app('guestbook')
+  query.set_kind(kind)
+  return query
+
+
+class TestPropertyStatsCollector(unittest.TestCase):
+  def test_serialize(self):
+    collector = PropertyStatsCollector()
+    for index in range(10):
+      collector.add_entity('guestbook', '', 'Greeting', new_entity(
+        {'author': 'user{}'.format(index % 2), 'content': str(index)}))
+
+    stats = json.loads(collector.serialize('guestbook'))
+    self.assertEqual(stats['']['Greeting']['entities'], 10)
+    self.assertEqual(stats['']['Greeting']['properties'],
+                     {'author': [10, 2], 'content': [10, 10]})
+    self.assertEqual(collector.projects, ['guestbook'])
+    self.assertEqual(json.loads(collector.serialize('other')), {})
+
+  def test_distinct_values_are_extrapolated(self):
+    collector = PropertyStatsCollector()
+    collector.MAX_TRACKED_VALUES = 10
+    for index in range(40):
+      collector.add_entity('guestbook', '', 'Greeting',
+                           new_entity({'content': str(index)}))
+
+    stats = json.loads(collector.serialize('guestbook'))
+    self.assertEqual(stats['']['Greeting']['properties']['content'],
+                     [40, 40])
+
+
+class TestQueryPlanner(testing.AsyncTestCase):
+  STATS = {'': {'Greeting': {
+    'entities': 100000,
+    'properties': {
+      # Two values, so each one matches about 50,000 entities.
+      'public': [100000, 2],
+      # Each author has about 10 entities.
+      'author': [100000, 10000],
+      'content': [100000, 100000]
+    }
+  }}}
+
+  def get_planner(self, stats):
+    db = flexmock()
+    future = gen.Future()
+    future.set_result(json.dumps(stats) if stats is not None else None)
+    db.should_receive('get_metadata').\
+      with_args(property_stats_key('guestbook')).and_return(future).once()
+    return QueryPlanner(db)
+
+  @testing.gen_test
+  def test_selective_property_avoids_merge_join(self):
+    planner = self.get_planner(self.STATS)
+    filter_info = {'public': [(EQUAL, 'true')], 'author': [(EQUAL, 'bob')]}
+    plans = yield planner.plan(new_query(), filter_info, [], 20, True)
+
+    self.assertEqual(plans[0].strategy, Strategy.FILTERED_SINGLE_PROPERTY)
+    self.assertEqual(plans[0].property_name, 'author')
+    self.assertEqual(len(plans), 3)
+
+    # The statistics are cached.
+    plans = yield planner.plan(new_query(), filter_info, [], 20, True)
+    self.assertEqual(plans[0].property_name, 'author')
+
+  @testing.gen_test
+  def test_merge_join_for_similar_properties(self):
+    stats = {'': {'Greeting': {
+      'entities': 100000,
+      'properties': {'author': [100000, 1000], 'tag': [100000, 1000]}}}}
+    planner = self.get_planner(stats)
+    filter_info = {'author': [(EQUAL, 'bob')], 'tag': [(EQUAL, 'news')]}
+    plans = yield planner.plan(new_query(), filter_info, [], 20, True)
+    self.assertEqual(plans[0].strategy, Strategy.ZIGZAG_MERGE_JOIN)
+
+  @testing.gen_test
+  def test_no_stats(self):
+    planner = self.get_planner(None)
+    filter_info = {'public': [(EQUAL, 'true')], 'author': [(EQUAL, 'bob')]}
+    plans = yield planner.plan(new_query(), filter_info, [], 20, True)
+    self.assertEqual(plans[0].strategy, Strategy.ZIGZAG_MERGE_JOIN)
+    self.assertIsNone(plans[0].cost)
+
+    explanation = planner.explain(plans)
+    self.assertEqual(explanation['strategy'], Strategy.ZIGZAG_MERGE_JOIN)
+    self.assertEqual(len(explanation['candidates']), 3)
+
+  @testing.gen_test
+  def test_unavailable_stats(self):
+    db = flexmock()
+    db.should_receive('get_metadata').and_raise(
+      AppScaleDBConnectionError('Bad connection'))
+    planner = QueryPlanner(db)
+    plans = yield planner.plan(new_query(), {}, [], 20, False)
+    self.assertEqual(len(plans), 1)
+    self.assertEqual(plans[0].strategy, Strategy.KIND)
+
+  @testing.gen_test
+  def test_single_strategy(self):
+    planner = self.get_planner(self.STATS)
+    filter_info = {'author': [(EQUAL, 'bob')]}
+    plans = yield planner.plan(new_query(), filter_info, [], 20, False)
+    self.assertEqual(len(plans), 1)
+    self.assertEqual(plans[0].strategy, Strategy.SINGLE_PROPERTY)
+    self.assertEqual(plans[0].rows, 10)
+
+    # Queries that none of the strategies support use the default order.
+    filter_info = {'author': [(datastore_pb.Query_Filter.GREATER_THAN, 'a')],
+                   'content': [(datastore_pb.Query_Filter.LESS_THAN, 'b')]}
+    plans = yield planner.plan(new_query(), filter_info, [], 20, False)
+    self.assertEqual(plans, [])
+    self.assertEqual(planner.explain(plans),
+                     {'strategy': None, 'candidates': []})
@@ -0,0 +1,142 @@
+import sys
+
+from tornado import gen, testing
+
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore.datastore_distributed import DatastoreDistributed
+from appscale.datastore.range_iterator import RangeExhausted, RangeIterator
+from appscale.datastore.utils import encode_index_pb
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.datastore import entity_pb
+from google.appengine.datastore.datastore_pb import Path
+
+
+def new_path(entity_id):
+  path = Path()
+  element = path.add_element()
+  element.set_type('Greeting')
+  element.set_id(entity_id)
+  return path
+
+
+def new_value(value):
+  prop_value = entity_pb.PropertyValue()
+  prop_value.set_stringvalue(value)
+  return prop_value
+
+
+class FakeIndex(object):
+  """ Keeps index entries in memory and counts range queries. """
+  def __init__(self):
+    self.rows = []
+    self.queries = 0
+
+  def add_entries(self, prop_name, value, entity_ids):
+    range_ = RangeIterator(self, 'guestbook', '', 'Greeting', prop_name,
+                           new_value(value))
+    for entity_id in entity_ids:
+      key = range_.prefix + str(encode_index_pb(new_path(entity_id)))
+      self.rows.append({key: {'reference': 'Greeting:{}'.format(entity_id)}})
+
+    self.rows.sort(key=lambda row: row.keys()[0])
+
+  @gen.coroutine
+  def range_query(self, table, schema, start, end, limit, start_inclusive=True):
+    self.queries += 1
+    rows = [row for row in self.rows
+            if (row.keys()[0] > start or
+                (start_inclusive and row.keys()[0] == start)) and
+            row.keys()[0] <= end]
+    raise gen.Return(rows[:limit])
+
+
+class TestRangeIterator(testing.AsyncTestCase):
+  @testing.gen_test
+  def test_iterate_range(self):
+    index = FakeIndex()
+    index.add_entries('color', 'red', range(1, 501))
+    index.add_entries('color', 'blue', range(1, 10))
+    range_ = RangeIterator(index, 'guestbook', '', 'Greeting', 'color',
+                           new_value('red'))
+
+    entity_ids = []
+    while True:
+      try:
+        entry = yield range_.async_next()
+      except RangeExhausted:
+        break
+
+      entity_ids.append(entry.path.element(0).id())
+
+    self.assertListEqual(entity_ids, range(1, 501))
+
+    # The page size grows as entries are consumed sequentially.
+    self.assertLess(range_.fetches, 5)
+    self.assertEqual(range_.fetches, index.queries)
+
+  @testing.gen_test
+  def test_seek_within_cache(self):
+    index = FakeIndex()
+    index.add_entries('color', 'red', range(1, 51))
+    range_ = RangeIterator(index, 'guestbook', '', 'Greeting', 'color',
+                           new_value('red'))
+
+    entry = yield range_.async_next()
+    self.assertEqual(entry.path.element(0).id(), 1)
+
+    range_.set_cursor(new_path(30), inclusive=True)
+    entry = yield range_.async_next()
+    self.assertEqual(entry.path.element(0).id(), 30)
+    self.assertEqual(index.queries, 1)
+
+    range_.set_cursor(new_path(50), inclusive=False)
+    with self.assertRaises(RangeExhausted):
+      yield range_.async_next()
+
+    self.assertEqual(index.queries, 1)
+
+  @testing.gen_test
+  def test_chunk_size_grows_when_skipping(self):
+    index = FakeIndex()
+    index.add_entries('color', 'red', range(1, 5001))
+    range_ = RangeIterator(index, 'guestbook', '', 'Greeting', 'color',
+                           new_value('red'))
+
+    for entity_id in range(1, 5001, 250):
+      range_.set_cursor(new_path(entity_id), inclusive=True)
+      entry = yield range_.async_next()
+      self.assertEqual(entry.path.element(0).id(), entity_id)
+
+    self.assertEqual(range_._chunk_size, RangeIterator.CHUNK_SIZE)
+    self.assertLess(range_.fetches, 20)
+
+  @testing.gen_test
+  def test_merge_join(self):
+    index = FakeIndex()
+    index.add_entries('color', 'red', range(1, 1001))
+    index.add_entries('size', 'small', range(1, 1001, 100))
+    ranges = [
+      RangeIterator(index, 'guestbook', '', 'Greeting', 'color',
+                    new_value('red')),
+      RangeIterator(index, 'guestbook', '', 'Greeting', 'size',
+                    new_value('small'))
+    ]
+
+    refs = yield DatastoreDistributed._common_refs_from_ranges(ranges, 100)
+    self.assertEqual(sorted(refs.keys()),
+                     sorted('Greeting:{}'.format(entity_id)
+                            for entity_id in range(1, 1001, 100)))
+    for entries in refs.values():
+      self.assertEqual([entry['prop_name'] for entry in entries],
+                       ['color', 'size'])
+
+    # Stop once the limit has been reached.
+    ranges = [
+      RangeIterator(index, 'guestbook', '', 'Greeting', 'color',
+                    new_value('red')),
+      RangeIterator(index, 'guestbook', '', 'Greeting', 'size',
+                    new_value('small'))
+    ]
+    refs = yield DatastoreDistributed._common_refs_from_ranges(ranges, 2)
+    self.assertEqual(sorted(refs.keys()), ['Greeting:1', 'Greeting:101'])
@@ -0,0 +1,127 @@
+import sys
+
+from cassandra.query import BatchStatement, SimpleStatement
+from flexmock import flexmock
+from tornado import gen, testing
+
+from appscale.common.service_stats import stats_manager
+from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore import request_trace, statistics
+from appscale.datastore.cassandra_env.tornado_cassandra import (
+  TornadoCassandra, query_category)
+from appscale.datastore.request_trace import (
+  Category, RequestTrace, current_trace, timed)
+from appscale.datastore.scripts import datastore
+from appscale.datastore.statistics import service_stats
+
+sys.path.append(APPSCALE_PYTHON_APPSERVER)
+from google.appengine.ext.remote_api import remote_api_pb
+
+
+class TestRequestTrace(testing.AsyncTestCase):
+  @testing.gen_test
+  def test_trace_follows_coroutines(self):
+    @gen.coroutine
+    def handle_request():
+      with timed(Category.LOCK):
+        yield gen.moment
+
+      yield gen.moment
+      raise gen.Return(current_trace())
+
+    trace = RequestTrace()
+    other_trace = RequestTrace()
+    with trace.activate():
+      future = handle_request()
+
+    with other_trace.activate():
+      other_future = handle_request()
+
+    self.assertIsNone(current_trace())
+    results = yield [future, other_future]
+    self.assertIs(results[0], trace)
+    self.assertIs(results[1], other_trace)
+
+  def test_timed_without_trace(self):
+    with timed(Category.READ):
+      pass
+
+    self.assertIsNone(current_trace())
+
+  def test_fields(self):
+    flexmock(request_trace.time).should_receive('time').\
+      and_return(1.0).and_return(1.25)
+    trace = RequestTrace()
+    with trace.timer(Category.WRITE):
+      pass
+
+    fields = trace.fields()
+    self.assertEqual(fields['write_time'], 250)
+    self.assertEqual(fields['read_time'], 0)
+    self.assertEqual(fields['round_trips'], 0)
+
+  def test_query_category(self):
+    self.assertEqual(query_category('SELECT * FROM entities'), Category.READ)
+    self.assertEqual(query_category(SimpleStatement(' select value FROM t')),
+                     Category.READ)
+    self.assertEqual(query_category('INSERT INTO t (k) VALUES (1)'),
+                     Category.WRITE)
+    self.assertEqual(query_category(BatchStatement()), Category.WRITE)
+
+  @testing.gen_test
+  def test_database_round_trips(self):
+    cassandra_future = flexmock(add_callbacks=lambda *args, **kwargs: None)
+    session = flexmock()
+    session.should_receive('execute_async').and_return(cassandra_future)
+    tornado_cassandra = TornadoCassandra(session)
+
+    trace = RequestTrace()
+    with trace.activate():
+      read = tornado_cassandra.execute('SELECT * FROM entities')
+      write = tornado_cassandra.execute('DELETE FROM entities WHERE k = 1')
+
+    # Queries made outside of a request are not recorded.
+    tornado_cassandra.execute('SELECT * FROM entities')
+
+    read.set_result([])
+    write.set_result(None)
+    self.assertEqual(trace.round_trips, 2)
+    self.assertGreaterEqual(trace.timings[Category.READ], 0)
+
+  def test_service_stats(self):
+    trace = RequestTrace()
+    trace.round_trips = 3
+    stats_info = service_stats.start_request(app='guestbook')
+    stats_info.finalize(method='Get', status='OK', request_id='abc',
+                        **trace.fields())
+
+    recent = service_stats.get_recent()
+    self.assertGreaterEqual(recent['all'], 1)
+    self.assertIn('Get', recent['by_method'])
+    method_stats = recent['by_app']['guestbook']['by_method']['Get']
+    self.assertEqual(method_stats['avg_round_trips'], 3)
+    self.assertEqual(sum(method_stats['latency_histogram'].values()), 1)
+    self.assertEqual(service_stats.get_cumulative_counters()['failed'], 0)
+
+  @testing.gen_test
+  def test_failed_request_stats(self):
+    stats = stats_manager.ServiceStats(
+      'datastore', request_fields=statistics.REQUEST_STATS_FIELDS,
+      cumulative_counters=statistics.CUMULATIVE_COUNTERS,
+      default_metrics_for_recent=statistics.METRICS_CONFIG)
+    flexmock(datastore, service_stats=stats)
+    handler = datastore.MainHandler.__new__(datastore.MainHandler)
+    flexmock(handler).should_receive('put_request').\
+      and_raise(ValueError('Unexpected error'))
+    apirequest = remote_api_pb.Request()
+    apirequest.set_service_name('datastore_v3')
+    apirequest.set_method('Put')
+    apirequest.set_request('')
+
+    with self.assertRaises(ValueError):
+      yield handler.remote_request('guestbook', apirequest.Encode(),
+                                   RequestTrace(), None, None)
+
+    counters = stats.get_cumulative_counters()
+    self.assertEqual(counters['failed'], 1)
+    self.assertEqual(counters['by_method']['Put']['failed'], 1)
@@ -3,6 +3,7 @@
 """ Unit tests for restore_data.py """
 
 import argparse
+import cPickle
 import glob
 import time
 import unittest
@@ -10,6 +11,7 @@ import unittest
 from appscale.datastore import appscale_datastore_batch
 from appscale.datastore import datastore_distributed
 from appscale.datastore.backup.datastore_restore import DatastoreRestore
+from appscale.datastore.dbconstants import AppScaleDBConnectionError
 from appscale.datastore.zkappscale.zktransaction import ZKTransactionException
 from appscale.datastore.zkappscale.transaction_manager import (
   TransactionManager)
@@ -117,8 +119,26 @@ class TestRestore(unittest.TestCase):
     self.assertEquals(True, fake_restore.get_restore_lock())
 
   def test_store_entity_batch(self):
-    # TODO
-    pass
+    zookeeper = flexmock()
+    fake_restore = flexmock(DatastoreRestore('app_id', 'backup/dir',
+      zookeeper, "cassandra"))
+    entity = cPickle.loads(FAKE_PICKLED_ENTITY.lstrip())
+
+    stored = []
+    fake_restore.bulk_put_sync = \
+      lambda app_id, entities, indexes: stored.extend(entities)
+    self.assertTrue(fake_restore.store_entity_batch([entity]))
+    self.assertEqual(fake_restore.entities_restored, 1)
+    self.assertEqual(stored[0].key().app(), 'app_id')
+
+    # Batches are retried after connection errors.
+    flexmock(time).should_receive('sleep')
+    fake_restore.bulk_put_sync = flexmock()
+    fake_restore.should_receive('bulk_put_sync').\
+      and_raise(AppScaleDBConnectionError('Bad connection')).\
+      and_return(None)
+    self.assertTrue(fake_restore.store_entity_batch([entity]))
+    self.assertEqual(fake_restore.entities_restored, 2)
 
   def test_read_from_file_and_restore(self):
     # TODO
@@ -130,6 +150,7 @@ class TestRestore(unittest.TestCase):
       zookeeper, "cassandra"))
 
     flexmock(glob).should_receive('glob').and_return(['some/file.backup'])
+    fake_restore.should_receive('load_indexes')
     fake_restore.should_receive('read_from_file_and_restore').and_return()
 
     fake_restore.run_restore()
@@ -0,0 +1,199 @@
+import threading
+import unittest
+
+from flexmock import flexmock
+from tornado import gen
+
+from appscale.datastore.cassandra_env import get_token
+from appscale.datastore.cassandra_env import token_ranges
+from appscale.datastore.cassandra_env.token_ranges import (
+  ParallelScan, key_midpoint, range_fraction, split_range)
+from appscale.datastore.dbconstants import AppScaleDBConnectionError
+
+
+class FakeScan(object):
+  def __init__(self, pages):
+    self.pages = list(pages)
+
+  @gen.coroutine
+  def next_page(self):
+    if not self.pages:
+      raise gen.Return([])
+
+    page = self.pages.pop(0)
+    if isinstance(page, Exception):
+      raise page
+
+    raise gen.Return(page)
+
+
+class FakeDatastore(object):
+  def __init__(self, rows, errors=0):
+    self.rows = sorted(rows)
+    self.errors = errors
+    self.scans = []
+
+  def range_scan(self, table, schema, start, end, limit=None, offset=0,
+                 start_inclusive=True, end_inclusive=True, page_size=100):
+    self.scans.append((start, end))
+    keys = [key for key in self.rows
+            if key > start and (not end or key <= end)]
+    pages = [[(key, {}) for key in keys[index:index + page_size]]
+             for index in range(0, len(keys), page_size)]
+    if self.errors:
+      self.errors -= 1
+      pages.insert(1, AppScaleDBConnectionError('Bad connection'))
+
+    return FakeScan(pages)
+
+
+class TestTokenRanges(unittest.TestCase):
+  def test_key_midpoint(self):
+    self.assertEqual(key_midpoint('a', 'c'), 'b')
+    self.assertEqual(key_midpoint('', ''), '\x80')
+
+    middle = key_midpoint('guestbook\x00', 'guestbook\x01')
+    self.assertTrue('guestbook\x00' < middle < 'guestbook\x01')
+
+    middle = key_midpoint('\xff\xff', '')
+    self.assertTrue(middle > '\xff\xff')
+
+    # There are no keys between a key and the key followed by a null byte.
+    self.assertIsNone(key_midpoint('a', 'a\x00'))
+
+  def test_range_fraction(self):
+    self.assertEqual(range_fraction('a', 'c', 'b'), 0.5)
+    self.assertEqual(range_fraction('', '', '\x80'), 0.5)
+
+    # Long shared prefixes should not affect the estimate.
+    prefix = 'guestbook\x00' * 20
+    self.assertEqual(
+      range_fraction(prefix + 'a', prefix + 'e', prefix + 'b'), 0.25)
+    self.assertEqual(range_fraction('a', 'c', 'd'), 1)
+
+  def test_split_range(self):
+    ranges = split_range('', '', ['c', 'f', 'i'], 4)
+    self.assertEqual(ranges, [('', 'c'), ('c', 'f'), ('f', 'i'), ('i', '')])
+
+    # Boundaries outside of the range are ignored.
+    ranges = split_range('b', 'h', ['a', 'c', 'i'], 2)
+    self.assertEqual(ranges, [('b', 'c'), ('c', 'h')])
+
+    # Extra boundaries are spread across the ranges.
+    ranges = split_range('', '', [chr(index) for index in range(1, 100)], 3)
+    self.assertEqual(len(ranges), 3)
+
+  def test_split_range_without_boundaries(self):
+    ranges = split_range('', '', [], 8)
+    self.assertEqual(len(ranges), 8)
+    self.assertEqual(ranges[0][0], '')
+    self.assertEqual(ranges[-1][1], '')
+    for (_, end), (start, _) in zip(ranges[:-1], ranges[1:]):
+      self.assertEqual(end, start)
+      self.assertTrue(start)
+
+    self.assertEqual(split_range('a', 'a\x00', [], 4), [('a', 'a\x00')])
+
+  def test_get_boundaries(self):
+    tokens = [flexmock(value='c'), flexmock(value='m')]
+    cluster = flexmock(metadata=flexmock(token_map=flexmock(ring=tokens)))
+    flexmock(get_token).should_receive('get_sample').\
+      and_return([{'key': 'g', 'size': 0}])
+    self.assertEqual(token_ranges.get_boundaries(cluster), ['c', 'm', 'g'])
+
+    flexmock(get_token).should_receive('get_sample').and_raise(OSError)
+    self.assertEqual(token_ranges.get_boundaries(cluster), ['c', 'm'])
+
+  def test_parallel_scan(self):
+    keys = ['key{}'.format(index) for index in range(50)]
+    db_access = FakeDatastore(keys)
+    ranges = split_range('', '', ['key2', 'key4'], 3)
+
+    processed = []
+    checkpoints = []
+    scan = ParallelScan(db_access, 'table', ['column'], ranges,
+                        lambda rows: processed.extend(rows),
+                        checkpoints.append, workers=2, batch_size=5)
+    scan.run()
+
+    self.assertEqual(sorted(key for key, _ in processed), sorted(keys))
+    self.assertEqual(scan.remaining, [])
+    self.assertTrue(checkpoints)
+
+  def test_parallel_scan_resumes_after_error(self):
+    flexmock(token_ranges.time).should_receive('sleep')
+    keys = ['key{}'.format(index) for index in range(20)]
+    db_access = FakeDatastore(keys, errors=1)
+
+    processed = []
+    scan = ParallelScan(db_access, 'table', ['column'], [('', '')],
+                        lambda rows: processed.extend(rows), batch_size=5)
+    scan.run()
+
+    # The scan is restarted after the last processed batch.
+    self.assertEqual(sorted(key for key, _ in processed), sorted(keys))
+    self.assertEqual(db_access.scans, [('', ''), (sorted(keys)[4], '')])
+
+  def test_parallel_scan_retries_batch(self):
+    sleeps = []
+    flexmock(token_ranges.time).should_receive('sleep').replace_with(
+      sleeps.append)
+    failures = [ValueError(), ValueError()]
+    processed = []
+
+    def process(rows):
+      if failures:
+        raise failures.pop()
+      processed.extend(rows)
+
+    db_access = FakeDatastore(['a', 'b'])
+    scan = ParallelScan(db_access, 'table', ['column'], [('', '')], process)
+    scan.run()
+    self.assertEqual([key for key, _ in processed], ['a', 'b'])
+    self.assertEqual(sleeps, [token_ranges.BATCH_RETRY_DELAY,
+                              token_ranges.BATCH_RETRY_DELAY * 2])
+
+  def test_parallel_scan_error(self):
+    flexmock(token_ranges.time).should_receive('sleep')
+    attempts = []
+
+    def fail(rows):
+      attempts.append(rows)
+      raise ValueError()
+
+    db_access = FakeDatastore(['a', 'b'])
+    checkpoints = []
+    scan = ParallelScan(db_access, 'table', ['column'], [('', 'a'), ('a', '')],
+                        fail, checkpoints.append, workers=1)
+    self.assertRaises(ValueError, scan.run)
+    self.assertEqual(len(attempts), token_ranges.MAX_BATCH_ATTEMPTS)
+    self.assertEqual(checkpoints, [])
+    self.assertEqual(scan.remaining, [('', 'a'), ('a', '')])
+
+  def test_parallel_scan_stops_after_error(self):
+    flexmock(token_ranges.time).should_receive('sleep')
+    keys = ['key{}'.format(index) for index in range(20)]
+    db_access = FakeDatastore(keys)
+    processed = []
+    started = threading.Event()
+
+    def process(rows):
+      if rows[0][0] == 'key0':
+        started.wait(5)
+        raise ValueError()
+
+      # Wait for the other worker to fail.
+      started.set()
+      while not scan._errors:
+        threading.Event().wait(0.01)
+
+      processed.extend(rows)
+
+    scan = ParallelScan(db_access, 'table', ['column'],
+                        [('', 'key0'), ('key0', '')], process, workers=2,
+                        batch_size=5)
+    self.assertRaises(ValueError, scan.run)
+
+    # The other worker stops after its current batch.
+    self.assertEqual(len(processed), 5)
+    self.assertEqual(scan.remaining, [('', 'key0'), (processed[-1][0], '')])
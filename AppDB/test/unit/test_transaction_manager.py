@@ -1,54 +1,67 @@
-import unittest
-
 from mock import ANY
 from mock import call
 from mock import MagicMock
+from tornado import gen, testing
 
 from appscale.datastore.zkappscale.transaction_manager import (
   ProjectTransactionManager)
 
 
-class TestDatastoreServer(unittest.TestCase):
+class AsyncMock(MagicMock):
+  """ A MagicMock that returns its results as futures. """
+  def __call__(self, *args, **kwargs):
+    result = super(AsyncMock, self).__call__(*args, **kwargs)
+    return gen.maybe_future(result)
+
+
+class TestDatastoreServer(testing.AsyncTestCase):
+  @testing.gen_test
   def test_create_transaction_id(self):
     project_id = 'guestbook'
     project_node = '/appscale/apps/{}'.format(project_id)
 
     zk_client = MagicMock()
     tx_manager = ProjectTransactionManager(project_id, zk_client)
+    tx_manager._tornado_zk = AsyncMock()
 
     # Ensure the first created node is ignored.
     created_nodes = ['{}/txids/tx0000000000'.format(project_node),
                      '{}/txids/tx0000000001'.format(project_node)]
-    zk_client.create = MagicMock(side_effect=created_nodes)
-    self.assertEqual(tx_manager.create_transaction_id(xg=False), 1)
+    tx_manager._tornado_zk.create = AsyncMock(side_effect=created_nodes)
+    txid = yield tx_manager.create_transaction_id(xg=False)
+    self.assertEqual(txid, 1)
     calls = [
       call('{}/txids/tx'.format(project_node), value=ANY, sequence=True),
       call('{}/txids/tx'.format(project_node), value=ANY, sequence=True)]
-    zk_client.create.assert_has_calls(calls)
+    tx_manager._tornado_zk.create.assert_has_calls(calls)
 
     # Ensure the manual offset works.
     tx_manager._txid_manual_offset = 10
     created_nodes = ['{}/txids/tx0000000015'.format(project_node)]
-    zk_client.create = MagicMock(side_effect=created_nodes)
-    self.assertEqual(tx_manager.create_transaction_id(xg=False), 25)
+    tx_manager._tornado_zk.create = AsyncMock(side_effect=created_nodes)
+    txid = yield tx_manager.create_transaction_id(xg=False)
+    self.assertEqual(txid, 25)
     calls = [
       call('{}/txids/tx'.format(project_node), value=ANY, sequence=True)]
-    zk_client.create.assert_has_calls(calls)
+    tx_manager._tornado_zk.create.assert_has_calls(calls)
     tx_manager._txid_manual_offset = 0
 
     # Ensure the automatic rollover works.
     created_nodes = ['{}/txids/tx-2147483647'.format(project_node),
                      '{}/txids2'.format(project_node),
                      '{}/txids2/tx0000000000'.format(project_node)]
-    zk_client.create = MagicMock(side_effect=created_nodes)
-    zk_client.get_children = MagicMock(return_value=['txids', 'txids2'])
-    self.assertEqual(tx_manager.create_transaction_id(xg=False), 2147483648)
+    tx_manager._tornado_zk.create = AsyncMock(side_effect=created_nodes)
+    tx_manager._tornado_zk.get_children = AsyncMock(
+      return_value=['txids', 'txids2'])
+    txid = yield tx_manager.create_transaction_id(xg=False)
+    self.assertEqual(txid, 2147483648)
     calls = [
       call('{}/txids/tx'.format(project_node), value=ANY, sequence=True),
       call('{}/txids2'.format(project_node)),
       call('{}/txids2/tx'.format(project_node), value=ANY, sequence=True)]
-    zk_client.create.assert_has_calls(calls)
+    tx_manager._tornado_zk.create.assert_has_calls(calls)
 
+  @testing.gen_test
   def test_delete_transaction_id(self):
     project_id = 'guestbook'
     project_node = '/appscale/apps/{}'.format(project_id)
@@ -57,25 +70,26 @@ class TestDatastoreServer(unittest.TestCase):
     tx_manager = ProjectTransactionManager(project_id, zk_client)
 
     # A small transaction ID should be located in the first bucket.
-    tx_manager._delete_counter = MagicMock()
-    tx_manager.delete_transaction_id(5)
+    tx_manager._delete_counter = AsyncMock()
+    yield tx_manager.delete_transaction_id(5)
     tx_manager._delete_counter.assert_called_with(
       '{}/txids/tx0000000005'.format(project_node))
 
     # Transactions above the max counter value should be in a different bucket.
-    tx_manager._delete_counter = MagicMock()
-    tx_manager.delete_transaction_id(2147483649)
+    tx_manager._delete_counter = AsyncMock()
+    yield tx_manager.delete_transaction_id(2147483649)
     tx_manager._delete_counter.assert_called_with(
       '{}/txids2/tx0000000001'.format(project_node))
 
     # Offset transactions should be corrected.
     tx_manager._txid_manual_offset = 2 ** 31
-    tx_manager._delete_counter = MagicMock()
-    tx_manager.delete_transaction_id(2 ** 31 * 2)
+    tx_manager._delete_counter = AsyncMock()
+    yield tx_manager.delete_transaction_id(2 ** 31 * 2)
     tx_manager._delete_counter.assert_called_with(
       '{}/txids2/tx0000000000'.format(project_node))
     tx_manager._txid_manual_offset = 0
 
+  @testing.gen_test
   def test_get_open_transactions(self):
     project_id = 'guestbook'
     project_node = '/appscale/apps/{}'.format(project_id)
@@ -91,9 +105,11 @@ class TestDatastoreServer(unittest.TestCase):
                      '{}/txids/tx2147483647'.format(project_node)],
                     ['{}/txids2/tx0000000000'.format(project_node),
                      '{}/txids2/tx0000000001'.format(project_node)]]
-    zk_client.get_children = MagicMock(side_effect=zk_responses)
+    tx_manager._tornado_zk = AsyncMock()
+    tx_manager._tornado_zk.get_children = AsyncMock(side_effect=zk_responses)
     open_txids = [2147483646, 2147483647, 2147483648, 2147483649]
-    self.assertListEqual(tx_manager.get_open_transactions(), open_txids)
+    txids = yield tx_manager.get_open_transactions()
+    self.assertListEqual(txids, open_txids)
 
     # A manual offset should affect the list of open transactions.
     tx_manager._txid_manual_offset = 10
@@ -101,7 +117,43 @@ class TestDatastoreServer(unittest.TestCase):
     tx_manager._active_containers = MagicMock(return_value=active_buckets)
     zk_response = ['{}/txids/tx0000000001'.format(project_node),
                    '{}/txids/tx0000000002'.format(project_node)]
-    zk_client.get_children = MagicMock(return_value=zk_response)
+    tx_manager._tornado_zk.get_children = AsyncMock(return_value=zk_response)
     open_txids = [11, 12]
-    self.assertListEqual(tx_manager.get_open_transactions(), open_txids)
+    txids = yield tx_manager.get_open_transactions()
+    self.assertListEqual(txids, open_txids)
     tx_manager._txid_manual_offset = 0
+
+  @testing.gen_test
+  def test_reserve_transaction_ids(self):
+    project_id = 'guestbook'
+    project_node = '/appscale/apps/{}'.format(project_id)
+
+    zk_client = MagicMock()
+    tx_manager = ProjectTransactionManager(project_id, zk_client,
+                                           txid_block_size=3)
+    tx_manager._tornado_zk = AsyncMock()
+    zk_transaction = MagicMock()
+    tx_manager._tornado_zk.transaction = MagicMock(return_value=zk_transaction)
+
+    # Concurrent requests should share one reservation.
+    created_nodes = ['{}/txids/tx000000000{}'.format(project_node, counter)
+                     for counter in range(1, 4)]
+    zk_transaction.commit = AsyncMock(return_value=created_nodes)
+    txids = yield [tx_manager.create_transaction_id(xg=True),
+                   tx_manager.create_transaction_id(xg=False)]
+    self.assertListEqual(txids, [1, 2])
+    self.assertEqual(zk_transaction.commit.call_count, 1)
+    self.assertEqual(zk_transaction.create.call_count, 3)
+    zk_transaction.create.assert_called_with(
+      '{}/txids/tx'.format(project_node), value=ANY, sequence=True)
+
+    # Stale reservations should be released instead of handed out.
+    tx_manager._reserved[0] = (3, 0)
+    created_nodes = ['{}/txids/tx000000000{}'.format(project_node, counter)
+                     for counter in range(4, 7)]
+    zk_transaction.commit = AsyncMock(return_value=created_nodes)
+    txid = yield tx_manager.create_transaction_id(xg=False)
+    self.assertEqual(txid, 4)
+    yield gen.moment
+    zk_transaction.delete.assert_called_once_with(
+      '{}/txids/tx0000000003'.format(project_node))
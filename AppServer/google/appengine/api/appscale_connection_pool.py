@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+AppScale: A bounded pool of persistent HTTP connections.
+
+API stubs that talk to AppScale services (such as the datastore server) use
+this to avoid paying for TCP setup and teardown on every RPC.
+"""
+
+import collections
+import errno
+import httplib
+import socket
+import threading
+import time
+
+
+# The maximum number of idle connections kept open for each server.
+DEFAULT_MAX_IDLE = 10
+
+# The number of seconds an idle connection may sit in the pool before it is
+# discarded instead of reused.
+DEFAULT_IDLE_TIMEOUT = 30
+
+
+class ConnectionPool(object):
+  """ A thread-safe pool of keep-alive connections to a single server. """
+
+  def __init__(self, server, secure=False, keyfile=None, certfile=None,
+               max_idle=DEFAULT_MAX_IDLE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """ Creates a new ConnectionPool.
+
+    Args:
+      server: A string specifying the server location (host:port).
+      secure: A boolean indicating that HTTPS should be used.
+      keyfile: A string specifying the location of an SSL private key.
+      certfile: A string specifying the location of an SSL certificate.
+      max_idle: An integer specifying how many idle connections to keep.
+      idle_timeout: An integer specifying how many seconds an idle connection
+        is considered healthy.
+    """
+    self.server = server
+    self.secure = secure
+    self.keyfile = keyfile
+    self.certfile = certfile
+    self.max_idle = max_idle
+    self.idle_timeout = idle_timeout
+
+    # Idle connections are stored as (connection, time_released) tuples.
+    self._idle = collections.deque()
+    self._lock = threading.Lock()
+
+    # Counters for reporting how often pooled connections are reused.
+    self.hits = 0
+    self.misses = 0
+    self.discarded = 0
+
+  def _new_connection(self):
+    """ Opens a new connection to the server.
+
+    Returns:
+      An httplib.HTTPConnection or httplib.HTTPSConnection object.
+    """
+    if not self.secure:
+      return httplib.HTTPConnection(self.server)
+
+    if self.keyfile and self.certfile:
+      return httplib.HTTPSConnection(self.server, key_file=self.keyfile,
+                                     cert_file=self.certfile)
+
+    return httplib.HTTPSConnection(self.server)
+
+  @staticmethod
+  def _is_healthy(conn):
+    """ Checks if an idle connection can still be used.
+
+    Args:
+      conn: An httplib.HTTPConnection object.
+    Returns:
+      A boolean indicating whether or not the connection is usable.
+    """
+    if conn.sock is None:
+      return False
+
+    # SSL sockets do not support peeking, so rely on the idle timeout.
+    if isinstance(conn, httplib.HTTPSConnection):
+      return True
+
+    # An idle keep-alive socket should have nothing to read. If it is
+    # readable, the server has either closed it or sent unexpected data.
+    conn.sock.setblocking(0)
+    try:
+      conn.sock.recv(1, socket.MSG_PEEK)
+      return False
+    except socket.error as error:
+      return error.errno in (errno.EAGAIN, errno.EWOULDBLOCK)
+    finally:
+      conn.sock.setblocking(1)
+
+  def acquire(self):
+    """ Takes a connection from the pool or opens a new one.
+
+    Returns:
+      A tuple containing a connection and a boolean indicating whether or not
+      it was reused.
+    """
+    now = time.time()
+    with self._lock:
+      while self._idle:
+        conn, released = self._idle.pop()
+        if now - released <= self.idle_timeout and self._is_healthy(conn):
+          self.hits += 1
+          return conn, True
+
+        self.discarded += 1
+        conn.close()
+
+      self.misses += 1
+
+    return self._new_connection(), False
+
+  def release(self, conn):
+    """ Returns a connection to the pool.
+
+    Args:
+      conn: An httplib.HTTPConnection object.
+    """
+    if conn.sock is None:
+      return
+
+    with self._lock:
+      if len(self._idle) < self.max_idle:
+        self._idle.append((conn, time.time()))
+        return
+
+      self.discarded += 1
+
+    conn.close()
+
+  def discard(self, conn):
+    """ Closes a connection that should not be reused.
+
+    Args:
+      conn: An httplib.HTTPConnection object.
+    """
+    with self._lock:
+      self.discarded += 1
+
+    conn.close()
+
+  def close(self):
+    """ Closes all idle connections. """
+    with self._lock:
+      while self._idle:
+        conn, _ = self._idle.pop()
+        conn.close()
+
+  def stats(self):
+    """ Reports pool usage.
+
+    Returns:
+      A dictionary containing pool metrics.
+    """
+    with self._lock:
+      return {'hits': self.hits,
+              'misses': self.misses,
+              'discarded': self.discarded,
+              'idle': len(self._idle)}
@@ -25,10 +25,13 @@ blobs into the AppScale backends. Blobs are split into chunks of
 1MB segments. 
 
 """
+from collections import deque
+from collections import OrderedDict
+
 from google.appengine.api import blobstore
 from google.appengine.api.blobstore import MAX_BLOB_FETCH_SIZE
 from google.appengine.api.blobstore import blobstore_service_pb, blobstore_stub
-from google.appengine.api import datastore, datastore_errors, datastore_types
+from google.appengine.api import datastore, datastore_types
 from google.appengine.ext.blobstore.blobstore import BlobReader
 from google.appengine.runtime import apiproxy_errors
 
@@ -39,11 +42,41 @@ _BLOB_CHUNK_KIND_ = "__BlobChunk__"
 
 
 class DatastoreBlobReader(BlobReader):
-  """ A reader that fetches from the datastore instead of the blobstore. """
+  """ A reader that fetches from the datastore instead of the blobstore.
 
-  @staticmethod
-  @datastore.NonTransactional
-  def _fetch_data(blob_key, start_index, end_index):
+  Chunks are fetched several at a time, and the next group of chunks is
+  requested before the reader needs it. Recently read chunks are kept in
+  memory so that small or overlapping reads do not fetch them again.
+  """
+
+  # The number of chunks to request with each datastore Get.
+  READ_AHEAD_CHUNKS = 4
+
+  # The maximum number of chunks that each reader keeps in memory. This must
+  # hold at least two groups of chunks so that a prefetch does not evict the
+  # chunks that are being read.
+  MAX_CACHED_CHUNKS = 8
+
+  def __init__(self, *args, **kwargs):
+    """ Creates a new DatastoreBlobReader.
+
+    Args:
+      args: The positional arguments for a BlobReader.
+      kwargs: The keyword arguments for a BlobReader.
+    """
+    super(DatastoreBlobReader, self).__init__(*args, **kwargs)
+    # Maps chunk indexes to their data or None if the chunk does not exist.
+    self._chunks = OrderedDict()
+    # A tuple containing the first chunk index and RPC for a pending Get.
+    self._prefetch = None
+
+  def close(self):
+    """ Closes the reader and releases the cached chunks. """
+    super(DatastoreBlobReader, self).close()
+    self._chunks.clear()
+    self._prefetch = None
+
+  def _fetch_data(self, blob_key, start_index, end_index):
     """ Retrieves a chunk of blob data from datastore entities.
 
     Args:
@@ -64,49 +97,100 @@ class DatastoreBlobReader(BlobReader):
     # This is the last block we'll look at for this request
     block_count_end = int(end_index / MAX_BLOB_FETCH_SIZE)
 
-    block_key = '__'.join([str(blob_key), str(block_count)])
-    block_key = datastore.Key.from_path(
-      _BLOB_CHUNK_KIND_, block_key, namespace='')
-
-    try:
-      block = datastore.Get(block_key)
-    except datastore_errors.EntityNotFoundError:
-      # If this is the first block, the blob does not exist.
-      if block_count == 0:
-        raise apiproxy_errors.ApplicationError(
-           blobstore_service_pb.BlobstoreServiceError.BLOB_NOT_FOUND)
-
-      # If the first block exists, the index is just past the last block.
-      first_block_key = datastore.Key.from_path(
-        _BLOB_CHUNK_KIND_, '__'.join([str(blob_key), '0']), namespace='')
-      try:
-        datastore.Get(first_block_key)
-      except datastore_errors.EntityNotFoundError:
+    block = self._get_chunk(blob_key, block_count)
+    if block is None:
+      # If this is the first block, the blob does not exist. If the first
+      # block exists, the index is just past the last block.
+      if block_count == 0 or self._get_chunk(blob_key, 0) is None:
         raise apiproxy_errors.ApplicationError(
            blobstore_service_pb.BlobstoreServiceError.BLOB_NOT_FOUND)
 
       return ''
 
-    data = block['block'][block_modulo:]
+    data = block[block_modulo:]
 
-    # Matching boundaries, start and end are within one fetch
-    if block_count_end == block_count:
-      return data[:fetch_size]
+    # Must fetch the next block. If it is not found, assume the first block
+    # was the final block.
+    if block_count_end != block_count:
+      data += self._get_chunk(blob_key, block_count + 1) or ''
 
-    # Must fetch the next block
-    block_key = '__'.join([str(blob_key), str(block_count + 1)])
-    block_key = datastore.Key.from_path(
-      _BLOB_CHUNK_KIND_, block_key, namespace='')
+    self._start_prefetch(blob_key, block_count_end)
+    return data[:fetch_size]
 
-    try:
-      block = datastore.Get(block_key)
-      data += block['block']
-    except datastore_errors.EntityNotFoundError:
-      # If the second block is not found, assume the first block was the final
-      # block.
-      pass
+  def _get_chunk(self, blob_key, index):
+    """ Retrieves a chunk from memory or the datastore.
 
-    return data[:fetch_size]
+    Args:
+      blob_key: A BlobKey used to identify which blob to fetch data from.
+      index: An integer specifying the chunk index.
+    Returns:
+      A raw bytes string containing the chunk data or None if the chunk does
+      not exist.
+    """
+    if index in self._chunks:
+      block = self._chunks.pop(index)
+      self._chunks[index] = block
+      return block
+
+    # Wait for the pending Get since it probably contains the chunk.
+    if self._prefetch is not None:
+      first_index, rpc = self._prefetch
+      self._prefetch = None
+      self._cache_chunks(first_index, rpc)
+      if index in self._chunks:
+        return self._get_chunk(blob_key, index)
+
+    self._cache_chunks(index, self._request_chunks(blob_key, index))
+    return self._chunks[index]
+
+  def _start_prefetch(self, blob_key, index):
+    """ Requests the chunks after a chunk if the reader does not have them.
+
+    Args:
+      blob_key: A BlobKey used to identify which blob to fetch data from.
+      index: An integer specifying the last chunk index that was read.
+    """
+    if self._prefetch is not None or index + 1 in self._chunks:
+      return
+
+    # A short or missing chunk is the last one in the blob.
+    block = self._chunks.get(index)
+    if block is None or len(block) < MAX_BLOB_FETCH_SIZE:
+      return
+
+    self._prefetch = (index + 1, self._request_chunks(blob_key, index + 1))
+
+  @datastore.NonTransactional
+  def _request_chunks(self, blob_key, first_index):
+    """ Starts fetching a group of chunks with a single datastore Get.
+
+    Args:
+      blob_key: A BlobKey used to identify which blob to fetch data from.
+      first_index: An integer specifying the first chunk index to fetch.
+    Returns:
+      An RPC object for the datastore Get.
+    """
+    keys = [
+      datastore.Key.from_path(
+        _BLOB_CHUNK_KIND_, '__'.join([str(blob_key), str(index)]),
+        namespace='')
+      for index in range(first_index, first_index + self.READ_AHEAD_CHUNKS)]
+    return datastore.GetAsync(keys)
+
+  def _cache_chunks(self, first_index, rpc):
+    """ Keeps the chunks from a datastore Get in memory.
+
+    Args:
+      first_index: An integer specifying the first chunk index in the Get.
+      rpc: An RPC object for the datastore Get.
+    """
+    for offset, entity in enumerate(rpc.get_result()):
+      index = first_index + offset
+      self._chunks.pop(index, None)
+      self._chunks[index] = entity['block'] if entity is not None else None
+
+    while len(self._chunks) > self.MAX_CACHED_CHUNKS:
+      self._chunks.popitem(last=False)
 
   def _BlobReader__fill_buffer(self, size=0):
     """Fills the internal buffer.
@@ -125,6 +209,87 @@ class DatastoreBlobReader(BlobReader):
     self._BlobReader__eof = len(self._BlobReader__buffer) < read_size
 
 
+class DatastoreBlobWriter(object):
+  """ Stores a blob in the datastore as its data arrives.
+
+  Each chunk is stored with its own datastore Put since a chunk is about as
+  large as a datastore RPC. Up to MAX_PENDING_PUTS chunks are written at the
+  same time, which limits the amount of blob data that is held in memory
+  regardless of the size of the blob.
+  """
+
+  # The maximum number of datastore Puts to wait on at once.
+  MAX_PENDING_PUTS = 4
+
+  def __init__(self, blob_key, app_id=None):
+    """ Creates a new DatastoreBlobWriter.
+
+    Args:
+      blob_key: A BlobKey specifying the blob to store.
+      app_id: A string specifying the application that owns the blob or None
+        for the current application.
+    """
+    self.size = 0
+    self._blob_key = blob_key
+    self._app_id = app_id
+    self._pieces = []
+    self._buffered = 0
+    self._pending_puts = deque()
+    self._block_count = 0
+
+  def write(self, data):
+    """ Adds data to the end of the blob.
+
+    Args:
+      data: A string containing the next part of the blob.
+    """
+    self._pieces.append(data)
+    self._buffered += len(data)
+    self.size += len(data)
+    if self._buffered < MAX_BLOB_FETCH_SIZE:
+      return
+
+    buffered_data = ''.join(self._pieces)
+    offset = 0
+    while len(buffered_data) - offset >= MAX_BLOB_FETCH_SIZE:
+      self._put_chunk(buffered_data[offset:offset + MAX_BLOB_FETCH_SIZE])
+      offset += MAX_BLOB_FETCH_SIZE
+
+    remaining = buffered_data[offset:]
+    self._pieces = [remaining] if remaining else []
+    self._buffered = len(remaining)
+
+  @datastore.NonTransactional
+  def close(self):
+    """ Stores the remaining data and waits for all of the Puts to finish. """
+    if self._buffered:
+      self._put_chunk(''.join(self._pieces))
+      self._pieces = []
+      self._buffered = 0
+
+    while self._pending_puts:
+      self._pending_puts.popleft().get_result()
+
+  @datastore.NonTransactional
+  def _put_chunk(self, block):
+    """ Starts storing a chunk.
+
+    Args:
+      block: A string containing the chunk data.
+    """
+    entity = datastore.Entity(
+      _BLOB_CHUNK_KIND_,
+      name=str(self._blob_key) + "__" + str(self._block_count), namespace='',
+      _app=self._app_id)
+    entity.update({'block': datastore_types.Blob(block)})
+    self._block_count += 1
+    self._pending_puts.append(datastore.PutAsync(entity))
+
+    # Limit the number of chunks that are held in memory.
+    if len(self._pending_puts) > self.MAX_PENDING_PUTS:
+      self._pending_puts.popleft().get_result()
+
+
 class DatastoreBlobStorage(blobstore_stub.BlobStorage):
   """Storage mechanism for storing blob data in datastore."""
 
@@ -156,18 +321,25 @@ class DatastoreBlobStorage(blobstore_stub.BlobStorage):
       blob_key: Blob key of blob to store.
       blob_stream: Stream or stream-like object that will generate blob content.
     """
-    block_count = 0
-    blob_key_object = self._BlobKey(blob_key)
+    writer = self.CreateBlobWriter(blob_key)
     while True:
       block = blob_stream.read(blobstore.MAX_BLOB_FETCH_SIZE)
       if not block:
         break
-      entity = datastore.Entity(_BLOB_CHUNK_KIND_,
-                                name=str(blob_key_object) + "__" + str(block_count), 
-                                namespace='')
-      entity.update({'block': datastore_types.Blob(block)})
-      datastore.Put(entity)
-      block_count += 1
+      writer.write(block)
+
+    writer.close()
+
+  def CreateBlobWriter(self, blob_key):
+    """Create a writer that stores a blob as its data arrives.
+
+    Args:
+      blob_key: Blob key of blob to store.
+
+    Returns:
+      A DatastoreBlobWriter. The blob is stored once the writer is closed.
+    """
+    return DatastoreBlobWriter(self._BlobKey(blob_key), self._app_id)
 
   def OpenBlob(self, blob_key):
     """Open blob file for streaming.
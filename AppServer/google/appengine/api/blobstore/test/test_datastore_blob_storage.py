@@ -0,0 +1,119 @@
+import os
+import sys
+import unittest
+from StringIO import StringIO
+from flexmock import flexmock
+
+appserver = "{0}/../../../../..".format(os.path.dirname(__file__))
+sys.path.append(appserver)
+from google.appengine.api import datastore
+from google.appengine.api.blobstore import datastore_blob_storage
+from google.appengine.api.blobstore import MAX_BLOB_FETCH_SIZE
+from google.appengine.runtime import apiproxy_errors
+
+DatastoreBlobStorage = datastore_blob_storage.DatastoreBlobStorage
+DatastoreBlobWriter = datastore_blob_storage.DatastoreBlobWriter
+
+
+class FakeRPC(object):
+  def __init__(self, result):
+    self.result = result
+
+  def get_result(self):
+    return self.result
+
+
+class FakeDatastore(object):
+  """ Stores chunk entities in memory and records the RPCs made. """
+  def __init__(self):
+    self.entities = {}
+    self.puts = []
+    self.gets = []
+
+  def put_async(self, entity):
+    self.puts.append(entity.key().name())
+    self.entities[entity.key().name()] = entity
+    return FakeRPC(entity.key())
+
+  def get_async(self, keys):
+    self.gets.append([int(key.name().split('__')[-1]) for key in keys])
+    return FakeRPC([self.entities.get(key.name()) for key in keys])
+
+
+class TestDatastoreBlobStorage(unittest.TestCase):
+  def setUp(self):
+    os.environ['APPLICATION_ID'] = 'guestbook'
+    self.datastore = FakeDatastore()
+    flexmock(datastore).should_receive('PutAsync').replace_with(
+      self.datastore.put_async)
+    flexmock(datastore).should_receive('GetAsync').replace_with(
+      self.datastore.get_async)
+    self.storage = DatastoreBlobStorage('guestbook')
+
+  def test_store_blob(self):
+    chunk_count = DatastoreBlobWriter.MAX_PENDING_PUTS * 2 + 1
+    data = 'x' * (MAX_BLOB_FETCH_SIZE * (chunk_count - 1) + 10)
+    self.storage.StoreBlob('blob', StringIO(data))
+
+    # Each chunk is stored with its own Put.
+    self.assertListEqual(self.datastore.puts,
+                         ['blob__{}'.format(index)
+                          for index in range(chunk_count)])
+    self.assertEqual(len(self.datastore.entities), chunk_count)
+    self.assertEqual(
+      len(self.datastore.entities['blob__{}'.format(chunk_count - 1)]['block']),
+      10)
+
+  def test_blob_writer(self):
+    writer = self.storage.CreateBlobWriter('blob')
+    piece = 'x' * (MAX_BLOB_FETCH_SIZE / 4 + 1)
+    for _ in range(9):
+      writer.write(piece)
+
+    # Only complete chunks are stored before the writer is closed.
+    self.assertListEqual(self.datastore.puts, ['blob__0', 'blob__1'])
+    writer.close()
+    self.assertListEqual(self.datastore.puts,
+                         ['blob__0', 'blob__1', 'blob__2'])
+    self.assertEqual(writer.size, len(piece) * 9)
+    self.assertEqual(len(self.datastore.entities['blob__0']['block']),
+                     MAX_BLOB_FETCH_SIZE)
+    self.assertEqual(len(self.datastore.entities['blob__2']['block']),
+                     MAX_BLOB_FETCH_SIZE / 4 + 9)
+
+    # Chunks belong to the storage's project rather than the current one.
+    os.environ['APPLICATION_ID'] = 'other'
+    writer = DatastoreBlobStorage('guestbook').CreateBlobWriter('blob2')
+    writer.write('x')
+    writer.close()
+    self.assertEqual(self.datastore.entities['blob2__0'].app(), 'guestbook')
+
+  def test_read_blob(self):
+    chunk_count = 6
+    data = ''.join(chr(ord('a') + index) * MAX_BLOB_FETCH_SIZE
+                   for index in range(chunk_count))
+    self.storage.StoreBlob('blob', StringIO(data))
+
+    reader = self.storage.OpenBlob('blob')
+    self.assertEqual(reader.read(), data)
+
+    # The second group of chunks is requested before it is needed.
+    self.assertListEqual(self.datastore.gets,
+                         [[0, 1, 2, 3], [4, 5, 6, 7]])
+
+    # Recently read chunks are not fetched again.
+    reader.seek(MAX_BLOB_FETCH_SIZE * 5)
+    self.assertEqual(reader.read(3), 'fff')
+    self.assertEqual(len(self.datastore.gets), 2)
+
+    # Reading past the end of the blob returns nothing.
+    reader.seek(MAX_BLOB_FETCH_SIZE * 10)
+    self.assertEqual(reader.read(), '')
+
+  def test_missing_blob(self):
+    reader = self.storage.OpenBlob('missing')
+    self.assertRaises(apiproxy_errors.ApplicationError, reader.read)
+
+
+if __name__ == "__main__":
+  unittest.main()
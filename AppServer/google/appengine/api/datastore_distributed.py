@@ -36,6 +36,7 @@ import warnings
 from google.appengine.api import api_base_pb
 from google.appengine.api import apiproxy_stub
 from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import appscale_connection_pool
 from google.appengine.api import datastore
 from google.appengine.api import datastore_errors
 from google.appengine.api import datastore_types
@@ -195,6 +196,11 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
       if int(res[1]) != SSL_DEFAULT_PORT:
         self.__is_encrypted = False
 
+    # Keep connections to the datastore server open between requests.
+    self.__connection_pool = appscale_connection_pool.ConnectionPool(
+      self.__datastore_location, secure=self.__is_encrypted,
+      keyfile=KEY_LOCATION, certfile=CERT_LOCATION)
+
     self.SetTrusted(trusted)
 
     self.__queries = {}
@@ -321,6 +327,10 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
     assert pb.IsInitialized(explanation), explanation
     pb.Encode()
 
+  def ConnectionPoolStats(self):
+    """Returns a dict of hit and miss counters for the connection pool."""
+    return self.__connection_pool.stats()
+
   def QueryHistory(self):
     """Returns a dict that maps Query PBs to times they've been run."""
     return []
@@ -356,7 +366,8 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
         1,
         self.__is_encrypted,
         KEY_LOCATION,
-        CERT_LOCATION)
+        CERT_LOCATION,
+        connection_pool=self.__connection_pool)
     except socket.error as socket_error:
       if socket_error.errno == errno.ETIMEDOUT:
         raise apiproxy_errors.ApplicationError(
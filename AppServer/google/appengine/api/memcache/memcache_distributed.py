@@ -24,6 +24,7 @@ import logging
 import hashlib
 import memcache
 import os
+import socket
 import time
 
 from google.appengine.api import apiproxy_stub
@@ -40,6 +41,121 @@ from google.appengine.api.memcache import TYPE_INT
 from google.appengine.api.memcache import TYPE_LONG
 from google.appengine.api.memcache import MAX_KEY_SIZE
 
+# Entries keep their format version in the high byte of memcached's item
+# flags and the App Engine flags in the rest. The value is stored as given so
+# that memcached can increment integers itself.
+FORMAT_VERSION = 1
+VERSION_SHIFT = 24
+FLAGS_MASK = (1 << VERSION_SHIFT) - 1
+
+# Entries written before the format version was added have this version. They
+# contain a pickled list of the flags, a CAS counter, and the value.
+LEGACY_VERSION = 0
+
+# The set statuses that correspond to memcached storage replies.
+STORE_REPLIES = {
+  'STORED': MemcacheSetResponse.STORED,
+  'NOT_STORED': MemcacheSetResponse.NOT_STORED,
+  'EXISTS': MemcacheSetResponse.EXISTS,
+  'NOT_FOUND': MemcacheSetResponse.NOT_STORED
+}
+
+# The memcached commands used for each set policy.
+STORE_COMMANDS = {
+  MemcacheSetRequest.SET: 'set',
+  MemcacheSetRequest.ADD: 'add',
+  MemcacheSetRequest.REPLACE: 'replace',
+  MemcacheSetRequest.CAS: 'cas'
+}
+
+
+class MemcacheClient(memcache.Client):
+  """ A memcached client that can send the commands for several keys to each
+  server before waiting for any of the replies.
+  """
+  def get_entries(self, keys, for_cas=False):
+    """ Retrieves several keys without decoding their values.
+
+    Args:
+      keys: A list of memcached keys.
+      for_cas: A boolean indicating that CAS IDs should be fetched.
+    Returns:
+      A dictionary mapping each key that was found to a tuple containing its
+      memcached flags, value, and CAS ID (or None).
+    """
+    server_keys, prefixed_to_orig_key = self._map_and_prefix_keys(keys, '')
+    command = 'gets ' if for_cas else 'get '
+
+    dead_servers = []
+    for server, keys_for_server in server_keys.iteritems():
+      try:
+        server.send_cmd(command + ' '.join(keys_for_server))
+      except socket.error as error:
+        server.mark_dead(str(error))
+        dead_servers.append(server)
+
+    for server in dead_servers:
+      del server_keys[server]
+
+    entries = {}
+    for server in server_keys:
+      try:
+        line = server.readline()
+        while line and line != 'END':
+          # VALUE <key> <flags> <bytes> [<cas unique>]
+          parts = line.split()
+          if parts[0] != 'VALUE':
+            raise memcache._Error('Unexpected reply: {}'.format(line))
+
+          length = int(parts[3])
+          value = server.recv(length + 2)
+          if len(value) != length + 2:
+            raise memcache._Error('Received {} bytes when expecting {}'.format(
+              len(value), length + 2))
+
+          cas_id = long(parts[4]) if for_cas else None
+          entries[prefixed_to_orig_key[parts[1]]] = (
+            int(parts[2]), value[:-2], cas_id)
+          line = server.readline()
+      except (memcache._Error, socket.error) as error:
+        server.mark_dead(str(error))
+
+    return entries
+
+  def pipeline(self, commands):
+    """ Sends commands that have single line replies.
+
+    Args:
+      commands: A list of tuples containing the memcached key and the full
+        encoded command for that key.
+    Returns:
+      A list containing the reply to each command, or None if the server
+      could not be reached.
+    """
+    replies = [None for _ in commands]
+    server_commands = {}
+    for index, (key, _) in enumerate(commands):
+      server, _ = self._get_server(key)
+      if server is not None:
+        server_commands.setdefault(server, []).append(index)
+
+    for server, indexes in server_commands.items():
+      try:
+        server.send_cmds(''.join(commands[index][1] for index in indexes))
+      except socket.error as error:
+        server.mark_dead(str(error))
+        del server_commands[server]
+
+    for server, indexes in server_commands.iteritems():
+      try:
+        for index in indexes:
+          replies[index] = server.readline()
+      except (memcache._Error, socket.error) as error:
+        server.mark_dead(str(error))
+
+    return replies
+
+
 class MemcacheService(apiproxy_stub.APIProxyStub):
   """Python only memcache service.
 
@@ -56,15 +172,20 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
   # down).
   UPDATE_WINDOW = 60  # seconds
 
-  def __init__(self, gettime=time.time, service_name='memcache'):
+  def __init__(self, gettime=time.time, service_name='memcache',
+               read_legacy_entries=True):
     """Initializer.
 
     Args:
       gettime: time.time()-like function used for testing.
       service_name: Service name expected for all calls.
+      read_legacy_entries: A boolean indicating that entries written in the
+        pickled format should still be read. When it is False, they are
+        treated as missing.
     """
     super(MemcacheService, self).__init__(service_name)
     self._gettime = gettime
+    self._read_legacy_entries = read_legacy_entries
     self._memcache = None
     self.setupMemcacheClient()
 
@@ -79,7 +200,7 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
 
     memcaches = [ip + ":" + self.MEMCACHE_PORT for ip in all_ips if ip != '']
     memcaches.sort()    
-    self._memcache = memcache.Client(memcaches, debug=0)
+    self._memcache = MemcacheClient(memcaches, debug=0)
 
   def _Dynamic_Get(self, request, response):
     """Implementation of gets for memcache.
@@ -88,18 +209,19 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
       request: A MemcacheGetRequest protocol buffer.
       response: A MemcacheGetResponse protocol buffer.
     """
-    for key in set(request.key_list()):
-      internal_key = self._GetKey(request.name_space(), key)
-      value = self._memcache.get(internal_key)
-      if value is None:
+    keys = {self._GetKey(request.name_space(), key): key
+            for key in set(request.key_list())}
+    entries = self._memcache.get_entries(keys.keys(), request.for_cas())
+    for internal_key, (memcached_flags, value, cas_id) in entries.iteritems():
+      entry = self._DecodeEntry(memcached_flags, value)
+      if entry is None:
         continue
-      flags = 0
-      stored_flags, cas_id, stored_value = cPickle.loads(value)
-      flags |= stored_flags
+
+      stored_flags, stored_value = entry
       item = response.add_item()
-      item.set_key(key)
+      item.set_key(keys[internal_key])
       item.set_value(stored_value)
-      item.set_flags(flags)
+      item.set_flags(stored_flags)
       if request.for_cas():
         item.set_cas_id(cas_id)
 
@@ -110,43 +232,32 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
       request: A MemcacheSetRequest.
       response: A MemcacheSetResponse.
     """
+    commands = []
     for item in request.item_list():
       key = self._GetKey(request.name_space(), item.key())
       set_policy = item.set_policy()
-      old_entry = self._memcache.get(key)
-      cas_id = 0
-      if old_entry:
-        _, cas_id, _ = cPickle.loads(old_entry)
-      set_status = MemcacheSetResponse.NOT_STORED
-
-      if ((set_policy == MemcacheSetRequest.SET) or
-        (set_policy == MemcacheSetRequest.ADD and old_entry is None) or
-        (set_policy == MemcacheSetRequest.REPLACE and
-        old_entry is not None)):
-
-        if (old_entry is None or set_policy == MemcacheSetRequest.SET):
-          set_status = MemcacheSetResponse.STORED
-
-      elif (set_policy == MemcacheSetRequest.CAS and item.for_cas() and
-        item.has_cas_id()):
-        if old_entry is None:
-          set_status = MemcacheSetResponse.NOT_STORED
-        elif cas_id != item.cas_id():
-          set_status = MemcacheSetResponse.EXISTS
-        else:
-          set_status = MemcacheSetResponse.STORED
-
-      if (set_status == MemcacheSetResponse.STORED
-        or set_policy == MemcacheSetRequest.REPLACE):
-
-        set_value = cPickle.dumps(
-          [item.flags(), cas_id + 1, item.value()])
-        if set_policy == MemcacheSetRequest.REPLACE:
-          self._memcache.replace(key, set_value)
-        else:
-          self._memcache.set(key, set_value, item.expiration_time())
-
-      response.add_set_status(set_status)
+      if (set_policy == MemcacheSetRequest.CAS and
+          not (item.for_cas() and item.has_cas_id())):
+        commands.append(None)
+        continue
+
+      cas_id = None
+      if set_policy == MemcacheSetRequest.CAS:
+        cas_id = item.cas_id()
+
+      commands.append((key, self._StoreCommand(
+        STORE_COMMANDS[set_policy], key, item.flags(), item.value(),
+        item.expiration_time(), cas_id)))
+
+    replies = iter(self._memcache.pipeline(
+      [command for command in commands if command is not None]))
+    for command in commands:
+      if command is None:
+        response.add_set_status(MemcacheSetResponse.NOT_STORED)
+        continue
+
+      response.add_set_status(
+        STORE_REPLIES.get(next(replies), MemcacheSetResponse.ERROR))
 
   def _Dynamic_Delete(self, request, response):
     """Implementation of delete in memcache.
@@ -155,59 +266,122 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
       request: A MemcacheDeleteRequest protocol buffer.
       response: A MemcacheDeleteResponse protocol buffer.
     """
+    commands = []
     for item in request.item_list():
       key = self._GetKey(request.name_space(), item.key())
-      entry = self._memcache.get(key)
-      delete_status = MemcacheDeleteResponse.DELETED
+      commands.append((key, 'delete {}\r\n'.format(key)))
 
-      if entry is None:
-        delete_status = MemcacheDeleteResponse.NOT_FOUND
+    for reply in self._memcache.pipeline(commands):
+      if reply == 'DELETED':
+        response.add_delete_status(MemcacheDeleteResponse.DELETED)
       else:
-        self._memcache.delete(key)
+        response.add_delete_status(MemcacheDeleteResponse.NOT_FOUND)
 
-      response.add_delete_status(delete_status)
+  def _Increment(self, namespace, requests):
+    """Internal function for incrementing from MemcacheIncrementRequests.
 
-  def _Increment(self, namespace, request):
-    """Internal function for incrementing from a MemcacheIncrementRequest.
+    The counters are changed by memcached, and the commands for all of the
+    requests are sent together.
 
     Args:
       namespace: A string containing the namespace for the request,
         if any. Pass an empty string if there is no namespace.
+      requests: A list of MemcacheIncrementRequest instances.
+
+    Returns:
+      A list containing an integer or long for each request that was
+      successful, or None on error.
+    """
+    results = [None for _ in requests]
+    commands = []
+    pending = []
+    for index, request in enumerate(requests):
+      if not request.delta():
+        continue
+
+      key = self._GetKey(namespace, request.key())
+      commands.append((key, self._IncrementCommand(key, request)))
+      pending.append(index)
+
+    replies = self._memcache.pipeline(commands)
+    for index, (key, _), reply in zip(pending, commands, replies):
+      request = requests[index]
+      if reply is not None and reply.isdigit():
+        results[index] = int(reply)
+      elif reply == 'NOT_FOUND':
+        results[index] = self._InitializeCounter(key, request)
+      elif reply is not None and reply.startswith('CLIENT_ERROR'):
+        # The entry is not a number, or it was written in the legacy format.
+        results[index] = self._IncrementLegacyEntry(key, request)
+
+    return results
+
+  def _InitializeCounter(self, key, request):
+    """Creates a counter that does not exist yet.
+
+    Args:
+      key: A string specifying the memcached key.
+      request: A MemcacheIncrementRequest instance.
+
+    Returns:
+      An integer or long if the counter was created, None on error.
+    """
+    if not request.has_initial_value():
+      return None
+
+    flags = TYPE_INT
+    if request.has_initial_flags():
+      flags = request.initial_flags()
+
+    new_value = self._ApplyDelta(request.initial_value(), request)
+    command = self._StoreCommand('add', key, flags, str(new_value), 0)
+    reply = self._memcache.pipeline([(key, command)])[0]
+    if reply == 'STORED':
+      return new_value
+
+    if reply != 'NOT_STORED':
+      return None
+
+    # The counter was created by another request, so it can be changed now.
+    reply = self._memcache.pipeline(
+      [(key, self._IncrementCommand(key, request))])[0]
+    if reply is not None and reply.isdigit():
+      return int(reply)
+
+    return None
+
+  def _IncrementLegacyEntry(self, key, request):
+    """Changes a counter that was written in the legacy format.
+
+    The entry is rewritten in the current format so that memcached can change
+    it from then on.
+
+    Args:
+      key: A string specifying the memcached key.
       request: A MemcacheIncrementRequest instance.
 
     Returns:
       An integer or long if the offset was successful, None on error.
     """
-    if not request.delta():
+    if not self._read_legacy_entries:
       return None
 
-    cas_id = 0
+    entries = self._memcache.get_entries([key], for_cas=True)
+    if key not in entries:
+      return None
 
-    key = self._GetKey(namespace, request.key())
-    value = self._memcache.get(key)
-    if value is None:
-      if not request.has_initial_value():
-        return None
-      flags, cas_id, stored_value = (
-        TYPE_INT, cas_id, str(request.initial_value()))
-    else:
-      flags, cas_id, stored_value = cPickle.loads(value)
-
-    if flags == TYPE_INT:
-      new_value = int(stored_value)
-    elif flags == TYPE_LONG:
-      new_value = long(stored_value)
-
-    if request.direction() == MemcacheIncrementRequest.INCREMENT:
-      new_value += request.delta()
-    elif request.direction() == MemcacheIncrementRequest.DECREMENT:
-      new_value = max(new_value-request.delta(), 0)
-
-    new_stored_value = cPickle.dumps([flags, cas_id + 1, str(new_value)])
-    try:
-      self._memcache.cas(key, new_stored_value)
-    except Exception, e:
-      logging.error(str(e))
+    memcached_flags, value, cas_id = entries[key]
+    if memcached_flags >> VERSION_SHIFT != LEGACY_VERSION:
+      return None
+
+    flags, _, stored_value = cPickle.loads(value)
+    if flags not in (TYPE_INT, TYPE_LONG):
+      return None
+
+    new_value = self._ApplyDelta(long(stored_value), request)
+    command = self._StoreCommand('cas', key, flags, str(new_value), 0, cas_id)
+    if self._memcache.pipeline([(key, command)])[0] != 'STORED':
+      logging.error('Unable to convert counter {}'.format(key))
       return None
 
     return new_value
@@ -219,7 +393,7 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
       request: A MemcacheIncrementRequest protocol buffer.
       response: A MemcacheIncrementResponse protocol buffer.
     """
-    new_value = self._Increment(request.name_space(), request)
+    new_value = self._Increment(request.name_space(), [request])[0]
     if new_value is None:
       raise apiproxy_errors.ApplicationError(
         memcache_service_pb.MemcacheServiceError.UNSPECIFIED_ERROR)
@@ -233,9 +407,8 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
       request: A MemcacheBatchIncrementRequest protocol buffer.
       response: A MemcacheBatchIncrementResponse protocol buffer.
     """
-    namespace = request.name_space()
-    for request_item in request.item_list():
-      new_value = self._Increment(namespace, request_item)
+    new_values = self._Increment(request.name_space(), request.item_list())
+    for new_value in new_values:
       item = response.add_item()
       if new_value is None:
         item.set_increment_status(MemcacheIncrementResponse.NOT_CHANGED)
@@ -295,6 +468,86 @@ class MemcacheService(apiproxy_stub.APIProxyStub):
     # may not be expecting an int.
     stats.set_oldest_item_age(int(time.time() - time_total / num_servers))
    
+  def _DecodeEntry(self, memcached_flags, value):
+    """Extracts the App Engine flags and value from a stored entry.
+
+    Args:
+      memcached_flags: An integer containing the memcached item flags.
+      value: A string containing the stored value.
+    Returns:
+      A tuple containing the flags and value, or None if the entry cannot be
+      read.
+    """
+    version = memcached_flags >> VERSION_SHIFT
+    if version == FORMAT_VERSION:
+      flags = memcached_flags & FLAGS_MASK
+      if flags in (TYPE_INT, TYPE_LONG):
+        # memcached may pad a counter with spaces when it gets shorter.
+        value = value.rstrip()
+
+      return flags, value
+
+    if version == LEGACY_VERSION and self._read_legacy_entries:
+      flags, _, stored_value = cPickle.loads(value)
+      return flags, stored_value
+
+    return None
+
+  @staticmethod
+  def _StoreCommand(command, key, flags, value, expiration_time, cas_id=None):
+    """Encodes a memcached storage command.
+
+    Args:
+      command: A string specifying the storage command.
+      key: A string specifying the memcached key.
+      flags: An integer containing the App Engine flags.
+      value: A string containing the value.
+      expiration_time: An integer specifying when the entry expires.
+      cas_id: The CAS ID that a cas command expects.
+    Returns:
+      A string containing the command.
+    """
+    header = '{command} {key} {flags} {time} {length}'.format(
+      command=command, key=key,
+      flags=(FORMAT_VERSION << VERSION_SHIFT) | flags, time=expiration_time,
+      length=len(value))
+    if cas_id is not None:
+      header += ' {}'.format(cas_id)
+
+    return '\r\n'.join([header, value, ''])
+
+  @staticmethod
+  def _IncrementCommand(key, request):
+    """Encodes a memcached incr or decr command.
+
+    Args:
+      key: A string specifying the memcached key.
+      request: A MemcacheIncrementRequest instance.
+    Returns:
+      A string containing the command.
+    """
+    command = 'incr'
+    if request.direction() == MemcacheIncrementRequest.DECREMENT:
+      command = 'decr'
+
+    return '{} {} {}\r\n'.format(command, key, request.delta())
+
+  @staticmethod
+  def _ApplyDelta(value, request):
+    """Changes a counter value the way that memcached does.
+
+    Args:
+      value: An integer or long containing the current value.
+      request: A MemcacheIncrementRequest instance.
+    Returns:
+      An integer or long containing the new value.
+    """
+    if request.direction() == MemcacheIncrementRequest.DECREMENT:
+      return max(value - request.delta(), 0)
+
+    # Counters are unsigned 64-bit integers.
+    return (value + request.delta()) % 2 ** 64
+
   def _GetKey(self, namespace, key):
     """Used to get the Memcache key. It is encoded because the sdk
     allows special characters but the Memcache client does not.
@@ -0,0 +1,153 @@
+""" Compares memcached round trips for batched and per-key stub operations.
+
+The per-key path issues the commands that the stub used to send: a get for
+every key in a get_multi, and a get followed by a set for every item in a
+set_multi. The batched path sends the same batches through the stub. Each
+command that is sent to a server counts as one round trip.
+
+This requires a memcached server.
+
+Example:
+  python benchmark_round_trips.py --server localhost:11211 --batch-sizes 1 100
+"""
+import argparse
+import cPickle
+import os
+import sys
+import time
+
+appserver = "{0}/../../../../..".format(
+  os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, appserver)
+import memcache
+from google.appengine.api.memcache import memcache_distributed
+from google.appengine.api.memcache import memcache_service_pb
+
+MemcacheSetRequest = memcache_service_pb.MemcacheSetRequest
+
+
+class RoundTripCounter(object):
+  """ Counts the commands that memcache clients send to servers. """
+  def __init__(self):
+    self.count = 0
+    self._send_cmd = memcache._Host.send_cmd
+    self._send_cmds = memcache._Host.send_cmds
+
+  def __enter__(self):
+    counter = self
+
+    def send_cmd(host, command):
+      counter.count += 1
+      return counter._send_cmd(host, command)
+
+    def send_cmds(host, commands):
+      counter.count += 1
+      return counter._send_cmds(host, commands)
+
+    memcache._Host.send_cmd = send_cmd
+    memcache._Host.send_cmds = send_cmds
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    memcache._Host.send_cmd = self._send_cmd
+    memcache._Host.send_cmds = self._send_cmds
+
+
+def per_key_batch(stub, keys, value):
+  """ Sets and gets keys with separate commands for each key.
+
+  Args:
+    stub: A MemcacheService.
+    keys: A list of keys.
+    value: A string to store for each key.
+  """
+  client = stub._memcache
+  internal_keys = [stub._GetKey('', key) for key in keys]
+  for internal_key in internal_keys:
+    client.get(internal_key)
+    client.set(internal_key, cPickle.dumps([0, 1, value]))
+
+  for internal_key in internal_keys:
+    client.get(internal_key)
+
+
+def batched(stub, keys, value):
+  """ Sets and gets keys with one stub request for each batch.
+
+  Args:
+    stub: A MemcacheService.
+    keys: A list of keys.
+    value: A string to store for each key.
+  """
+  set_request = MemcacheSetRequest()
+  for key in keys:
+    item = set_request.add_item()
+    item.set_key(key)
+    item.set_value(value)
+    item.set_set_policy(MemcacheSetRequest.SET)
+
+  stub._Dynamic_Set(set_request, memcache_service_pb.MemcacheSetResponse())
+
+  get_request = memcache_service_pb.MemcacheGetRequest()
+  for key in keys:
+    get_request.add_key(key)
+
+  stub._Dynamic_Get(get_request, memcache_service_pb.MemcacheGetResponse())
+
+
+def measure(function, stub, batch_size, args):
+  """ Runs a batch function several times.
+
+  Args:
+    function: The function that sets and gets a batch.
+    stub: A MemcacheService.
+    batch_size: An integer specifying the number of keys in each batch.
+    args: The parsed command line arguments.
+  Returns:
+    A tuple containing the round trips and milliseconds per batch.
+  """
+  value = 'x' * args.value_size
+  with RoundTripCounter() as counter:
+    start = time.time()
+    for iteration in range(args.iterations):
+      keys = ['key-{}-{}'.format(iteration, index)
+              for index in range(batch_size)]
+      function(stub, keys, value)
+
+    elapsed = time.time() - start
+
+  return (float(counter.count) / args.iterations,
+          elapsed * 1000 / args.iterations)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--server', nargs='+', default=['localhost:11211'],
+                      help='The memcached servers to use')
+  parser.add_argument('--batch-sizes', type=int, nargs='+',
+                      default=[1, 10, 100, 500],
+                      help='The numbers of keys in each batch')
+  parser.add_argument('--iterations', type=int, default=20,
+                      help='The number of batches to send for each size')
+  parser.add_argument('--value-size', type=int, default=100,
+                      help='The size of each value in bytes')
+  args = parser.parse_args()
+
+  os.environ['APPNAME'] = 'memcache-benchmark'
+  stub = memcache_distributed.MemcacheService()
+  stub._memcache = memcache_distributed.MemcacheClient(args.server)
+
+  print('Batch size | Per-key trips | Batched trips | Per-key ms | Batched ms')
+  try:
+    for batch_size in args.batch_sizes:
+      per_key_trips, per_key_ms = measure(per_key_batch, stub, batch_size,
+                                          args)
+      batched_trips, batched_ms = measure(batched, stub, batch_size, args)
+      print('{:>10} | {:>13.1f} | {:>13.1f} | {:>10.2f} | {:>10.2f}'.format(
+        batch_size, per_key_trips, batched_trips, per_key_ms, batched_ms))
+  finally:
+    stub._memcache.flush_all()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,257 @@
+import cPickle
+import os
+import sys
+import unittest
+from flexmock import flexmock
+
+appserver = "{0}/../../../../..".format(os.path.dirname(__file__))
+sys.path.append(appserver)
+from google.appengine.api.memcache import memcache_distributed
+from google.appengine.api.memcache import memcache_service_pb
+
+MemcacheSetRequest = memcache_service_pb.MemcacheSetRequest
+MemcacheSetResponse = memcache_service_pb.MemcacheSetResponse
+MemcacheDeleteResponse = memcache_service_pb.MemcacheDeleteResponse
+MemcacheIncrementRequest = memcache_service_pb.MemcacheIncrementRequest
+MemcacheIncrementResponse = memcache_service_pb.MemcacheIncrementResponse
+
+
+class FakeServer(object):
+  """ Records the commands sent to a memcached server. """
+  def __init__(self, replies):
+    self.replies = list(replies)
+    self.sent = []
+
+  def send_cmds(self, commands):
+    self.sent.append(commands)
+
+  def send_cmd(self, command):
+    self.sent.append(command + '\r\n')
+
+  def readline(self):
+    return self.replies.pop(0)
+
+  def recv(self, length):
+    return self.replies.pop(0)
+
+  def mark_dead(self, reason):
+    pass
+
+
+class FakeClient(object):
+  """ Stores entries in memory and counts the requests made. """
+  def __init__(self):
+    self.entries = {}
+    self.requests = []
+
+  def get_entries(self, keys, for_cas=False):
+    self.requests.append('get_entries')
+    return {key: self.entries[key] for key in keys if key in self.entries}
+
+  def pipeline(self, commands):
+    self.requests.append('pipeline')
+    return [self._reply(key, command) for key, command in commands]
+
+  def _reply(self, key, command):
+    header, _, value = command.partition('\r\n')
+    parts = header.split()
+    entry = self.entries.get(key)
+    if parts[0] == 'delete':
+      self.entries.pop(key, None)
+      return 'DELETED' if entry else 'NOT_FOUND'
+
+    if parts[0] in ('incr', 'decr'):
+      if entry is None:
+        return 'NOT_FOUND'
+
+      if not entry[1].isdigit():
+        return 'CLIENT_ERROR cannot increment or decrement non-numeric value'
+
+      delta = int(parts[2]) if parts[0] == 'incr' else -int(parts[2])
+      new_value = str(max(int(entry[1]) + delta, 0))
+      self.entries[key] = (entry[0], new_value, entry[2] + 1)
+      return new_value
+
+    if parts[0] == 'cas' and entry is None:
+      return 'NOT_FOUND'
+
+    if parts[0] == 'cas' and entry[2] != int(parts[5]):
+      return 'EXISTS'
+
+    if ((parts[0] == 'add' and entry) or
+        (parts[0] == 'replace' and not entry)):
+      return 'NOT_STORED'
+
+    cas_id = entry[2] + 1 if entry else 1
+    self.entries[key] = (int(parts[2]), value[:-2], cas_id)
+    return 'STORED'
+
+
+class TestMemcacheDistributed(unittest.TestCase):
+  def setUp(self):
+    os.environ['APPNAME'] = 'guestbook'
+    self.stub = memcache_distributed.MemcacheService()
+    self.client = FakeClient()
+    self.stub._memcache = self.client
+
+  def set_items(self, items):
+    request = MemcacheSetRequest()
+    for key, value, policy, cas_id in items:
+      item = request.add_item()
+      item.set_key(key)
+      item.set_value(value)
+      item.set_set_policy(policy)
+      if cas_id is not None:
+        item.set_for_cas(True)
+        item.set_cas_id(cas_id)
+
+    response = MemcacheSetResponse()
+    self.stub._Dynamic_Set(request, response)
+    return response.set_status_list()
+
+  def get_items(self, keys, for_cas=False):
+    request = memcache_service_pb.MemcacheGetRequest()
+    for key in keys:
+      request.add_key(key)
+
+    request.set_for_cas(for_cas)
+    response = memcache_service_pb.MemcacheGetResponse()
+    self.stub._Dynamic_Get(request, response)
+    return {item.key(): item for item in response.item_list()}
+
+  def test_batched_requests(self):
+    statuses = self.set_items(
+      [('key{}'.format(index), 'value', MemcacheSetRequest.SET, None)
+       for index in range(100)])
+    self.assertListEqual(statuses, [MemcacheSetResponse.STORED] * 100)
+
+    items = self.get_items(['key{}'.format(index) for index in range(200)])
+    self.assertEqual(len(items), 100)
+    self.assertEqual(items['key1'].value(), 'value')
+
+    # Each batch takes a single request.
+    self.assertListEqual(self.client.requests, ['pipeline', 'get_entries'])
+
+  def test_set_policies(self):
+    self.set_items([('existing', 'value', MemcacheSetRequest.SET, None)])
+    statuses = self.set_items([
+      ('existing', 'value', MemcacheSetRequest.ADD, None),
+      ('new', 'value', MemcacheSetRequest.ADD, None),
+      ('missing', 'value', MemcacheSetRequest.REPLACE, None),
+      ('existing', 'value', MemcacheSetRequest.REPLACE, None),
+      ('existing', 'value', MemcacheSetRequest.CAS, None)])
+    self.assertListEqual(statuses, [
+      MemcacheSetResponse.NOT_STORED, MemcacheSetResponse.STORED,
+      MemcacheSetResponse.NOT_STORED, MemcacheSetResponse.STORED,
+      MemcacheSetResponse.NOT_STORED])
+
+  def test_cas(self):
+    self.set_items([('key', 'value', MemcacheSetRequest.SET, None)])
+    cas_id = self.get_items(['key'], for_cas=True)['key'].cas_id()
+
+    statuses = self.set_items([
+      ('key', 'new', MemcacheSetRequest.CAS, cas_id),
+      ('key', 'newer', MemcacheSetRequest.CAS, cas_id),
+      ('missing', 'value', MemcacheSetRequest.CAS, cas_id)])
+    self.assertListEqual(statuses, [
+      MemcacheSetResponse.STORED, MemcacheSetResponse.EXISTS,
+      MemcacheSetResponse.NOT_STORED])
+    self.assertEqual(self.get_items(['key'])['key'].value(), 'new')
+
+  def test_delete(self):
+    self.set_items([('key', 'value', MemcacheSetRequest.SET, None)])
+    request = memcache_service_pb.MemcacheDeleteRequest()
+    for key in ('key', 'missing'):
+      request.add_item().set_key(key)
+
+    response = memcache_service_pb.MemcacheDeleteResponse()
+    self.stub._Dynamic_Delete(request, response)
+    self.assertListEqual(
+      response.delete_status_list(),
+      [MemcacheDeleteResponse.DELETED, MemcacheDeleteResponse.NOT_FOUND])
+
+
+  def increment(self, items):
+    request = memcache_service_pb.MemcacheBatchIncrementRequest()
+    for key, delta, direction, initial_value in items:
+      item = request.add_item()
+      item.set_key(key)
+      item.set_delta(delta)
+      item.set_direction(direction)
+      if initial_value is not None:
+        item.set_initial_value(initial_value)
+
+    response = memcache_service_pb.MemcacheBatchIncrementResponse()
+    self.stub._Dynamic_BatchIncrement(request, response)
+    return [item.new_value() if item.increment_status() ==
+            MemcacheIncrementResponse.OK else None
+            for item in response.item_list()]
+
+  def test_increment(self):
+    self.set_items([('counter', '5', MemcacheSetRequest.SET, None),
+                    ('text', 'value', MemcacheSetRequest.SET, None)])
+    new_values = self.increment([
+      ('counter', 3, MemcacheIncrementRequest.INCREMENT, None),
+      ('counter', 10, MemcacheIncrementRequest.DECREMENT, None),
+      ('missing', 1, MemcacheIncrementRequest.INCREMENT, None),
+      ('new', 2, MemcacheIncrementRequest.INCREMENT, 40),
+      ('text', 1, MemcacheIncrementRequest.INCREMENT, None)])
+    self.assertListEqual(new_values, [8, 0, None, 42, None])
+
+    # After the set, the counters are changed with one request, and the new
+    # counter is added with another.
+    self.assertEqual(self.client.requests.count('pipeline'), 3)
+    self.assertEqual(self.get_items(['new'])['new'].value(), '42')
+
+  def test_legacy_entries(self):
+    key = self.stub._GetKey('', 'legacy')
+    self.client.entries[key] = (
+      0, cPickle.dumps([memcache_distributed.TYPE_INT, 3, '7']), 1)
+    item = self.get_items(['legacy'])['legacy']
+    self.assertEqual(item.value(), '7')
+    self.assertEqual(item.flags(), memcache_distributed.TYPE_INT)
+
+    # Incrementing a legacy counter rewrites it in the current format.
+    new_values = self.increment(
+      [('legacy', 1, MemcacheIncrementRequest.INCREMENT, None)])
+    self.assertListEqual(new_values, [8])
+    self.assertEqual(self.client.entries[key][1], '8')
+    self.assertListEqual(self.increment(
+      [('legacy', 1, MemcacheIncrementRequest.INCREMENT, None)]), [9])
+
+    # Legacy entries are ignored when the migration is finished.
+    self.client.entries[key] = (
+      0, cPickle.dumps([memcache_distributed.TYPE_INT, 3, '7']), 1)
+    self.stub._read_legacy_entries = False
+    self.assertDictEqual(self.get_items(['legacy']), {})
+
+
+class TestMemcacheClient(unittest.TestCase):
+  def test_pipeline(self):
+    servers = {'a': FakeServer(['STORED', 'NOT_STORED']),
+               'b': FakeServer(['DELETED'])}
+    client = memcache_distributed.MemcacheClient([])
+    flexmock(client).should_receive('_get_server').replace_with(
+      lambda key: (servers[key[0]], key))
+
+    replies = client.pipeline([('a1', 'set a1\r\n'), ('b1', 'delete b1\r\n'),
+                               ('a2', 'add a2\r\n')])
+    self.assertListEqual(replies, ['STORED', 'DELETED', 'NOT_STORED'])
+
+    # The commands for each server are sent together.
+    self.assertListEqual(servers['a'].sent, ['set a1\r\nadd a2\r\n'])
+    self.assertListEqual(servers['b'].sent, ['delete b1\r\n'])
+
+  def test_get_entries(self):
+    server = FakeServer(['VALUE key1 16777216 5 7', 'value\r\n', 'END'])
+    client = memcache_distributed.MemcacheClient([])
+    flexmock(client).should_receive('_map_and_prefix_keys').and_return(
+      ({server: ['key1', 'key2']}, {'key1': 'key1', 'key2': 'key2'}))
+
+    self.assertDictEqual(client.get_entries(['key1', 'key2'], for_cas=True),
+                         {'key1': (1 << 24, 'value', 7)})
+    self.assertListEqual(server.sent, ['gets key1 key2\r\n'])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,181 @@
+import errno
+import httplib
+import os
+import socket
+import sys
+import unittest
+from flexmock import flexmock
+
+appserver = "{0}/../../../..".format(os.path.dirname(__file__))
+sys.path.append(appserver)
+from google.appengine.api import appscale_connection_pool
+from google.appengine.datastore import datastore_pb
+from google.net.proto import ProtocolBuffer
+
+ConnectionPool = appscale_connection_pool.ConnectionPool
+
+
+class FakeSocket(object):
+  """ An idle socket that the server has not closed. """
+  def setblocking(self, flag):
+    pass
+
+  def recv(self, size, flags):
+    raise socket.error(errno.EAGAIN, 'Resource temporarily unavailable')
+
+
+class FakeResponse(object):
+  def __init__(self, body=''):
+    self.status = 200
+    self.will_close = False
+    self.body = body
+
+  def read(self):
+    return self.body
+
+
+class FakeConnection(object):
+  """ Records requests and fails at a chosen step. """
+  def __init__(self, send_error=None, response_error=None, response=None):
+    self.sock = FakeSocket()
+    self.send_error = send_error
+    self.response_error = response_error
+    self.response = response or FakeResponse()
+    self.sent = 0
+    self.closed = False
+
+  def putrequest(self, method, url):
+    pass
+
+  def putheader(self, name, value):
+    pass
+
+  def endheaders(self):
+    pass
+
+  def send(self, data):
+    if self.send_error is not None:
+      raise self.send_error
+    self.sent += 1
+
+  def getresponse(self):
+    if self.response_error is not None:
+      raise self.response_error
+    return self.response
+
+  def close(self):
+    self.closed = True
+    self.sock = None
+
+
+class TestConnectionPool(unittest.TestCase):
+  def test_reuse(self):
+    pool = ConnectionPool('localhost:8888')
+    conn = FakeConnection()
+    flexmock(pool).should_receive('_new_connection').and_return(conn).once()
+    self.assertEqual(pool.acquire(), (conn, False))
+
+    pool.release(conn)
+    self.assertEqual(pool.acquire(), (conn, True))
+
+  def test_discard(self):
+    pool = ConnectionPool('localhost:8888')
+    conn = FakeConnection()
+    pool.discard(conn)
+    self.assertTrue(conn.closed)
+
+    # Closed connections are not returned to the pool.
+    pool.release(conn)
+    new_conn = FakeConnection()
+    flexmock(pool).should_receive('_new_connection').and_return(new_conn)
+    self.assertEqual(pool.acquire(), (new_conn, False))
+
+  def test_unhealthy_connections(self):
+    pool = ConnectionPool('localhost:8888', idle_timeout=30)
+    expired = FakeConnection()
+    pool.release(expired)
+    flexmock(appscale_connection_pool.time).should_receive('time').\
+      and_return(1000 + 31)
+    pool._idle[0] = (expired, 1000)
+
+    new_conn = FakeConnection()
+    flexmock(pool).should_receive('_new_connection').and_return(new_conn)
+    self.assertEqual(pool.acquire(), (new_conn, False))
+    self.assertTrue(expired.closed)
+
+  def test_max_idle(self):
+    pool = ConnectionPool('localhost:8888', max_idle=2)
+    connections = [FakeConnection() for _ in range(3)]
+    for conn in connections:
+      pool.release(conn)
+
+    self.assertEqual(len(pool._idle), 2)
+    self.assertTrue(connections[2].closed)
+
+  def test_stats(self):
+    pool = ConnectionPool('localhost:8888', idle_timeout=30)
+    conn = FakeConnection()
+    flexmock(pool).should_receive('_new_connection').and_return(conn)
+    pool.acquire()
+    self.assertDictEqual(pool.stats(),
+                         {'hits': 0, 'misses': 1, 'discarded': 0, 'idle': 0})
+
+    pool.release(conn)
+    self.assertDictEqual(pool.stats(),
+                         {'hits': 0, 'misses': 1, 'discarded': 0, 'idle': 1})
+    pool.acquire()
+    self.assertDictEqual(pool.stats(),
+                         {'hits': 1, 'misses': 1, 'discarded': 0, 'idle': 0})
+
+    # An expired connection is evicted and counts as a miss.
+    pool.release(conn)
+    pool._idle[0] = (conn, 1000)
+    flexmock(appscale_connection_pool.time).should_receive('time').\
+      and_return(1000 + 31)
+    pool.acquire()
+    self.assertDictEqual(pool.stats(),
+                         {'hits': 1, 'misses': 2, 'discarded': 1, 'idle': 0})
+
+
+class TestPooledCommand(unittest.TestCase):
+  def send(self, connections):
+    pool = ConnectionPool('localhost:8888')
+    for conn in connections[:-1]:
+      pool.release(conn)
+    flexmock(pool).should_receive('_new_connection').\
+      and_return(connections[-1])
+    request = datastore_pb.GetRequest()
+    return request.sendCommand('localhost:8888', 'guestbook', None,
+                               connection_pool=pool)
+
+  def test_stale_connection_retried(self):
+    stale = FakeConnection(send_error=socket.error(errno.EPIPE, 'Broken pipe'))
+    new_conn = FakeConnection()
+    self.send([stale, new_conn])
+    self.assertTrue(stale.closed)
+    self.assertEqual(new_conn.sent, 1)
+
+    unusable = FakeConnection(send_error=httplib.CannotSendRequest())
+    new_conn = FakeConnection()
+    self.send([unusable, new_conn])
+    self.assertEqual(new_conn.sent, 1)
+
+  def test_failed_response_not_retried(self):
+    # The server might have handled the request before dropping it.
+    dropped = FakeConnection(response_error=httplib.BadStatusLine(''))
+    new_conn = FakeConnection()
+    self.assertRaises(httplib.BadStatusLine, self.send, [dropped, new_conn])
+    self.assertTrue(dropped.closed)
+    self.assertEqual(new_conn.sent, 0)
+
+    reset = FakeConnection(
+      send_error=socket.error(errno.ECONNRESET, 'Connection reset'))
+    self.assertRaises(socket.error, self.send, [reset, FakeConnection()])
+
+  def test_new_connection_not_retried(self):
+    failing = FakeConnection(send_error=socket.error(errno.EPIPE, 'Broken pipe'))
+    self.assertRaises(socket.error, self.send, [failing])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -89,7 +89,8 @@ class InvalidMetadataError(Error):
   """The filename or content type of the entity was not a valid UTF-8 string."""
 
 
-def GenerateBlobKey(time_func=time.time, random_func=random.random):
+def GenerateBlobKey(time_func=time.time, random_func=random.random,
+                    app_id=None):
   """Generate a unique BlobKey.
 
   BlobKey is generated using the current time stamp combined with a random
@@ -103,6 +104,8 @@ def GenerateBlobKey(time_func=time.time, random_func=random.random):
       Must return a floating point UTC timestamp.
     random_func: Function used for generating the random number.  Used for
       dependency injection.  Allows for predictable results during tests.
+    app_id: The application to check for existing keys.  Defaults to the
+      current application.
 
   Returns:
     String version of BlobKey that is unique within the BlobInfo datastore.
@@ -118,7 +121,8 @@ def GenerateBlobKey(time_func=time.time, random_func=random.random):
     blob_key = base64.urlsafe_b64encode(digester.digest())
     datastore_key = datastore.Key.from_path(blobstore.BLOB_INFO_KIND,
                                             blob_key,
-                                            namespace='')
+                                            namespace='',
+                                            _app=app_id)
     try:
       datastore.Get(datastore_key)
       tries += 1
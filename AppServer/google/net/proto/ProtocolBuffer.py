@@ -19,9 +19,11 @@
 
 
 import array
+import errno
 import httplib
 import os
 import re
+import socket
 import struct
 
 __all__ = ['ProtocolMessage', 'Encoder', 'Decoder',
@@ -33,6 +35,10 @@ __all__ = ['ProtocolMessage', 'Encoder', 'Decoder',
 
 URL_RE = re.compile('^(https?)://([^/]+)(/.*)$')
 
+# AppScale: Socket errors that indicate a request could not be sent because
+# the server closed a reused connection.
+STALE_CONNECTION_ERRNOS = (errno.EPIPE,)
+
 class ProtocolMessage:
 
 
@@ -109,8 +115,13 @@ class ProtocolMessage:
 
   def sendCommand(self, server, url, response, follow_redirects=1,
                   secure=0, keyfile=None, certfile=None, service_id=None,
-                  version_id=None):
+                  version_id=None, connection_pool=None):
     data = self.Encode()
+    # AppScale: Reuse a persistent connection when a pool is provided.
+    if connection_pool is not None:
+      return self._sendPooledCommand(connection_pool, url, data, response,
+                                     follow_redirects)
+
     if secure:
       if keyfile and certfile:
         conn = httplib.HTTPSConnection(server, key_file=keyfile,
@@ -119,6 +130,27 @@ class ProtocolMessage:
         conn = httplib.HTTPSConnection(server)
     else:
       conn = httplib.HTTPConnection(server)
+    self._putRequest(conn, url, data)
+    conn.send(data)
+    resp = conn.getresponse()
+    if follow_redirects > 0 and resp.status == 302:
+      m = URL_RE.match(resp.getheader('Location'))
+      if m:
+        protocol, server, url = m.groups()
+        return self.sendCommand(server, url, response,
+                                follow_redirects=follow_redirects - 1,
+                                secure=(protocol == 'https'),
+                                keyfile=keyfile,
+                                certfile=certfile)
+    if resp.status != 200:
+      conn.close()
+      raise ProtocolBufferReturnError(resp.status)
+    if response is not None:
+      response.ParseFromString(resp.read())
+    conn.close()
+    return response
+
+  def _putRequest(self, conn, url, data):
     conn.putrequest("POST", '/')
     conn.putheader("Content-Length", "%d" %len(data))
     # AppScale:
@@ -138,23 +170,59 @@ class ProtocolMessage:
     conn.putheader('Version', version_id)
 
     conn.endheaders()
-    conn.send(data)
-    resp = conn.getresponse()
+
+  def _sendPooledCommand(self, pool, url, data, response, follow_redirects):
+    # AppScale: A reused connection may have been closed by the server while
+    # it was idle. If sending the request fails because of that, the server
+    # did not receive it, so it is safe to send it once more over a new
+    # connection. Failures after the request is sent are not retried since
+    # the server might have already handled it.
+    while True:
+      conn, reused = pool.acquire()
+      try:
+        self._putRequest(conn, url, data)
+        conn.send(data)
+      except (httplib.CannotSendRequest, socket.error) as error:
+        pool.discard(conn)
+        stale = (isinstance(error, httplib.CannotSendRequest) or
+                 error.errno in STALE_CONNECTION_ERRNOS)
+        if reused and stale:
+          continue
+        raise
+      break
+
+    try:
+      resp = conn.getresponse()
+    except (httplib.HTTPException, socket.error):
+      pool.discard(conn)
+      raise
+
     if follow_redirects > 0 and resp.status == 302:
-      m = URL_RE.match(resp.getheader('Location'))
+      location = resp.getheader('Location')
+      pool.discard(conn)
+      m = URL_RE.match(location)
       if m:
         protocol, server, url = m.groups()
         return self.sendCommand(server, url, response,
                                 follow_redirects=follow_redirects - 1,
                                 secure=(protocol == 'https'),
-                                keyfile=keyfile,
-                                certfile=certfile)
+                                keyfile=pool.keyfile,
+                                certfile=pool.certfile)
+    try:
+      body = resp.read()
+    except (httplib.HTTPException, socket.error):
+      pool.discard(conn)
+      raise
+
+    if resp.will_close:
+      pool.discard(conn)
+    else:
+      pool.release(conn)
+
     if resp.status != 200:
-      conn.close()
       raise ProtocolBufferReturnError(resp.status)
     if response is not None:
-      response.ParseFromString(resp.read())
-    conn.close()
+      response.ParseFromString(body)
     return response
 
   def sendSecureCommand(self, server, keyfile, certfile, url, response,
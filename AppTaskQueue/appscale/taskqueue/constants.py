@@ -55,6 +55,7 @@ SUPPORTED_PUSH_QUEUE_FIELDS = {
   'mode': lambda mode: mode == 'push',
   'name': QUEUE_NAME_RE.match,
   'rate': RATE_REGEX.match,
+  'bucket_size': lambda size: isinstance(size, int) and size > 0,
   'target': TARGET_REGEX.match,
   'retry_parameters': {
     'task_retry_limit': non_negative_int,
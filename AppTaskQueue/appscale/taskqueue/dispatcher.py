@@ -0,0 +1,172 @@
+""" Helpers that push workers use to dispatch tasks to their targets. """
+import time
+from collections import defaultdict
+
+import eventlet
+from eventlet.green import httplib
+
+from .utils import logger
+
+# The number of seconds in each unit that a queue rate can use.
+RATE_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+# The bucket size that queues use when it is not specified.
+DEFAULT_BUCKET_SIZE = 5
+
+
+def parse_rate(rate):
+  """ Converts a queue rate to the number of tasks per second.
+
+  Args:
+    rate: A string specifying a queue rate (eg. '5/s').
+  Returns:
+    A float specifying the number of tasks per second.
+  """
+  if '/' not in rate:
+    return float(rate)
+
+  amount, unit = rate.split('/')
+  return float(amount) / RATE_UNITS[unit]
+
+
+class TokenBucket(object):
+  """ Limits how often a queue's tasks are dispatched.
+
+  Tokens are added at the queue's rate, and up to bucket_size tokens can be
+  saved up for bursts. A rate of 0 does not limit the queue, which matches how
+  Celery treated it.
+  """
+  def __init__(self, rate, bucket_size=DEFAULT_BUCKET_SIZE):
+    """ Creates a new TokenBucket.
+
+    Args:
+      rate: A float specifying the number of tokens added per second.
+      bucket_size: An integer specifying the maximum number of tokens.
+    """
+    self.rate = rate
+    self.capacity = max(bucket_size, 1)
+    self._tokens = float(self.capacity)
+    self._last_update = time.time()
+
+  def acquire(self):
+    """ Waits until a token is available and takes it. """
+    if not self.rate:
+      return
+
+    while True:
+      now = time.time()
+      self._tokens = min(self.capacity,
+                         self._tokens + (now - self._last_update) * self.rate)
+      self._last_update = now
+      if self._tokens >= 1:
+        self._tokens -= 1
+        return
+
+      eventlet.sleep((1 - self._tokens) / self.rate)
+
+
+class ConnectionPool(object):
+  """ Keeps idle connections to each target port open for reuse. """
+
+  # The maximum number of idle connections to keep for each target.
+  MAX_IDLE = 100
+
+  def __init__(self, host):
+    """ Creates a new ConnectionPool.
+
+    Args:
+      host: A string specifying the host that serves targets.
+    """
+    self.host = host
+    self._idle = defaultdict(list)
+
+  def get(self, scheme, port):
+    """ Fetches a connection to a target.
+
+    Args:
+      scheme: A string specifying the URL scheme.
+      port: An integer specifying the target port.
+    Returns:
+      A tuple containing an HTTPConnection and a boolean indicating that the
+      connection was used before.
+    Raises:
+      ValueError if the scheme is not supported.
+    """
+    idle = self._idle[(scheme, port)]
+    if idle:
+      return idle.pop(), True
+
+    if scheme == 'http':
+      return httplib.HTTPConnection(self.host, port), False
+    elif scheme == 'https':
+      return httplib.HTTPSConnection(self.host, port), False
+    else:
+      raise ValueError('Unsupported URL scheme: {}'.format(scheme))
+
+  def release(self, scheme, port, connection, response):
+    """ Returns a connection to the pool after its response has been read.
+
+    Args:
+      scheme: A string specifying the URL scheme.
+      port: An integer specifying the target port.
+      connection: An HTTPConnection.
+      response: The HTTPResponse that was read from the connection.
+    """
+    idle = self._idle[(scheme, port)]
+    if response.will_close or len(idle) >= self.MAX_IDLE:
+      connection.close()
+      return
+
+    idle.append(connection)
+
+
+class TaskStateWriter(object):
+  """ Records the final states of tasks in batches. """
+
+  # The maximum number of seconds to wait before recording states.
+  FLUSH_INTERVAL = 1
+
+  # The number of states that are recorded right away.
+  MAX_BATCH_SIZE = 100
+
+  def __init__(self, task_names):
+    """ Creates a new TaskStateWriter.
+
+    Args:
+      task_names: A TaskNameStore.
+    """
+    self.task_names = task_names
+    self._pending = []
+    self._flusher = None
+
+  def finish(self, name, app, queue, state):
+    """ Schedules a task's final state to be recorded.
+
+    Args:
+      name: A string specifying the task name.
+      app: A string specifying the application ID.
+      queue: A string specifying the queue name.
+      state: A string from TASK_STATES.
+    """
+    self._pending.append((name, app, queue, state))
+    if len(self._pending) >= self.MAX_BATCH_SIZE:
+      self.flush()
+    elif self._flusher is None:
+      self._flusher = eventlet.spawn_after(self.FLUSH_INTERVAL,
+                                           self._scheduled_flush)
+
+  def flush(self):
+    """ Records all of the pending states. """
+    tasks, self._pending = self._pending, []
+    if not tasks:
+      return
+
+    try:
+      self.task_names.finish(tasks)
+    except Exception:
+      logger.exception('Unable to record {} task states'.format(len(tasks)))
+
+  def _scheduled_flush(self):
+    """ Records the pending states when the flush interval has passed. """
+    self._flusher = None
+    self.flush()
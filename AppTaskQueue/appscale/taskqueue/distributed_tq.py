@@ -7,16 +7,12 @@ import base64
 import datetime
 import hashlib
 import json
-import os
 import socket
 import sys
 import time
 import tq_lib
 
-from appscale.common import (
-  appscale_info,
-  constants
-)
+from appscale.common import appscale_info
 from appscale.common.constants import SCHEMA_CHANGE_TIMEOUT
 from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
 from appscale.datastore.cassandra_env.cassandra_interface import KEYSPACE
@@ -40,8 +36,8 @@ from .queue import (
   PushQueue,
   TransientError
 )
-from .task import Task
-from .task_name import TaskName
+from .task import InvalidTaskInfo, Task, TaskNameTaken
+from .task_name import TaskNameStore
 from .tq_lib import TASK_STATES
 from .utils import (
   get_celery_queue_name,
@@ -52,13 +48,9 @@ from .queue_manager import GlobalQueueManager
 from .service_manager import GlobalServiceManager
 
 sys.path.append(APPSCALE_PYTHON_APPSERVER)
-from google.appengine.api import apiproxy_stub_map
-from google.appengine.api import datastore_errors
-from google.appengine.api import datastore_distributed
 from google.appengine.api.taskqueue import taskqueue_service_pb
 from google.appengine.api.taskqueue.taskqueue_service_pb import (
   TaskQueueServiceError)
-from google.appengine.ext import db
 from google.appengine.runtime import apiproxy_errors
 
 # A policy that does not retry statements.
@@ -239,12 +231,33 @@ def create_pull_queue_tables(cluster, session):
     raise
 
 
-def setup_env():
-  """ Sets required environment variables for GAE datastore library. """
-  os.environ['AUTH_DOMAIN'] = "appscale.com"
-  os.environ['USER_EMAIL'] = ""
-  os.environ['USER_NICKNAME'] = ""
-  os.environ['APPLICATION_ID'] = ""
+def create_push_task_names_table(session):
+  """ Create the table that tracks push task names.
+
+  Args:
+    session: A cassandra-driver session.
+  """
+  logger.info('Trying to create push_task_names')
+  create_table = """
+    CREATE TABLE IF NOT EXISTS push_task_names (
+      name text,
+      app text,
+      queue text,
+      state text,
+      op_id uuid,
+      endtime timestamp,
+      PRIMARY KEY (name)
+    ) WITH gc_grace_seconds = 120
+  """
+  statement = SimpleStatement(create_table, retry_policy=NO_RETRIES)
+  try:
+    session.execute(statement, timeout=SCHEMA_CHANGE_TIMEOUT)
+  except OperationTimedOut:
+    logger.warning(
+      'Encountered an operation timeout while creating push_task_names. '
+      'Waiting {} seconds for schema to settle.'.format(SCHEMA_CHANGE_TIMEOUT))
+    time.sleep(SCHEMA_CHANGE_TIMEOUT)
+    raise
 
 class DistributedTaskQueue():
   """ AppScale taskqueue layer for the TaskQueue API. """
@@ -273,16 +286,8 @@ class DistributedTaskQueue():
       db_access: A DatastoreProxy object.
       zk_client: A KazooClient.
     """
-    setup_env()
-
-    db_proxy = appscale_info.get_db_proxy()
-    connection_str = '{}:{}'.format(db_proxy, str(constants.DB_SERVER_PORT))
-    ds_distrib = datastore_distributed.DatastoreDistributed(
-      constants.DASHBOARD_APP_ID, connection_str, require_indexes=False)
-    apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', ds_distrib)
-    os.environ['APPLICATION_ID'] = constants.DASHBOARD_APP_ID
-
     self.db_access = db_access
+    self.task_names = TaskNameStore(db_access)
     self.load_balancers = appscale_info.get_load_balancer_ips()
     self.queue_manager = GlobalQueueManager(zk_client, db_access)
     self.service_manager = GlobalServiceManager(zk_client)
@@ -350,10 +355,7 @@ class DistributedTaskQueue():
         num_tasks = queue.total_tasks()
         oldest_eta = queue.oldest_eta()
       else:
-        num_tasks = TaskName.all().\
-          filter("state =", tq_lib.TASK_STATES.QUEUED).\
-          filter("queue =", queue_name).\
-          filter("app_id =", app_id).count()
+        num_tasks = self.task_names.count_queued(app_id, queue_name)
 
         # This is not supported for push queues yet.
         oldest_eta = None
@@ -521,8 +523,10 @@ class DistributedTaskQueue():
 
     now = datetime.datetime.utcfromtimestamp(time.time())
 
-    # Assign names if needed and validate tasks.
+    # Assign names if needed and validate tasks. Pull tasks are grouped by
+    # queue so that each queue can add them together.
     error_found = False
+    pull_tasks = {}
     for add_request in request.add_request_list():
       task_result = response.add_taskresult()
 
@@ -542,10 +546,9 @@ class DistributedTaskQueue():
         if add_request.has_tag():
           task_info['tag'] = add_request.tag()
 
-        new_task = Task(task_info)
-        queue.add_task(new_task)
-        task_result.set_result(TaskQueueServiceError.OK)
-        task_result.set_chosen_task_name(new_task.id)
+        queue_key = (add_request.app_id(), add_request.queue_name())
+        pull_tasks.setdefault(queue_key, (queue, []))[1].append(
+          (Task(task_info), task_result))
         continue
 
       result = tq_lib.verify_task_queue_add_request(add_request.app_id(),
@@ -566,15 +569,61 @@ class DistributedTaskQueue():
       else:
         error_found = True
         task_result.set_result(result)
+
+    for queue, queue_tasks in pull_tasks.itervalues():
+      add_results = queue.add_tasks([task for task, _ in queue_tasks])
+      for (task, task_result), error in zip(queue_tasks, add_results):
+        if isinstance(error, TaskNameTaken):
+          task_result.set_result(TaskQueueServiceError.TASK_ALREADY_EXISTS)
+        elif isinstance(error, InvalidTaskInfo):
+          logger.warning(str(error))
+          task_result.set_result(TaskQueueServiceError.INVALID_REQUEST)
+        elif isinstance(error, TransientError):
+          task_result.set_result(TaskQueueServiceError.TRANSIENT_ERROR)
+        else:
+          task_result.set_result(TaskQueueServiceError.OK)
+          task_result.set_chosen_task_name(task.id)
+
     if error_found:
       return
 
+    push_tasks = []
     for add_request, task_result in zip(request.add_request_list(),
                                         response.taskresult_list()):
       if (add_request.has_mode() and
           add_request.mode() == taskqueue_service_pb.TaskQueueMode.PULL):
         continue
 
+      try:
+        self.__validate_push_task(add_request)
+      except apiproxy_errors.ApplicationError as error:
+        task_result.set_result(error.application_error)
+        continue
+
+      push_tasks.append((add_request, task_result))
+
+    # Store the names of all the push tasks at once to prevent duplicates.
+    name_results = self.task_names.claim(
+      [(add_request.task_name(), add_request.app_id(),
+        add_request.queue_name()) for add_request, _ in push_tasks])
+    for (add_request, task_result), existing in zip(push_tasks, name_results):
+      if isinstance(existing, TransientError):
+        logger.error(str(existing))
+        task_result.set_result(TaskQueueServiceError.TRANSIENT_ERROR)
+        continue
+
+      if existing == TASK_STATES.QUEUED:
+        logger.warning(
+          'Task already exists: {}'.format(add_request.task_name()))
+        task_result.set_result(TaskQueueServiceError.TASK_ALREADY_EXISTS)
+        continue
+
+      if existing is not None:
+        # If a task with the same name has already been processed, it should
+        # be tombstoned for some time to prevent a duplicate task.
+        task_result.set_result(TaskQueueServiceError.TOMBSTONED_TASK)
+        continue
+
       try:
         self.__enqueue_push_task(source_info, add_request)
       except apiproxy_errors.ApplicationError as error:
@@ -604,55 +653,15 @@ class DistributedTaskQueue():
     elif method == taskqueue_service_pb.TaskQueueQueryTasksResponse_Task.DELETE:
       return 'DELETE'
 
-  def __check_and_store_task_names(self, request):
-    """ Tries to fetch the taskqueue name, if it exists it will raise an
-    exception.
-
-    We store a receipt of each enqueued task in the datastore. If we find that
-    task in the datastore, we will raise an exception. If the task is not
-    in the datastore, then it is assumed this is the first time seeing the
-    tasks and we create a receipt of the task in the datastore to prevent
-    a duplicate task from being enqueued.
-
-    Args:
-      request: A taskqueue_service_pb.TaskQueueAddRequest.
-    Raises:
-      A apiproxy_errors.ApplicationError of TASK_ALREADY_EXISTS.
-    """
-    task_name = request.task_name()
-    item = TaskName.get_by_key_name(task_name)
-    logger.debug("Task name {0}".format(task_name))
-    if item:
-      if item.state == TASK_STATES.QUEUED:
-        logger.warning("Task already exists")
-        raise apiproxy_errors.ApplicationError(
-          TaskQueueServiceError.TASK_ALREADY_EXISTS)
-      else:
-        # If a task with the same name has already been processed, it should
-        # be tombstoned for some time to prevent a duplicate task.
-        raise apiproxy_errors.ApplicationError(
-          TaskQueueServiceError.TOMBSTONED_TASK)
-
-    new_name = TaskName(key_name=task_name, state=tq_lib.TASK_STATES.QUEUED,
-      queue=request.queue_name(), app_id=request.app_id())
-    logger.debug("Creating entity {0}".format(str(new_name)))
-    try:
-      db.put(new_name)
-    except datastore_errors.InternalError as internal_error:
-      logger.error(str(internal_error))
-      raise apiproxy_errors.ApplicationError(
-        TaskQueueServiceError.DATASTORE_ERROR)
-
   def __enqueue_push_task(self, source_info, request):
-    """ Enqueues a batch of push tasks.
+    """ Enqueues a push task. The task should already be validated and its
+    name should already be stored.
 
     Args:
       source_info: A dictionary containing the application, module, and version
        ID that is sending this request.
       request: A taskqueue_service_pb.TaskQueueAddRequest.
     """
-    self.__validate_push_task(request)
-    self.__check_and_store_task_names(request)
     headers = self.get_task_headers(request)
     args = self.get_task_args(source_info, headers, request)
     countdown = int(headers['X-AppEngine-TaskETA']) - \
@@ -3,18 +3,22 @@ import datetime
 import json
 import logging
 import os
-import sys
 
-from appscale.common import appscale_info
-from appscale.common import constants
-from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from appscale.datastore.cassandra_env.cassandra_interface import DatastoreProxy
+from celery.signals import worker_shutdown
 from celery.utils.log import get_task_logger
-from eventlet.green import httplib
 from eventlet.green.httplib import BadStatusLine
 from eventlet.timeout import Timeout as EventletTimeout
 from socket import error as SocketError
 from urlparse import urlparse
-from .task_name import TaskName
+from .dispatcher import (
+  ConnectionPool,
+  DEFAULT_BUCKET_SIZE,
+  parse_rate,
+  TaskStateWriter,
+  TokenBucket
+)
+from .task_name import TaskNameStore
 from .tq_lib import TASK_STATES
 from .utils import (
   create_celery_for_app,
@@ -22,11 +26,6 @@ from .utils import (
   get_queue_function_name
 )
 
-sys.path.append(APPSCALE_PYTHON_APPSERVER)
-from google.appengine.api import apiproxy_stub_map
-from google.appengine.api import datastore_distributed
-from google.appengine.ext import db
-
 
 # The maximum number of seconds a task is permitted to take.
 MAX_TASK_DURATION = 13 * 60
@@ -35,19 +34,32 @@ app_id = os.environ['APP_ID']
 remote_host = os.environ['HOST']
 
 with open(get_celery_configuration_path(app_id)) as config_file:
-  rates = json.load(config_file)
+  queue_config = json.load(config_file)
+
+rates = {}
+buckets = {}
+for queue_name, queue_info in queue_config.iteritems():
+  # Older configuration files only contain the rate.
+  if isinstance(queue_info, basestring):
+    queue_info = {'rate': queue_info}
+
+  rates[queue_name] = queue_info['rate']
+  buckets[queue_name] = TokenBucket(
+    parse_rate(queue_info['rate']),
+    queue_info.get('bucket_size', DEFAULT_BUCKET_SIZE))
 
 celery = create_celery_for_app(app_id, rates)
 
+# Queue rates are enforced by the token buckets.
+celery.conf.CELERY_DISABLE_RATE_LIMITS = True
+
 logger = get_task_logger(__name__)
 logger.setLevel(logging.INFO)
 
-db_proxy = appscale_info.get_db_proxy()
-connection_str = '{}:{}'.format(db_proxy, str(constants.DB_SERVER_PORT))
-ds_distrib = datastore_distributed.DatastoreDistributed(
-  'appscaledashboard', connection_str, require_indexes=False)
-apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', ds_distrib)
-os.environ['APPLICATION_ID'] = 'appscaledashboard'
+connections = ConnectionPool(remote_host)
+
+task_states = TaskStateWriter(TaskNameStore(DatastoreProxy()))
+worker_shutdown.connect(lambda **kwargs: task_states.flush(), weak=False)
 
 
 def get_wait_time(retries, args):
@@ -71,6 +83,86 @@ def get_wait_time(retries, args):
   return wait_time
 
 
+def send_request(url, method, urlpath, headers, body):
+  """ Sends a task request to its target over a pooled connection.
+
+  A connection that was reused may have been closed by the target while it was
+  idle, so the request is sent again over a new connection if that fails.
+
+  Args:
+    url: A ParseResult specifying the task URL.
+    method: A string specifying the HTTP method.
+    urlpath: A string specifying the path and query of the request.
+    headers: A dictionary of headers for the request.
+    body: A string containing the request body.
+  Returns:
+    An HTTPResponse that has already been read.
+  Raises:
+    ValueError if the URL scheme is not supported.
+    BadStatusLine or SocketError if the request fails.
+  """
+  while True:
+    connection, reused = connections.get(url.scheme, url.port)
+    try:
+      response = send_request_over(connection, method, urlpath, headers, body)
+    except (BadStatusLine, SocketError):
+      connection.close()
+      if reused:
+        continue
+
+      raise
+
+    connections.release(url.scheme, url.port, connection, response)
+    return response
+
+
+def send_request_over(connection, method, urlpath, headers, body):
+  """ Sends a task request over a connection and reads the response.
+
+  Args:
+    connection: An HTTPConnection.
+    method: A string specifying the HTTP method.
+    urlpath: A string specifying the path and query of the request.
+    headers: A dictionary of headers for the request.
+    body: A string containing the request body.
+  Returns:
+    An HTTPResponse that has already been read.
+  """
+  skip_host = False
+  if 'host' in headers or 'Host' in headers:
+    skip_host = True
+
+  skip_accept_encoding = False
+  if 'accept-encoding' in headers or 'Accept-Encoding' in headers:
+    skip_accept_encoding = True
+
+  connection.putrequest(method,
+                        urlpath,
+                        skip_host=skip_host,
+                        skip_accept_encoding=skip_accept_encoding)
+
+  for header in headers:
+    connection.putheader(header, headers[header])
+
+  if 'content-type' not in headers or 'Content-Type' not in headers:
+    if '?' in urlpath:
+      connection.putheader('content-type', 'application/octet-stream')
+    else:
+      connection.putheader('content-type',
+                           'application/x-www-form-urlencoded')
+
+  connection.putheader("Content-Length", str(len(body)))
+
+  connection.endheaders()
+  if body:
+    connection.send(body)
+
+  response = connection.getresponse()
+  response.read()
+  response.close()
+  return response
+
+
 def execute_task(task, headers, args):
   """ Executes a task to a url with the given args.
 
@@ -114,11 +206,8 @@ def execute_task(task, headers, args):
            args['task_name'], task.request.id, args['expires']))
         celery.control.revoke(task.request.id)
 
-        item = TaskName.get_by_key_name(args['task_name'])
-        if item is not None:
-          item.state = TASK_STATES.EXPIRED
-          item.endtime = datetime.datetime.now()
-          db.put(item)
+        task_states.finish(args['task_name'], args['app_id'],
+                           args['queue_name'], TASK_STATES.EXPIRED)
 
         return
 
@@ -129,65 +218,32 @@ def execute_task(task, headers, args):
           args['max_retries']))
         celery.control.revoke(task.request.id)
 
-        item = TaskName.get_by_key_name(args['task_name'])
-        if item is not None:
-          item.state = TASK_STATES.FAILED
-          item.endtime = datetime.datetime.now()
-          db.put(item)
+        task_states.finish(args['task_name'], args['app_id'],
+                           args['queue_name'], TASK_STATES.FAILED)
 
         return
 
       # Targets do not get X-Forwarded-Proto from nginx, they use haproxy port.
       headers['X-Forwarded-Proto'] = url.scheme
-      if url.scheme == 'http':
-        connection = httplib.HTTPConnection(remote_host, url.port)
-      elif url.scheme == 'https':
-        connection = httplib.HTTPSConnection(remote_host, url.port)
-      else:
-        logger.error("Task %s tried to use url scheme %s, "
-                     "which is not supported." % (
-                     args['task_name'], url.scheme))
-
-      skip_host = False
-      if 'host' in headers or 'Host' in headers:
-        skip_host = True
-
-      skip_accept_encoding = False
-      if 'accept-encoding' in headers or 'Accept-Encoding' in headers:
-        skip_accept_encoding = True
-
-      connection.putrequest(method,
-                            urlpath,
-                            skip_host=skip_host,
-                            skip_accept_encoding=skip_accept_encoding)
 
       # Update the task headers
       headers['X-AppEngine-TaskRetryCount'] = str(task.request.retries)
       headers['X-AppEngine-TaskExecutionCount'] = str(task.request.retries)
 
-      for header in headers:
-        connection.putheader(header, headers[header])
-
-      if 'content-type' not in headers or 'Content-Type' not in headers:
-        if url.query:
-          connection.putheader('content-type', 'application/octet-stream')
-        else:
-          connection.putheader('content-type',
-                               'application/x-www-form-urlencoded')
-
-      connection.putheader("Content-Length", str(content_length))
-
       retries = int(task.request.retries) + 1
       wait_time = get_wait_time(retries, args)
 
-      try:
-        connection.endheaders()
-        if args["body"]:
-          connection.send(args['body'])
+      bucket = buckets.get(args['queue_name'])
+      if bucket is not None:
+        bucket.acquire()
 
-        response = connection.getresponse()
-        response.read()
-        response.close()
+      try:
+        response = send_request(url, method, urlpath, headers, args['body'])
+      except ValueError:
+        logger.error("Task %s tried to use url scheme %s, "
+                     "which is not supported." % (
+                     args['task_name'], url.scheme))
+        return
       except (BadStatusLine, SocketError):
         logger.warning(
           '{task} failed before receiving response. It will retry in {wait} '
@@ -196,11 +252,8 @@ def execute_task(task, headers, args):
 
       if 200 <= response.status < 300:
         # Task successful.
-        item = TaskName.get_by_key_name(args['task_name'])
-        if item is not None:
-          item.state = TASK_STATES.SUCCESS
-          item.endtime = datetime.datetime.now()
-          db.put(item)
+        task_states.finish(args['task_name'], args['app_id'],
+                           args['queue_name'], TASK_STATES.SUCCESS)
 
         time_elapsed = datetime.datetime.utcnow() - start_time
         logger.info(
@@ -1,10 +1,13 @@
 import datetime
 
 import base64
+import hashlib
 import json
+import random
 import re
 import sys
 import uuid
+import zlib
 
 from appscale.common import retrying
 from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
@@ -14,9 +17,9 @@ from appscale.datastore.cassandra_env.retry_policies import (
 )
 from appscale.datastore.dbconstants import TRANSIENT_CASSANDRA_ERRORS
 from cassandra import DriverException
+from cassandra.concurrent import execute_concurrent
 from cassandra.query import BatchStatement
 from cassandra.query import ConsistencyLevel
-from cassandra.query import SimpleStatement
 from collections import deque
 from threading import Lock
 from .constants import AGE_LIMIT_REGEX
@@ -24,7 +27,7 @@ from .constants import EmptyQueue
 from .constants import InvalidQueueConfiguration
 from .constants import RATE_REGEX
 from .constants import TaskNotFound
-from .task import InvalidTaskInfo
+from .task import InvalidTaskInfo, TaskNameTaken
 from .task import Task
 from .utils import logger
 
@@ -72,6 +75,21 @@ def current_time_ms():
   return now.replace(microsecond=new_microsecond)
 
 
+def lease_bucket(task_id, buckets):
+  """ Assigns a task to one of the buckets that leasers claim.
+
+  Args:
+    task_id: A string containing the task ID.
+    buckets: An integer specifying the number of buckets.
+  Returns:
+    An integer specifying the bucket.
+  """
+  if isinstance(task_id, unicode):
+    task_id = task_id.encode('utf-8')
+
+  return (zlib.crc32(task_id) & 0xffffffff) % buckets
+
+
 def next_key(key):
   """ Calculates the next partition value of a key. Note: Cassandra BOP orders
   'b' before 'aa'.
@@ -126,7 +144,6 @@ class Queue(object):
         self.task_retry_limit = retry_params['task_retry_limit']
 
     self.validate_config()
-    self.prepared_statements = {}
 
   def validate_config(self):
     """ Ensures all of the Queue's attributes are valid.
@@ -249,6 +266,19 @@ class PostgresPullQueue(Queue):
 
   TTL_INTERVAL_AFTER_DELETED = '7 days'
 
+  # The number of days that the names of deleted tasks are kept.
+  DELETED_TTL_DAYS = 7
+
+  # The number of rows that the task counter is spread across. Each write
+  # updates a random row in order to avoid contention.
+  COUNTER_SLOTS = 16
+
+  # The maximum length of a PostgreSQL identifier.
+  MAX_IDENTIFIER_LENGTH = 63
+
+  # The number of hex digits of the queue name's hash used in long names.
+  IDENTIFIER_HASH_LENGTH = 8
+
   def __init__(self, queue_info, app, pg_connection=None):
     """ Create a PostgresPullQueue object.
 
@@ -266,7 +296,9 @@ class PostgresPullQueue(Queue):
     @retrying.retry(max_retries=5, retry_on_exception=IntegrityError)
     def ensure_tables_created():
       try:
-        self.pg_connection.cursor().execute(
+        pg_cursor = self.pg_connection.cursor()
+        self._rename_truncated_identifiers(pg_cursor)
+        pg_cursor.execute(
           'CREATE TABLE IF NOT EXISTS "{table_name}" ('
           '  task_name varchar(500) NOT NULL,'
           '  time_deleted timestamp DEFAULT NULL,'
@@ -277,14 +309,50 @@ class PostgresPullQueue(Queue):
           '  tag varchar(500),'
           '  PRIMARY KEY (task_name)'
           ');'
-          'CREATE INDEX IF NOT EXISTS "{table_name}-eta-retry-tag-index" '
+          'CREATE INDEX IF NOT EXISTS "{eta_index}" '
           '  ON "{table_name}" USING BTREE (lease_expires, lease_count, tag) '
           '  WHERE time_deleted IS NULL;'
-          'CREATE INDEX IF NOT EXISTS "{table_name}-retry-eta-tag-index" '
+          'CREATE INDEX IF NOT EXISTS "{retry_index}" '
           '  ON "{table_name}" (lease_count, lease_expires, tag) '
           '  WHERE time_deleted IS NULL;'
-            .format(table_name=self.tasks_table_name)
+          # Covers tag-grouped leases without reading other tags' entries.
+          'CREATE INDEX IF NOT EXISTS "{tag_index}" '
+          '  ON "{table_name}" (tag, lease_expires, lease_count, task_name) '
+          '  WHERE time_deleted IS NULL;'
+          # Deleted task names are kept in daily partitions of this table.
+          'CREATE TABLE IF NOT EXISTS "{deleted_table}" ('
+          '  task_name varchar(500) NOT NULL,'
+          '  time_deleted timestamp NOT NULL'
+          ');'
+          'CREATE TABLE IF NOT EXISTS "{counters_table}" ('
+          '  slot integer NOT NULL,'
+          '  tasks bigint NOT NULL,'
+          '  PRIMARY KEY (slot)'
+          ');'
+            .format(table_name=self.tasks_table_name,
+                    eta_index=self._identifier('-eta-retry-tag-index'),
+                    retry_index=self._identifier('-retry-eta-tag-index'),
+                    tag_index=self._identifier('-tag-eta-index'),
+                    deleted_table=self.deleted_table_name,
+                    counters_table=self.counters_table_name)
         )
+
+        # Existing tasks are counted when the counters are first created.
+        pg_cursor.execute('SELECT 1 FROM "{counters_table}" LIMIT 1'
+                          .format(counters_table=self.counters_table_name))
+        if pg_cursor.fetchone() is None:
+          pg_cursor.execute(
+            'INSERT INTO "{counters_table}" (slot, tasks) '
+            'SELECT slot, CASE WHEN slot = 0 THEN ('
+            '  SELECT count(*) FROM "{table_name}" WHERE time_deleted IS NULL'
+            ') ELSE 0 END '
+            'FROM generate_series(0, {max_slot}) AS slot '
+            'ON CONFLICT (slot) DO NOTHING;'
+              .format(table_name=self.tasks_table_name,
+                      counters_table=self.counters_table_name,
+                      max_slot=self.COUNTER_SLOTS - 1)
+          )
+
         self.pg_connection.commit()
       except Exception as err:
         logger.error('Rolling back transaction ({err})'.format(err=err))
@@ -292,10 +360,19 @@ class PostgresPullQueue(Queue):
         raise
 
     ensure_tables_created()
+    self._deleted_partition = None
 
   @property
   def tasks_table_name(self):
-    return 'pullqueue-{}'.format(self.name)
+    return self._identifier()
+
+  @property
+  def deleted_table_name(self):
+    return self._identifier('-deleted')
+
+  @property
+  def counters_table_name(self):
+    return self._identifier('-counters')
 
   def add_task(self, task):
     """ Adds a task to the queue.
@@ -306,59 +383,85 @@ class PostgresPullQueue(Queue):
       InvalidTaskInfo if the task ID already exists in the queue
         or it doesn't have payloadBase64 attribute.
     """
-    import psycopg2  # Import psycopg2 lazily
-    if not hasattr(task, 'payloadBase64'):
-      raise InvalidTaskInfo('{} is missing a payload.'.format(task))
+    error = self.add_tasks([task])[0]
+    if error is not None:
+      raise error
 
-    # TODO: remove decoding when task.payloadBase64
-    #       is replaced with task.payload
-    params = {
-      'task_name': task.id,
-      'payload': bytearray(base64.urlsafe_b64decode(task.payloadBase64)),
-      'lease_count': 0,
-      'tag': getattr(task, 'tag', None)
-    }
+  def add_tasks(self, tasks):
+    """ Adds several tasks to the queue with a single statement.
 
-    try:
-      lease_expires = '%(lease_expires_val)s'
-      params['lease_expires_val'] = task.leaseTimestamp
-    except AttributeError:
-      lease_expires = 'current_timestamp'
+    Args:
+      tasks: A list of Task objects.
+    Returns:
+      A list containing None for each task that was added. For each task that
+      was not added, it contains an InvalidTaskInfo describing why.
+    """
+    results = [None for _ in tasks]
+    pending = {}
+    for task_num, task in enumerate(tasks):
+      if not hasattr(task, 'payloadBase64'):
+        results[task_num] = InvalidTaskInfo(
+          '{} is missing a payload.'.format(task))
+      elif task.id in pending:
+        results[task_num] = TaskNameTaken(
+          'Task name already taken: {}'.format(task.id))
+      else:
+        pending[task.id] = task_num
+
+    if not pending:
+      return results
 
     pg_cursor = self.pg_connection.cursor()
+    # TODO: remove decoding when task.payloadBase64
+    #       is replaced with task.payload
+    values = ', '.join(
+      pg_cursor.mogrify(
+        '(%s, %s, current_timestamp, '
+        ' COALESCE(%s, current_timestamp::timestamp), 0, %s)',
+        (task.id, bytearray(base64.urlsafe_b64decode(task.payloadBase64)),
+         getattr(task, 'leaseTimestamp', None), getattr(task, 'tag', None)))
+      for task in (tasks[task_num] for task_num in sorted(pending.values())))
     try:
+      # Names of recently deleted tasks cannot be reused.
       pg_cursor.execute(
         'INSERT INTO "{table}" ( '
         '  task_name, payload, time_enqueued, '
         '  lease_expires, lease_count, tag '
-        ')'
-        'VALUES ( '
-        '  %(task_name)s, %(payload)s, current_timestamp, '
-        '  {lease_expires}, %(lease_count)s, %(tag)s '
         ') '
-        'RETURNING time_enqueued, lease_expires'
-        .format(table=self.tasks_table_name, lease_expires=lease_expires),
-        vars=params
+        'SELECT * FROM (VALUES {values}) AS new_task ( '
+        '  task_name, payload, time_enqueued, '
+        '  lease_expires, lease_count, tag '
+        ') '
+        'WHERE NOT EXISTS ( '
+        '  SELECT 1 FROM "{deleted_table}" '
+        '  WHERE task_name = new_task.task_name '
+        ') '
+        'ON CONFLICT (task_name) DO NOTHING '
+        'RETURNING task_name, time_enqueued, lease_expires'
+        .format(table=self.tasks_table_name,
+                deleted_table=self.deleted_table_name, values=values)
       )
-      row = pg_cursor.fetchone()
-
+      rows = pg_cursor.fetchall()
+      self._update_counter(pg_cursor, len(rows))
       self.pg_connection.commit()
-      logger.debug('Added task: {}'.format(task))
-
-    except psycopg2.IntegrityError as err:
-      name_taken_msg = 'Task name already taken: {}'.format(task.id)
-      logger.warning('{msg}. Rolling back transaction({err})'
-                     .format(msg=name_taken_msg, err=err))
-      self.pg_connection.rollback()
-      raise InvalidTaskInfo(name_taken_msg)
     except Exception as err:
       logger.error('Rolling back transaction ({err})'.format(err=err))
       self.pg_connection.rollback()
       raise
 
-    task.queueName = self.name
-    task.enqueueTimestamp = row[0]  # time_enqueued is generated on PG side
-    task.leaseTimestamp = row[1]    # lease_expires is generated on PG side
+    for task_name, time_enqueued, lease_expires in rows:
+      task = tasks[pending.pop(task_name)]
+      task.queueName = self.name
+      task.enqueueTimestamp = time_enqueued
+      task.leaseTimestamp = lease_expires
+
+    # Tasks that were not returned conflicted with existing task names.
+    for task_name, task_num in pending.iteritems():
+      results[task_num] = TaskNameTaken(
+        'Task name already taken: {}'.format(task_name))
+
+    logger.debug('Added {} of {} tasks'.format(len(rows), len(tasks)))
+    return results
 
   def get_task(self, task, omit_payload=False):
     """ Gets a task from the queue.
@@ -399,22 +502,29 @@ class PostgresPullQueue(Queue):
     return self._task_from_row(columns, row, id=task.id)
 
   def delete_task(self, task):
-    """ Marks a task as deleted. It will be permanently removed later
-     (after TTL_INTERVAL_AFTER_DELETED).
+    """ Deletes a task. Its name is kept in the current deleted partition
+    until the partition is dropped (after DELETED_TTL_DAYS).
 
     Args:
       task: A Task object.
     """
+    partition = self._ensure_deleted_partition()
+    pg_cursor = self.pg_connection.cursor()
     try:
-      self.pg_connection.cursor().execute(
-        'UPDATE "{tasks_table}" '
-        'SET time_deleted = current_timestamp '
-        'WHERE "{tasks_table}".task_name = %(task_name)s'
-        .format(tasks_table=self.tasks_table_name),
+      pg_cursor.execute(
+        'WITH deleted AS ( '
+        '  DELETE FROM "{tasks_table}" '
+        '  WHERE task_name = %(task_name)s AND time_deleted IS NULL '
+        '  RETURNING task_name '
+        ') '
+        'INSERT INTO "{partition}" (task_name, time_deleted) '
+        'SELECT task_name, current_timestamp FROM deleted'
+        .format(tasks_table=self.tasks_table_name, partition=partition),
         vars={
           'task_name': task.id,
         }
       )
+      self._update_counter(pg_cursor, -pg_cursor.rowcount)
       self.pg_connection.commit()
     except Exception as err:
       logger.error('Rolling back transaction ({err})'.format(err=err))
@@ -643,9 +753,16 @@ class PostgresPullQueue(Queue):
     """ Remove all tasks from queue.
     """
     try:
-      self.pg_connection.cursor().execute(
-        'TRUNCATE TABLE "{tasks_table}"'
-        .format(tasks_table=self.tasks_table_name)
+      pg_cursor = self.pg_connection.cursor()
+      # This also truncates the deleted partitions.
+      pg_cursor.execute(
+        'TRUNCATE TABLE "{tasks_table}", "{deleted_table}"'
+        .format(tasks_table=self.tasks_table_name,
+                deleted_table=self.deleted_table_name)
+      )
+      pg_cursor.execute(
+        'UPDATE "{counters_table}" SET tasks = 0'
+        .format(counters_table=self.counters_table_name)
       )
       self.pg_connection.commit()
     except Exception as err:
@@ -695,10 +812,10 @@ class PostgresPullQueue(Queue):
     pg_cursor = self.pg_connection.cursor()
     try:
       pg_cursor.execute(
-        'SELECT count(*) FROM "{tasks_table}" WHERE time_deleted IS NULL'
-        .format(tasks_table=self.tasks_table_name)
+        'SELECT COALESCE(sum(tasks), 0) FROM "{counters_table}"'
+        .format(counters_table=self.counters_table_name)
       )
-      tasks_count = pg_cursor.fetchone()[0]
+      tasks_count = int(pg_cursor.fetchone()[0])
       self.pg_connection.commit()
     except Exception as err:
       logger.error('Rolling back transaction ({err})'.format(err=err))
@@ -731,8 +848,27 @@ class PostgresPullQueue(Queue):
   def flush_deleted(self):
     """ Removes all tasks which were deleted more than week ago.
     """
+    oldest_kept = (datetime.datetime.utcnow() -
+                   datetime.timedelta(days=self.DELETED_TTL_DAYS)).date()
     pg_cursor = self.pg_connection.cursor()
     try:
+      pg_cursor.execute(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid '
+        'WHERE pg_inherits.inhparent = %(deleted_table)s::regclass',
+        vars={'deleted_table': '"{}"'.format(self.deleted_table_name)}
+      )
+      partitions = [row[0] for row in pg_cursor.fetchall()]
+      expired = [partition for partition in partitions
+                 if self._partition_day(partition) < oldest_kept]
+      for partition in expired:
+        pg_cursor.execute('DROP TABLE IF EXISTS "{}"'.format(partition))
+
+      logger.info('Dropped {} deleted partitions from {}'
+                  .format(len(expired), self.tasks_table_name))
+
+      # Tasks that were deleted before partitions were used are removed
+      # individually.
       pg_cursor.execute(
         'DELETE FROM "{tasks_table}" '
         'WHERE time_deleted < current_timestamp - interval \'{ttl}\''
@@ -780,6 +916,143 @@ class PostgresPullQueue(Queue):
 
     return Task(task_info)
 
+  def _identifier(self, suffix=''):
+    """ Generates the name of a table or index that belongs to the queue.
+
+    PostgreSQL truncates longer identifiers, which could make names collide,
+    so they are shortened and given a hash of the queue name instead.
+
+    Args:
+      suffix: A string that identifies the table or index.
+    Returns:
+      A string specifying a PostgreSQL identifier.
+    """
+    prefix = 'pullqueue-{}'.format(self.name)
+    if len(prefix) + len(suffix) <= self.MAX_IDENTIFIER_LENGTH:
+      return prefix + suffix
+
+    digest = hashlib.sha1(self.name.encode('utf-8')).hexdigest()
+    digest = digest[:self.IDENTIFIER_HASH_LENGTH]
+    prefix_length = self.MAX_IDENTIFIER_LENGTH - len(digest) - len(suffix) - 1
+    return '{}-{}{}'.format(prefix[:prefix_length], digest, suffix)
+
+  def _rename_truncated_identifiers(self, pg_cursor):
+    """ Renames the table and indexes of a queue created with truncated names.
+
+    Before long names were shortened with a hash, PostgreSQL truncated them,
+    so the tasks of a queue with a long name are in a table with the
+    truncated name. The table and its indexes are renamed so that the tasks
+    are not orphaned.
+
+    Args:
+      pg_cursor: A psycopg2 cursor.
+    """
+    legacy_prefix = 'pullqueue-{}'.format(self.name)
+    suffixes = ['-eta-retry-tag-index', '-retry-eta-tag-index']
+    if all((legacy_prefix + suffix)[:self.MAX_IDENTIFIER_LENGTH] ==
+           self._identifier(suffix) for suffix in [''] + suffixes):
+      return
+
+    legacy_table = legacy_prefix[:self.MAX_IDENTIFIER_LENGTH]
+    if legacy_table != self.tasks_table_name:
+      pg_cursor.execute(
+        'SELECT to_regclass(%(legacy_table)s), to_regclass(%(table)s)',
+        vars={'legacy_table': '"{}"'.format(legacy_table),
+              'table': '"{}"'.format(self.tasks_table_name)}
+      )
+      legacy_exists, exists = pg_cursor.fetchone()
+      if legacy_exists is not None and exists is None:
+        logger.info('Renaming {} to {}'.format(legacy_table,
+                                               self.tasks_table_name))
+        pg_cursor.execute('ALTER TABLE "{}" RENAME TO "{}"'.format(
+          legacy_table, self.tasks_table_name))
+
+    # Renaming a table does not rename its indexes.
+    pg_cursor.execute(
+      'SELECT indexname FROM pg_indexes WHERE tablename = %(table)s',
+      vars={'table': self.tasks_table_name}
+    )
+    indexes = set(row[0] for row in pg_cursor.fetchall())
+    for suffix in suffixes:
+      legacy_index = (legacy_prefix + suffix)[:self.MAX_IDENTIFIER_LENGTH]
+      index = self._identifier(suffix)
+      if (legacy_index == index or legacy_index not in indexes or
+          index in indexes):
+        continue
+
+      pg_cursor.execute('ALTER INDEX "{}" RENAME TO "{}"'.format(
+        legacy_index, index))
+      indexes.discard(legacy_index)
+      indexes.add(index)
+
+  def _partition_name(self, day, suffix=''):
+    """ Generates the name of the partition for tasks deleted on a day.
+
+    Args:
+      day: A date object.
+      suffix: A string to append to the name.
+    Returns:
+      A string specifying the partition table name.
+    """
+    return self._identifier(day.strftime('-deleted-%Y%m%d') + suffix)
+
+  @staticmethod
+  def _partition_day(partition):
+    """ Extracts the day from a deleted partition name.
+
+    Args:
+      partition: A string specifying the partition table name.
+    Returns:
+      A date object.
+    """
+    return datetime.datetime.strptime(partition[-8:], '%Y%m%d').date()
+
+  def _ensure_deleted_partition(self):
+    """ Creates the partition for tasks deleted today if necessary.
+
+    Returns:
+      A string specifying the partition table name.
+    """
+    today = datetime.datetime.utcnow().date()
+    partition = self._partition_name(today)
+    if partition == self._deleted_partition:
+      return partition
+
+    try:
+      self.pg_connection.cursor().execute(
+        'CREATE TABLE IF NOT EXISTS "{partition}" () '
+        '  INHERITS ("{deleted_table}");'
+        'CREATE INDEX IF NOT EXISTS "{index}" '
+        '  ON "{partition}" (task_name);'
+        .format(partition=partition, deleted_table=self.deleted_table_name,
+                index=self._partition_name(today, '-index'))
+      )
+      self.pg_connection.commit()
+    except Exception as err:
+      logger.error('Rolling back transaction ({err})'.format(err=err))
+      self.pg_connection.rollback()
+      raise
+
+    self._deleted_partition = partition
+    return partition
+
+  def _update_counter(self, pg_cursor, change):
+    """ Adjusts the number of tasks in the queue as part of a transaction.
+
+    Args:
+      pg_cursor: A psycopg2 cursor.
+      change: An integer specifying the number of tasks added or removed.
+    """
+    if not change:
+      return
+
+    pg_cursor.execute(
+      'UPDATE "{counters_table}" SET tasks = tasks + %(change)s '
+      'WHERE slot = %(slot)s'
+      .format(counters_table=self.counters_table_name),
+      vars={'change': change, 'slot': random.randrange(self.COUNTER_SLOTS)}
+    )
+
   def _get_earliest_tag(self):
     """ Get the tag with the earliest ETA.
 
@@ -791,7 +1064,8 @@ class PostgresPullQueue(Queue):
       pg_cursor.execute(
         'SELECT tag FROM "{tasks_table}" '
         'WHERE time_deleted IS NULL '
-        'ORDER BY lease_expires'
+        'ORDER BY lease_expires '
+        'LIMIT 1'
         .format(tasks_table=self.tasks_table_name)
       )
       row = pg_cursor.fetchone()
@@ -859,6 +1133,16 @@ class PullQueue(Queue):
   # The seconds to wait after fetching 0 index results before retrying.
   EMPTY_RESULTS_COOLDOWN = 5
 
+  # The number of buckets that available tasks are sharded into for leasing.
+  LEASE_BUCKETS = 16
+
+  # The maximum number of task IDs to fetch with a single multi-key read.
+  READ_BATCH_SIZE = 100
+
+  # The maximum number of concurrent writes when adding or leasing several
+  # tasks.
+  MAX_CONCURRENT_WRITES = 50
+
   def __init__(self, queue_info, app, db_access=None):
     """ Create a PullQueue object.
 
@@ -879,69 +1163,104 @@ class PullQueue(Queue):
       task: A Task object.
       retries: The number of times to retry adding the task.
     Raises:
-      InvalidTaskInfo if the task ID already exists in the queue.
+      InvalidTaskInfo if the task does not have a payload.
+      TaskNameTaken if the task ID already exists in the queue.
     """
     if not hasattr(task, 'payloadBase64'):
       raise InvalidTaskInfo('{} is missing a payload.'.format(task))
 
-    enqueue_time = datetime.datetime.utcnow()
-    try:
-      lease_expires = task.leaseTimestamp
-    except AttributeError:
-      lease_expires = datetime.datetime.utcfromtimestamp(0)
-
-    parameters = {
-      'app': self.app,
-      'queue': self.name,
-      'id': task.id,
-      'payload': task.payloadBase64,
-      'enqueued': enqueue_time,
-      'retry_count': 0,
-      'lease_expires': lease_expires,
-      'op_id': uuid.uuid4()
-    }
-
-    try:
-      parameters['tag'] = task.tag
-    except AttributeError:
-      parameters['tag'] = None
-
+    parameters = self._task_parameters(task, datetime.datetime.utcnow())
     self._insert_task(parameters, retries)
-
-    task.queueName = self.name
-    task.enqueueTimestamp = enqueue_time
-    task.leaseTimestamp = lease_expires
+    self._set_added_info(task, parameters)
 
     # Create index entries so the task can be queried by ETA and (tag, ETA).
     # This can't be done in a batch because the payload from the previous
     # insert can be up to 1MB, and Cassandra does not approve of large batches.
-    try:
-      tag = task.tag
-    except AttributeError:
-      # The API does not differentiate between empty and unspecified tags.
-      tag = ''
-
-    insert_eta_index = SimpleStatement("""
-      INSERT INTO pull_queue_eta_index (app, queue, eta, id, tag)
-      VALUES (%(app)s, %(queue)s, %(eta)s, %(id)s, %(tag)s)
-    """, retry_policy=BASIC_RETRIES)
-    parameters = {
-      'app': self.app,
-      'queue': self.name,
-      'eta': task.get_eta(),
-      'id': task.id,
-      'tag': tag
-    }
+    insert_eta_index, insert_tag_index = self._index_insert_statements()
+    parameters = self._index_parameters(task)
     self.db_access.session.execute(insert_eta_index, parameters)
-
-    insert_tag_index = SimpleStatement("""
-      INSERT INTO pull_queue_tags_index (app, queue, tag, eta, id)
-      VALUES (%(app)s, %(queue)s, %(tag)s, %(eta)s, %(id)s)
-    """, retry_policy=BASIC_RETRIES)
     self.db_access.session.execute(insert_tag_index, parameters)
 
     logger.debug('Added task: {}'.format(task))
 
+  def add_tasks(self, tasks, retries=5):
+    """ Adds several tasks to the queue.
+
+    The task entries and then the index entries are written concurrently,
+    with at most MAX_CONCURRENT_WRITES requests in flight.
+
+    Args:
+      tasks: A list of Task objects.
+      retries: The number of times to retry adding each task.
+    Returns:
+      A list containing None for each task that was added. For each task that
+      was not added, it contains an InvalidTaskInfo or TransientError
+      describing why.
+    """
+    results = [None for _ in tasks]
+    session = self.db_access.session
+    enqueue_time = datetime.datetime.utcnow()
+
+    pending = []
+    for task_num, task in enumerate(tasks):
+      if not hasattr(task, 'payloadBase64'):
+        results[task_num] = InvalidTaskInfo(
+          '{} is missing a payload.'.format(task))
+        continue
+
+      pending.append((task_num, self._task_parameters(task, enqueue_time)))
+
+    insert_task = self._task_insert_statement()
+    insert_results = execute_concurrent(
+      session, [(insert_task, parameters) for _, parameters in pending],
+      concurrency=self.MAX_CONCURRENT_WRITES, raise_on_first_error=False)
+
+    inserted = []
+    for (task_num, parameters), (success, result) in zip(pending,
+                                                         insert_results):
+      task = tasks[task_num]
+      try:
+        if success and not result.was_applied:
+          raise TaskNameTaken('Task name already taken: {}'.format(task.id))
+
+        # Retrying the insert on its own checks if a failed attempt was
+        # applied anyway.
+        if not success:
+          if not isinstance(result, TRANSIENT_CASSANDRA_ERRORS):
+            raise result
+
+          self._insert_task(parameters, retries - 1)
+      except InvalidTaskInfo as error:
+        results[task_num] = error
+        continue
+      except TRANSIENT_CASSANDRA_ERRORS + (TransientError,):
+        results[task_num] = TransientError(
+          'Unable to insert task {}'.format(task.id))
+        continue
+
+      self._set_added_info(task, parameters)
+      inserted.append(task_num)
+
+    insert_eta_index, insert_tag_index = self._index_insert_statements()
+    index_inserts = []
+    for task_num in inserted:
+      parameters = self._index_parameters(tasks[task_num])
+      index_inserts.append((insert_eta_index, parameters))
+      index_inserts.append((insert_tag_index, parameters))
+
+    index_results = execute_concurrent(
+      session, index_inserts, concurrency=self.MAX_CONCURRENT_WRITES,
+      raise_on_first_error=False)
+    for insert_num, (success, result) in enumerate(index_results):
+      task_num = inserted[insert_num // 2]
+      if not success:
+        results[task_num] = TransientError(
+          'Unable to index task {}'.format(tasks[task_num].id))
+
+    logger.debug('Added {} of {} tasks'.format(
+      len([result for result in results if result is None]), len(tasks)))
+    return results
+
   def get_task(self, task, omit_payload=False):
     """ Gets a task from the queue.
 
@@ -958,10 +1277,11 @@ class PullQueue(Queue):
     select_task = """
       SELECT {payload} enqueued, lease_expires, retry_count, tag
       FROM pull_queue_tasks
-      WHERE app = %(app)s AND queue = %(queue)s AND id = %(id)s
+      WHERE app = :app AND queue = :queue AND id = :id
     """.format(payload=payload)
-    statement = SimpleStatement(select_task,
-                                consistency_level=ConsistencyLevel.SERIAL)
+    statement = self.db_access.statement_cache.get(
+      ('pull_queue_tasks', 'select', omit_payload), select_task,
+      consistency_level=ConsistencyLevel.SERIAL)
     parameters = {'app': self.app, 'queue': self.name, 'id': task.id}
     try:
       response = self.db_access.session.execute(statement, parameters)[0]
@@ -1072,14 +1392,16 @@ class PullQueue(Queue):
     start_date = datetime.datetime.utcfromtimestamp(0)
     task_id = ''
     while True:
-      query_tasks = """
+      query_tasks = self.db_access.statement_cache.get(
+        ('pull_queue_eta_index', 'list'), """
         SELECT eta, id FROM pull_queue_eta_index
-        WHERE token(app, queue, eta, id) > token(%(app)s, %(queue)s, %(eta)s, %(id)s)
-        AND token(app, queue, eta, id) < token(%(app)s, %(next_queue)s, 0, '')
-        LIMIT {limit}
-      """.format(limit=limit)
+        WHERE token(app, queue, eta, id) > token(:app, :queue, :eta, :id)
+        AND token(app, queue, eta, id) < token(:app, :next_queue, 0, '')
+        LIMIT :limit
+      """)
       parameters = {'app': self.app, 'queue': self.name, 'eta': start_date,
-                    'id': task_id, 'next_queue': next_key(self.name)}
+                    'id': task_id, 'next_queue': next_key(self.name),
+                    'limit': limit}
       results = [result for result in session.execute(query_tasks, parameters)]
 
       if not results:
@@ -1193,11 +1515,12 @@ class PullQueue(Queue):
     Returns:
       An integer specifying the number of tasks in the queue.
     """
-    select_count = """
+    select_count = self.db_access.statement_cache.get(
+      ('pull_queue_tasks', 'count'), """
       SELECT COUNT(*) FROM pull_queue_tasks
-      WHERE token(app, queue, id) >= token(%(app)s, %(queue)s, '')
-      AND token(app, queue, id) < token(%(app)s, %(next_queue)s, '')
-    """
+      WHERE token(app, queue, id) >= token(:app, :queue, '')
+      AND token(app, queue, id) < token(:app, :next_queue, '')
+    """)
     parameters = {'app': self.app, 'queue': self.name,
                   'next_queue': next_key(self.name)}
     return self.db_access.session.execute(select_count, parameters)[0].count
@@ -1210,12 +1533,13 @@ class PullQueue(Queue):
       tasks.
     """
     session = self.db_access.session
-    select_oldest = """
+    select_oldest = self.db_access.statement_cache.get(
+      ('pull_queue_eta_index', 'oldest'), """
       SELECT eta FROM pull_queue_eta_index
-      WHERE token(app, queue, eta, id) >= token(%(app)s, %(queue)s, 0, '')
-      AND token(app, queue, eta, id) < token(%(app)s, %(next_queue)s, 0, '')
+      WHERE token(app, queue, eta, id) >= token(:app, :queue, 0, '')
+      AND token(app, queue, eta, id) < token(:app, :next_queue, 0, '')
       LIMIT 1
-    """
+    """)
     parameters = {'app': self.app, 'queue': self.name,
                   'next_queue': next_key(self.name)}
     try:
@@ -1229,11 +1553,12 @@ class PullQueue(Queue):
     Cassandra cannot perform a range scan during a delete, so this function
     selects all the tasks before deleting them one at a time.
     """
-    select_tasks = """
+    select_tasks = self.db_access.statement_cache.get(
+      ('pull_queue_tasks', 'select_all'), """
       SELECT id, enqueued, lease_expires, tag FROM pull_queue_tasks
-      WHERE token(app, queue, id) >= token(%(app)s, %(queue)s, '')
-      AND token(app, queue, id) < token(%(app)s, %(next_queue)s, '')
-    """
+      WHERE token(app, queue, id) >= token(:app, :queue, '')
+      AND token(app, queue, id) < token(:app, :next_queue, '')
+    """)
     parameters = {'app': self.app, 'queue': self.name,
                   'next_queue': next_key(self.name)}
     results = self.db_access.session.execute(select_tasks, parameters)
@@ -1286,9 +1611,10 @@ class PullQueue(Queue):
     Returns:
       A boolean indicating that the task was last mutated with the ID.
     """
-    select_statement = SimpleStatement("""
+    select_statement = self.db_access.statement_cache.get(
+      ('pull_queue_tasks', 'select_op_id'), """
       SELECT op_id FROM pull_queue_tasks
-      WHERE app = %(app)s AND queue = %(queue)s AND id = %(id)s
+      WHERE app = :app AND queue = :queue AND id = :id
     """, consistency_level=ConsistencyLevel.SERIAL)
     parameters = {
       'app': self.app,
@@ -1303,26 +1629,118 @@ class PullQueue(Queue):
 
     return result.op_id == op_id
 
-  def _insert_task(self, parameters, retries):
-    """ Insert task entry into pull_queue_tasks.
+  def _task_parameters(self, task, enqueue_time):
+    """ Builds the parameters for inserting a task entry.
 
     Args:
-      parameters: A dictionary specifying the task parameters.
-      retries: The number of times to try the insert.
-    Raises:
-      InvalidTaskInfo if the task ID already exists in the queue.
+      task: A Task object.
+      enqueue_time: A datetime object specifying when the task was added.
+    Returns:
+      A dictionary specifying the task parameters.
     """
-    insert_statement = SimpleStatement("""
+    try:
+      lease_expires = task.leaseTimestamp
+    except AttributeError:
+      lease_expires = datetime.datetime.utcfromtimestamp(0)
+
+    parameters = {
+      'app': self.app,
+      'queue': self.name,
+      'id': task.id,
+      'payload': task.payloadBase64,
+      'enqueued': enqueue_time,
+      'retry_count': 0,
+      'lease_expires': lease_expires,
+      'op_id': uuid.uuid4()
+    }
+
+    try:
+      parameters['tag'] = task.tag
+    except AttributeError:
+      parameters['tag'] = None
+
+    return parameters
+
+  def _set_added_info(self, task, parameters):
+    """ Fills in the attributes that a task gets when it is added.
+
+    Args:
+      task: A Task object.
+      parameters: A dictionary specifying the inserted task parameters.
+    """
+    task.queueName = self.name
+    task.enqueueTimestamp = parameters['enqueued']
+    task.leaseTimestamp = parameters['lease_expires']
+
+  def _index_parameters(self, task):
+    """ Builds the parameters for inserting a task's index entries.
+
+    Args:
+      task: A Task object.
+    Returns:
+      A dictionary specifying the index parameters.
+    """
+    try:
+      tag = task.tag
+    except AttributeError:
+      # The API does not differentiate between empty and unspecified tags.
+      tag = ''
+
+    return {
+      'app': self.app,
+      'queue': self.name,
+      'eta': task.get_eta(),
+      'id': task.id,
+      'tag': tag
+    }
+
+  def _task_insert_statement(self):
+    """ Fetches the prepared statement for inserting a task entry.
+
+    Returns:
+      A prepared statement.
+    """
+    return self.db_access.statement_cache.get(
+      ('pull_queue_tasks', 'insert'), """
       INSERT INTO pull_queue_tasks (
         app, queue, id, payload,
         enqueued, lease_expires, retry_count, tag, op_id
       )
       VALUES (
-        %(app)s, %(queue)s, %(id)s, %(payload)s,
-        %(enqueued)s, %(lease_expires)s, %(retry_count)s, %(tag)s, %(op_id)s
+        :app, :queue, :id, :payload,
+        :enqueued, :lease_expires, :retry_count, :tag, :op_id
       )
       IF NOT EXISTS
     """, retry_policy=NO_RETRIES)
+
+  def _index_insert_statements(self):
+    """ Fetches the prepared statements for inserting index entries.
+
+    Returns:
+      A tuple containing the ETA index and tags index statements.
+    """
+    insert_eta_index = self.db_access.statement_cache.get(
+      ('pull_queue_eta_index', 'insert'), """
+      INSERT INTO pull_queue_eta_index (app, queue, eta, id, tag)
+      VALUES (:app, :queue, :eta, :id, :tag)
+    """, retry_policy=BASIC_RETRIES)
+    insert_tag_index = self.db_access.statement_cache.get(
+      ('pull_queue_tags_index', 'insert'), """
+      INSERT INTO pull_queue_tags_index (app, queue, tag, eta, id)
+      VALUES (:app, :queue, :tag, :eta, :id)
+    """, retry_policy=BASIC_RETRIES)
+    return insert_eta_index, insert_tag_index
+
+  def _insert_task(self, parameters, retries):
+    """ Insert task entry into pull_queue_tasks.
+
+    Args:
+      parameters: A dictionary specifying the task parameters.
+      retries: The number of times to try the insert.
+    Raises:
+      TaskNameTaken if the task ID already exists in the queue.
+    """
+    insert_statement = self._task_insert_statement()
     try:
       result = self.db_access.session.execute(insert_statement, parameters)
     except TRANSIENT_CASSANDRA_ERRORS as error:
@@ -1342,7 +1760,7 @@ class PullQueue(Queue):
       raise TransientError('Unable to insert task')
 
     if not success:
-      raise InvalidTaskInfo(
+      raise TaskNameTaken(
         'Task name already taken: {}'.format(parameters['id']))
 
   def _update_lease(self, parameters, retries, check_lease=True):
@@ -1358,17 +1776,19 @@ class PullQueue(Queue):
     """
     update_task = """
       UPDATE pull_queue_tasks
-      SET lease_expires = %(new_eta)s, op_id = %(op_id)s
-      WHERE app = %(app)s AND queue = %(queue)s AND id = %(id)s
-      IF lease_expires > %(current_time)s
+      SET lease_expires = :new_eta, op_id = :op_id
+      WHERE app = :app AND queue = :queue AND id = :id
+      IF lease_expires > :current_time
     """
 
     # When reporting errors, GCP does not differentiate between a lease
     # expiration and the client providing the wrong old_eta.
     if check_lease:
-      update_task += 'AND lease_expires = %(old_eta)s'
+      update_task += 'AND lease_expires = :old_eta'
 
-    update_statement = SimpleStatement(update_task, retry_policy=NO_RETRIES)
+    update_statement = self.db_access.statement_cache.get(
+      ('pull_queue_tasks', 'update_lease', check_lease), update_task,
+      retry_policy=NO_RETRIES)
     try:
       result = self.db_access.session.execute(update_statement, parameters)
     except TRANSIENT_CASSANDRA_ERRORS as error:
@@ -1399,22 +1819,25 @@ class PullQueue(Queue):
       A list of results from the index table.
     """
     if group_by_tag:
-      query_tasks = """
+      query_tasks = self.db_access.statement_cache.get(
+        ('pull_queue_tags_index', 'available'), """
         SELECT tag, eta, id FROM pull_queue_tags_index
-        WHERE token(app, queue, tag, eta, id) >= token(%(app)s, %(queue)s, %(tag)s, 0, '')
-        AND token(app, queue, tag, eta, id) <= token(%(app)s, %(queue)s, %(tag)s, dateof(now()), '')
-        LIMIT {limit}
-      """.format(limit=num_tasks)
-      parameters = {'app': self.app, 'queue': self.name, 'tag': tag}
+        WHERE token(app, queue, tag, eta, id) >= token(:app, :queue, :tag, 0, '')
+        AND token(app, queue, tag, eta, id) <= token(:app, :queue, :tag, dateof(now()), '')
+        LIMIT :limit
+      """)
+      parameters = {'app': self.app, 'queue': self.name, 'tag': tag,
+                    'limit': num_tasks}
       results = self.db_access.session.execute(query_tasks, parameters)
     else:
-      query_tasks = """
+      query_tasks = self.db_access.statement_cache.get(
+        ('pull_queue_eta_index', 'available'), """
         SELECT eta, id, tag FROM pull_queue_eta_index
-        WHERE token(app, queue, eta, id) >= token(%(app)s, %(queue)s, 0, '')
-        AND token(app, queue, eta, id) <= token(%(app)s, %(queue)s, dateof(now()), '')
-        LIMIT {limit}
-      """.format(limit=num_tasks)
-      parameters = {'app': self.app, 'queue': self.name}
+        WHERE token(app, queue, eta, id) >= token(:app, :queue, 0, '')
+        AND token(app, queue, eta, id) <= token(:app, :queue, dateof(now()), '')
+        LIMIT :limit
+      """)
+      parameters = {'app': self.app, 'queue': self.name, 'limit': num_tasks}
       results = self.db_access.session.execute(query_tasks, parameters)
     return results
 
@@ -1432,7 +1855,8 @@ class PullQueue(Queue):
     """
     # If the request is larger than the max cache size, don't use the cache.
     if num_tasks > self.MAX_CACHE_SIZE:
-      return self._query_index(num_tasks, group_by_tag, tag)
+      return self._bucket_order(
+        self._query_index(num_tasks, group_by_tag, tag))
 
     with self.index_cache_lock:
       if group_by_tag:
@@ -1445,7 +1869,7 @@ class PullQueue(Queue):
       # If results have never been fetched, populate the cache.
       if not tag_cache:
         results = self._query_index(self.MAX_CACHE_SIZE, group_by_tag, tag)
-        tag_cache['queue'] = deque(results)
+        tag_cache['queue'] = deque(self._bucket_order(results))
         tag_cache['last_fetch'] = datetime.datetime.now()
         tag_cache['last_results'] = len(tag_cache['queue'])
 
@@ -1462,7 +1886,7 @@ class PullQueue(Queue):
       if (num_tasks > len(tag_cache['queue']) or
           tag_cache['last_fetch'] < outdated):
         results = self._query_index(self.MAX_CACHE_SIZE, group_by_tag, tag)
-        tag_cache['queue'] = deque(results)
+        tag_cache['queue'] = deque(self._bucket_order(results))
         tag_cache['last_fetch'] = datetime.datetime.now()
         tag_cache['last_results'] = len(tag_cache['queue'])
 
@@ -1476,6 +1900,29 @@ class PullQueue(Queue):
 
       return results
 
+  def _bucket_order(self, results):
+    """ Orders index results so that concurrent leasers claim different tasks.
+
+    Results are merged by ETA, so the oldest tasks are still leased first.
+    Each result is assigned to one of LEASE_BUCKETS buckets by its task ID,
+    and tasks with the same ETA are claimed by bucket, starting with a random
+    one. Leasers in different processes therefore begin with different
+    candidates when many tasks share an ETA, like tasks that were added
+    together.
+
+    Args:
+      results: An iterable of index results.
+    Returns:
+      A list of index results.
+    """
+    first_bucket = random.randrange(self.LEASE_BUCKETS)
+
+    def lease_order(result):
+      bucket = lease_bucket(result.id, self.LEASE_BUCKETS)
+      return result.eta, (bucket - first_bucket) % self.LEASE_BUCKETS
+
+    return sorted(results, key=lease_order)
+
   def _get_earliest_tag(self):
     """ Get the tag with the earliest ETA.
 
@@ -1484,11 +1931,12 @@ class PullQueue(Queue):
     Raises:
       EmptyQueue if there are no tasks.
     """
-    get_earliest_tag = """
+    get_earliest_tag = self.db_access.statement_cache.get(
+      ('pull_queue_eta_index', 'earliest_tag'), """
       SELECT tag FROM pull_queue_eta_index
-      WHERE token(app, queue, eta, id) > token(%(app)s, %(queue)s, 0, '')
+      WHERE token(app, queue, eta, id) > token(:app, :queue, 0, '')
       LIMIT 1
-    """
+    """)
     parameters = {'app': self.app, 'queue': self.name}
     try:
       tag = self.db_access.session.execute(get_earliest_tag, parameters)[0].tag
@@ -1496,34 +1944,48 @@ class PullQueue(Queue):
       raise EmptyQueue('No entries in queue index')
     return tag
 
-  def _increment_count_async(self, task):
-    """ Update retry count for a task.
+  def _read_tasks(self, task_ids, columns):
+    """ Fetches several task entries with multi-key reads.
 
     Args:
-      task: A Task object.
+      task_ids: An iterable of strings containing task IDs.
+      columns: A tuple of strings specifying the columns to fetch.
+    Returns:
+      A dictionary mapping task IDs to rows. Missing tasks are omitted.
+    Raises:
+      TransientError if unable to read the tasks.
     """
-    session = self.db_access.session
-
     statement = """
-      UPDATE pull_queue_tasks
-      SET retry_count=?
-      WHERE app=? AND queue=? AND id=?
-      IF retry_count=?
-    """
-    if statement not in self.prepared_statements:
-      self.prepared_statements[statement] = session.prepare(statement)
-    update_count = self.prepared_statements[statement]
+      SELECT id, {columns} FROM pull_queue_tasks
+      WHERE app = ? AND queue = ? AND id IN ?
+    """.format(columns=', '.join(columns))
+    select = self.db_access.statement_cache.get(
+      ('pull_queue_tasks', 'multi_get', columns), statement)
+
+    task_ids = list(task_ids)
+    futures = []
+    for batch_start in range(0, len(task_ids), self.READ_BATCH_SIZE):
+      batch = task_ids[batch_start:batch_start + self.READ_BATCH_SIZE]
+      futures.append(self.db_access.session.execute_async(
+        select, (self.app, self.name, batch)))
+
+    rows = {}
+    for future in futures:
+      try:
+        rows.update({row.id: row for row in future.result()})
+      except TRANSIENT_CASSANDRA_ERRORS:
+        raise TransientError('Unable to read tasks')
 
-    old_count = task.retry_count
-    new_count = task.retry_count + 1
-    params = [new_count, self.app, self.name, task.id, old_count]
-    bound_update = update_count.bind(params)
-    bound_update.retry_policy = NO_RETRIES
-    self.db_access.session.execute_async(bound_update)
+    return rows
 
   def _lease_batch(self, indexes, new_eta):
     """ Acquires a lease on tasks in the queue.
 
+    The lease state of every candidate is fetched with one multi-key read so
+    that unavailable tasks are skipped without a Paxos round and so that each
+    lease can increment the retry count in the same operation. The payloads of
+    the leased tasks are fetched with another multi-key read.
+
     Args:
       indexes: An iterable containing results from the index table.
       new_eta: A datetime object containing the new lease expiration.
@@ -1535,22 +1997,31 @@ class PullQueue(Queue):
     session = self.db_access.session
     op_id = uuid.uuid4()
 
-    lease_statement = """
+    current_time = datetime.datetime.utcnow()
+    states = self._read_tasks(set(index.id for index in indexes),
+                              ('lease_expires', 'retry_count'))
+
+    lease_task = self.db_access.statement_cache.get(
+      ('pull_queue_tasks', 'lease_and_count'), """
       UPDATE pull_queue_tasks
-      SET lease_expires = ?, op_id = ?
+      SET lease_expires = ?, op_id = ?, retry_count = ?
       WHERE app = ? AND queue = ? AND id = ?
-      IF lease_expires < ?
-    """
-    if self.task_retry_limit != 0:
-      lease_statement += 'AND retry_count < {}'.format(self.task_retry_limit)
-    lease_task = session.prepare(lease_statement)
-    lease_task.retry_policy = NO_RETRIES
-    current_time = datetime.datetime.utcnow()
+      IF lease_expires < ? AND retry_count = ?
+    """, retry_policy=NO_RETRIES)
 
-    update_futures = []
-    for index in indexes:
-      params = (new_eta, op_id, self.app, self.name, index.id, current_time)
-      update_futures.append(session.execute_async(lease_task, params))
+    update_futures = {}
+    for result_num, index in enumerate(indexes):
+      state = states.get(index.id)
+      if state is None or state.lease_expires >= current_time:
+        continue
+
+      if (self.task_retry_limit != 0 and
+          state.retry_count >= self.task_retry_limit):
+        continue
+
+      params = (new_eta, op_id, state.retry_count + 1, self.app, self.name,
+                index.id, current_time, state.retry_count)
+      update_futures[result_num] = session.execute_async(lease_task, params)
 
     # Check which lease operations succeeded.
     statement = """
@@ -1558,40 +2029,43 @@ class PullQueue(Queue):
       FROM pull_queue_tasks
       WHERE app=? AND queue=? AND id=?
     """
-    if statement not in self.prepared_statements:
-      self.prepared_statements[statement] = session.prepare(statement)
-    select = self.prepared_statements[statement]
+    select = self.db_access.statement_cache.get(
+      ('pull_queue_tasks', 'select_leased'), statement)
 
-    futures = {}
-    for result_num, update_future in enumerate(update_futures):
+    acquired = {}
+    for result_num, update_future in update_futures.iteritems():
+      index = indexes[result_num]
       try:
-        result = update_future.result()
-        success = True
-      except DriverException:
-        result = None
-        success = False
-
-      if success and not result.was_applied:
-        # The lease operation failed, so keep this index as None.
+        if update_future.result().was_applied:
+          acquired[result_num] = None
         continue
+      except DriverException:
+        pass
 
-      index = indexes[result_num]
+      # If the lease operation timed out, the operation ID indicates whether or
+      # not it was applied.
       bound_select = select.bind([self.app, self.name, index.id])
       bound_select.consistency_level = ConsistencyLevel.SERIAL
-      future = session.execute_async(bound_select)
-      futures[result_num] = (future, not success)
-
-    index_update_futures = []
-    for result_num, (future, lease_timed_out) in futures.iteritems():
-      index = indexes[result_num]
       try:
-        read_result = future.result()[0]
+        read_result = session.execute(bound_select)[0]
       except (TRANSIENT_CASSANDRA_ERRORS, IndexError):
         raise TransientError('Unable to read task {}'.format(index.id))
 
-      # If the operation IDs do not match, the lease was not successful.
-      if lease_timed_out and read_result.op_id != op_id:
-        continue
+      if read_result.op_id == op_id:
+        acquired[result_num] = read_result
+
+    payloads = self._read_tasks(
+      set(indexes[result_num].id for result_num, read_result
+          in acquired.iteritems() if read_result is None),
+      ('payload', 'enqueued', 'tag'))
+
+    index_updates = []
+    for result_num, read_result in acquired.iteritems():
+      index = indexes[result_num]
+      if read_result is None:
+        read_result = payloads.get(index.id)
+        if read_result is None:
+          continue
 
       task_info = {
         'queueName': self.name,
@@ -1599,36 +2073,31 @@ class PullQueue(Queue):
         'payloadBase64': read_result.payload,
         'enqueueTimestamp': read_result.enqueued,
         'leaseTimestamp': new_eta,
-        'retry_count': read_result.retry_count
+        'retry_count': states[index.id].retry_count
       }
       if read_result.tag:
         task_info['tag'] = read_result.tag
       task = Task(task_info)
       leased[result_num] = task
 
-      self._increment_count_async(task)
-      index_update_futures.append(self._update_index_async(index, task))
+      index_updates.append((index, task))
       self._update_stats()
 
     # Make sure all of the index updates complete successfully.
-    for index_update in index_update_futures:
-      index_update.result()
+    self._update_indexes(index_updates)
 
     return leased
 
-  def _update_index_async(self, old_index, task):
-    """ Updates the index table after leasing a task.
+  def _old_index_deletes(self, old_index, task):
+    """ Lists the statements that remove a task's old index entries.
 
     Args:
       old_index: The row to remove from the index table.
-      task: A Task object to create a new index entry for.
+      task: A Task object.
     Returns:
-      A cassandra-driver future.
+      A list of (statement, parameters) tuples.
     """
-    session = self.db_access.session
-
     old_eta = old_index.eta
-    update_index = BatchStatement(retry_policy=BASIC_RETRIES)
 
     statement = """
       DELETE FROM pull_queue_eta_index
@@ -1637,12 +2106,8 @@ class PullQueue(Queue):
       AND eta=?
       AND id=?
     """
-    if statement not in self.prepared_statements:
-      self.prepared_statements[statement] = session.prepare(statement)
-    delete_old_eta_index = self.prepared_statements[statement]
-
-    parameters = [self.app, self.name, old_eta, task.id]
-    update_index.add(delete_old_eta_index, parameters)
+    delete_old_eta_index = self.db_access.statement_cache.get(
+      ('pull_queue_eta_index', 'delete'), statement)
 
     statement = """
       DELETE FROM pull_queue_tags_index
@@ -1652,13 +2117,23 @@ class PullQueue(Queue):
       AND eta=?
       AND id=?
     """
-    if statement not in self.prepared_statements:
-      self.prepared_statements[statement] = session.prepare(statement)
-    delete_old_tag_index = self.prepared_statements[statement]
+    delete_old_tag_index = self.db_access.statement_cache.get(
+      ('pull_queue_tags_index', 'delete'), statement)
 
-    parameters = [self.app, self.name, old_index.tag, old_eta, task.id]
-    update_index.add(delete_old_tag_index, parameters)
+    return [
+      (delete_old_eta_index, [self.app, self.name, old_eta, task.id]),
+      (delete_old_tag_index,
+       [self.app, self.name, old_index.tag, old_eta, task.id])
+    ]
 
+  def _new_index_inserts(self, task):
+    """ Lists the statements that create a task's index entries.
+
+    Args:
+      task: A Task object to create new index entries for.
+    Returns:
+      A list of (statement, parameters) tuples.
+    """
     try:
       tag = task.tag
     except AttributeError:
@@ -1668,26 +2143,64 @@ class PullQueue(Queue):
       INSERT INTO pull_queue_eta_index (app, queue, eta, id, tag)
       VALUES (?, ?, ?, ?, ?)
     """
-    if statement not in self.prepared_statements:
-      self.prepared_statements[statement] = session.prepare(statement)
-    create_new_eta_index = self.prepared_statements[statement]
-
-    parameters = [self.app, self.name, task.leaseTimestamp, task.id, tag]
-    update_index.add(create_new_eta_index, parameters)
+    create_new_eta_index = self.db_access.statement_cache.get(
+      ('pull_queue_eta_index', 'insert_positional'), statement)
 
     statement = """
       INSERT INTO pull_queue_tags_index (app, queue, tag, eta, id)
       VALUES (?, ?, ?, ?, ?)
     """
-    if statement not in self.prepared_statements:
-      self.prepared_statements[statement] = session.prepare(statement)
-    create_new_tag_index = self.prepared_statements[statement]
+    create_new_tag_index = self.db_access.statement_cache.get(
+      ('pull_queue_tags_index', 'insert_positional'), statement)
+
+    return [
+      (create_new_eta_index,
+       [self.app, self.name, task.leaseTimestamp, task.id, tag]),
+      (create_new_tag_index,
+       [self.app, self.name, tag, task.leaseTimestamp, task.id])
+    ]
+
+  def _update_index_async(self, old_index, task):
+    """ Updates the index table after leasing a task.
 
-    parameters = [self.app, self.name, tag, task.leaseTimestamp, task.id]
-    update_index.add(create_new_tag_index, parameters)
+    Args:
+      old_index: The row to remove from the index table.
+      task: A Task object to create a new index entry for.
+    Returns:
+      A cassandra-driver future.
+    """
+    update_index = BatchStatement(retry_policy=BASIC_RETRIES)
+    for statement, parameters in (self._old_index_deletes(old_index, task) +
+                                  self._new_index_inserts(task)):
+      update_index.add(statement, parameters)
 
     return self.db_access.session.execute_async(update_index)
 
+  def _update_indexes(self, updates):
+    """ Updates the index table after leasing several tasks.
+
+    Each index entry is its own partition, so the entries are written
+    concurrently instead of in a multi-partition batch. The new entries are
+    written before the old ones are deleted. If a lease is interrupted, a
+    stale entry is left for _resolve_task to clean up, and the task can
+    still be found.
+
+    Args:
+      updates: A list of tuples containing the row to remove from the index
+        table and the Task object to create a new index entry for.
+    """
+    session = self.db_access.session
+    inserts = []
+    deletes = []
+    for old_index, task in updates:
+      inserts.extend(self._new_index_inserts(task))
+      deletes.extend(self._old_index_deletes(old_index, task))
+
+    for statements in (inserts, deletes):
+      execute_concurrent(session, statements,
+                         concurrency=self.MAX_CONCURRENT_WRITES,
+                         raise_on_first_error=True)
+
   def _delete_index(self, eta, task_id, tag):
     """ Deletes an index entry for a task.
 
@@ -1696,25 +2209,27 @@ class PullQueue(Queue):
       task_id: A string containing the task ID.
       tag: A string containing the task tag.
     """
-    delete_eta_index = """
+    delete_eta_index = self.db_access.statement_cache.get(
+      ('pull_queue_eta_index', 'delete_named'), """
       DELETE FROM pull_queue_eta_index
-      WHERE app = %(app)s
-      AND queue = %(queue)s
-      AND eta = %(eta)s
-      AND id = %(id)s
-    """
+      WHERE app = :app
+      AND queue = :queue
+      AND eta = :eta
+      AND id = :id
+    """)
     parameters = {'app': self.app, 'queue': self.name, 'eta': eta,
                   'id': task_id}
     self.db_access.session.execute(delete_eta_index, parameters)
 
-    delete_tag_index = """
+    delete_tag_index = self.db_access.statement_cache.get(
+      ('pull_queue_tags_index', 'delete_named'), """
       DELETE FROM pull_queue_tags_index
-      WHERE app = %(app)s
-      AND queue = %(queue)s
-      AND tag = %(tag)s
-      AND eta = %(eta)s
-      AND id = %(id)s
-    """
+      WHERE app = :app
+      AND queue = :queue
+      AND tag = :tag
+      AND eta = :eta
+      AND id = :id
+    """)
     parameters = {'app': self.app, 'queue': self.name, 'tag': tag, 'eta': eta,
                   'id': task_id}
     self.db_access.session.execute(delete_tag_index, parameters)
@@ -1725,9 +2240,10 @@ class PullQueue(Queue):
     Args:
       task: A Task object.
     """
-    delete_task = SimpleStatement("""
+    delete_task = self.db_access.statement_cache.get(
+      ('pull_queue_tasks', 'delete'), """
       DELETE FROM pull_queue_tasks
-      WHERE app = %(app)s AND queue = %(queue)s AND id = %(id)s
+      WHERE app = :app AND queue = :queue AND id = :id
       IF EXISTS
     """, retry_policy=NO_RETRIES)
     parameters = {'app': self.app, 'queue': self.name, 'id': task.id}
@@ -1741,12 +2257,13 @@ class PullQueue(Queue):
         'Encountered error while deleting task: {}. Retrying.'.format(error))
       return self._delete_task_and_index(task, retries=retries_left)
 
-    delete_task_eta_index = SimpleStatement("""
+    delete_task_eta_index = self.db_access.statement_cache.get(
+      ('pull_queue_eta_index', 'delete_named'), """
       DELETE FROM pull_queue_eta_index
-      WHERE app = %(app)s
-      AND queue = %(queue)s
-      AND eta = %(eta)s
-      AND id = %(id)s
+      WHERE app = :app
+      AND queue = :queue
+      AND eta = :eta
+      AND id = :id
     """)
     parameters = {
       'app': self.app,
@@ -1761,13 +2278,14 @@ class PullQueue(Queue):
     except AttributeError:
       tag = ''
 
-    delete_task_tag_index = SimpleStatement("""
+    delete_task_tag_index = self.db_access.statement_cache.get(
+      ('pull_queue_tags_index', 'delete_named'), """
       DELETE FROM pull_queue_tags_index
-      WHERE app = %(app)s
-      AND queue = %(queue)s
-      AND tag = %(tag)s
-      AND eta = %(eta)s
-      AND id = %(id)s
+      WHERE app = :app
+      AND queue = :queue
+      AND tag = :tag
+      AND eta = :eta
+      AND id = :id
     """)
     parameters = {
       'app': self.app,
@@ -1799,7 +2317,6 @@ class PullQueue(Queue):
 
   def _update_stats(self):
     """ Write queue metadata for keeping track of statistics. """
-    session = self.db_access.session
     # Stats are only kept for one hour.
     ttl = 60 * 60
     statement = """
@@ -1807,9 +2324,8 @@ class PullQueue(Queue):
       VALUES (?, ?, ?)
       USING TTL {ttl}
     """.format(ttl=ttl)
-    if statement not in self.prepared_statements:
-      self.prepared_statements[statement] = session.prepare(statement)
-    record_lease = self.prepared_statements[statement]
+    record_lease = self.db_access.statement_cache.get(
+      ('pull_queue_leases', 'insert'), statement)
 
     parameters = [self.app, self.name, datetime.datetime.utcnow()]
     self.db_access.session.execute_async(record_lease, parameters)
@@ -1834,24 +2350,26 @@ class PullQueue(Queue):
       stats['oldestTask'] = int((oldest_eta - epoch).total_seconds())
 
     if 'leasedLastMinute' in fields:
-      select_count = """
+      select_count = self.db_access.statement_cache.get(
+        ('pull_queue_leases', 'count'), """
         SELECT COUNT(*) from pull_queue_leases
-        WHERE token(app, queue, leased) > token(%(app)s, %(queue)s, %(ts)s)
+        WHERE token(app, queue, leased) > token(:app, :queue, :ts)
         AND token(app, queue, leased) <=
-            token(%(app)s, %(queue)s, dateof(now()))
-      """
+            token(:app, :queue, dateof(now()))
+      """)
       start_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=60)
       parameters = {'app': self.app, 'queue': self.name, 'ts': start_time}
       leased_last_minute = session.execute(select_count, parameters)[0].count
       stats['leasedLastMinute'] = leased_last_minute
 
     if 'leasedLastHour' in fields:
-      select_count = """
+      select_count = self.db_access.statement_cache.get(
+        ('pull_queue_leases', 'count'), """
         SELECT COUNT(*) from pull_queue_leases
-        WHERE token(app, queue, leased) > token(%(app)s, %(queue)s, %(ts)s)
+        WHERE token(app, queue, leased) > token(:app, :queue, :ts)
         AND token(app, queue, leased) <=
-            token(%(app)s, %(queue)s, dateof(now()))
-      """
+            token(:app, :queue, dateof(now()))
+      """)
       start_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=60)
       parameters = {'app': self.app, 'queue': self.name, 'ts': start_time}
       leased_last_hour = session.execute(select_count, parameters)[0].count
@@ -50,6 +50,11 @@ class InvalidTaskInfo(Exception):
   pass
 
 
+class TaskNameTaken(InvalidTaskInfo):
+  """ Indicates that a queue already contains a task with the same name. """
+  pass
+
+
 class Task(object):
   """ Represents a task created by an App Engine application. """
 
@@ -1,14 +1,32 @@
-""" Stores push task metadata. """
+""" Stores push task names in order to prevent duplicate tasks. """
+import datetime
 import sys
+import time
+import uuid
 
+from collections import OrderedDict
+from threading import Lock
+
+from appscale.datastore.cassandra_env.retry_policies import (
+  BASIC_RETRIES,
+  NO_RETRIES
+)
+from appscale.datastore.dbconstants import TRANSIENT_CASSANDRA_ERRORS
 from appscale.common.unpackaged import APPSCALE_PYTHON_APPSERVER
+from cassandra import DriverException
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import ConsistencyLevel
+from .queue import TransientError
+from .tq_lib import TASK_STATES
 
 sys.path.append(APPSCALE_PYTHON_APPSERVER)
 from google.appengine.ext import db
 
+
 class TaskName(db.Model):
-  """ A datastore model for tracking task names in order to prevent
-  tasks with the same name from being enqueued repeatedly.
+  """ A datastore model that was used for tracking task names before they
+  were stored in the push_task_names table. The groomer removes the remaining
+  entities.
 
   Attributes:
     timestamp: The time the task was enqueued.
@@ -24,3 +42,207 @@ class TaskName(db.Model):
   def kind(cls):
     """ Kind name override. """
     return cls.STORED_KIND_NAME
+
+
+class TaskNameStore(object):
+  """ Tracks the names of push tasks in the push_task_names table.
+
+  Each name is claimed with a single lightweight transaction, and the names in
+  a request are claimed concurrently. Names that were recently found to be
+  taken are kept in memory so that repeated attempts to enqueue them are
+  rejected without a database round trip.
+  """
+
+  # The number of seconds to keep the names of queued tasks. This is longer
+  # than the time that a task is allowed to run.
+  QUEUED_TTL = 60 * 60 * 24 * 31
+
+  # The number of seconds to keep the names of finished tasks.
+  TOMBSTONE_TTL = 60 * 60 * 24
+
+  # The maximum number of taken names to keep in memory.
+  MAX_CACHE_SIZE = 10000
+
+  # The number of seconds to keep a taken name in memory.
+  CACHE_DURATION = 60
+
+  # The maximum number of concurrent writes when recording task states.
+  MAX_CONCURRENT_WRITES = 50
+
+  def __init__(self, db_access):
+    """ Creates a new TaskNameStore.
+
+    Args:
+      db_access: A DatastoreProxy object.
+    """
+    self.db_access = db_access
+    self._taken = OrderedDict()
+    self._taken_lock = Lock()
+
+  def claim(self, tasks):
+    """ Stores the names of new tasks.
+
+    Args:
+      tasks: A list of tuples containing the task name, application ID, and
+        queue name of each task.
+    Returns:
+      A list containing None for each name that was claimed. For each name
+      that was already taken, it contains the state of the existing task. For
+      each name that could not be stored, it contains a TransientError.
+    """
+    results = [None for _ in tasks]
+    insert = self.db_access.statement_cache.get(
+      ('push_task_names', 'insert'), """
+      INSERT INTO push_task_names (name, app, queue, state, op_id)
+      VALUES (?, ?, ?, ?, ?)
+      IF NOT EXISTS
+      USING TTL {ttl}
+    """.format(ttl=self.QUEUED_TTL), retry_policy=NO_RETRIES)
+
+    op_id = uuid.uuid4()
+    futures = {}
+    for task_num, (name, app, queue) in enumerate(tasks):
+      state = self._cached_state(name)
+      if state is not None:
+        results[task_num] = state
+        continue
+
+      parameters = (name, app, queue, TASK_STATES.QUEUED, op_id)
+      futures[task_num] = self.db_access.session.execute_async(
+        insert, parameters)
+
+    for task_num, future in futures.iteritems():
+      name = tasks[task_num][0]
+      try:
+        result = future.result()
+      except DriverException:
+        # The insert may have been applied even though it failed.
+        try:
+          existing = self._get(name)
+        except TransientError as error:
+          results[task_num] = error
+          continue
+
+        if existing is None or existing.op_id != op_id:
+          results[task_num] = TransientError(
+            'Unable to store task name {}'.format(name))
+          continue
+      else:
+        if not result.was_applied:
+          results[task_num] = result[0].state
+          self._cache(name, result[0].state)
+          continue
+
+      self._cache(name, TASK_STATES.QUEUED)
+
+    return results
+
+  def finish(self, tasks):
+    """ Records that tasks are no longer queued.
+
+    The names are kept for TOMBSTONE_TTL seconds to prevent the tasks from
+    being enqueued again. The entries are written concurrently.
+
+    Args:
+      tasks: A list of tuples containing the task name, application ID, queue
+        name, and final state (from TASK_STATES) of each task.
+    Raises:
+      TransientError if unable to record a state.
+    """
+    insert = self.db_access.statement_cache.get(
+      ('push_task_names', 'finish'), """
+      INSERT INTO push_task_names (name, app, queue, state, op_id, endtime)
+      VALUES (?, ?, ?, ?, null, ?)
+      USING TTL {ttl}
+    """.format(ttl=self.TOMBSTONE_TTL), retry_policy=BASIC_RETRIES)
+    endtime = datetime.datetime.utcnow()
+    results = execute_concurrent(
+      self.db_access.session,
+      [(insert, (name, app, queue, state, endtime))
+       for name, app, queue, state in tasks],
+      concurrency=self.MAX_CONCURRENT_WRITES, raise_on_first_error=False)
+    failures = len([success for success, _ in results if not success])
+    if failures:
+      raise TransientError('Unable to record {} task states'.format(failures))
+
+  def count_queued(self, app, queue):
+    """ Counts the tasks in a queue that have not finished yet.
+
+    Args:
+      app: A string specifying the application ID.
+      queue: A string specifying the queue name.
+    Returns:
+      An integer specifying the number of queued tasks.
+    """
+    # Task names are prefixed with the application ID and queue name. Since
+    # both can contain underscores, the prefix range can also include other
+    # queues (e.g. "default_x" for "default"), so rows are checked against
+    # their stored app and queue.
+    prefix = 'task_{}_{}_'.format(app, queue)
+    select = self.db_access.statement_cache.get(
+      ('push_task_names', 'select_prefix'), """
+      SELECT app, queue, state FROM push_task_names
+      WHERE token(name) >= token(?) AND token(name) < token(?)
+    """)
+    parameters = (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    results = self.db_access.session.execute(select, parameters)
+    return len([result for result in results
+                if result.app == app and result.queue == queue and
+                result.state == TASK_STATES.QUEUED])
+
+  def _get(self, name):
+    """ Fetches a task name entry with a serial read.
+
+    Args:
+      name: A string specifying the task name.
+    Returns:
+      A row from the push_task_names table or None.
+    """
+    select = self.db_access.statement_cache.get(
+      ('push_task_names', 'select'), """
+      SELECT state, op_id FROM push_task_names WHERE name = ?
+    """)
+    bound_select = select.bind([name])
+    bound_select.consistency_level = ConsistencyLevel.SERIAL
+    try:
+      results = self.db_access.session.execute(bound_select)
+    except TRANSIENT_CASSANDRA_ERRORS:
+      raise TransientError('Unable to read task name {}'.format(name))
+
+    try:
+      return results[0]
+    except IndexError:
+      return None
+
+  def _cached_state(self, name):
+    """ Checks if a name was recently found to be taken.
+
+    Args:
+      name: A string specifying the task name.
+    Returns:
+      The state of the existing task or None.
+    """
+    with self._taken_lock:
+      try:
+        state, expires = self._taken[name]
+      except KeyError:
+        return None
+
+      if expires < time.time():
+        del self._taken[name]
+        return None
+
+      return state
+
+  def _cache(self, name, state):
+    """ Keeps a taken name in memory.
+
+    Args:
+      name: A string specifying the task name.
+      state: A string specifying the state of the existing task.
+    """
+    with self._taken_lock:
+      self._taken.pop(name, None)
+      self._taken[name] = (state, time.time() + self.CACHE_DURATION)
+      while len(self._taken) > self.MAX_CACHE_SIZE:
+        self._taken.popitem(last=False)
@@ -0,0 +1,122 @@
+""" Measures how quickly tasks are leased from a Cassandra pull queue.
+
+Each leaser has its own PullQueue object, so it behaves like a separate
+TaskQueue server process with its own index cache. For every number of
+concurrent leasers, the queue is filled with new tasks and the leasers lease
+batches of tasks until the queue is exhausted.
+
+This must run on a machine that can reach the deployment's Cassandra nodes.
+The queue is purged before every scenario.
+
+Example:
+  python test/benchmarks/lease_throughput.py --tasks 2000 --leasers 1 4 16
+"""
+import argparse
+import base64
+import threading
+import time
+import uuid
+
+from appscale.datastore.cassandra_env.cassandra_interface import DatastoreProxy
+from appscale.taskqueue.queue import PullQueue
+from appscale.taskqueue.task import Task
+
+PROJECT_ID = 'lease-benchmark'
+
+QUEUE_NAME = 'lease-benchmark'
+
+
+def fill_queue(queue, num_tasks, payload_size):
+  """ Adds new tasks to a queue.
+
+  Args:
+    queue: A PullQueue object.
+    num_tasks: An integer specifying the number of tasks to add.
+    payload_size: An integer specifying the payload size in bytes.
+  """
+  payload = base64.urlsafe_b64encode('x' * payload_size)
+  for _ in range(num_tasks):
+    task_id = uuid.uuid4().hex
+    queue.add_task(Task({'id': task_id, 'payloadBase64': payload}))
+
+
+def lease_all(queue, batch_size, lease_seconds, leased):
+  """ Leases tasks until no more are available.
+
+  Args:
+    queue: A PullQueue object.
+    batch_size: An integer specifying how many tasks to lease at a time.
+    lease_seconds: An integer specifying how long to lease the tasks.
+    leased: A list to extend with the IDs of leased tasks.
+  """
+  while True:
+    tasks = queue.lease_tasks(batch_size, lease_seconds)
+    if not tasks:
+      return
+
+    leased.extend(task.id for task in tasks)
+
+
+def measure(db_access, num_leasers, args):
+  """ Leases every task in a queue with concurrent leasers.
+
+  Args:
+    db_access: A DatastoreProxy object.
+    num_leasers: An integer specifying the number of concurrent leasers.
+    args: The parsed command line arguments.
+  Returns:
+    A tuple containing the elapsed time, the number of leased tasks, and the
+    number of tasks that were leased more than once.
+  """
+  queue_info = {'name': QUEUE_NAME, 'mode': 'pull'}
+  setup_queue = PullQueue(queue_info, PROJECT_ID, db_access)
+  setup_queue.purge()
+  fill_queue(setup_queue, args.tasks, args.payload_size)
+
+  leased = []
+  threads = [
+    threading.Thread(target=lease_all,
+                     args=(PullQueue(queue_info, PROJECT_ID, db_access),
+                           args.batch_size, args.lease_seconds, leased))
+    for _ in range(num_leasers)]
+
+  start = time.time()
+  for thread in threads:
+    thread.start()
+
+  for thread in threads:
+    thread.join()
+
+  elapsed = time.time() - start
+  return elapsed, len(leased), len(leased) - len(set(leased))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--tasks', type=int, default=2000,
+                      help='The number of tasks to lease in each scenario')
+  parser.add_argument('--leasers', type=int, nargs='+', default=[1, 2, 4, 8],
+                      help='The numbers of concurrent leasers to measure')
+  parser.add_argument('--batch-size', type=int, default=100,
+                      help='The number of tasks each lease request asks for')
+  parser.add_argument('--lease-seconds', type=int, default=300,
+                      help='How long each task is leased for')
+  parser.add_argument('--payload-size', type=int, default=512,
+                      help='The size of each task payload in bytes')
+  args = parser.parse_args()
+
+  db_access = DatastoreProxy()
+  print('Leasers | Elapsed | Tasks/s | Leased | Duplicates')
+  try:
+    for num_leasers in args.leasers:
+      elapsed, count, duplicates = measure(db_access, num_leasers, args)
+      print('{:>7} | {:>6.2f}s | {:>7.1f} | {:>6} | {}'.format(
+        num_leasers, elapsed, count / elapsed, count, duplicates))
+  finally:
+    PullQueue({'name': QUEUE_NAME, 'mode': 'pull'}, PROJECT_ID,
+              db_access).purge()
+    db_access.close()
+
+
+if __name__ == '__main__':
+  main()
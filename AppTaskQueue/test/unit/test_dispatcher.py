@@ -0,0 +1,93 @@
+import unittest
+
+from mock import MagicMock, patch
+
+from appscale.taskqueue.dispatcher import (
+  ConnectionPool,
+  parse_rate,
+  TaskStateWriter,
+  TokenBucket
+)
+from appscale.taskqueue.tq_lib import TASK_STATES
+
+
+class FakeClock(object):
+  def __init__(self):
+    self.now = 1000.0
+    self.sleeps = []
+
+  def time(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.sleeps.append(seconds)
+    self.now += seconds
+
+
+class TestDispatcher(unittest.TestCase):
+  def test_parse_rate(self):
+    self.assertEqual(parse_rate('5/s'), 5)
+    self.assertEqual(parse_rate('30/m'), 0.5)
+    self.assertEqual(parse_rate('0'), 0)
+
+  def test_token_bucket(self):
+    clock = FakeClock()
+    with patch('appscale.taskqueue.dispatcher.time.time', clock.time), \
+         patch('appscale.taskqueue.dispatcher.eventlet.sleep', clock.sleep):
+      bucket = TokenBucket(parse_rate('2/s'), bucket_size=3)
+      # A full bucket allows a burst without waiting.
+      for _ in range(3):
+        bucket.acquire()
+
+      self.assertListEqual(clock.sleeps, [])
+
+      bucket.acquire()
+      self.assertListEqual(clock.sleeps, [0.5])
+
+      # A rate of 0 does not limit the queue.
+      unlimited = TokenBucket(0)
+      for _ in range(10):
+        unlimited.acquire()
+
+      self.assertEqual(len(clock.sleeps), 1)
+
+  def test_connection_pool(self):
+    pool = ConnectionPool('localhost')
+    connection, reused = pool.get('http', 8080)
+    self.assertFalse(reused)
+
+    pool.release('http', 8080, connection, MagicMock(will_close=False))
+    self.assertEqual(pool.get('http', 8080), (connection, True))
+
+    # Connections that the target closes are not kept.
+    closing = MagicMock()
+    pool.release('http', 8080, closing, MagicMock(will_close=True))
+    closing.close.assert_called_once_with()
+    self.assertFalse(pool.get('http', 8080)[1])
+
+    self.assertRaises(ValueError, pool.get, 'ftp', 21)
+
+  def test_state_writer(self):
+    task_names = MagicMock()
+    writer = TaskStateWriter(task_names)
+    with patch('appscale.taskqueue.dispatcher.eventlet.spawn_after') as spawn:
+      for task_num in range(TaskStateWriter.MAX_BATCH_SIZE + 1):
+        writer.finish('task{}'.format(task_num), 'app', 'queue',
+                      TASK_STATES.SUCCESS)
+
+      # A full batch is written right away.
+      task_names.finish.assert_called_once()
+      self.assertEqual(len(task_names.finish.call_args[0][0]),
+                       TaskStateWriter.MAX_BATCH_SIZE)
+      self.assertEqual(spawn.call_count, 1)
+
+      # The remaining states are written when the timer fires.
+      writer._scheduled_flush()
+      self.assertListEqual(task_names.finish.call_args[0][0],
+                           [('task100', 'app', 'queue', TASK_STATES.SUCCESS)])
+
+      # Failures are logged instead of being raised.
+      task_names.finish.side_effect = Exception
+      writer.finish('task101', 'app', 'queue', TASK_STATES.FAILED)
+      self.assertEqual(spawn.call_count, 2)
+      writer.flush()
@@ -0,0 +1,185 @@
+import datetime
+import re
+import unittest
+
+from appscale.taskqueue.queue import PostgresPullQueue
+from appscale.taskqueue.task import Task, TaskNameTaken
+
+
+class FakeCursor(object):
+  def __init__(self, connection):
+    self.connection = connection
+    self.rowcount = 0
+    self.statusmessage = None
+    self._rows = []
+
+  def execute(self, statement, vars=None):
+    self.connection.statements.append((statement, vars))
+    self._rows = []
+    self.rowcount = 0
+    if 'pg_inherits' in statement:
+      self._rows = [(name,) for name in self.connection.partitions]
+    elif statement.startswith('WITH deleted'):
+      self.rowcount = 1
+    elif 'RETURNING task_name' in statement:
+      self._rows = [(name, None, None) for name in self.connection.added]
+    elif 'to_regclass' in statement:
+      self._rows = [tuple(vars[name].strip('"') in self.connection.relations
+                          or None for name in ('legacy_table', 'table'))]
+    elif 'pg_indexes' in statement:
+      self._rows = [(name,) for name in self.connection.relations]
+    elif statement.startswith('ALTER'):
+      old_name, new_name = re.findall(r'"([^"]+)"', statement)
+      self.connection.relations.remove(old_name)
+      self.connection.relations.add(new_name)
+    elif statement.startswith('SELECT 1 FROM') and self.connection.counted:
+      self._rows = [(1,)]
+    elif statement.startswith('INSERT INTO') and 'count(*)' in statement:
+      self.connection.counted = True
+
+  def mogrify(self, statement, parameters):
+    return repr(parameters)
+
+  def fetchall(self):
+    return self._rows
+
+  def fetchone(self):
+    return self._rows[0] if self._rows else None
+
+
+class FakeConnection(object):
+  def __init__(self):
+    self.statements = []
+    self.partitions = []
+    self.relations = set()
+    self.added = []
+    self.counted = False
+
+  def cursor(self):
+    return FakeCursor(self)
+
+  def commit(self):
+    pass
+
+  def rollback(self):
+    pass
+
+  def executed(self, prefix):
+    return [statement for statement in self.statements
+            if statement[0].startswith(prefix)]
+
+
+class TestPostgresPullQueue(unittest.TestCase):
+  def setUp(self):
+    self.connection = FakeConnection()
+    queue_info = {'name': 'pull-queue', 'mode': 'pull'}
+    self.queue = PostgresPullQueue(queue_info, 'guestbook', self.connection)
+
+  def test_add_tasks(self):
+    self.connection.added = ['task1']
+    tasks = [Task({'id': task_id, 'payloadBase64': 'cGF5bG9hZA=='})
+             for task_id in ('task1', 'task2')]
+    results = self.queue.add_tasks(tasks)
+    self.assertIsNone(results[0])
+    self.assertIsInstance(results[1], TaskNameTaken)
+
+    # Only the tasks that were added are counted.
+    counter_updates = self.connection.executed(
+      'UPDATE "pullqueue-pull-queue-counters"')
+    self.assertEqual(len(counter_updates), 1)
+    self.assertEqual(counter_updates[0][1]['change'], 1)
+
+  def test_delete_task(self):
+    for task_id in ('task1', 'task2'):
+      self.queue.delete_task(Task({'id': task_id}))
+
+    # The partition for the current day is only created once.
+    today = datetime.datetime.utcnow().strftime('%Y%m%d')
+    creates = self.connection.executed('CREATE TABLE IF NOT EXISTS '
+                                       '"pullqueue-pull-queue-deleted-')
+    self.assertEqual(len(creates), 1)
+    self.assertIn(today, creates[0][0])
+
+    counter_updates = self.connection.executed(
+      'UPDATE "pullqueue-pull-queue-counters"')
+    self.assertListEqual([update[1]['change'] for update in counter_updates],
+                         [-1, -1])
+
+  def test_flush_deleted(self):
+    today = datetime.datetime.utcnow().date()
+    days = [today - datetime.timedelta(days=days_ago)
+            for days_ago in (0, 7, 8, 30)]
+    self.connection.partitions = [self.queue._partition_name(day)
+                                  for day in days]
+    self.queue.flush_deleted()
+
+    drops = [statement[0] for statement in self.connection.executed('DROP')]
+    self.assertListEqual(
+      drops, ['DROP TABLE IF EXISTS "{}"'.format(partition)
+              for partition in self.connection.partitions[2:]])
+
+  def test_partition_name(self):
+    queue_info = {'name': 'q' * 100, 'mode': 'pull'}
+    queue = PostgresPullQueue(queue_info, 'guestbook', self.connection)
+    day = datetime.date(2019, 3, 1)
+    partition = queue._partition_name(day)
+    self.assertEqual(len(partition), PostgresPullQueue.MAX_IDENTIFIER_LENGTH)
+    self.assertEqual(queue._partition_day(partition), day)
+
+  def test_long_queue_name(self):
+    queue_info = {'name': 'q' * 100, 'mode': 'pull'}
+    queue = PostgresPullQueue(queue_info, 'guestbook', self.connection)
+    queue.delete_task(Task({'id': 'task1'}))
+
+    identifiers = set()
+    for statement, _ in self.connection.statements:
+      identifiers.update(re.findall(r'"([^"]+)"', statement))
+
+    long_names = [name for name in identifiers if 'qqq' in name]
+    self.assertGreater(len(long_names), 6)
+    for name in long_names:
+      self.assertLessEqual(len(name), PostgresPullQueue.MAX_IDENTIFIER_LENGTH)
+
+    # The names stay distinct after they are shortened.
+    truncated = set(name[:PostgresPullQueue.MAX_IDENTIFIER_LENGTH]
+                    for name in long_names)
+    self.assertEqual(len(truncated), len(long_names))
+
+    # Queues that only differ after the shortened prefix get other tables.
+    other_info = {'name': 'q' * 99 + 'r', 'mode': 'pull'}
+    other_queue = PostgresPullQueue(other_info, 'guestbook', self.connection)
+    self.assertNotEqual(queue.tasks_table_name, other_queue.tasks_table_name)
+
+  def test_rename_truncated_identifiers(self):
+    # Tables created before long names were hashed are renamed.
+    name = 'q' * 60
+    legacy_table = 'pullqueue-' + name[:53]
+    self.connection.relations.add(legacy_table)
+    queue = PostgresPullQueue({'name': name, 'mode': 'pull'}, 'guestbook',
+                              self.connection)
+    self.assertSetEqual(self.connection.relations, {queue.tasks_table_name})
+    self.assertNotEqual(queue.tasks_table_name, legacy_table)
+
+    # Indexes are renamed even when the table name was not truncated.
+    name = 'r' * 40
+    legacy_index = ('pullqueue-' + name + '-eta-retry-tag-index')[:63]
+    self.connection.relations = {'pullqueue-' + name, legacy_index}
+    queue = PostgresPullQueue({'name': name, 'mode': 'pull'}, 'guestbook',
+                              self.connection)
+    self.assertSetEqual(self.connection.relations,
+                        {queue.tasks_table_name,
+                         queue._identifier('-eta-retry-tag-index')})
+
+    # Queues with short names do not need to look for old names.
+    self.connection.statements = []
+    PostgresPullQueue({'name': 'pull-queue', 'mode': 'pull'}, 'guestbook',
+                      self.connection)
+    self.assertEqual(self.connection.executed('SELECT indexname'), [])
+
+  def test_counters_seeded_once(self):
+    queue_info = {'name': 'pull-queue', 'mode': 'pull'}
+    PostgresPullQueue(queue_info, 'guestbook', self.connection)
+
+    # The existing tasks are only counted when the counters are created.
+    seeds = self.connection.executed('INSERT INTO "pullqueue-pull-queue-')
+    self.assertEqual(len(seeds), 1)
@@ -0,0 +1,204 @@
+import datetime
+import unittest
+from collections import namedtuple
+
+from mock import patch
+
+from appscale.taskqueue.queue import PullQueue, lease_bucket
+from appscale.taskqueue.task import InvalidTaskInfo, Task, TaskNameTaken
+
+IndexRow = namedtuple('IndexRow', ['eta', 'id', 'tag'])
+
+
+class FakeResult(list):
+  def __init__(self, rows=(), was_applied=True):
+    super(FakeResult, self).__init__(rows)
+    self.was_applied = was_applied
+
+
+class FakeFuture(object):
+  def __init__(self, result):
+    self._result = result
+
+  def result(self):
+    return self._result
+
+
+class FakeStatement(object):
+  def __init__(self, key):
+    self.key = key
+
+
+class FakeBatch(object):
+  def __init__(self, retry_policy=None):
+    self.statements = []
+
+  def add(self, statement, parameters):
+    self.statements.append((statement.key, parameters))
+
+
+def fake_execute_concurrent(session, statements_and_params, concurrency,
+                            raise_on_first_error):
+  results = []
+  for statement, parameters in statements_and_params:
+    try:
+      results.append(
+        (True, session.execute_async(statement, parameters).result()))
+    except Exception as error:
+      results.append((False, error))
+
+  return results
+
+
+class FakeStatementCache(object):
+  def get(self, key, statement, **kwargs):
+    return FakeStatement(key)
+
+
+class FakeSession(object):
+  """ Keeps pull_queue_tasks rows in memory and records each request. """
+  def __init__(self, tasks):
+    self.tasks = tasks
+    self.requests = []
+
+  def execute_async(self, statement, parameters=None):
+    if isinstance(statement, FakeBatch):
+      self.requests.append(('batch', statement.statements))
+      return FakeFuture(FakeResult())
+
+    self.requests.append((statement.key, parameters))
+    table, operation = statement.key[:2]
+    if operation == 'multi_get':
+      columns = ('id',) + statement.key[2]
+      row_type = namedtuple('Row', columns)
+      rows = [row_type(*[task_id] + [self.tasks[task_id][column]
+                                     for column in columns[1:]])
+              for task_id in parameters[2] if task_id in self.tasks]
+      return FakeFuture(FakeResult(rows))
+
+    if statement.key == ('pull_queue_tasks', 'insert'):
+      applied = parameters['id'] not in self.tasks
+      if applied:
+        self.tasks[parameters['id']] = parameters
+
+      return FakeFuture(FakeResult(was_applied=applied))
+
+    if operation == 'lease_and_count':
+      (new_eta, op_id, new_count, _, _, task_id, current_time,
+       old_count) = parameters
+      task = self.tasks[task_id]
+      applied = (task['lease_expires'] < current_time and
+                 task['retry_count'] == old_count)
+      if applied:
+        task.update({'lease_expires': new_eta, 'op_id': op_id,
+                     'retry_count': new_count})
+
+      return FakeFuture(FakeResult(was_applied=applied))
+
+    return FakeFuture(FakeResult())
+
+
+class TestPullQueueLease(unittest.TestCase):
+  def setUp(self):
+    now = datetime.datetime.utcnow()
+    available = now - datetime.timedelta(minutes=1)
+    leased = now + datetime.timedelta(minutes=1)
+    self.tasks = {}
+    for task_num, (lease_expires, retry_count) in enumerate(
+        [(available, 0), (available, 2), (leased, 0), (available, 5),
+         (available, 1)]):
+      self.tasks['task{}'.format(task_num)] = {
+        'payload': 'payload{}'.format(task_num), 'enqueued': available,
+        'tag': 'tag' if task_num % 2 else None,
+        'lease_expires': lease_expires, 'retry_count': retry_count}
+
+    self.session = FakeSession(self.tasks)
+    db_access = type('FakeProxy', (object,), {})()
+    db_access.session = self.session
+    db_access.statement_cache = FakeStatementCache()
+    queue_info = {'name': 'pull-queue', 'mode': 'pull',
+                  'retry_parameters': {'task_retry_limit': 5}}
+    self.queue = PullQueue(queue_info, 'guestbook', db_access)
+
+  def test_lease_batch(self):
+    indexes = [IndexRow(self.tasks[task_id]['lease_expires'], task_id, '')
+               for task_id in sorted(self.tasks)]
+    new_eta = datetime.datetime.utcnow() + datetime.timedelta(minutes=5)
+    with patch('appscale.taskqueue.queue.BatchStatement', FakeBatch), \
+         patch('appscale.taskqueue.queue.execute_concurrent',
+               fake_execute_concurrent):
+      leased = self.queue._lease_batch(indexes, new_eta)
+
+    # Tasks that are still leased or out of retries should be skipped.
+    self.assertEqual([task and task.id for task in leased],
+                     ['task0', 'task1', None, None, 'task4'])
+    self.assertEqual(leased[1].payloadBase64, 'payload1')
+    self.assertEqual(leased[1].retry_count, 2)
+    self.assertEqual(self.tasks['task1']['retry_count'], 3)
+    self.assertEqual(self.tasks['task3']['retry_count'], 5)
+
+    operations = [request[0] for request in self.session.requests
+                  if request[0] != ('pull_queue_leases', 'insert')]
+    self.assertEqual(operations.count(('pull_queue_tasks', 'lease_and_count')),
+                     3)
+    multi_gets = [operation for operation in operations
+                  if operation[1] == 'multi_get']
+    self.assertEqual(len(multi_gets), 2)
+
+    # The index entries are moved without a multi-partition batch, and new
+    # entries are written before the old ones are deleted.
+    index_writes = [request[0][1] for request in self.session.requests
+                    if request[0][0] in ('pull_queue_eta_index',
+                                         'pull_queue_tags_index')]
+    self.assertNotIn('batch', [request[0] for request in self.session.requests])
+    self.assertListEqual(index_writes,
+                         ['insert_positional'] * 6 + ['delete'] * 6)
+
+  def test_bucket_order(self):
+    now = datetime.datetime.utcnow()
+    indexes = [IndexRow(now + datetime.timedelta(seconds=task_num % 5),
+                        'task{}'.format(task_num), '')
+               for task_num in range(50)]
+    ordered = self.queue._bucket_order(indexes)
+    self.assertItemsEqual(ordered, indexes)
+
+    # The oldest tasks are still leased first.
+    self.assertListEqual([index.eta for index in ordered],
+                         sorted(index.eta for index in indexes))
+
+    # Tasks with the same ETA are claimed by bucket, starting with a random
+    # one.
+    same_eta = [index for index in ordered if index.eta == now]
+    buckets = [lease_bucket(index.id, PullQueue.LEASE_BUCKETS)
+               for index in same_eta]
+    first_bucket = buckets[0]
+    self.assertListEqual(
+      buckets,
+      sorted(buckets, key=lambda bucket: (bucket - first_bucket) %
+                                         PullQueue.LEASE_BUCKETS))
+    self.assertEqual(lease_bucket(u'task1', 16), lease_bucket('task1', 16))
+
+  def test_add_tasks(self):
+    tasks = [Task({'id': task_id, 'payloadBase64': 'cGF5bG9hZA=='})
+             for task_id in ('new1', 'task0', 'new2', 'new1')]
+    tasks.append(Task({'id': 'nopayload'}))
+    with patch('appscale.taskqueue.queue.execute_concurrent',
+               fake_execute_concurrent):
+      results = self.queue.add_tasks(tasks)
+
+    self.assertIsNone(results[0])
+    self.assertIsNone(results[2])
+    for result in results[1], results[3]:
+      self.assertIsInstance(result, TaskNameTaken)
+
+    self.assertIsInstance(results[4], InvalidTaskInfo)
+    self.assertNotIsInstance(results[4], TaskNameTaken)
+
+    self.assertEqual(tasks[0].queueName, 'pull-queue')
+    self.assertEqual(self.tasks['new2']['retry_count'], 0)
+
+    # Each added task gets an ETA index entry and a tags index entry.
+    index_inserts = [request for request in self.session.requests
+                     if request[0][1] == 'insert' and
+                     request[0][0] != 'pull_queue_tasks']
+    self.assertEqual(len(index_inserts), 4)
@@ -0,0 +1,100 @@
+import unittest
+from collections import namedtuple
+
+from cassandra import OperationTimedOut
+from mock import MagicMock
+
+from appscale.taskqueue.queue import TransientError
+from appscale.taskqueue.task_name import TaskNameStore
+from appscale.taskqueue.tq_lib import TASK_STATES
+
+Row = namedtuple('Row', ['state', 'op_id'])
+NameRow = namedtuple('NameRow', ['app', 'queue', 'state'])
+
+
+class FakeResult(list):
+  def __init__(self, rows=(), was_applied=True):
+    super(FakeResult, self).__init__(rows)
+    self.was_applied = was_applied
+
+
+class FakeFuture(object):
+  def __init__(self, result=None, error=None):
+    self._result = result
+    self._error = error
+
+  def result(self):
+    if self._error is not None:
+      raise self._error
+
+    return self._result
+
+
+class FakeStatement(object):
+  def bind(self, parameters):
+    bound = FakeStatement()
+    bound.parameters = parameters
+    return bound
+
+
+class FakeSession(object):
+  """ Keeps push_task_names rows in memory. """
+  def __init__(self, names):
+    self.names = names
+    self.inserts = 0
+
+  def execute_async(self, statement, parameters):
+    self.inserts += 1
+    name, app, queue, state, op_id = parameters
+    if name == 'task_app_queue_timeout':
+      self.names.setdefault(name, Row(state, op_id))
+      return FakeFuture(error=OperationTimedOut())
+
+    if name in self.names:
+      return FakeFuture(FakeResult([self.names[name]], was_applied=False))
+
+    self.names[name] = Row(state, op_id)
+    return FakeFuture(FakeResult())
+
+  def execute(self, statement):
+    name = statement.parameters[0]
+    return FakeResult([self.names[name]])
+
+
+class TestTaskNameStore(unittest.TestCase):
+  def setUp(self):
+    self.names = {'task_app_queue_done': Row(TASK_STATES.SUCCESS, None)}
+    self.session = FakeSession(self.names)
+    db_access = MagicMock()
+    db_access.session = self.session
+    db_access.statement_cache.get.return_value = FakeStatement()
+    self.store = TaskNameStore(db_access)
+
+  def test_claim(self):
+    tasks = [('task_app_queue_{}'.format(name), 'app', 'queue')
+             for name in ('new', 'done', 'timeout')]
+    results = self.store.claim(tasks)
+    self.assertListEqual(results, [None, TASK_STATES.SUCCESS, None])
+    self.assertEqual(self.session.inserts, 3)
+
+    # Names that were seen recently are rejected without a round trip.
+    results = self.store.claim(tasks[:2])
+    self.assertListEqual(results, [TASK_STATES.QUEUED, TASK_STATES.SUCCESS])
+    self.assertEqual(self.session.inserts, 3)
+
+  def test_timed_out_claim(self):
+    # A timed out insert that was applied by another request is not claimed.
+    self.store.claim([('task_app_queue_timeout', 'app', 'queue')])
+    self.store._taken.clear()
+    results = self.store.claim([('task_app_queue_timeout', 'app', 'queue')])
+    self.assertIsInstance(results[0], TransientError)
+
+  def test_count_queued(self):
+    rows = [NameRow('app', 'default', TASK_STATES.QUEUED),
+            NameRow('app', 'default', TASK_STATES.SUCCESS),
+            NameRow('app', 'default_x', TASK_STATES.QUEUED)]
+    self.store.db_access.session = MagicMock()
+    self.store.db_access.session.execute.return_value = FakeResult(rows)
+
+    # Queues whose names extend the prefix are not counted.
+    self.assertEqual(self.store.count_queued('app', 'default'), 1)
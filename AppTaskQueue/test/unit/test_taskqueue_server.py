@@ -5,6 +5,11 @@ from mock import MagicMock, patch
 from appscale.common import file_io
 
 from appscale.taskqueue import distributed_tq
+from appscale.taskqueue.queue import PullQueue
+from appscale.taskqueue.task import InvalidTaskInfo, TaskNameTaken
+from google.appengine.api.taskqueue import taskqueue_service_pb
+from google.appengine.api.taskqueue.taskqueue_service_pb import (
+  TaskQueueServiceError)
 
 
 class TestDistributedTaskQueue(unittest.TestCase):
@@ -25,6 +30,35 @@ class TestDistributedTaskQueue(unittest.TestCase):
     zk_client = MagicMock()
     distributed_tq.DistributedTaskQueue(db_access, zk_client)
 
+  def test_bulk_add_pull_task_errors(self):
+    tq = distributed_tq.DistributedTaskQueue(MagicMock(), MagicMock())
+    queue = MagicMock(spec=PullQueue)
+    queue.add_tasks.return_value = [
+      TaskNameTaken('Task name already taken: task1'),
+      InvalidTaskInfo('task2 is missing a payload.'),
+      None]
+    tq.get_queue = MagicMock(return_value=queue)
+
+    request = taskqueue_service_pb.TaskQueueBulkAddRequest()
+    for task_name in ('task1', 'task2', 'task3'):
+      add_request = request.add_add_request()
+      add_request.set_app_id('guestbook')
+      add_request.set_queue_name('pull-queue')
+      add_request.set_task_name(task_name)
+      add_request.set_eta_usec(0)
+      add_request.set_body('payload')
+      add_request.set_mode(taskqueue_service_pb.TaskQueueMode.PULL)
+
+    encoded_response, _, _ = tq.bulk_add({}, request.Encode())
+    response = taskqueue_service_pb.TaskQueueBulkAddResponse(encoded_response)
+
+    # Only duplicate names are reported as existing tasks.
+    self.assertListEqual(
+      [task_result.result() for task_result in response.taskresult_list()],
+      [TaskQueueServiceError.TASK_ALREADY_EXISTS,
+       TaskQueueServiceError.INVALID_REQUEST,
+       TaskQueueServiceError.OK])
+
   # TODO:
   # def test_fetch_queue_stats(self):
   # def test_delete(self):
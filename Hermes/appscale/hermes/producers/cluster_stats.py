@@ -18,7 +18,7 @@ from appscale.hermes import converter
 from appscale.hermes.constants import STATS_REQUEST_TIMEOUT
 from appscale.hermes.producers import (
   proxy_stats, node_stats, process_stats, rabbitmq_stats,
-  taskqueue_stats, cassandra_stats
+  taskqueue_stats, datastore_stats, cassandra_stats
 )
 
 # Allow tornado to fetch up to 100 concurrent requests
@@ -168,6 +168,13 @@ cluster_taskqueue_stats = ClusterStatsSource(
   local_stats_source=taskqueue_stats.taskqueue_stats_source
 )
 
+cluster_datastore_stats = ClusterStatsSource(
+  ips_getter=get_random_lb_node,
+  method_path='stats/local/datastore',
+  stats_model=datastore_stats.DatastoreServiceStatsSnapshot,
+  local_stats_source=datastore_stats.datastore_stats_source
+)
+
 cluster_rabbitmq_stats = ClusterStatsSource(
   ips_getter=appscale_info.get_taskqueue_nodes,
   method_path='stats/local/rabbitmq',
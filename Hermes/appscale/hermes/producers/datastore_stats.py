@@ -0,0 +1,263 @@
+""" Fetches datastore service statistics. """
+import collections
+import json
+import logging
+import socket
+import sys
+import time
+
+import attr
+from tornado import gen, httpclient
+
+from appscale.hermes.converter import include_list_name, Meta
+from appscale.hermes.producers import proxy_stats
+
+# The endpoint used for retrieving datastore server stats.
+STATS_ENDPOINT = '/service-stats'
+
+# The HAProxy proxy name for datastore servers.
+DATASTORE_PROXY = 'appscale-datastore_server'
+
+# Average times (in milliseconds) reported for recent requests.
+AVERAGE_FIELDS = ['avg_latency', 'avg_round_trips', 'avg_lock_time',
+                  'avg_read_time', 'avg_write_time', 'avg_decode_time',
+                  'avg_encode_time']
+
+
+class BadDatastoreStatsFormat(ValueError):
+  pass
+
+
+@include_list_name('datastore.cumulative')
+@attr.s(cmp=False, hash=False, slots=True, frozen=True)
+class CumulativeStatsSnapshot(object):
+  """ Cumulative counters reported for datastore servers. """
+  total = attr.ib()
+  failed = attr.ib()
+  by_method = attr.ib()
+  by_app = attr.ib()
+
+
+@include_list_name('datastore.recent')
+@attr.s(cmp=False, hash=False, slots=True, frozen=True)
+class RecentStatsSnapshot(object):
+  """ Recent stats reported for datastore servers. """
+  total = attr.ib()
+  failed = attr.ib()
+  avg_latency = attr.ib()
+  avg_round_trips = attr.ib()
+  avg_lock_time = attr.ib()
+  avg_read_time = attr.ib()
+  avg_write_time = attr.ib()
+  avg_decode_time = attr.ib()
+  avg_encode_time = attr.ib()
+  latency_histogram = attr.ib()
+  by_method = attr.ib()
+  by_app = attr.ib()
+
+
+@include_list_name('datastore.instance')
+@attr.s(cmp=False, hash=False, slots=True, frozen=True)
+class InstanceStatsSnapshot(object):
+  """ Stats reported for each datastore server. """
+  ip_port = attr.ib()
+  start_timestamp_ms = attr.ib()
+  workers_count = attr.ib()
+  current_requests = attr.ib()
+  cumulative = attr.ib(metadata={Meta.ENTITY: CumulativeStatsSnapshot})
+  recent = attr.ib(metadata={Meta.ENTITY: RecentStatsSnapshot})
+
+
+@include_list_name('datastore.failure')
+@attr.s(cmp=False, hash=False, slots=True, frozen=True)
+class FailureSnapshot(object):
+  """ Failure reported for a datastore server. """
+  ip_port = attr.ib()
+  error = attr.ib()
+
+
+@include_list_name('datastore')
+@attr.s(cmp=False, hash=False, slots=True, frozen=True)
+class DatastoreServiceStatsSnapshot(object):
+  """ Stats reported for datastore service. """
+  utc_timestamp = attr.ib()
+  current_requests = attr.ib()
+  cumulative = attr.ib(metadata={Meta.ENTITY: CumulativeStatsSnapshot})
+  recent = attr.ib(metadata={Meta.ENTITY: RecentStatsSnapshot})
+  instances = attr.ib(metadata={Meta.ENTITY_LIST: InstanceStatsSnapshot})
+  instances_count = attr.ib()
+  failures = attr.ib(metadata={Meta.ENTITY_LIST: FailureSnapshot})
+
+
+def _sum_dicts(dicts):
+  """ Adds up counters from several dictionaries.
+
+  Args:
+    dicts: An iterable of dictionaries mapping names to counts.
+  Returns:
+    A dictionary mapping names to total counts.
+  """
+  total = collections.defaultdict(int)
+  for counters in dicts:
+    for name, count in counters.iteritems():
+      total[name] += count
+  return dict(total)
+
+
+class DatastoreStatsSource(object):
+
+  IGNORE_RECENT_OLDER_THAN = 5*60*1000  # 5 minutes
+  REQUEST_TIMEOUT = 10  # Wait up to 10 seconds
+
+  @staticmethod
+  def parse_worker_stats(worker_dict):
+    """ Reads the stats that one datastore worker process reports.
+
+    Args:
+      worker_dict: A dictionary containing a worker's stats.
+    Returns:
+      A tuple containing the time the worker started counting requests, the
+      number of current requests, and cumulative and recent stats snapshots.
+    """
+    cumulative_dict = worker_dict["cumulative_counters"]
+    recent_dict = worker_dict["recent_stats"]
+    cumulative = CumulativeStatsSnapshot(
+      total=cumulative_dict["all"],
+      failed=cumulative_dict["failed"],
+      by_method={method: counters["all"] for method, counters
+                 in cumulative_dict["by_method"].iteritems()},
+      by_app={app: counters["all"] for app, counters
+              in cumulative_dict["by_app"].iteritems()}
+    )
+    recent_fields = {field: recent_dict[field] for field in AVERAGE_FIELDS}
+    recent = RecentStatsSnapshot(
+      total=recent_dict["all"],
+      failed=recent_dict["failed"],
+      latency_histogram=recent_dict["latency_histogram"],
+      by_method={method: method_stats["all"] for method, method_stats
+                 in recent_dict["by_method"].iteritems()},
+      by_app={app: app_stats["all"] for app, app_stats
+              in recent_dict["by_app"].iteritems()},
+      **recent_fields
+    )
+    return (cumulative_dict["from"], worker_dict["current_requests"],
+            cumulative, recent)
+
+  @gen.coroutine
+  def fetch_stats_from_instance(self, ip_port):
+    url = "http://{ip_port}{path}?last_milliseconds={max_age}".format(
+      ip_port=ip_port, path=STATS_ENDPOINT,
+      max_age=self.IGNORE_RECENT_OLDER_THAN
+    )
+    request = httpclient.HTTPRequest(
+      url=url, method='GET', request_timeout=self.REQUEST_TIMEOUT
+    )
+    async_client = httpclient.AsyncHTTPClient()
+
+    try:
+      # Send Future object to coroutine and suspend till result is ready
+      response = yield async_client.fetch(request)
+    except (socket.error, httpclient.HTTPError) as err:
+      msg = u"Failed to get stats from {url} ({err})".format(url=url, err=err)
+      if hasattr(err, 'response') and err.response and err.response.body:
+        msg += u"\nBODY: {body}".format(body=err.response.body)
+      logging.error(msg)
+      failure = FailureSnapshot(ip_port=ip_port, error=unicode(err))
+      raise gen.Return(failure)
+
+    try:
+      # Each worker process of a datastore server reports its own stats.
+      workers = [self.parse_worker_stats(worker_dict)
+                 for worker_dict in json.loads(response.body)["workers"]]
+      instance_stats_snapshot = InstanceStatsSnapshot(
+        ip_port=ip_port,
+        start_timestamp_ms=min(worker[0] for worker in workers),
+        workers_count=len(workers),
+        current_requests=sum(worker[1] for worker in workers),
+        cumulative=self.summarise_cumulative(
+          [worker[2] for worker in workers]),
+        recent=self.summarise_recent([worker[3] for worker in workers])
+      )
+      raise gen.Return(instance_stats_snapshot)
+    except (TypeError, KeyError, ValueError) as err:
+      msg = u"Can't parse datastore stats ({})".format(err)
+      raise BadDatastoreStatsFormat(msg), None, sys.exc_info()[2]
+
+  @staticmethod
+  def summarise_cumulative(cumulative_stats):
+    return CumulativeStatsSnapshot(
+      total=sum(cumulative.total for cumulative in cumulative_stats),
+      failed=sum(cumulative.failed for cumulative in cumulative_stats),
+      by_method=_sum_dicts(cumulative.by_method
+                           for cumulative in cumulative_stats),
+      by_app=_sum_dicts(cumulative.by_app for cumulative in cumulative_stats)
+    )
+
+  @staticmethod
+  def summarise_recent(recent_stats):
+    total_recent_reqs = sum(recent.total for recent in recent_stats)
+    # Averages are weighted by the number of requests they describe.
+    averages = {}
+    for field in AVERAGE_FIELDS:
+      weighted_sum = sum(
+        getattr(recent, field) * recent.total for recent in recent_stats
+        if getattr(recent, field) is not None
+      )
+      averages[field] = (weighted_sum / total_recent_reqs
+                         if total_recent_reqs else None)
+
+    return RecentStatsSnapshot(
+      total=total_recent_reqs,
+      failed=sum(recent.failed for recent in recent_stats),
+      latency_histogram=_sum_dicts(recent.latency_histogram
+                                   for recent in recent_stats),
+      by_method=_sum_dicts(recent.by_method for recent in recent_stats),
+      by_app=_sum_dicts(recent.by_app for recent in recent_stats),
+      **averages
+    )
+
+  @gen.coroutine
+  def get_current(self):
+    start_time = time.time()
+    # Find all datastore servers
+    datastore_instances = proxy_stats.get_service_instances(
+      proxy_stats.HAPROXY_SERVICES_STATS_SOCKET_PATH, DATASTORE_PROXY
+    )
+    # Query all datastore servers
+    instances_responses = yield [
+      self.fetch_stats_from_instance(ip_port)
+      for ip_port in datastore_instances
+    ]
+    # Select successful
+    instances_stats = [
+      stats_or_err for stats_or_err in instances_responses
+      if isinstance(stats_or_err, InstanceStatsSnapshot)
+    ]
+    # Select failures
+    failures = [
+      stats_or_err for stats_or_err in instances_responses
+      if isinstance(stats_or_err, FailureSnapshot)
+    ]
+    # Prepare service stats
+    current_reqs = sum(server.current_requests for server in instances_stats)
+    total_cumulative = self.summarise_cumulative(
+      [server.cumulative for server in instances_stats])
+    total_recent = self.summarise_recent(
+      [server.recent for server in instances_stats])
+    stats = DatastoreServiceStatsSnapshot(
+      utc_timestamp=int(time.time()),
+      current_requests=current_reqs,
+      cumulative=total_cumulative,
+      recent=total_recent,
+      instances=instances_stats,
+      instances_count=len(instances_stats),
+      failures=failures
+    )
+    logging.info(
+      "Fetched datastore server stats from {nodes} instances in {elapsed:.1f}s."
+      .format(nodes=len(instances_stats), elapsed=time.time() - start_time)
+    )
+    raise gen.Return(stats)
+
+
+datastore_stats_source = DatastoreStatsSource()
@@ -0,0 +1,111 @@
+import json
+import os
+import socket
+
+from mock import patch, mock
+from tornado import testing, gen, httpclient
+
+from appscale.hermes.producers import datastore_stats, proxy_stats
+
+CUR_DIR = os.path.dirname(os.path.realpath(__file__))
+TEST_DATA_DIR = os.path.join(CUR_DIR, 'test-data')
+
+
+class TestDatastoreStatsSource(testing.AsyncTestCase):
+
+  @patch.object(proxy_stats, 'get_service_instances')
+  @patch.object(datastore_stats.httpclient.AsyncHTTPClient, 'fetch')
+  @testing.gen_test
+  def test_datastore_stats(self, mock_fetch, mock_get_instances):
+    # Read test data from json file
+    test_data_path = os.path.join(TEST_DATA_DIR, 'datastore-stats.json')
+    with open(test_data_path) as json_file:
+      datastore_stats_data = json.load(json_file)
+
+    # Tell that we have 2 working datastore servers
+    datastore_responses = {
+      '10.10.7.86:4000': mock.MagicMock(
+        code=200, reason='OK',
+        body=json.dumps(datastore_stats_data['10.10.7.86:4000'])
+      ),
+      '10.10.7.86:4001': mock.MagicMock(
+        code=200, reason='OK',
+        body=json.dumps(datastore_stats_data['10.10.7.86:4001'])
+      ),
+      '10.10.7.86:4002': socket.error("Connection refused")
+    }
+    mock_get_instances.return_value = datastore_responses.keys()
+
+    # Mock datastore service stats API
+    def fetch(request, **kwargs):
+      ip_port = request.url.split('://')[1].split('/')[0]
+      result = datastore_responses[ip_port]
+      future_response = gen.Future()
+      if isinstance(result, Exception):
+        future_response.set_exception(result)
+      else:
+        future_response.set_result(result)
+      return future_response
+
+    mock_fetch.side_effect = fetch
+
+    # Call method under test
+    stats_source = datastore_stats.DatastoreStatsSource()
+    stats_snapshot = yield stats_source.get_current()
+
+    mock_get_instances.assert_called_once_with(
+      proxy_stats.HAPROXY_SERVICES_STATS_SOCKET_PATH,
+      'appscale-datastore_server')
+    self.assertIsInstance(stats_snapshot.utc_timestamp, int)
+    self.assertEqual(stats_snapshot.current_requests, 3)
+
+    # Check summarised cumulative stats
+    self.assertEqual(stats_snapshot.cumulative.total, 60)
+    self.assertEqual(stats_snapshot.cumulative.failed, 3)
+    self.assertEqual(stats_snapshot.cumulative.by_method,
+                     {"Get": 40, "Put": 20})
+    self.assertEqual(stats_snapshot.cumulative.by_app,
+                     {"guestbook": 45, "other": 15})
+
+    # Check summarised recent stats
+    self.assertEqual(stats_snapshot.recent.total, 40)
+    self.assertEqual(stats_snapshot.recent.failed, 3)
+    self.assertEqual(stats_snapshot.recent.avg_latency, 12)
+    self.assertEqual(stats_snapshot.recent.avg_round_trips, 1)
+    self.assertEqual(stats_snapshot.recent.latency_histogram,
+                     {"5": 12, "10": 18, "25": 10, "inf": 0})
+    self.assertEqual(stats_snapshot.recent.by_method, {"Get": 36, "Put": 4})
+    self.assertEqual(stats_snapshot.recent.by_app,
+                     {"guestbook": 30, "other": 10})
+
+    # Check instances
+    self.assertEqual(stats_snapshot.instances_count, 2)
+    server_4000 = next(instance for instance in stats_snapshot.instances
+                       if instance.ip_port == '10.10.7.86:4000')
+    server_4001 = next(instance for instance in stats_snapshot.instances
+                       if instance.ip_port == '10.10.7.86:4001')
+
+    # The stats of the server's worker processes are combined.
+    self.assertEqual(server_4000.start_timestamp_ms, 1494240000000)
+    self.assertEqual(server_4000.workers_count, 2)
+    self.assertEqual(server_4000.current_requests, 3)
+    self.assertEqual(server_4000.cumulative.total, 50)
+    self.assertEqual(server_4000.cumulative.failed, 3)
+    self.assertEqual(server_4000.cumulative.by_method, {"Get": 40, "Put": 10})
+    self.assertEqual(server_4000.recent.total, 40)
+    self.assertEqual(server_4000.recent.avg_latency, 12)
+    self.assertEqual(server_4000.recent.avg_read_time, 10)
+    self.assertEqual(server_4000.recent.latency_histogram,
+                     {"5": 12, "10": 18, "25": 10, "inf": 0})
+
+    # A server without recent requests has no averages.
+    self.assertEqual(server_4001.start_timestamp_ms, 1494240000200)
+    self.assertEqual(server_4001.workers_count, 1)
+    self.assertEqual(server_4001.cumulative.total, 10)
+    self.assertEqual(server_4001.recent.total, 0)
+    self.assertIsNone(server_4001.recent.avg_latency)
+
+    # Check Failures
+    self.assertEqual(len(stats_snapshot.failures), 1)
+    self.assertEqual(stats_snapshot.failures[0].ip_port, '10.10.7.86:4002')
+    self.assertEqual(stats_snapshot.failures[0].error, 'Connection refused')
@@ -12,6 +12,7 @@ from appscale.hermes.constants import (
   PROCESSES_STATS_CONFIGS_NODE,
   PROXIES_STATS_CONFIGS_NODE
 )
+from appscale.hermes.producers.datastore_stats import DatastoreStatsSource
 from appscale.hermes.producers.taskqueue_stats import TaskqueueStatsSource
 from appscale.hermes.profile import (
   NodesProfileLog, ProcessesProfileLog, ProxiesProfileLog
@@ -23,7 +24,7 @@ from appscale.hermes.handlers import (
 from appscale.hermes.producers.cluster_stats import (
   cluster_nodes_stats, cluster_processes_stats, cluster_proxies_stats,
   cluster_rabbitmq_stats, cluster_push_queues_stats,
-  cluster_taskqueue_stats,
+  cluster_taskqueue_stats, cluster_datastore_stats,
   cluster_cassandra_stats
 )
 from appscale.hermes.producers.cassandra_stats import CassandraStatsSource
@@ -62,6 +63,14 @@ DEFAULT_INCLUDE_LISTS = IncludeLists({
   'taskqueue.cumulative': ['total', 'failed', 'pb_reqs', 'rest_reqs'],
   'taskqueue.recent': ['total', 'failed', 'avg_latency',
                        'pb_reqs', 'rest_reqs'],
+  # Datastore service stats
+  'datastore': ['utc_timestamp', 'current_requests', 'cumulative', 'recent',
+                'instances_count', 'failures'],
+  'datastore.instance': ['start_timestamp_ms', 'workers_count',
+                         'current_requests', 'cumulative', 'recent'],
+  'datastore.cumulative': ['total', 'failed'],
+  'datastore.recent': ['total', 'failed', 'avg_latency', 'avg_round_trips',
+                       'latency_histogram'],
   # RabbitMQ stats
   'rabbitmq': ['utc_timestamp', 'disk_free_alarm', 'mem_alarm', 'name'],
   # Push queue stats
@@ -119,6 +128,12 @@ def get_local_stats_api_routes(is_lb_node, is_tq_node, is_db_node):
                    'default_include_lists': DEFAULT_INCLUDE_LISTS,
                    'cache_container': [None]}
     )
+    local_datastore_stats_handler = HandlerInfo(
+      handler_class=CurrentStatsHandler,
+      init_kwargs={'source': DatastoreStatsSource(),
+                   'default_include_lists': DEFAULT_INCLUDE_LISTS,
+                   'cache_container': [None]}
+    )
   else:
     # Stub handler for non-LB nodes
     local_proxies_stats_handler = HandlerInfo(
@@ -129,6 +144,10 @@ def get_local_stats_api_routes(is_lb_node, is_tq_node, is_db_node):
       handler_class=Respond404Handler,
       init_kwargs={'reason': 'Only LB nodes provide taskqueue service stats'}
     )
+    local_datastore_stats_handler = HandlerInfo(
+      handler_class=Respond404Handler,
+      init_kwargs={'reason': 'Only LB nodes provide datastore service stats'}
+    )
 
   if is_tq_node:
     # Only TQ nodes provide RabbitMQ stats.
@@ -176,6 +195,7 @@ def get_local_stats_api_routes(is_lb_node, is_tq_node, is_db_node):
     '/stats/local/rabbitmq': local_rabbitmq_stats_handler,
     '/stats/local/push_queues': local_push_queue_stats_handler,
     '/stats/local/taskqueue': local_taskqueue_stats_handler,
+    '/stats/local/datastore': local_datastore_stats_handler,
     '/stats/local/cassandra': local_cassandra_stats_handler,
   }
   return [
@@ -220,6 +240,12 @@ def get_cluster_stats_api_routes(is_lb):
                    'default_include_lists': DEFAULT_INCLUDE_LISTS,
                    'cache_container': {}}
     )
+    cluster_datastore_stats_handler = HandlerInfo(
+      handler_class=CurrentClusterStatsHandler,
+      init_kwargs={'source': cluster_datastore_stats,
+                   'default_include_lists': DEFAULT_INCLUDE_LISTS,
+                   'cache_container': {}}
+    )
     cluster_rabbitmq_stats_handler = HandlerInfo(
       handler_class=CurrentClusterStatsHandler,
       init_kwargs={'source': cluster_rabbitmq_stats,
@@ -247,6 +273,7 @@ def get_cluster_stats_api_routes(is_lb):
     cluster_processes_stats_handler = cluster_stub_handler
     cluster_proxies_stats_handler = cluster_stub_handler
     cluster_taskqueue_stats_handler = cluster_stub_handler
+    cluster_datastore_stats_handler = cluster_stub_handler
     cluster_rabbitmq_stats_handler = cluster_stub_handler
     cluster_push_queue_stats_handler = cluster_stub_handler
     cluster_cassandra_stats_handler = cluster_stub_handler
@@ -256,6 +283,7 @@ def get_cluster_stats_api_routes(is_lb):
     '/stats/cluster/processes': cluster_processes_stats_handler,
     '/stats/cluster/proxies': cluster_proxies_stats_handler,
     '/stats/cluster/taskqueue': cluster_taskqueue_stats_handler,
+    '/stats/cluster/datastore': cluster_datastore_stats_handler,
     '/stats/cluster/rabbitmq': cluster_rabbitmq_stats_handler,
     '/stats/cluster/push_queues': cluster_push_queue_stats_handler,
     '/stats/cluster/cassandra': cluster_cassandra_stats_handler,
@@ -1,22 +1,32 @@
 
+import bisect
 import capnp  # pylint: disable=unused-import
+import heapq
 import logging_capnp
 import os
 import re
 import struct
 import time
 
+from array import array
 from cStringIO import StringIO
-from twisted.internet import protocol
+from twisted.internet import defer, protocol, threads
 from twisted.python import log
 
 MAX_LOG_FILE_SIZE = 1024 * 1024 * 1024
 
+# The number of seconds a search can spend reading log files that do not
+# have a time index yet.
+SCAN_TIME_LIMIT = 5
+
 _I_SIZE = struct.calcsize('I')
-_qI_SIZE = struct.calcsize('qI')
 _PAGE_SIZE = 1000
 _ONE_BINARY = struct.pack('I', 1)
 
+# Timestamps are microseconds, so they need 64 bits. Where 'l' is smaller,
+# doubles still hold them exactly.
+_TIME_TYPECODE = 'l' if array('l').itemsize >= 8 else 'd'
+
 def readLogRecord(handle, parse=False):
   buf = handle.read(_I_SIZE)
   if not buf:
@@ -31,6 +41,232 @@ def calculateOffset(log_file_id, position):
 def parseOffset(offset):
   return struct.unpack('HI', offset)
 
+def majorVersion(versionId):
+  return versionId.split('.', 1)[0] if versionId else ''
+
+def maxLogLevel(record):
+  return max([appLog.level for appLog in record.appLogs] or [-1])
+
+class LogIndex(object):
+  """ Locates the records of a log file by endTime.
+
+  Entries are sorted by endTime. Each entry holds the position of a record,
+  a number identifying its major version and the highest level of its app
+  logs, so queries are filtered without decoding records. Entries are
+  grouped into pages that have a bitmap of their versions and a bitmap of
+  their levels, which lets a search skip pages without matching entries.
+  """
+  PAGE_SIZE = 256
+
+  # Index files use little-endian values with explicit sizes, so they do not
+  # depend on the platform that wrote them.
+  _MAGIC = 'LIDX'
+  _HEADER = '<4sIII'
+  _HEADER_SIZE = struct.calcsize(_HEADER)
+
+  # The formats of the endTime, position, version and level columns.
+  _COLUMN_FORMATS = 'qIHb'
+  _ENTRY_SIZE = struct.calcsize('<' + _COLUMN_FORMATS)
+  _TIME_SIZE = struct.calcsize('<' + _COLUMN_FORMATS[0])
+
+  # Each page has a version bitmap and a level bitmap.
+  _PAGE_BITMAPS_SIZE = struct.calcsize('<QB')
+
+  # Versions and levels past the last bit share it.
+  _VERSION_BITS = 64
+  _LEVEL_BITS = 8
+
+  def __init__(self):
+    self.endTimes = array(_TIME_TYPECODE)
+    self.positions = array('I')
+    self.versions = array('H')
+    self.levels = array('b')
+    self._versionNames = ['']
+    self._versionNumbers = {'': 0}
+    self._pageVersions = []
+    self._pageLevels = []
+    # Pages before this one have up-to-date bitmaps.
+    self._cleanPages = 0
+
+  def __len__(self):
+    return len(self.endTimes)
+
+  def add(self, endTime, position, versionId, level):
+    version = majorVersion(versionId)
+    if version not in self._versionNumbers:
+      self._versionNumbers[version] = len(self._versionNames)
+      self._versionNames.append(version)
+    versionNumber = self._versionNumbers[version]
+    level = max(min(level, 127), -128)
+    # Records arrive roughly in endTime order, so this is usually an append.
+    index = bisect.bisect_right(self.endTimes, endTime)
+    if index == len(self.endTimes):
+      self.endTimes.append(endTime)
+      self.positions.append(position)
+      self.versions.append(versionNumber)
+      self.levels.append(level)
+    else:
+      self.endTimes.insert(index, endTime)
+      self.positions.insert(index, position)
+      self.versions.insert(index, versionNumber)
+      self.levels.insert(index, level)
+    self._cleanPages = min(self._cleanPages, index // self.PAGE_SIZE)
+
+  def search(self, startTime, endTime, versionIds, minimumLogLevel):
+    """ Yields the endTime and position of matching entries, newest first.
+
+    Records without a version match any versionIds, and minimumLogLevel is
+    ignored when it is 0.
+    """
+    self._updatePages()
+    low = bisect.bisect_left(self.endTimes, startTime) if startTime else 0
+    high = (bisect.bisect_right(self.endTimes, endTime) if endTime
+            else len(self.endTimes))
+    versions = set([0])
+    for versionId in versionIds:
+      if versionId in self._versionNumbers:
+        versions.add(self._versionNumbers[versionId])
+    versionMask = 0
+    for version in versions:
+      versionMask |= self._versionBit(version)
+    levelMask = 0
+    if minimumLogLevel:
+      for bit in xrange(self._levelBitIndex(minimumLogLevel), self._LEVEL_BITS):
+        levelMask |= 1 << bit
+    index = high - 1
+    while index >= low:
+      page = index // self.PAGE_SIZE
+      pageStart = max(page * self.PAGE_SIZE, low)
+      if (self._pageVersions[page] & versionMask and
+          (not minimumLogLevel or self._pageLevels[page] & levelMask)):
+        for entry in xrange(index, pageStart - 1, -1):
+          if self.versions[entry] not in versions:
+            continue
+          if minimumLogLevel and self.levels[entry] < minimumLogLevel:
+            continue
+          yield self.endTimes[entry], self.positions[entry]
+      index = pageStart - 1
+
+  def save(self, filename):
+    self._updatePages()
+    versionTable = '\n'.join(self._versionNames)
+    pageCount = len(self._pageVersions)
+    tmpFilename = '%s.tmp' % filename
+    with open(tmpFilename, 'wb') as fh:
+      fh.write(struct.pack(self._HEADER, self._MAGIC, len(self.endTimes),
+                           len(versionTable), pageCount))
+      fh.write(versionTable)
+      for columnFormat, column in zip(self._COLUMN_FORMATS, self._columns()):
+        fh.write(struct.pack('<%d%s' % (len(column), columnFormat), *column))
+      fh.write(struct.pack('<%dQ' % pageCount, *self._pageVersions))
+      fh.write(struct.pack('<%dB' % pageCount, *self._pageLevels))
+    os.rename(tmpFilename, filename)
+
+  @classmethod
+  def load(cls, filename):
+    with open(filename, 'rb') as fh:
+      buf = fh.read()
+    if len(buf) < cls._HEADER_SIZE:
+      raise ValueError('%s is truncated' % filename)
+    magic, entryCount, versionTableSize, pageCount = struct.unpack(
+      cls._HEADER, buf[:cls._HEADER_SIZE])
+    if magic != cls._MAGIC:
+      raise ValueError('%s is not a log index' % filename)
+    expectedSize = (cls._HEADER_SIZE + versionTableSize +
+                    entryCount * cls._ENTRY_SIZE +
+                    pageCount * cls._PAGE_BITMAPS_SIZE)
+    if len(buf) != expectedSize:
+      raise ValueError('%s is truncated' % filename)
+    index = cls()
+    pos = cls._HEADER_SIZE
+    index._versionNames = buf[pos:pos + versionTableSize].split('\n')
+    index._versionNumbers = dict(
+      (name, number) for number, name in enumerate(index._versionNames))
+    pos += versionTableSize
+    for columnFormat, column in zip(cls._COLUMN_FORMATS, index._columns()):
+      columnFormat = '<%d%s' % (entryCount, columnFormat)
+      size = struct.calcsize(columnFormat)
+      column.extend(struct.unpack(columnFormat, buf[pos:pos + size]))
+      pos += size
+    size = pageCount * struct.calcsize('<Q')
+    index._pageVersions = list(struct.unpack('<%dQ' % pageCount,
+                                             buf[pos:pos + size]))
+    pos += size
+    index._pageLevels = list(struct.unpack('<%dB' % pageCount,
+                                           buf[pos:pos + pageCount]))
+    if pageCount != index._pageCount():
+      raise ValueError('%s is truncated' % filename)
+    index._cleanPages = len(index.endTimes) // cls.PAGE_SIZE
+    return index
+
+  @classmethod
+  def readTimeRange(cls, filename):
+    """ Returns the first and last endTime in an index file.
+
+    Only the header and two entries are read. None is returned if the index
+    is empty.
+    """
+    with open(filename, 'rb') as fh:
+      header = fh.read(cls._HEADER_SIZE)
+      if len(header) < cls._HEADER_SIZE:
+        raise ValueError('%s is truncated' % filename)
+      magic, entryCount, versionTableSize, _ = struct.unpack(cls._HEADER,
+                                                             header)
+      if magic != cls._MAGIC:
+        raise ValueError('%s is not a log index' % filename)
+      if not entryCount:
+        return None
+      # The endTime column follows the version table.
+      columnStart = cls._HEADER_SIZE + versionTableSize
+      fh.seek(columnStart)
+      first = fh.read(cls._TIME_SIZE)
+      fh.seek(columnStart + (entryCount - 1) * cls._TIME_SIZE)
+      last = fh.read(cls._TIME_SIZE)
+    if len(last) < cls._TIME_SIZE:
+      raise ValueError('%s is truncated' % filename)
+    timeFormat = '<' + cls._COLUMN_FORMATS[0]
+    return (struct.unpack(timeFormat, first)[0],
+            struct.unpack(timeFormat, last)[0])
+
+  def timeRange(self):
+    """ Returns the first and last endTime, or None if the index is empty. """
+    if not self.endTimes:
+      return None
+    return self.endTimes[0], self.endTimes[-1]
+
+  def _columns(self):
+    return self.endTimes, self.positions, self.versions, self.levels
+
+  def _pageCount(self):
+    return (len(self.endTimes) + self.PAGE_SIZE - 1) // self.PAGE_SIZE
+
+  def _versionBit(self, version):
+    return 1 << min(version, self._VERSION_BITS - 1)
+
+  def _levelBitIndex(self, level):
+    # Records without app logs have a level of -1.
+    return max(min(level + 1, self._LEVEL_BITS - 1), 0)
+
+  def _updatePages(self):
+    pageCount = self._pageCount()
+    if self._cleanPages == pageCount:
+      return
+    del self._pageVersions[self._cleanPages:]
+    del self._pageLevels[self._cleanPages:]
+    for page in xrange(self._cleanPages, pageCount):
+      start = page * self.PAGE_SIZE
+      end = start + self.PAGE_SIZE
+      versionBitmap = 0
+      for version in set(self.versions[start:end]):
+        versionBitmap |= self._versionBit(version)
+      levelBitmap = 0
+      for level in set(self.levels[start:end]):
+        levelBitmap |= 1 << self._levelBitIndex(level)
+      self._pageVersions.append(versionBitmap)
+      self._pageLevels.append(levelBitmap)
+    # The last page is updated again if it is not full yet.
+    self._cleanPages = len(self.endTimes) // self.PAGE_SIZE
+
 class AppLogFile(object):
   MODE_SEARCH = 1
   MODE_WRITE = 2
@@ -40,26 +276,48 @@ class AppLogFile(object):
     self.log_file_id = log_file_id
     self._filename = os.path.join(root_path, 'logservice_%s.%s.log' % (app_id, log_file_id))
     self._requestIdIndexFilename = '%s.ridx' % self._filename
-    self._pageIndexFilename = '%s.pidx' % self._filename
+    self._timeIndexFilename = '%s.tidx' % self._filename
+    self._readHandle = None
+    self.deleted = False
+    # Set if the time index could not be built, so that it is not retried.
+    self.indexFailed = False
     if mode == AppLogFile.MODE_WRITE:
       self._handle = open(self._filename, 'ab')
-      self._pageIndexHandle = open(self._pageIndexFilename, 'ab')
       self._requestIdIndexHandle = open(self._requestIdIndexFilename, 'ab')
+      self._timeIndex = LogIndex()
+      self.indexed = True
     else:
       self._handle = open(self._filename, 'rb')
-      self._pageIndexHandle = open(self._pageIndexFilename, 'rb')
       self._requestIdIndexHandle = open(self._requestIdIndexFilename, 'rb')
+      # The index is loaded when the file is first searched. Until then, its
+      # time range is enough to skip searches that cannot match.
+      self._timeIndex = None
+      self._timeRange = None
+      try:
+        self._timeRange = LogIndex.readTimeRange(self._timeIndexFilename)
+        self.indexed = True
+      except (IOError, ValueError, struct.error):
+        # The index is missing if the server stopped before the file was
+        # rotated. AppRegistry builds it outside the reactor thread.
+        self.indexed = False
     self._indexSize = self._requestIdIndexHandle.tell() / 14
 
   def close(self):
+    if self.mode == AppLogFile.MODE_WRITE:
+      self._timeIndex.save(self._timeIndexFilename)
     self._handle.close()
-    self._pageIndexHandle.close()
     self._requestIdIndexHandle.close()
+    if self._readHandle:
+      self._readHandle.close()
 
   def delete(self):
+    self.deleted = True
     os.unlink(self._filename)
     os.unlink(self._requestIdIndexFilename)
-    os.unlink(self._pageIndexFilename)
+    # Files written by older versions have a page index instead.
+    for filename in (self._timeIndexFilename, '%s.pidx' % self._filename):
+      if os.path.exists(filename):
+        os.unlink(filename)
 
   def write(self, buf):
     if self.mode != AppLogFile.MODE_WRITE:
@@ -73,9 +331,9 @@ class AppLogFile(object):
     # Index the new logline
     if requestLog.requestId:
       self._requestIdIndexHandle.write('%s%s' % (requestLog.requestId, struct.pack('I', position)))
+    self._timeIndex.add(requestLog.endTime, position, requestLog.versionId,
+                        maxLogLevel(requestLog))
     if self._indexSize % _PAGE_SIZE == 0:
-      self._pageIndexHandle.write(struct.pack('qI', requestLog.endTime, position))
-      self._pageIndexHandle.flush()
       self._handle.flush()
       self._requestIdIndexHandle.flush()
     self._indexSize += 1
@@ -117,42 +375,147 @@ class AppLogFile(object):
         handle.close()
         index_handle.close()
 
-  def iterpages(self):
-    if self.mode == AppLogFile.MODE_WRITE:
-      self._pageIndexHandle.flush()
-      with open(self._pageIndexFilename, 'rb') as fh:
-        pages = fh.read()
+  def search(self, query, before=None, deadline=None):
+    """ Yields sort keys for matching records, newest first.
+
+    Each key contains the negated endTime, log file ID and position of a
+    record followed by this file, so keys from several files can be merged.
+    Only records that sort before the (endTime, log_file_id, position) tuple
+    in before are included. Files without a time index are only read until
+    deadline.
+    """
+    endTime = query.endTime
+    if before:
+      endTime = min(endTime, before[0]) if endTime else before[0]
+    versionIds = list(query.versionIds)
+    timeIndex = None
+    if self.indexed:
+      if not self._overlaps(query.startTime, endTime):
+        return
+      timeIndex = self._getTimeIndex()
+    if timeIndex is not None:
+      matches = timeIndex.search(query.startTime, endTime, versionIds,
+                                 query.minimumLogLevel)
     else:
-      self._pageIndexHandle.seek(0)
-      pages = self._pageIndexHandle.read()
-    for pos in xrange(len(pages)-_qI_SIZE, -1, -_qI_SIZE):
-      yield struct.unpack('qI', pages[pos:pos+_qI_SIZE])
+      if deadline is None:
+        deadline = time.time() + SCAN_TIME_LIMIT
+      matches = self._scan(query.startTime, endTime, versionIds,
+                           query.minimumLogLevel, deadline)
+    for recordEndTime, position in matches:
+      if before and (recordEndTime, self.log_file_id, position) >= before:
+        continue
+      yield -recordEndTime, -self.log_file_id, -position, self
 
-  def iterrecords(self, start_position, end_position):
+  def read(self, position):
     if self.mode == AppLogFile.MODE_WRITE:
       self._handle.flush()
-      handle = open(self._filename, 'rb')
+      if not self._readHandle:
+        self._readHandle = open(self._filename, 'rb')
+      handle = self._readHandle
     else:
       handle = self._handle
+    handle.seek(position)
+    return readLogRecord(handle, True)
+
+  def buildTimeIndex(self):
+    """ Reads every record in the file to build its time index.
+
+    This reads the whole file, so it runs outside the reactor thread with its
+    own file handle.
+    """
+    log.msg("Building index for {}".format(self._filename))
+    timeIndex = LogIndex()
+    with open(self._filename, 'rb') as handle:
+      while True:
+        position = handle.tell()
+        try:
+          buf, record = readLogRecord(handle, True)
+        except Exception:
+          # The last record is incomplete if the server stopped while writing.
+          break
+        if buf is None:
+          break
+        timeIndex.add(record.endTime, position, record.versionId,
+                      maxLogLevel(record))
     try:
-      handle.seek(start_position)
-      if end_position != -1:
-        buf = handle.read(end_position - start_position)
-      else:
-        buf = handle.read()
-    finally:
-      if self.mode == AppLogFile.MODE_WRITE:
-        handle.close()
-    pos = 0
-    while pos < len(buf):
-      buf2 = buf[pos:pos+_I_SIZE]
-      pos += _I_SIZE
-      if not buf2:
+      timeIndex.save(self._timeIndexFilename)
+    except (IOError, OSError) as error:
+      log.err("Unable to save index for {}: {}".format(self._filename, error))
+    return timeIndex
+
+  def setTimeIndex(self, timeIndex):
+    """ Starts using an index that was built by buildTimeIndex. """
+    if self.deleted:
+      # The file was removed while its index was being built.
+      if os.path.exists(self._timeIndexFilename):
+        os.unlink(self._timeIndexFilename)
+      return
+    self._timeIndex = timeIndex
+    self._timeRange = timeIndex.timeRange()
+    self.indexed = True
+
+  def _overlaps(self, startTime, endTime):
+    """ Checks if the file can have records within a time window. """
+    if self._timeIndex is not None:
+      timeRange = self._timeIndex.timeRange()
+    else:
+      timeRange = self._timeRange
+    if timeRange is None:
+      return False
+    firstEndTime, lastEndTime = timeRange
+    if startTime and lastEndTime < startTime:
+      return False
+    if endTime and firstEndTime > endTime:
+      return False
+    return True
+
+  def _getTimeIndex(self):
+    if self._timeIndex is not None:
+      return self._timeIndex
+    try:
+      self._timeIndex = LogIndex.load(self._timeIndexFilename)
+    except (IOError, ValueError, struct.error) as error:
+      # AppRegistry rebuilds indexes that cannot be loaded.
+      log.err("Unable to load index for {}: {}".format(self._filename, error))
+      self.indexed = False
+    return self._timeIndex
+
+  def _scan(self, startTime, endTime, versionIds, minimumLogLevel, deadline):
+    """ Finds matching records in a file that does not have a time index.
+
+    Records are read newest first through the request ID index until
+    deadline, so records without a request ID and older records might be
+    missed.
+
+    Returns:
+      A list of (endTime, position) tuples, newest first.
+    """
+    self._requestIdIndexHandle.seek(0)
+    requestIdIndex = self._requestIdIndexHandle.read()
+    matches = []
+    for offset in xrange(len(requestIdIndex) - 14, -1, -14):
+      if time.time() > deadline:
         break
-      length, = struct.unpack('I', buf2)
-      buf2 = buf[pos:pos+length]
-      pos += length
-      yield buf2, logging_capnp.RequestLog.from_bytes(buf2)
+      position, = struct.unpack('I', requestIdIndex[offset + 10:offset + 14])
+      self._handle.seek(position)
+      try:
+        _, record = readLogRecord(self._handle, True)
+      except Exception:
+        continue
+      if record is None:
+        continue
+      # Records are written roughly in endTime order.
+      if startTime and record.endTime < startTime:
+        break
+      if endTime and record.endTime > endTime:
+        continue
+      if record.versionId and majorVersion(record.versionId) not in versionIds:
+        continue
+      if minimumLogLevel and maxLogLevel(record) < minimumLogLevel:
+        continue
+      matches.append((record.endTime, position))
+    matches.sort(reverse=True)
+    return matches
 
 class AppRegistry(object):
 
@@ -173,6 +536,8 @@ class AppRegistry(object):
                                         AppLogFile.MODE_SEARCH))
     self._log_files.sort(key=lambda x: x.log_file_id)
     self._writer = AppLogFile(root_path, app_id, max(ids) + 1, AppLogFile.MODE_WRITE)
+    self._indexBuilder = None
+    self._buildMissingIndexes()
 
   def write(self, buf):
     position, requestLog = self._writer.write(buf)
@@ -204,10 +569,55 @@ class AppRegistry(object):
       for requestId, record in alf.get(lookupRequestIds):
         yield requestId, record
 
-  def iterpages(self):
+  def find(self, log_file_id):
     for alf in self.iter():
-      for endTime, position in alf.iterpages():
-         yield endTime, position, alf
+      if alf.log_file_id == log_file_id:
+        return alf
+    return None
+
+  def search(self, query, before=None):
+    """ Yields matching records from every log file, newest first. """
+    self._buildMissingIndexes()
+    # Files without an index share the time limit for reading records.
+    deadline = time.time() + SCAN_TIME_LIMIT
+    keys = heapq.merge(*[alf.search(query, before, deadline)
+                         for alf in self.iter()])
+    for _, _, position, alf in keys:
+      yield alf.read(-position)
+
+  def _buildMissingIndexes(self):
+    """ Starts building the time indexes that log files are missing. """
+    if self._indexBuilder is not None:
+      return
+
+    def finished(result):
+      self._indexBuilder = None
+      return result
+
+    indexBuilder = self._buildIndexes()
+    indexBuilder.addErrback(log.err)
+    # The builder finishes right away if no indexes are missing.
+    if not indexBuilder.called:
+      self._indexBuilder = indexBuilder
+      indexBuilder.addBoth(finished)
+
+  @defer.inlineCallbacks
+  def _buildIndexes(self):
+    """ Builds missing time indexes one at a time, newest file first. """
+    while True:
+      pending = [alf for alf in reversed(self._log_files)
+                 if not alf.indexed and not alf.indexFailed]
+      if not pending:
+        break
+      alf = pending[0]
+      try:
+        timeIndex = yield threads.deferToThread(alf.buildTimeIndex)
+      except Exception:
+        log.err(None, "Unable to build index for log file {}".format(
+          alf.log_file_id))
+        alf.indexFailed = True
+        continue
+      alf.setTimeIndex(timeIndex)
 
   def registerFollower(self, protocol, query):
     self._followers[protocol] = query
@@ -288,55 +698,23 @@ class Protocol(protocol.Protocol):
       self.processActionQuerySearch(query)
 
   def processActionQuerySearch(self, query):
-    results = list()
-    versionIds = list(query.versionIds)
+    before = None
     if query.offset:
       query_log_file_id, query_position = parseOffset(query.offset)
-    oldestRecord = None
-    start = time.time()
-    previousALF = None
-    previousPosition = -1
-    for endTime, position, alf in self.app_registry.iterpages():
-      if query.endTime and query.endTime < endTime:
+      alf = self.app_registry.find(query_log_file_id)
+      if alf is None:
+        # Only newer records remain once a log file is deleted.
+        self.sendQueryResult([])
+        return
+      _, record = alf.read(query_position)
+      before = (record.endTime, query_log_file_id, query_position)
+    results = list()
+    for buf, record in self.app_registry.search(query, before):
+      if query.startTime and query.startTime > record.startTime:
         continue
-      if query.offset:
-        if alf.log_file_id > query_log_file_id:
-          continue
-        if alf.log_file_id == query_log_file_id and position > query_position:
-          continue
-      end_position = previousPosition if alf == previousALF else -1
-      for buf, record in alf.iterrecords(position, end_position):
-        if not oldestRecord or oldestRecord.startTime > record.startTime:
-          oldestRecord = record
-        if query.endTime and query.endTime < endTime:
-          break
-        if query.offset:
-          log_file_id, position = parseOffset(record.offset)
-          if log_file_id == query_log_file_id and position >= query_position:
-            break
-        if query.minimumLogLevel:
-          include = False
-          for appLog in record.appLogs:
-            if appLog.level >= query.minimumLogLevel:
-              include = True
-              break
-          if not include:
-            continue
-        if record.versionId and not record.versionId.split('.', 1)[0] in versionIds:
-          continue
-        if query.startTime and query.startTime > record.startTime:
-          continue
-        results.append((buf, record))
-      if query.startTime and oldestRecord.endTime < query.startTime:
-        break
+      results.append((buf, record))
       if len(results) >= query.count:
         break
-      if results and time.time() - start > 5:
-        break
-      if time.time() - start > 25:
-        break
-      previousALF = alf
-      previousPosition = position
     results.sort(key=lambda entry: entry[1].endTime, reverse=query.reverse)
     self.sendQueryResult([b for b, _ in results])
 
@@ -0,0 +1,266 @@
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+from flexmock import flexmock
+from twisted.internet import defer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+import logserver
+from logserver import AppLogFile, AppRegistry, LogIndex
+
+
+class SmallPageIndex(LogIndex):
+  """ A LogIndex with small pages so that tests cross page boundaries. """
+  PAGE_SIZE = 4
+
+
+class TestLogIndex(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.filename = os.path.join(self.tmp_dir, 'logservice.log.tidx')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def build_index(self, entries):
+    index = SmallPageIndex()
+    for end_time, position, version_id, level in entries:
+      index.add(end_time, position, version_id, level)
+    return index
+
+  def test_add(self):
+    index = self.build_index([(30, 300, 'v1.1', 1),
+                              (10, 100, 'v1.1', 2),
+                              (20, 200, 'v2.1', -1)])
+    self.assertEqual(len(index), 3)
+
+    # Entries are kept in endTime order even when they arrive out of order.
+    self.assertListEqual(list(index.endTimes), [10, 20, 30])
+    self.assertListEqual(list(index.positions), [100, 200, 300])
+
+  def test_search_order(self):
+    entries = [(end_time, end_time * 10, 'v1.1', 1)
+               for end_time in range(1, 11)]
+    index = self.build_index(entries)
+
+    # Results are returned newest first across page boundaries.
+    results = list(index.search(None, None, ['v1'], 0))
+    self.assertListEqual(results, [(end_time, end_time * 10)
+                                   for end_time in range(10, 0, -1)])
+
+  def test_search_time_window(self):
+    index = self.build_index([(end_time, end_time, 'v1.1', 1)
+                              for end_time in range(1, 11)])
+    results = [end_time for end_time, _ in index.search(3, 7, ['v1'], 0)]
+    self.assertListEqual(results, [7, 6, 5, 4, 3])
+
+    results = [end_time for end_time, _ in index.search(8, None, ['v1'], 0)]
+    self.assertListEqual(results, [10, 9, 8])
+
+    results = [end_time for end_time, _ in index.search(None, 2, ['v1'], 0)]
+    self.assertListEqual(results, [2, 1])
+
+  def test_search_versions(self):
+    entries = [(1, 1, 'v1.1', 1), (2, 2, 'v2.1', 1), (3, 3, '', 1),
+               (4, 4, 'v1.2', 1), (5, 5, 'v2.2', 1), (6, 6, 'v3.1', 1)]
+    index = self.build_index(entries)
+
+    # Records without a version match any version.
+    results = [end_time for end_time, _ in index.search(None, None, ['v1'], 0)]
+    self.assertListEqual(results, [4, 3, 1])
+
+    results = [end_time
+               for end_time, _ in index.search(None, None, ['v2', 'v3'], 0)]
+    self.assertListEqual(results, [6, 5, 3, 2])
+
+    results = [end_time
+               for end_time, _ in index.search(None, None, ['unknown'], 0)]
+    self.assertListEqual(results, [3])
+
+  def test_search_levels(self):
+    entries = [(end_time, end_time, 'v1.1', level)
+               for end_time, level in enumerate([-1, 0, 1, 2, 3, 4, 1, 0],
+                                                start=1)]
+    index = self.build_index(entries)
+
+    results = [end_time for end_time, _ in index.search(None, None, ['v1'], 3)]
+    self.assertListEqual(results, [6, 5])
+
+    # A minimum level of 0 matches every record.
+    results = [end_time for end_time, _ in index.search(None, None, ['v1'], 0)]
+    self.assertListEqual(results, range(8, 0, -1))
+
+  def test_pages_updated_after_insert(self):
+    index = self.build_index([(end_time, end_time, 'v1.1', 1)
+                              for end_time in range(10, 110, 10)])
+    self.assertListEqual(
+      [end_time for end_time, _ in index.search(None, None, ['v2'], 0)], [])
+
+    # An entry inserted into an earlier page updates that page's bitmaps.
+    index.add(15, 15, 'v2.1', 4)
+    results = [end_time for end_time, _ in index.search(None, None, ['v2'], 4)]
+    self.assertListEqual(results, [15])
+
+  def test_save_and_load(self):
+    entries = [(1500000000000000 + end_time, end_time, version_id, level)
+               for end_time, version_id, level in [(1, 'v1.1', 1),
+                                                   (2, 'v2.1', 3),
+                                                   (3, '', -1),
+                                                   (4, 'v1.1', 0),
+                                                   (5, 'v3.1', 4)]]
+    index = self.build_index(entries)
+    index.save(self.filename)
+
+    loaded = SmallPageIndex.load(self.filename)
+    self.assertEqual(len(loaded), len(index))
+    for versions, level in [(['v1'], 0), (['v2', 'v3'], 3), (['v1'], 4)]:
+      self.assertListEqual(list(loaded.search(None, None, versions, level)),
+                           list(index.search(None, None, versions, level)))
+
+    # Entries can be added to a loaded index.
+    loaded.add(1500000000000006, 6, 'v4.1', 1)
+    self.assertListEqual(list(loaded.search(None, None, ['v4'], 0)),
+                         [(1500000000000006, 6), (1500000000000003, 3)])
+
+  def test_file_format(self):
+    index = self.build_index([(end_time, end_time, 'v1.1', 1)
+                              for end_time in range(1, 6)])
+    index.save(self.filename)
+    with open(self.filename, 'rb') as index_file:
+      contents = index_file.read()
+
+    # The file has the same layout on every platform.
+    magic, entries, version_table_size, pages = struct.unpack(
+      '<4sIII', contents[:16])
+    self.assertEqual(magic, 'LIDX')
+    self.assertEqual(entries, 5)
+    self.assertEqual(pages, 2)
+    self.assertEqual(len(contents),
+                     16 + version_table_size + entries * 15 + pages * 9)
+
+  def test_load_truncated(self):
+    index = self.build_index([(end_time, end_time, 'v1.1', 1)
+                              for end_time in range(1, 6)])
+    index.save(self.filename)
+    with open(self.filename, 'rb') as index_file:
+      contents = index_file.read()
+
+    for size in (0, 10, 20, len(contents) - 1):
+      with open(self.filename, 'wb') as index_file:
+        index_file.write(contents[:size])
+
+      self.assertRaises(ValueError, SmallPageIndex.load, self.filename)
+
+  def test_read_time_range(self):
+    index = self.build_index([(end_time, end_time, 'v1.1', 1)
+                              for end_time in (30, 10, 20)])
+    index.save(self.filename)
+    self.assertEqual(index.timeRange(), (10, 30))
+    self.assertEqual(LogIndex.readTimeRange(self.filename), (10, 30))
+
+    SmallPageIndex().save(self.filename)
+    self.assertIsNone(LogIndex.readTimeRange(self.filename))
+
+    index.save(self.filename)
+    with open(self.filename, 'rb') as index_file:
+      contents = index_file.read()
+    with open(self.filename, 'wb') as index_file:
+      index_file.write(contents[:30])
+    self.assertRaises(ValueError, LogIndex.readTimeRange, self.filename)
+
+  def test_load_invalid(self):
+    with open(self.filename, 'wb') as index_file:
+      index_file.write('X' * 100)
+
+    self.assertRaises(ValueError, LogIndex.load, self.filename)
+
+
+class TestAppLogFile(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def create_log_file(self, log_file_id, index=None):
+    filename = os.path.join(self.tmp_dir,
+                            'logservice_guestbook.{}.log'.format(log_file_id))
+    for suffix in ('', '.ridx'):
+      open(filename + suffix, 'wb').close()
+    if index is not None:
+      index.save(filename + '.tidx')
+
+  @staticmethod
+  def query(start_time, end_time):
+    return flexmock(startTime=start_time, endTime=end_time,
+                    versionIds=['v1'], minimumLogLevel=0)
+
+  def test_search_outside_time_range(self):
+    index = LogIndex()
+    for end_time in range(100, 200, 10):
+      index.add(end_time, end_time, 'v1.1', 1)
+    self.create_log_file(1, index)
+    log_file = AppLogFile(self.tmp_dir, 'guestbook', 1,
+                          AppLogFile.MODE_SEARCH)
+    self.assertTrue(log_file.indexed)
+
+    # Files that cannot match are skipped without loading their index.
+    flexmock(LogIndex).should_receive('load').never()
+    self.assertListEqual(list(log_file.search(self.query(200, None))), [])
+    self.assertListEqual(list(log_file.search(self.query(None, 50))), [])
+    self.assertListEqual(
+      list(log_file.search(self.query(None, None), before=(90, 1, 0))), [])
+
+  def test_search_within_time_range(self):
+    index = LogIndex()
+    for end_time in range(100, 200, 10):
+      index.add(end_time, end_time, 'v1.1', 1)
+    self.create_log_file(1, index)
+    log_file = AppLogFile(self.tmp_dir, 'guestbook', 1,
+                          AppLogFile.MODE_SEARCH)
+
+    keys = list(log_file.search(self.query(150, 170)))
+    self.assertListEqual([-key[0] for key in keys], [170, 160, 150])
+
+  def test_missing_indexes_built_in_thread(self):
+    self.create_log_file(1)
+    self.create_log_file(2)
+    built = []
+    index = LogIndex()
+    index.add(100, 0, 'v1.1', 1)
+
+    def build_time_index(log_file):
+      built.append(log_file.log_file_id)
+      return index
+
+    flexmock(AppLogFile).should_receive('buildTimeIndex').\
+      replace_with(lambda: None)
+    threads = flexmock(logserver.threads)
+    threads.should_receive('deferToThread').replace_with(
+      lambda func: defer.succeed(build_time_index(func.__self__)))
+
+    registry = AppRegistry(self.tmp_dir, 'guestbook', None)
+
+    # The newest file's index is built first.
+    self.assertListEqual(built, [2, 1])
+    for log_file in registry.iter():
+      self.assertTrue(log_file.indexed)
+    keys = list(registry._log_files[0].search(self.query(None, None)))
+    self.assertListEqual([-key[0] for key in keys], [100])
+
+  def test_search_before_index_is_built(self):
+    self.create_log_file(1)
+    threads = flexmock(logserver.threads)
+    threads.should_receive('deferToThread').and_return(defer.Deferred())
+    registry = AppRegistry(self.tmp_dir, 'guestbook', None)
+
+    # The file is scanned instead until its index is ready.
+    log_file = registry._log_files[0]
+    self.assertFalse(log_file.indexed)
+    flexmock(log_file).should_receive('_scan').\
+      and_return([(100, 0)]).once()
+    keys = list(log_file.search(self.query(None, None)))
+    self.assertListEqual([-key[0] for key in keys], [100])
@@ -1,3 +1,6 @@
+import bisect
+import math
+
 from appscale.common.service_stats import matchers
 
 
@@ -47,3 +50,31 @@ class CountOf(Metric):
     return sum(1 for request in requests if self._matcher.matches(request))
 
 
+class Percentile(Metric):
+  """ Computes a percentile of a field's value using the nearest rank. """
+  def __init__(self, field, percent):
+    self._field_name = field
+    self._percent = percent
+
+  def compute(self, requests):
+    if not requests:
+      return None
+    values = sorted(getattr(r, self._field_name) for r in requests)
+    rank = int(math.ceil(self._percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class Histogram(Metric):
+  """ Counts requests by buckets named after their inclusive upper bounds. """
+  def __init__(self, field, buckets):
+    self._field_name = field
+    self._buckets = sorted(buckets)
+
+  def compute(self, requests):
+    counts = [0] * (len(self._buckets) + 1)
+    for request in requests:
+      value = getattr(request, self._field_name)
+      counts[bisect.bisect_left(self._buckets, value)] += 1
+    # The last bucket holds values above the largest bound.
+    names = [str(bucket) for bucket in self._buckets] + ["inf"]
+    return dict(zip(names, counts))
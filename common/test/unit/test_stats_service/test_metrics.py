@@ -64,6 +64,24 @@ class TestBuiltinMetrics(unittest.TestCase):
     self.assertEqual(server_errors.compute(requests), 2)
     self.assertEqual(post.compute(requests), 3)
 
+  def test_percentile(self):
+    requests = [RequestInfo() for _ in range(10)]
+    for latency, request in enumerate(requests):
+      request.latency = (latency + 1) * 100
+    self.assertEqual(metrics.Percentile("latency", 50).compute(requests), 500)
+    self.assertEqual(metrics.Percentile("latency", 99).compute(requests), 1000)
+    self.assertEqual(metrics.Percentile("latency", 0).compute(requests), 100)
+    self.assertIsNone(metrics.Percentile("latency", 50).compute([]))
+
+  def test_histogram(self):
+    requests = [RequestInfo() for _ in range(5)]
+    for request, latency in zip(requests, [5, 10, 11, 80, 5000]):
+      request.latency = latency
+    histogram = metrics.Histogram("latency", [100, 10])
+    self.assertEqual(histogram.compute(requests),
+                     {"10": 2, "100": 2, "inf": 1})
+    self.assertEqual(histogram.compute([]), {"10": 0, "100": 0, "inf": 0})
+
 
 class TestCustomMetric(unittest.TestCase):
 